@@ -0,0 +1,623 @@
+"""
+Benchmarks for inference with synthetic videos and randomly initialized models.
+
+Each benchmark creates a synthetic video of moving blobs on a noisy background, stored
+in memory (`NumpyVideo`) or in an HDF5 file (`HDF5Video`), and a predictor with tiny
+randomly initialized models for one of the model types:
+
+- `"single_instance"`: Single instance confidence maps.
+- `"topdown"`: Centroid and centered instance confidence maps.
+- `"bottomup"`: Multi-instance confidence maps and part affinity fields.
+
+The benchmarks run on the CPU and measure the throughput in frames per second, the peak
+resident memory of the process and the latency of each stage of inference as recorded
+by `sleap.nn.profiling`. The results are saved to a JSON file that can be compared
+between commits.
+
+The models are not trained, so the number of predicted instances depends on the random
+weights. This is reported with the results since it affects the time spent in grouping
+and tracking.
+
+Usage:
+
+> python -m sleap.benchmarks.inference --output results.json
+> python -m sleap.benchmarks.inference --model_types bottomup --backends hdf5
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Text
+
+import h5py
+import numpy as np
+import psutil
+import tensorflow as tf
+
+import sleap
+from sleap.io.framecache import get_frame_cache
+from sleap.nn.config import (
+    CentroidsHeadConfig,
+    CenteredInstanceConfmapsHeadConfig,
+    MultiInstanceConfig,
+    SingleInstanceConfmapsHeadConfig,
+    TrainingJobConfig,
+    UNetConfig,
+)
+from sleap.nn.data.providers import VideoReader
+from sleap.nn.inference import (
+    BottomUpPredictor,
+    Predictor,
+    SingleInstancePredictor,
+    TopDownPredictor,
+)
+from sleap.nn.model import Model
+from sleap.nn.profiling import get_profiler
+from sleap.nn.tracking import Tracker
+
+
+MODEL_TYPES = ("single_instance", "topdown", "bottomup")
+VIDEO_BACKENDS = ("numpy", "hdf5")
+
+
+def make_synthetic_skeleton(n_nodes: int = 5) -> sleap.Skeleton:
+    """Make a skeleton whose nodes are connected in a chain.
+
+    Args:
+        n_nodes: Number of nodes in the skeleton.
+
+    Returns:
+        A `sleap.Skeleton` with nodes named `"n0"`, `"n1"`, ... and edges between
+        consecutive nodes.
+    """
+    return sleap.Skeleton.from_names_and_edge_inds(
+        [f"n{i}" for i in range(n_nodes)], [(i, i + 1) for i in range(n_nodes - 1)]
+    )
+
+
+def make_synthetic_frames(
+    n_frames: int = 64,
+    height: int = 256,
+    width: int = 256,
+    channels: int = 1,
+    n_animals: int = 2,
+    seed: int = 0,
+) -> np.ndarray:
+    """Make frames with bright blobs moving over a noisy background.
+
+    Args:
+        n_frames: Number of frames.
+        height: Height of the frames.
+        width: Width of the frames.
+        channels: Number of channels of the frames.
+        n_animals: Number of blobs in each frame.
+        seed: Seed of the random number generator.
+
+    Returns:
+        A `uint8` array of shape `(n_frames, height, width, channels)`.
+    """
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[:height, :width].astype("float32")
+    sigma = min(height, width) / 16
+
+    positions = rng.uniform(0.2, 0.8, size=(n_animals, 2)) * [width, height]
+    velocities = rng.normal(scale=sigma / 4, size=(n_animals, 2))
+
+    frames = rng.integers(0, 32, size=(n_frames, height, width, channels))
+    frames = frames.astype("float32")
+    for frame in frames:
+        for x, y in positions:
+            blob = np.exp(-((xx - x) ** 2 + (yy - y) ** 2) / (2 * sigma ** 2))
+            frame += 200 * blob[..., None]
+
+        # Move the blobs and bounce them off the edges of the frame.
+        positions += velocities
+        out_of_frame = (positions < 0) | (positions >= [width, height])
+        velocities[out_of_frame] *= -1
+        positions = np.clip(positions, 0, [width - 1, height - 1])
+
+    return np.clip(frames, 0, 255).astype("uint8")
+
+
+def make_synthetic_video(
+    n_frames: int = 64,
+    height: int = 256,
+    width: int = 256,
+    channels: int = 1,
+    n_animals: int = 2,
+    backend: Text = "numpy",
+    filename: Optional[Text] = None,
+    seed: int = 0,
+) -> sleap.Video:
+    """Make a video from synthetic frames.
+
+    Args:
+        n_frames: Number of frames.
+        height: Height of the frames.
+        width: Width of the frames.
+        channels: Number of channels of the frames.
+        n_animals: Number of blobs in each frame.
+        backend: Either `"numpy"` to keep the frames in memory or `"hdf5"` to store
+            them in an HDF5 file.
+        filename: Path to the HDF5 file to store the frames in. If not specified, a
+            temporary file is created. Only used with the `"hdf5"` backend.
+        seed: Seed of the random number generator.
+
+    Returns:
+        A `sleap.Video` with a `NumpyVideo` or `HDF5Video` backend.
+    """
+    if backend not in VIDEO_BACKENDS:
+        raise ValueError(
+            f"Invalid video backend: {backend} (must be one of {VIDEO_BACKENDS})."
+        )
+
+    frames = make_synthetic_frames(
+        n_frames=n_frames,
+        height=height,
+        width=width,
+        channels=channels,
+        n_animals=n_animals,
+        seed=seed,
+    )
+
+    if backend == "numpy":
+        return sleap.Video.from_numpy(frames)
+
+    if filename is None:
+        fd, filename = tempfile.mkstemp(suffix=".h5", prefix="sleap_benchmark_")
+        os.close(fd)
+    with h5py.File(filename, "w") as f:
+        f.create_dataset("video", data=frames)
+    return sleap.Video.from_hdf5(
+        dataset="video", filename=filename, input_format="channels_last"
+    )
+
+
+def _make_random_model(
+    head_name: Text,
+    head_config: Any,
+    skeleton: sleap.Skeleton,
+    input_shape: Sequence[int],
+    filters: int,
+    max_stride: int,
+):
+    """Make the config and a randomly initialized model with a tiny UNet backbone.
+
+    Args:
+        head_name: Name of the head attribute of the `HeadsConfig`.
+        head_config: The head configuration.
+        skeleton: The skeleton of the model.
+        input_shape: Tuple of (height, width, channels) of the model inputs.
+        filters: Number of filters of the first block of the UNet.
+        max_stride: Maximum stride of the UNet.
+
+    Returns:
+        A tuple of `(config, model)` with a `TrainingJobConfig` and a `Model` whose
+        `keras_model` has been created.
+    """
+    config = TrainingJobConfig()
+    config.data.labels.skeletons = [skeleton]
+    config.data.preprocessing.pad_to_stride = max_stride
+    config.model.backbone.unet = UNetConfig(
+        max_stride=max_stride, filters=filters, filters_rate=1.5
+    )
+    setattr(config.model.heads, head_name, head_config)
+
+    model = Model.from_config(config.model, skeleton=skeleton, update_config=True)
+    model.make_model(tuple(input_shape))
+    return config, model
+
+
+def make_random_predictor(
+    model_type: Text,
+    skeleton: sleap.Skeleton,
+    input_shape: Sequence[int],
+    batch_size: int = 4,
+    filters: int = 8,
+    max_stride: int = 16,
+    crop_size: int = 64,
+    peak_threshold: float = 0.2,
+    instance_batch_size: Optional[int] = None,
+    seed: int = 0,
+) -> Predictor:
+    """Make a predictor with tiny randomly initialized models.
+
+    Args:
+        model_type: One of `MODEL_TYPES`.
+        skeleton: The skeleton of the models.
+        input_shape: Tuple of (height, width, channels) of the video frames.
+        batch_size: Number of frames per batch.
+        filters: Number of filters of the first block of the UNet backbones.
+        max_stride: Maximum stride of the UNet backbones. The frame size and the crop
+            size must be divisible by this.
+        crop_size: Size of the instance crops of top-down models.
+        peak_threshold: Minimum confidence map value of the detected peaks.
+        instance_batch_size: Number of crops per micro-batch of the centered instance
+            model of top-down predictors, or `None` to predict all crops at once.
+        seed: Seed of the TensorFlow random number generator used to initialize the
+            model weights.
+
+    Returns:
+        A `Predictor` of the model type with its inference model initialized.
+    """
+    tf.random.set_seed(seed)
+    input_shape = tuple(input_shape)
+    model_kwargs = dict(skeleton=skeleton, filters=filters, max_stride=max_stride)
+
+    if model_type == "single_instance":
+        config, model = _make_random_model(
+            "single_instance",
+            SingleInstanceConfmapsHeadConfig(output_stride=4),
+            input_shape=input_shape,
+            **model_kwargs,
+        )
+        predictor = SingleInstancePredictor(
+            confmap_config=config,
+            confmap_model=model,
+            batch_size=batch_size,
+            peak_threshold=peak_threshold,
+        )
+
+    elif model_type == "topdown":
+        centroid_config, centroid_model = _make_random_model(
+            "centroid",
+            CentroidsHeadConfig(output_stride=4),
+            input_shape=input_shape,
+            **model_kwargs,
+        )
+        confmap_config, confmap_model = _make_random_model(
+            "centered_instance",
+            CenteredInstanceConfmapsHeadConfig(output_stride=2),
+            input_shape=(crop_size, crop_size, input_shape[-1]),
+            **model_kwargs,
+        )
+        confmap_config.data.instance_cropping.crop_size = crop_size
+        predictor = TopDownPredictor(
+            centroid_config=centroid_config,
+            centroid_model=centroid_model,
+            confmap_config=confmap_config,
+            confmap_model=confmap_model,
+            batch_size=batch_size,
+            peak_threshold=peak_threshold,
+            instance_batch_size=instance_batch_size,
+        )
+
+    elif model_type == "bottomup":
+        head_config = MultiInstanceConfig()
+        head_config.confmaps.output_stride = 4
+        head_config.pafs.output_stride = 4
+        config, model = _make_random_model(
+            "multi_instance", head_config, input_shape=input_shape, **model_kwargs
+        )
+        predictor = BottomUpPredictor(
+            bottomup_config=config,
+            bottomup_model=model,
+            batch_size=batch_size,
+            peak_threshold=peak_threshold,
+        )
+
+    else:
+        raise ValueError(
+            f"Invalid model type: {model_type} (must be one of {MODEL_TYPES})."
+        )
+
+    predictor._initialize_inference_model()
+    return predictor
+
+
+class PeakMemoryMonitor:
+    """Context manager that tracks the peak resident memory of the process.
+
+    The memory is sampled in a background thread since most of it is allocated by
+    TensorFlow outside of the Python heap.
+
+    Attributes:
+        interval: Time between samples in seconds.
+        baseline: Resident memory in bytes when the context was entered.
+        peak: Highest sampled resident memory in bytes.
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.baseline = 0
+        self.peak = 0
+        self._process = psutil.Process()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        self.peak = max(self.peak, self._process.memory_info().rss)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self) -> "PeakMemoryMonitor":
+        self.baseline = self._process.memory_info().rss
+        self.peak = self.baseline
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+
+def benchmark_predictor(
+    predictor: Predictor, video: sleap.Video, repeats: int = 1
+) -> Dict[Text, Any]:
+    """Time inference of a predictor on all frames of a video.
+
+    The model is run on one batch first so that tracing and other one-time costs are
+    not timed. The shared frame cache is cleared before each timed run so that frames
+    are decoded again.
+
+    Args:
+        predictor: The predictor to benchmark. This should not have been run yet, so
+            that the stage timing ops are added when its model is traced.
+        video: The video to run inference on.
+        repeats: Number of timed runs over the video.
+
+    Returns:
+        A dictionary with the results:
+            `"n_frames"`: Number of frames in each run.
+            `"fps"`: Frames per second of the fastest run.
+            `"elapsed"`: Time of each run in seconds.
+            `"n_instances"`: Number of predicted instances in the last run.
+            `"baseline_memory"`: Resident memory of the process in bytes before the
+                timed runs.
+            `"peak_memory"`: Peak resident memory of the process in bytes during the
+                timed runs.
+            `"stage_times"`: Total time in each `Predictor.stage_times` stage,
+                summed over the runs.
+            `"stages"`: Statistics of each profiled stage over all runs from
+                `StageProfiler.to_dict()`.
+    """
+    profiler = get_profiler()
+    was_enabled = profiler.enabled
+    profiler.enable()
+    try:
+        predictor.predict(
+            VideoReader(video, example_indices=range(predictor.batch_size))
+        )
+        profiler.reset()
+
+        elapsed = []
+        stage_times = {}
+        with PeakMemoryMonitor() as memory:
+            for _ in range(repeats):
+                get_frame_cache().clear()
+                t0 = time.perf_counter()
+                labels = predictor.predict(video)
+                elapsed.append(time.perf_counter() - t0)
+                for stage, stage_time in predictor.stage_times.items():
+                    stage_times[stage] = stage_times.get(stage, 0.0) + stage_time
+        stages = profiler.to_dict()["stages"]
+    finally:
+        profiler.reset()
+        if not was_enabled:
+            profiler.disable()
+
+    return dict(
+        n_frames=len(video),
+        fps=len(video) / min(elapsed),
+        elapsed=elapsed,
+        n_instances=sum(len(lf.instances) for lf in labels),
+        baseline_memory=memory.baseline,
+        peak_memory=memory.peak,
+        stage_times=stage_times,
+        stages=stages,
+    )
+
+
+def run_benchmarks(
+    model_types: Sequence[Text] = MODEL_TYPES,
+    backends: Sequence[Text] = VIDEO_BACKENDS,
+    n_frames: int = 64,
+    height: int = 256,
+    width: int = 256,
+    channels: int = 1,
+    n_animals: int = 2,
+    n_nodes: int = 5,
+    batch_size: int = 4,
+    filters: int = 8,
+    peak_threshold: float = 0.2,
+    instance_batch_size: Optional[int] = None,
+    tracker: Optional[Text] = None,
+    pipelined: bool = False,
+    repeats: int = 1,
+    seed: int = 0,
+) -> List[Dict[Text, Any]]:
+    """Benchmark inference for each combination of model type and video backend.
+
+    Args:
+        model_types: Model types from `MODEL_TYPES` to benchmark.
+        backends: Video backends from `VIDEO_BACKENDS` to benchmark.
+        n_frames: Number of frames in the synthetic videos.
+        height: Height of the frames. Must be divisible by 16.
+        width: Width of the frames. Must be divisible by 16.
+        channels: Number of channels of the frames.
+        n_animals: Number of animals (blobs) in each frame.
+        n_nodes: Number of nodes in the skeleton.
+        batch_size: Number of frames per batch.
+        filters: Number of filters of the first block of the UNet backbones.
+        peak_threshold: Minimum confidence map value of the detected peaks.
+        instance_batch_size: Number of crops per micro-batch of the centered instance
+            model of top-down predictors, or `None` to predict all crops at once.
+        tracker: Name of a tracker for `Tracker.make_tracker_by_name` to use with the
+            multi-instance model types, or `None` to not track.
+        pipelined: If `True`, run the predictors in pipelined mode.
+        repeats: Number of timed runs over each video.
+        seed: Seed of the random number generators.
+
+    Returns:
+        A list with a dictionary of results from `benchmark_predictor` for each
+        benchmark, with the model type and video backend in the `"model_type"` and
+        `"backend"` keys.
+    """
+    skeleton = make_synthetic_skeleton(n_nodes)
+    results = []
+    for backend in backends:
+        video = make_synthetic_video(
+            n_frames=n_frames,
+            height=height,
+            width=width,
+            channels=channels,
+            n_animals=n_animals,
+            backend=backend,
+            seed=seed,
+        )
+        try:
+            for model_type in model_types:
+                predictor = make_random_predictor(
+                    model_type,
+                    skeleton,
+                    input_shape=(height, width, channels),
+                    batch_size=batch_size,
+                    filters=filters,
+                    peak_threshold=peak_threshold,
+                    instance_batch_size=instance_batch_size,
+                    seed=seed,
+                )
+                predictor.pipelined = pipelined
+                if tracker is not None and model_type != "single_instance":
+                    predictor.tracker = Tracker.make_tracker_by_name(tracker=tracker)
+
+                result = dict(model_type=model_type, backend=backend)
+                result.update(benchmark_predictor(predictor, video, repeats=repeats))
+                results.append(result)
+        finally:
+            if backend == "hdf5":
+                video.close()
+                os.remove(video.backend.filename)
+
+    return results
+
+
+def _get_git_commit() -> Optional[Text]:
+    """Return the hash of the checked out commit of the SLEAP repository, if any."""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(sleap.__file__)),
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(
+    results: List[Dict[Text, Any]], filename: Text, config: Optional[dict] = None
+):
+    """Save benchmark results to a JSON file with information about the system.
+
+    Args:
+        results: The results from `run_benchmarks`.
+        filename: Path to the output file.
+        config: Optional dictionary with the settings of the benchmarks.
+    """
+    data = dict(
+        timestamp=str(datetime.now()),
+        sleap_version=sleap.__version__,
+        git_commit=_get_git_commit(),
+        tensorflow_version=tf.__version__,
+        numpy_version=np.__version__,
+        platform=platform.platform(),
+        python_version=platform.python_version(),
+        cpu_count=os.cpu_count(),
+        config=config,
+        results=results,
+    )
+    with open(filename, "w") as f:
+        json.dump(data, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default=None,
+        help="Path to a JSON file to save the results to.",
+    )
+    parser.add_argument(
+        "--model_types",
+        type=str,
+        nargs="+",
+        choices=MODEL_TYPES,
+        default=list(MODEL_TYPES),
+        help="Model types to benchmark.",
+    )
+    parser.add_argument(
+        "--backends",
+        type=str,
+        nargs="+",
+        choices=VIDEO_BACKENDS,
+        default=list(VIDEO_BACKENDS),
+        help="Video backends to benchmark.",
+    )
+    parser.add_argument("--n_frames", type=int, default=64, help="Frames per video.")
+    parser.add_argument("--height", type=int, default=256, help="Frame height.")
+    parser.add_argument("--width", type=int, default=256, help="Frame width.")
+    parser.add_argument("--channels", type=int, default=1, help="Frame channels.")
+    parser.add_argument("--n_animals", type=int, default=2, help="Animals per frame.")
+    parser.add_argument("--n_nodes", type=int, default=5, help="Skeleton node count.")
+    parser.add_argument("--batch_size", type=int, default=4, help="Inference batch.")
+    parser.add_argument("--filters", type=int, default=8, help="UNet base filters.")
+    parser.add_argument(
+        "--peak_threshold", type=float, default=0.2, help="Peak threshold."
+    )
+    parser.add_argument(
+        "--instance_batch_size",
+        type=int,
+        default=None,
+        help="Crops per micro-batch of the top-down centered instance model.",
+    )
+    parser.add_argument(
+        "--tracker",
+        type=str,
+        default=None,
+        help="Tracker to use with multi-instance models (e.g., 'simple' or 'flow').",
+    )
+    parser.add_argument(
+        "--pipelined", action="store_true", help="Run the predictors pipelined."
+    )
+    parser.add_argument("--repeats", type=int, default=1, help="Timed runs per video.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    args = parser.parse_args()
+
+    sleap.nn.system.use_cpu_only()
+
+    config = vars(args).copy()
+    del config["output"]
+    results = run_benchmarks(**config)
+
+    print(
+        f"{'model_type':<16} {'backend':<8} {'fps':>8} {'instances':>10} "
+        f"{'peak memory (MB)':>17}"
+    )
+    for result in results:
+        print(
+            f"{result['model_type']:<16} {result['backend']:<8} "
+            f"{result['fps']:>8.1f} {result['n_instances']:>10d} "
+            f"{result['peak_memory'] / 1024 ** 2:>17.1f}"
+        )
+
+    if args.output is not None:
+        save_results(results, args.output, config=config)
+        print("Saved results:", args.output)
+
+
+if __name__ == "__main__":
+    main()
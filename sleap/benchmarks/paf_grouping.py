@@ -0,0 +1,133 @@
+"""
+Benchmarks for PAF-based instance grouping on synthetic frames.
+
+Synthetic frames are made of instances with a chain skeleton whose edges are listed in a
+random order, so that partial instances are formed and merged during assembly as they
+are in real frames. Some connections are dropped and some are swapped between instances
+to make fragments and conflicts.
+
+Usage:
+
+> python -m sleap.benchmarks.paf_grouping --n_instances 50 100 200 500
+"""
+
+import time
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+from sleap.nn.paf_grouping import (
+    EdgeConnection,
+    EdgeType,
+    assign_connections_to_instances,
+)
+
+
+def make_synthetic_connections(
+    n_instances: int,
+    n_nodes: int = 15,
+    drop_rate: float = 0.1,
+    swap_rate: float = 0.05,
+    shuffle_edges: bool = True,
+    seed: int = 0,
+) -> Dict[EdgeType, List[EdgeConnection]]:
+    """Make the matched connections of a synthetic frame.
+
+    Args:
+        n_instances: Number of instances (animals) in the frame.
+        n_nodes: Number of nodes in the chain skeleton of each instance.
+        drop_rate: Fraction of connections that are dropped.
+        swap_rate: Fraction of connections whose destination peak is swapped with the
+            one of another instance.
+        shuffle_edges: If `True`, the edges are listed in a random order. Otherwise,
+            they are listed in order along the chain.
+        seed: Seed of the random number generator.
+
+    Returns:
+        A dict that maps `EdgeType`s to lists of `EdgeConnection`s, as used by
+        `assign_connections_to_instances`.
+    """
+    rng = np.random.default_rng(seed)
+    edges = [(i, i + 1) for i in range(n_nodes - 1)]
+
+    # Peaks of each node are listed in a random order.
+    peak_inds = [rng.permutation(n_instances) for _ in range(n_nodes)]
+
+    connections = dict()
+    edge_inds = rng.permutation(len(edges)) if shuffle_edges else range(len(edges))
+    for edge_ind in edge_inds:
+        src_node_ind, dst_node_ind = edges[edge_ind]
+        dst_peak_inds = peak_inds[dst_node_ind].copy()
+        for i in np.flatnonzero(rng.random(n_instances) < swap_rate):
+            j = rng.integers(n_instances)
+            dst_peak_inds[i], dst_peak_inds[j] = dst_peak_inds[j], dst_peak_inds[i]
+
+        connections[EdgeType(src_node_ind, dst_node_ind)] = [
+            EdgeConnection(
+                int(peak_inds[src_node_ind][i]), int(dst_peak_inds[i]), rng.random()
+            )
+            for i in rng.permutation(n_instances)
+            if rng.random() >= drop_rate
+        ]
+
+    return connections
+
+
+def benchmark_assign_connections(
+    n_instances: Sequence[int] = (50, 100, 200, 500),
+    n_nodes: int = 15,
+    repeats: int = 5,
+) -> List[dict]:
+    """Time `assign_connections_to_instances` on synthetic frames.
+
+    Args:
+        n_instances: Numbers of instances per frame to benchmark.
+        n_nodes: Number of nodes in the skeleton.
+        repeats: Number of frames to time for each number of instances.
+
+    Returns:
+        A list of dicts with the number of instances and the best and mean time in
+        seconds for each benchmarked frame size.
+    """
+    results = []
+    for n in n_instances:
+        times = []
+        for seed in range(repeats):
+            connections = make_synthetic_connections(n, n_nodes=n_nodes, seed=seed)
+            t0 = time.perf_counter()
+            assign_connections_to_instances(connections, n_nodes=n_nodes)
+            times.append(time.perf_counter() - t0)
+        results.append(
+            dict(n_instances=n, best=float(np.min(times)), mean=float(np.mean(times)))
+        )
+    return results
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--n_instances",
+        type=int,
+        nargs="+",
+        default=[50, 100, 200, 500],
+        help="Numbers of instances per frame to benchmark.",
+    )
+    parser.add_argument("--n_nodes", type=int, default=15, help="Skeleton node count.")
+    parser.add_argument("--repeats", type=int, default=5, help="Frames per size.")
+    args = parser.parse_args()
+
+    results = benchmark_assign_connections(
+        n_instances=args.n_instances, n_nodes=args.n_nodes, repeats=args.repeats
+    )
+    print("n_instances\tbest (ms)\tmean (ms)")
+    for result in results:
+        print(
+            f"{result['n_instances']}\t\t{result['best'] * 1000:.1f}\t\t"
+            f"{result['mean'] * 1000:.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
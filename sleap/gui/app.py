@@ -66,6 +66,7 @@ from sleap.gui.dialogs.metrics import MetricsTableDialog
 from sleap.skeleton import Skeleton
 from sleap.instance import Instance
 from sleap.io.dataset import Labels
+from sleap.io.framecache import set_frame_cache_size
 from sleap.info.summary import StatisticSeries
 from sleap.gui.commands import CommandContext, UpdateTopic
 from sleap.gui.widgets.video import QtVideoPlayer
@@ -144,6 +145,9 @@ class MainWindow(QMainWindow):
         self.state["propagate track labels"] = prefs["propagate track labels"]
         self.state.connect("marker size", self.plotFrame)
 
+        # Frame cache size preference is in megabytes
+        set_frame_cache_size(prefs["frame cache size"] * 1024 ** 2)
+
         self.release_checker = ReleaseChecker()
 
         self._initialize_gui()
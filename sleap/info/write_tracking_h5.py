@@ -14,16 +14,22 @@ The HDF5 file has these datasets:
 * "node_names"         shape: nodes
 
 Note: the datasets are stored column-major as expected by MATLAB.
+
+`AnalysisH5StreamWriter` writes the same datasets incrementally from labeled frames,
+e.g., while they are being predicted, without holding the full matrices in memory.
 """
 
 import os
 import re
+import attr
 import h5py as h5
 import numpy as np
 
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
+from sleap.instance import LabeledFrame, Track
 from sleap.io.dataset import Labels
+from sleap.skeleton import Skeleton
 
 
 def get_tracks_as_np_strings(labels: Labels) -> List[np.string_]:
@@ -58,13 +64,11 @@ def get_occupancy_and_points_matrices(
     track_count = len(labels.tracks) or 1
     node_count = len(labels.skeletons[0].nodes)
 
-    frame_idxs = [lf.frame_idx for lf in labels]
-    frame_idxs.sort()
-
-    first_frame_idx = 0 if all_frames else frame_idxs[0]
+    labeled_frame_idxs = labels.get_labeled_frame_inds()
+    first_frame_idx = 0 if all_frames else labeled_frame_idxs.min()
 
     frame_count = (
-        frame_idxs[-1] - first_frame_idx + 1
+        labeled_frame_idxs.max() - first_frame_idx + 1
     )  # count should include unlabeled frames
 
     # Desired MATLAB format:
@@ -77,21 +81,19 @@ def get_occupancy_and_points_matrices(
         (frame_count, node_count, 2, track_count), np.nan, dtype=float
     )
 
-    for lf, inst in [(lf, inst) for lf in labels for inst in lf.instances]:
-        frame_i = lf.frame_idx - first_frame_idx
-        if inst.track is None:
-            # We could use lf.instances.index(inst) but then we'd need
-            # to calculate the number of "tracks" based on the max number of
-            # instances in any frame, so for now we'll assume that there's
-            # a single instance if we aren't using tracks.
-            track_i = 0
-        else:
-            track_i = labels.tracks.index(inst.track)
+    # Build the frame and track index of every instance once and scatter all of the
+    # points into the matrices at the same time.
+    frame_idxs, track_idxs, points = labels.get_instance_arrays()
+    frame_idxs = frame_idxs - first_frame_idx
 
-        occupancy_matrix[track_i, frame_i] = 1
+    # We could use the order of the instances in each frame but then we'd need to
+    # calculate the number of "tracks" based on the max number of instances in any
+    # frame, so for now we'll assume that there's a single instance if we aren't
+    # using tracks.
+    track_idxs[track_idxs < 0] = 0
 
-        inst_points = inst.points_array
-        locations_matrix[frame_i, ..., track_i] = inst_points
+    occupancy_matrix[track_idxs, frame_idxs] = 1
+    locations_matrix[frame_idxs, ..., track_idxs] = points
 
     return occupancy_matrix, locations_matrix
 
@@ -129,11 +131,19 @@ def remove_empty_tracks_from_matrices(
 
 
 def write_occupancy_file(
-    output_path: str, data_dict: Dict[str, Any], transpose: bool = True
+    output_path: str,
+    data_dict: Dict[str, Any],
+    transpose: bool = True,
+    slab_size: int = 4096,
+    compression: Optional[str] = "gzip",
+    compression_opts: Optional[int] = 9,
 ):
     """
     Write HDF5 file with data from given dictionary.
 
+    Arrays are written in slabs of `slab_size` along their first axis so that the
+    transposed or converted copy of the whole array is never held in memory.
+
     Args:
         output_path: Path of HDF5 file.
         data_dict: Dictionary with data to save. Keys are dataset names,
@@ -142,6 +152,12 @@ def write_occupancy_file(
             transposed before saving. This is useful for writing files
             that will be imported into MATLAB, which expects data in
             column-major format.
+        slab_size: Number of rows along the first axis of each array (e.g.,
+            frames of the "tracks" matrix) to write at a time.
+        compression: HDF5 compression filter of the arrays, or None to
+            disable compression.
+        compression_opts: Options of the compression filter, e.g., the gzip
+            compression level.
 
     Returns:
         None
@@ -152,18 +168,25 @@ def write_occupancy_file(
             if isinstance(val, np.ndarray):
                 print(f"{key}: {val.shape}")
 
-                if transpose:
-                    # Transpose since MATLAB expects column-major
-                    f.create_dataset(
-                        key,
-                        data=np.transpose(val),
-                        compression="gzip",
-                        compression_opts=9,
-                    )
-                else:
-                    f.create_dataset(
-                        key, data=val, compression="gzip", compression_opts=9
-                    )
+                if val.ndim == 0 or val.size == 0:
+                    f.create_dataset(key, data=np.transpose(val) if transpose else val)
+                    continue
+
+                # Transpose since MATLAB expects column-major
+                ds = f.create_dataset(
+                    key,
+                    shape=val.shape[::-1] if transpose else val.shape,
+                    dtype=val.dtype,
+                    chunks=True,
+                    compression=compression,
+                    compression_opts=compression_opts if compression else None,
+                )
+                for start in range(0, len(val), slab_size):
+                    slab = val[start : start + slab_size]
+                    if transpose:
+                        ds[..., start : start + slab_size] = np.transpose(slab)
+                    else:
+                        ds[start : start + slab_size] = slab
             else:
                 print(f"{key}: {len(val)}")
                 f.create_dataset(key, data=val)
@@ -171,6 +194,214 @@ def write_occupancy_file(
     print(f"Saved as {output_path}")
 
 
+@attr.s(auto_attribs=True)
+class AnalysisH5StreamWriter:
+    """Incrementally write labeled frames to an analysis HDF5 file.
+
+    The datasets are chunked and resizable, and grow along the frame and track axes as
+    frames are written. Frames are buffered and written in blocks of `block_size`
+    frames, so only the matrices of one block are held in memory at a time. The file is
+    opened for each block so that it stays readable if the process is interrupted.
+
+    The file has the same datasets and layout as the one written by `main` with
+    `all_frames=True`, except that tracks are ordered by their first appearance and
+    the coordinates can be stored as `float32`. Frames can be written in any order.
+
+    Usage:
+
+    > with AnalysisH5StreamWriter("predictions.analysis.h5") as writer:
+    >     for batch_of_frames in ...:
+    >         writer.write_frames(batch_of_frames)
+
+    Attributes:
+        filename: Path to the HDF5 file. Any existing file is overwritten.
+        skeleton: Skeleton of the instances. If `None`, the skeleton of the first
+            written instance is used.
+        dtype: Data type of the point coordinates, `"float64"` or `"float32"`.
+        block_size: Number of frames to buffer before writing them. This is also the
+            chunk size along the frame axis.
+        compression: HDF5 compression filter of the matrices, or `None` to disable
+            compression.
+        compression_opts: Options of the compression filter, e.g., the gzip
+            compression level.
+        tracks: The tracks in the order of the track axis of the file.
+        n_frames: Number of frames along the frame axis of the file, i.e., the largest
+            written frame index plus one.
+    """
+
+    filename: str
+    skeleton: Optional[Skeleton] = None
+    dtype: str = "float64"
+    block_size: int = 1024
+    compression: Optional[str] = "gzip"
+    compression_opts: Optional[int] = 4
+    tracks: List[Track] = attr.ib(factory=list, init=False)
+    n_frames: int = attr.ib(default=0, init=False)
+    _buffer: List[LabeledFrame] = attr.ib(factory=list, init=False)
+    _track_inds: Dict[Track, int] = attr.ib(factory=dict, init=False)
+    _n_tracks: int = attr.ib(default=0, init=False)
+    _n_track_names: int = attr.ib(default=0, init=False)
+
+    def __attrs_post_init__(self):
+        if self.dtype not in ("float64", "float32"):
+            raise ValueError(f"Points must be float64 or float32 (got {self.dtype}).")
+        if self.block_size < 1:
+            raise ValueError(f"Block size must be at least 1 (got {self.block_size}).")
+
+        with h5.File(self.filename, "w") as f:
+            if self.skeleton is not None:
+                self._create_datasets(f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _create_datasets(self, f: h5.File):
+        """Create the empty resizable datasets once the skeleton is known."""
+        n_nodes = len(self.skeleton.nodes)
+        compression = dict(
+            compression=self.compression,
+            compression_opts=self.compression_opts if self.compression else None,
+        )
+        f.create_dataset(
+            "node_names", data=[np.string_(node.name) for node in self.skeleton.nodes]
+        )
+        f.create_dataset(
+            "track_names",
+            shape=(0,),
+            maxshape=(None,),
+            dtype=h5.special_dtype(vlen=bytes),
+            chunks=(64,),
+        )
+
+        # Transposed shapes since MATLAB expects column-major.
+        f.create_dataset(
+            "tracks",
+            shape=(0, 2, n_nodes, 0),
+            maxshape=(None, 2, n_nodes, None),
+            dtype=self.dtype,
+            chunks=(1, 2, max(n_nodes, 1), self.block_size),
+            fillvalue=np.nan,
+            **compression,
+        )
+        f.create_dataset(
+            "track_occupancy",
+            shape=(0, 0),
+            maxshape=(None, None),
+            dtype=np.uint8,
+            chunks=(self.block_size, 16),
+            fillvalue=0,
+            **compression,
+        )
+
+    def _find_track(self, track: Optional[Track]) -> int:
+        """Return the index of the track, adding it to the track axis if needed."""
+        if track is None:
+            # As in `get_occupancy_and_points_matrices`, instances without a track
+            # are assumed to be a single instance in the first track.
+            self._n_tracks = max(self._n_tracks, 1)
+            return 0
+        if track not in self._track_inds:
+            self._track_inds[track] = len(self.tracks)
+            self.tracks.append(track)
+            self._n_tracks = max(self._n_tracks, len(self.tracks))
+        return self._track_inds[track]
+
+    def write_frames(self, labeled_frames: List[LabeledFrame]):
+        """Buffer labeled frames, writing them out every `block_size` frames."""
+        self._buffer.extend(labeled_frames)
+        if len(self._buffer) >= self.block_size:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered frames to the file in blocks of `block_size` frames."""
+        for start in range(0, len(self._buffer), self.block_size):
+            self._write_block(self._buffer[start : start + self.block_size])
+        self._buffer = []
+
+    def _write_block(self, labeled_frames: List[LabeledFrame]):
+        """Write a block of at most `block_size` labeled frames to the file."""
+        frame_idxs, track_idxs, points = [], [], []
+        for lf in labeled_frames:
+            self.n_frames = max(self.n_frames, lf.frame_idx + 1)
+            for inst in lf.instances:
+                if self.skeleton is None:
+                    self.skeleton = inst.skeleton
+                frame_idxs.append(lf.frame_idx)
+                track_idxs.append(self._find_track(inst.track))
+                points.append(inst.numpy())
+
+        if self.skeleton is None:
+            # Nothing can be written until the first instance.
+            return
+
+        with h5.File(self.filename, "a") as f:
+            if "tracks" not in f:
+                self._create_datasets(f)
+
+            new_track_names = self.tracks[self._n_track_names :]
+            if new_track_names:
+                f["track_names"].resize((len(self.tracks),))
+                f["track_names"][self._n_track_names :] = [
+                    np.string_(track.name) for track in new_track_names
+                ]
+                self._n_track_names = len(self.tracks)
+
+            tracks_ds, occupancy_ds = f["tracks"], f["track_occupancy"]
+            tracks_ds.resize((self._n_tracks, 2, tracks_ds.shape[2], self.n_frames))
+            occupancy_ds.resize((self.n_frames, self._n_tracks))
+
+            if len(points) == 0:
+                return
+
+            frame_idxs = np.array(frame_idxs, dtype="int64")
+            track_idxs = np.array(track_idxs, dtype="int64")
+            points = np.stack(points).astype(self.dtype).transpose((0, 2, 1))
+
+            # Read-modify-write one chunk of frames at a time so that frames written
+            # out of order in earlier blocks are kept, and so that frames far apart
+            # within a block don't require reading all of the frames in between.
+            chunk_idxs = frame_idxs // self.block_size
+            for chunk_idx in np.unique(chunk_idxs):
+                rows = chunk_idxs == chunk_idx
+                start = chunk_idx * self.block_size
+                end = min(start + self.block_size, self.n_frames)
+                chunk_frame_idxs = frame_idxs[rows] - start
+                chunk_track_idxs = track_idxs[rows]
+
+                tracks_block = tracks_ds[..., start:end]
+                tracks_block[chunk_track_idxs, ..., chunk_frame_idxs] = points[rows]
+                tracks_ds[..., start:end] = tracks_block
+
+                occupancy_block = occupancy_ds[start:end]
+                occupancy_block[chunk_frame_idxs, chunk_track_idxs] = 1
+                occupancy_ds[start:end] = occupancy_block
+
+    def close(self):
+        """Write the remaining frames and make sure all datasets exist."""
+        self.flush()
+        with h5.File(self.filename, "a") as f:
+            if "tracks" in f:
+                f["tracks"].resize(self.n_frames, axis=3)
+                f["track_occupancy"].resize(self.n_frames, axis=0)
+            else:
+                # No instances were written.
+                n_nodes = 0 if self.skeleton is None else len(self.skeleton.nodes)
+                names = [] if self.skeleton is None else self.skeleton.node_names
+                f.create_dataset("node_names", data=[np.string_(n) for n in names])
+                f.create_dataset(
+                    "track_names", shape=(0,), dtype=h5.special_dtype(vlen=bytes)
+                )
+                f.create_dataset(
+                    "tracks", shape=(0, 2, n_nodes, self.n_frames), dtype=self.dtype
+                )
+                f.create_dataset(
+                    "track_occupancy", shape=(self.n_frames, 0), dtype=np.uint8
+                )
+
+
 def main(labels: Labels, output_path: str, all_frames: bool = True):
     """
     Writes HDF5 file with matrices of track occupancy and coordinates.
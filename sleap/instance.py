@@ -1055,6 +1055,75 @@ class PredictedInstance(Instance):
             track=track,
         )
 
+    @classmethod
+    def from_arrays_batch(
+        cls,
+        points: np.ndarray,
+        point_confidences: np.ndarray,
+        instance_scores: np.ndarray,
+        skeleton: Skeleton,
+        tracks: Optional[List[Optional[Track]]] = None,
+    ) -> List["PredictedInstance"]:
+        """Create predicted instances from data arrays of multiple instances.
+
+        This is equivalent to calling `PredictedInstance.from_arrays` for each instance,
+        but the points of all instances are written to a single `PredictedPointArray`
+        at once and each instance gets a view of its row, so no points are created one
+        at a time.
+
+        Args:
+            points: A numpy array of shape `(n_instances, n_nodes, 2)` that contains the
+                points in `(x, y)` coordinates of each node of each instance. Missing
+                nodes should be represented as `NaN`.
+            point_confidences: A numpy array of shape `(n_instances, n_nodes)` that
+                contains the confidence/score of the points.
+            instance_scores: A numpy array of shape `(n_instances,)` with the overall
+                score of each instance, e.g., the PAF grouping score.
+            skeleton: A sleap.Skeleton instance with n_nodes nodes to associate with the
+                predicted instances.
+            tracks: Optional list of `n_instances` `sleap.Track`s (or `None`) to
+                associate with the instances.
+
+        Returns:
+            A list of `n_instances` new `PredictedInstance`s.
+
+        Raises:
+            ValueError: If the number of nodes does not match the skeleton.
+        """
+        points = np.asarray(points, dtype="float64")
+        n_instances = len(points)
+        if n_instances == 0:
+            return []
+
+        n_nodes = len(skeleton.nodes)
+        if points.shape[1:] != (n_nodes, 2):
+            raise ValueError(
+                f"Points must have shape (n_instances, {n_nodes}, 2) to match the "
+                f"skeleton nodes, got {points.shape}."
+            )
+
+        # Missing points are left at their defaults, as in from_arrays.
+        missing = np.isnan(points).any(axis=-1)
+        parray = PredictedPointArray((n_instances, n_nodes))
+        parray["x"] = np.where(missing, np.nan, points[..., 0])
+        parray["y"] = np.where(missing, np.nan, points[..., 1])
+        parray["visible"] = True
+        parray["complete"] = False
+        parray["score"] = np.where(missing, 0.0, point_confidences)
+
+        if tracks is None:
+            tracks = [None] * n_instances
+
+        return [
+            cls(
+                points=parray[i],
+                skeleton=skeleton,
+                score=instance_scores[i],
+                track=tracks[i],
+            )
+            for i in range(n_instances)
+        ]
+
 
 def make_instance_cattr() -> cattr.Converter:
     """Create a cattr converter for Lists of Instances/PredictedInstances.
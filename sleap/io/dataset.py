@@ -95,26 +95,47 @@ class LabelsDataCache:
 
     labels: "Labels"
 
+    # Data structures which are built lazily when the labeled frames are lazy.
+    _deferred_attrs = (
+        "_lf_by_video",
+        "_frame_idx_map",
+        "_track_occupancy",
+        "_frame_count_cache",
+    )
+
     def __attrs_post_init__(self):
+        self._deferred = False
         self.update()
 
+    def __getattr__(self, name):
+        # Only called when the attribute isn't found, i.e., when the cache has been
+        # deferred and hasn't been built yet.
+        if name in LabelsDataCache._deferred_attrs and self.__dict__.get("_deferred"):
+            self._deferred = False
+            self._build()
+            return getattr(self, name)
+        raise AttributeError(name)
+
     def update(self, new_frame: Optional[LabeledFrame] = None):
         """Build (or rebuilds) various caches."""
-        # Data structures for caching
         if new_frame is None:
-            self._lf_by_video = dict()
-            self._frame_idx_map = dict()
-            self._track_occupancy = dict()
-            self._frame_count_cache = dict()
-
-            for video in self.labels.videos:
-                self._lf_by_video[video] = [
-                    lf for lf in self.labels if lf.video == video
-                ]
-                self._frame_idx_map[video] = {
-                    lf.frame_idx: lf for lf in self._lf_by_video[video]
-                }
-                self._track_occupancy[video] = self._make_track_occupancy(video)
+            if getattr(self.labels.labeled_frames, "columns_valid", False):
+                # Defer building the cache for lazily loaded frames until it's
+                # needed since this requires creating every frame. Once any frame
+                # exists, it may have been edited, so the cache is built from the
+                # frames right away.
+                self._deferred = True
+                for name in self._deferred_attrs:
+                    self.__dict__.pop(name, None)
+            else:
+                self._deferred = False
+                self._build()
+
+        elif self._deferred:
+            # The full cache will already include the new frame.
+            self._deferred = False
+            self._build()
+
         else:
             new_vid = new_frame.video
 
@@ -125,6 +146,20 @@ class LabelsDataCache:
             self._lf_by_video[new_vid].append(new_frame)
             self._frame_idx_map[new_vid][new_frame.frame_idx] = new_frame
 
+    def _build(self):
+        """Build the caches from all of the labeled frames."""
+        self._lf_by_video = dict()
+        self._frame_idx_map = dict()
+        self._track_occupancy = dict()
+        self._frame_count_cache = dict()
+
+        for video in self.labels.videos:
+            self._lf_by_video[video] = [lf for lf in self.labels if lf.video == video]
+            self._frame_idx_map[video] = {
+                lf.frame_idx: lf for lf in self._lf_by_video[video]
+            }
+            self._track_occupancy[video] = self._make_track_occupancy(video)
+
     def find_frames(
         self, video: Video, frame_idx: Optional[Union[int, Iterable[int]]] = None
     ) -> Optional[List[LabeledFrame]]:
@@ -2056,6 +2091,73 @@ class Labels(MutableSequence):
         pipeline += pipelines.Prefetcher()
         return pipeline
 
+    def get_labeled_frame_inds(self, video: Optional[Video] = None) -> np.ndarray:
+        """Return the frame indices of the labeled frames.
+
+        Args:
+            video: Video whose frames should be included. If `None` (the default), the
+                frames of all videos are included.
+
+        Returns:
+            An `int64` array with the frame index of each labeled frame.
+        """
+        if getattr(self.labeled_frames, "columns_valid", False):
+            return self.labeled_frames.frame_inds(video=video)
+
+        return np.array(
+            [
+                lf.frame_idx
+                for lf in self.labeled_frames
+                if video is None or lf.video == video
+            ],
+            dtype="int64",
+        )
+
+    def get_instance_arrays(
+        self, video: Optional[Video] = None
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Return the frame, track and points of every instance as arrays.
+
+        This is the columnar form of the instances used for exporting tracks. Lazily
+        loaded labels are converted directly from the stored tables without creating
+        any frame or instance objects, unless frames have already been created, in
+        which case they may have been edited and are converted from the objects.
+
+        Args:
+            video: Video whose instances should be included. If `None` (the default),
+                the instances of all videos are included.
+
+        Returns:
+            A tuple of `(frame_inds, track_inds, points)` with shapes `(n_instances,)`,
+            `(n_instances,)` and `(n_instances, n_nodes, 2)`. `frame_inds` are the
+            frame indices in the video and `track_inds` are indices into
+            `Labels.tracks`, or -1 for instances without a track. Points of missing
+            nodes are `NaN`.
+        """
+        n_nodes = len(self.skeletons[0].nodes)
+        if getattr(self.labeled_frames, "columns_valid", False):
+            return self.labeled_frames.instance_arrays(
+                video=video, tracks=self.tracks, n_nodes=n_nodes
+            )
+
+        track_inds_map = {track: i for i, track in enumerate(self.tracks)}
+        frame_inds, track_inds, points = [], [], []
+        for lf in self.labeled_frames:
+            if video is not None and lf.video != video:
+                continue
+            for inst in lf.instances:
+                frame_inds.append(lf.frame_idx)
+                track_inds.append(track_inds_map.get(inst.track, -1))
+                points.append(inst.numpy())
+
+        if len(points) == 0:
+            points = np.full((0, n_nodes, 2), np.nan, dtype="float32")
+        return (
+            np.array(frame_inds, dtype="int64"),
+            np.array(track_inds, dtype="int64"),
+            np.stack(points).astype("float32"),
+        )
+
     def numpy(
         self, video: Optional[Video] = None, all_frames: bool = True
     ) -> np.ndarray:
@@ -2079,17 +2181,10 @@ class Labels(MutableSequence):
         """
         if video is None:
             video = self.videos[0]
-        lfs = self.find(video=video)
 
         if all_frames:
-            first_frame, last_frame = None, None
-            for lf in lfs:
-                if first_frame is None:
-                    first_frame = lf.frame_idx
-                if last_frame is None:
-                    last_frame = lf.frame_idx
-                first_frame = min(first_frame, lf.frame_idx)
-                last_frame = max(last_frame, lf.frame_idx)
+            frame_inds = self.get_labeled_frame_inds(video=video)
+            first_frame, last_frame = frame_inds.min(), frame_inds.max()
         else:
             first_frame, last_frame = 0, video.shape[0] - 1
 
@@ -2098,12 +2193,9 @@ class Labels(MutableSequence):
         n_nodes = len(self.skeleton.nodes)
 
         tracks = np.full((n_frames, n_tracks, n_nodes, 2), np.nan, dtype="float32")
-        for lf in lfs:
-            i = lf.frame_idx - first_frame
-            for inst in lf:
-                if inst.track is not None:
-                    j = self.tracks.index(inst.track)
-                    tracks[i, j] = inst.numpy()
+        frame_inds, track_inds, points = self.get_instance_arrays(video=video)
+        tracked = track_inds >= 0
+        tracks[frame_inds[tracked] - first_frame, track_inds[tracked]] = points[tracked]
 
         return tracks
 
@@ -2235,6 +2327,7 @@ def load_file(
     detect_videos: bool = True,
     search_paths: Optional[Union[List[Text], Text]] = None,
     match_to: Optional[Labels] = None,
+    lazy: bool = False,
 ) -> Labels:
     """Load a SLEAP labels file.
 
@@ -2256,6 +2349,10 @@ def load_file(
         match_to: If a `sleap.Labels` object is provided, attempt to match and reuse
             video and skeleton objects when loading. This is useful when comparing the
             contents across sets of labels.
+        lazy: If True, labeled frames in `.slp` files will be kept as columnar arrays
+            and only be created as `LabeledFrame` objects when they are accessed. This
+            makes loading large prediction files much faster. See
+            `sleap.io.lazy.LazyLabeledFrames` for details.
 
     Returns:
         The loaded `Labels` instance.
@@ -2270,6 +2367,6 @@ def load_file(
     if detect_videos:
         if search_paths is None:
             search_paths = os.path.dirname(filename)
-        return Labels.load_file(filename, search_paths, match_to=match_to)
+        return Labels.load_file(filename, search_paths, match_to=match_to, lazy=lazy)
     else:
-        return Labels.load_file(filename, match_to=match_to)
+        return Labels.load_file(filename, match_to=match_to, lazy=lazy)
@@ -17,14 +17,45 @@ from sleap.instance import (
     PredictedPoint,
     Point,
 )
+from sleap.io.lazy import LazyLabeledFrames
 from sleap.util import json_loads, json_dumps
 from sleap import Labels, Video
 
 import h5py
 import numpy as np
 import os
-
-from typing import Optional, Callable, List, Text, Union
+import weakref
+
+from typing import Optional, Callable, List, Text, Union, Dict, Tuple, Sequence
+
+import attr
+
+
+# We will store Instances and PredictedInstances in the same table. instance_type=0
+# for Instance and instance_type=1 for PredictedInstance, score will be ignored for
+# Instances.
+INSTANCE_DTYPE = np.dtype(
+    [
+        ("instance_id", "i8"),
+        ("instance_type", "u1"),
+        ("frame_id", "u8"),
+        ("skeleton", "u4"),
+        ("track", "i4"),
+        ("from_predicted", "i8"),
+        ("score", "f4"),
+        ("point_id_start", "u8"),
+        ("point_id_end", "u8"),
+    ]
+)
+FRAME_DTYPE = np.dtype(
+    [
+        ("frame_id", "u8"),
+        ("video", "u4"),
+        ("frame_idx", "u8"),
+        ("instance_id_start", "u8"),
+        ("instance_id_end", "u8"),
+    ]
+)
 
 
 class LabelsV1Adaptor(format.adaptor.Adaptor):
@@ -132,6 +163,7 @@ class LabelsV1Adaptor(format.adaptor.Adaptor):
         file: format.filehandle.FileHandle,
         video_search: Union[Callable, List[Text], None] = None,
         match_to: Optional[Labels] = None,
+        lazy: bool = False,
         *args,
         **kwargs,
     ):
@@ -150,6 +182,20 @@ class LabelsV1Adaptor(format.adaptor.Adaptor):
             points_dset[:]["x"] -= 0.5
             points_dset[:]["y"] -= 0.5
 
+        if lazy:
+            # Keep the tables as columns and only create frame objects on access.
+            labels.labeled_frames = LazyLabeledFrames(
+                frames=frames_dset,
+                instances=instances_dset,
+                points=points_dset,
+                pred_points=pred_points_dset,
+                videos=labels.videos,
+                skeletons=labels.skeletons,
+                tracks=labels.tracks,
+            )
+            labels.update_cache()
+            return labels
+
         # Rather than instantiate a bunch of Point\PredictedPoint objects, we will use
         # inplace numpy recarrays. This will save a lot of time and memory when reading
         # things in.
@@ -260,13 +306,7 @@ class LabelsV1Adaptor(format.adaptor.Adaptor):
 
         else:
             # Include the source video metadata if this was a package.
-            new_videos = []
-            for video in labels.videos:
-                if hasattr(video.backend, "_source_video"):
-                    new_videos.append(video.backend._source_video)
-                else:
-                    new_videos.append(video)
-            d["videos"] = Video.cattr().unstructure(new_videos)
+            d["videos"] = Video.cattr().unstructure(get_source_videos(labels.videos))
 
         with h5py.File(filename, "a") as f:
 
@@ -319,206 +359,475 @@ class LabelsV1Adaptor(format.adaptor.Adaptor):
                 d = labels.to_dict(skip_labels=True)
 
             if not append:
-                # These items are stored in separate lists because the metadata
-                # group got to be too big.
-                for key in ("videos", "tracks", "suggestions"):
-                    # Convert for saving in hdf5 dataset
-                    data = [np.string_(json_dumps(item)) for item in d[key]]
-
-                    hdf5_key = f"{key}_json"
-
-                    # Save in its own dataset (e.g., videos_json)
-                    f.create_dataset(hdf5_key, data=data, maxshape=(None,))
-
-                    # Clear from dict since we don't want to save this in attribute
-                    d[key] = []
+                write_json_lists(f, d)
 
             # Output the dict to JSON
             meta_group.attrs["json"] = np.string_(json_dumps(d))
 
-            # FIXME: We can probably construct these from attrs fields
-            # We will store Instances and PredcitedInstances in the same
-            # table. instance_type=0 or Instance and instance_type=1 for
-            # PredictedInstance, score will be ignored for Instances.
-            instance_dtype = np.dtype(
-                [
-                    ("instance_id", "i8"),
-                    ("instance_type", "u1"),
-                    ("frame_id", "u8"),
-                    ("skeleton", "u4"),
-                    ("track", "i4"),
-                    ("from_predicted", "i8"),
-                    ("score", "f4"),
-                    ("point_id_start", "u8"),
-                    ("point_id_end", "u8"),
-                ]
-            )
-            frame_dtype = np.dtype(
-                [
-                    ("frame_id", "u8"),
-                    ("video", "u4"),
-                    ("frame_idx", "u8"),
-                    ("instance_id_start", "u8"),
-                    ("instance_id_end", "u8"),
-                ]
-            )
-
-            num_instances = len(labels.all_instances)
-            max_skeleton_size = max([len(s.nodes) for s in labels.skeletons], default=0)
-
-            # Initialize data arrays for serialization
-            points = np.zeros(num_instances * max_skeleton_size, dtype=Point.dtype)
-            pred_points = np.zeros(
-                num_instances * max_skeleton_size, dtype=PredictedPoint.dtype
-            )
-            instances = np.zeros(num_instances, dtype=instance_dtype)
-            frames = np.zeros(len(labels), dtype=frame_dtype)
-
-            # Pre compute some structures to make serialization faster
-            skeleton_to_idx = {
-                skeleton: labels.skeletons.index(skeleton)
-                for skeleton in labels.skeletons
-            }
-            track_to_idx = {
-                track: labels.tracks.index(track) for track in labels.tracks
-            }
-            track_to_idx[None] = -1
-            video_to_idx = {
-                video: labels.videos.index(video) for video in labels.videos
-            }
-            instance_type_to_idx = {Instance: 0, PredictedInstance: 1}
-
-            # Each instance we create will have and index in the dataset, keep track of
-            # these so we can quickly add from_predicted links on a second pass.
-            instance_to_idx = {}
-            instances_with_from_predicted = []
-            instances_from_predicted = []
-
             # If we are appending, we need look inside to see what frame, instance, and
             # point ids we need to start from. This gives us offsets to use.
-            if append and "points" in f:
-                point_id_offset = f["points"].shape[0]
-                pred_point_id_offset = f["pred_points"].shape[0]
-                instance_id_offset = f["instances"][-1]["instance_id"] + 1
-                frame_id_offset = int(f["frames"][-1]["frame_id"]) + 1
+            offsets = get_table_offsets(f) if append else dict()
+
+            # Build the tables with vectorized operations. Lazily loaded frames are
+            # serialized straight from their columns.
+            if getattr(labels.labeled_frames, "columns_valid", False):
+                tables = serialize_lazy_frames(
+                    labels.labeled_frames,
+                    videos=labels.videos,
+                    skeletons=labels.skeletons,
+                    tracks=labels.tracks,
+                    **offsets,
+                )
             else:
-                point_id_offset = 0
-                pred_point_id_offset = 0
-                instance_id_offset = 0
-                frame_id_offset = 0
-
-            point_id = 0
-            pred_point_id = 0
-            instance_id = 0
-
-            for frame_id, label in enumerate(labels):
-                frames[frame_id] = (
-                    frame_id + frame_id_offset,
-                    video_to_idx[label.video],
-                    label.frame_idx,
-                    instance_id + instance_id_offset,
-                    instance_id + instance_id_offset + len(label.instances),
+                tables = serialize_labeled_frames(
+                    labels.labeled_frames,
+                    videos=labels.videos,
+                    skeletons=labels.skeletons,
+                    tracks=labels.tracks,
+                    **offsets,
                 )
-                for instance in label.instances:
-
-                    # Add this instance to our lookup structure we will need for
-                    # from_predicted links
-                    instance_to_idx[instance] = instance_id
-
-                    parray = instance.get_points_array(copy=False, full=True)
-                    instance_type = type(instance)
-
-                    # Check whether we are working with a PredictedInstance or an
-                    # Instance.
-                    if instance_type is PredictedInstance:
-                        score = instance.score
-                        pid = pred_point_id + pred_point_id_offset
-                    else:
-                        score = np.nan
-                        pid = point_id + point_id_offset
-
-                        # Keep track of any from_predicted instance links, we will
-                        # insert the correct instance_id in the dataset after we are
-                        # done.
-                        if instance.from_predicted:
-                            instances_with_from_predicted.append(instance_id)
-                            instances_from_predicted.append(instance.from_predicted)
-
-                    # Copy all the data
-                    instances[instance_id] = (
-                        instance_id + instance_id_offset,
-                        instance_type_to_idx[instance_type],
-                        frame_id,
-                        skeleton_to_idx[instance.skeleton],
-                        track_to_idx[instance.track],
-                        -1,
-                        score,
-                        pid,
-                        pid + len(parray),
+
+            append_tables(f, *tables)
+
+
+def get_source_videos(videos: List[Video]) -> List[Video]:
+    """Return the videos to save metadata for, using source videos of packages."""
+    new_videos = []
+    for video in videos:
+        if hasattr(video.backend, "_source_video"):
+            new_videos.append(video.backend._source_video)
+        else:
+            new_videos.append(video)
+    return new_videos
+
+
+def write_json_lists(f: h5py.File, d: dict):
+    """Write the lists of metadata which are stored in their own datasets.
+
+    These items are stored in separate lists because the metadata group got to be too
+    big. Existing datasets are replaced.
+
+    Args:
+        f: The open HDF5 file.
+        d: The metadata dictionary from `Labels.to_dict`. The lists which are written
+            to their own datasets will be cleared in the dictionary since we don't want
+            to save them in the metadata attribute.
+    """
+    for key in ("videos", "tracks", "suggestions"):
+        # Convert for saving in hdf5 dataset
+        data = [np.string_(json_dumps(item)) for item in d[key]]
+
+        hdf5_key = f"{key}_json"
+        if hdf5_key in f:
+            del f[hdf5_key]
+
+        # Save in its own dataset (e.g., videos_json)
+        f.create_dataset(hdf5_key, data=data, maxshape=(None,))
+
+        # Clear from dict since we don't want to save this in attribute
+        d[key] = []
+
+
+def get_table_offsets(f: h5py.File) -> Dict[Text, int]:
+    """Return the ids that rows appended to the tables in a file should start from."""
+    if "frames" not in f:
+        return dict()
+    return dict(
+        frame_id_offset=f["frames"].shape[0],
+        instance_id_offset=f["instances"].shape[0],
+        point_id_offset=f["points"].shape[0],
+        pred_point_id_offset=f["pred_points"].shape[0],
+    )
+
+
+def append_tables(
+    f: h5py.File,
+    frames: np.ndarray,
+    instances: np.ndarray,
+    points: np.ndarray,
+    pred_points: np.ndarray,
+):
+    """Append rows to the tables in the file, creating the datasets if needed."""
+    for name, data, dtype in (
+        ("points", points, Point.dtype),
+        ("pred_points", pred_points, PredictedPoint.dtype),
+        ("instances", instances, INSTANCE_DTYPE),
+        ("frames", frames, FRAME_DTYPE),
+    ):
+        if name in f:
+            if len(data) > 0:
+                dset = f[name]
+                dset.resize(dset.shape[0] + len(data), axis=0)
+                dset[-len(data) :] = data
+        else:
+            f.create_dataset(name, data=data, maxshape=(None,), dtype=dtype)
+
+
+def _make_index_map(items: Union[Sequence, Dict]) -> Dict:
+    """Return a dictionary mapping objects to their index in the sequence."""
+    if isinstance(items, dict):
+        return items
+    return {item: i for i, item in enumerate(items)}
+
+
+def _concatenate_points(arrays: List[np.ndarray], dtype: np.dtype) -> np.ndarray:
+    """Concatenate point arrays into a single table."""
+    out = np.zeros(sum(len(a) for a in arrays), dtype=dtype)
+    if len(arrays) > 0:
+        np.concatenate(arrays, out=out)
+    return out
+
+
+def serialize_labeled_frames(
+    labeled_frames: Sequence[LabeledFrame],
+    videos: Union[List[Video], Dict[Video, int]],
+    skeletons: Union[List, Dict],
+    tracks: Union[List, Dict],
+    frame_id_offset: int = 0,
+    instance_id_offset: int = 0,
+    point_id_offset: int = 0,
+    pred_point_id_offset: int = 0,
+    instance_ids: Optional[Dict[Instance, int]] = None,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Build the tables stored in a `.slp` file from labeled frames.
+
+    The attributes of all of the frames and instances are collected in a single pass
+    and the tables are then built with concatenation and offset arithmetic.
+
+    Args:
+        labeled_frames: The `LabeledFrame`s to serialize.
+        videos: List of videos (or dictionary mapping videos to their index) that the
+            `video` column of the frames refers to.
+        skeletons: List or dictionary for the `skeleton` column of the instances.
+        tracks: List or dictionary for the `track` column of the instances.
+        frame_id_offset: Id of the first frame, i.e., the number of rows already in the
+            frames table when appending.
+        instance_id_offset: Number of rows already in the instances table.
+        point_id_offset: Number of rows already in the points table.
+        pred_point_id_offset: Number of rows already in the pred_points table.
+        instance_ids: Optional dictionary mapping instances that were serialized
+            before to their ids. `from_predicted` links to these instances are saved,
+            and the ids of the serialized instances are added to it.
+
+    Returns:
+        A tuple of `(frames, instances, points, pred_points)` structured arrays.
+    """
+    video_to_idx = _make_index_map(videos)
+    skeleton_to_idx = _make_index_map(skeletons)
+    track_to_idx = dict(_make_index_map(tracks))
+    track_to_idx[None] = -1
+
+    frame_cols = []
+    instance_cols = []
+    point_arrays = []
+
+    # Each instance we create will have an id in the dataset, keep track of these so
+    # we can quickly add from_predicted links.
+    if instance_ids is None:
+        instance_ids = {}
+    from_predicted_links = []
+
+    for lf in labeled_frames:
+        frame_cols.append((video_to_idx[lf.video], lf.frame_idx, len(lf.instances)))
+        for instance in lf.instances:
+            instance_ids[instance] = len(point_arrays) + instance_id_offset
+
+            if type(instance) is PredictedInstance:
+                is_predicted, score = True, instance.score
+            else:
+                is_predicted, score = False, np.nan
+                if instance.from_predicted:
+                    from_predicted_links.append(
+                        (len(point_arrays), instance.from_predicted)
                     )
 
-                    # If these are predicted points, copy them to the predicted point
-                    # array otherwise, use the normal point array
-                    if type(parray) is PredictedPointArray:
-                        pred_points[
-                            pred_point_id : (pred_point_id + len(parray))
-                        ] = parray
-                        pred_point_id = pred_point_id + len(parray)
-                    else:
-                        points[point_id : (point_id + len(parray))] = parray
-                        point_id = point_id + len(parray)
-
-                    instance_id = instance_id + 1
-
-            # Add from_predicted links
-            for instance_id, from_predicted in zip(
-                instances_with_from_predicted, instances_from_predicted
-            ):
-                try:
-                    instances[instance_id]["from_predicted"] = instance_to_idx[
-                        from_predicted
-                    ]
-                except KeyError:
-                    # If we haven't encountered the from_predicted instance yet then
-                    # don't save the link. It's possible for a user to create a regular
-                    # instance from a predicted instance and then delete all predicted
-                    # instances from the file, but in this case I don’t think there's
-                    # any reason to remember which predicted instance the regular
-                    # instance came from.
-                    pass
-
-            # We pre-allocated our points array with max possible size considering the
-            # max skeleton size, drop any unused points.
-            points = points[0:point_id]
-            pred_points = pred_points[0:pred_point_id]
-
-            # Create datasets if we need to
-            if append and "points" in f:
-                f["points"].resize((f["points"].shape[0] + points.shape[0]), axis=0)
-                f["points"][-points.shape[0] :] = points
-                f["pred_points"].resize(
-                    (f["pred_points"].shape[0] + pred_points.shape[0]), axis=0
-                )
-                f["pred_points"][-pred_points.shape[0] :] = pred_points
-                f["instances"].resize(
-                    (f["instances"].shape[0] + instances.shape[0]), axis=0
+            instance_cols.append(
+                (
+                    is_predicted,
+                    skeleton_to_idx[instance.skeleton],
+                    track_to_idx[instance.track],
+                    score,
                 )
-                f["instances"][-instances.shape[0] :] = instances
-                f["frames"].resize((f["frames"].shape[0] + frames.shape[0]), axis=0)
-                f["frames"][-frames.shape[0] :] = frames
+            )
+            point_arrays.append(instance.get_points_array(copy=False, full=True))
+
+    frame_cols = np.array(
+        frame_cols, dtype=[("video", "u4"), ("frame_idx", "u8"), ("n_instances", "i8")]
+    ).reshape(-1)
+    instance_cols = np.array(
+        instance_cols,
+        dtype=[
+            ("predicted", "?"),
+            ("skeleton", "u4"),
+            ("track", "i4"),
+            ("score", "f4"),
+        ],
+    ).reshape(-1)
+    n_frames, n_instances = len(frame_cols), len(instance_cols)
+    is_predicted = instance_cols["predicted"]
+
+    # The points tables are the concatenation of the point arrays of each type.
+    n_points = np.array([len(p) for p in point_arrays], dtype="int64")
+    points = _concatenate_points(
+        [p for p, pred in zip(point_arrays, is_predicted) if not pred], Point.dtype
+    )
+    pred_points = _concatenate_points(
+        [p for p, pred in zip(point_arrays, is_predicted) if pred], PredictedPoint.dtype
+    )
+
+    # Point ids are the running count of points of the same instance type.
+    user_counts = np.where(is_predicted, 0, n_points)
+    pred_counts = np.where(is_predicted, n_points, 0)
+    point_id_start = np.where(
+        is_predicted,
+        np.cumsum(pred_counts) - pred_counts + pred_point_id_offset,
+        np.cumsum(user_counts) - user_counts + point_id_offset,
+    )
+
+    instances = np.zeros(n_instances, dtype=INSTANCE_DTYPE)
+    instances["instance_id"] = np.arange(n_instances) + instance_id_offset
+    instances["instance_type"] = is_predicted
+    instances["frame_id"] = (
+        np.repeat(np.arange(n_frames), frame_cols["n_instances"]) + frame_id_offset
+    )
+    instances["skeleton"] = instance_cols["skeleton"]
+    instances["track"] = instance_cols["track"]
+    instances["from_predicted"] = -1
+    instances["score"] = instance_cols["score"]
+    instances["point_id_start"] = point_id_start
+    instances["point_id_end"] = point_id_start + n_points
+
+    # Add from_predicted links. If we haven't encountered the from_predicted instance
+    # then don't save the link. It's possible for a user to create a regular instance
+    # from a predicted instance and then delete all predicted instances from the file,
+    # but in this case I don’t think there's any reason to remember which predicted
+    # instance the regular instance came from.
+    for row, from_predicted in from_predicted_links:
+        if from_predicted in instance_ids:
+            instances["from_predicted"][row] = instance_ids[from_predicted]
+
+    instance_id_end = np.cumsum(frame_cols["n_instances"]) + instance_id_offset
+    frames = np.zeros(n_frames, dtype=FRAME_DTYPE)
+    frames["frame_id"] = np.arange(n_frames) + frame_id_offset
+    frames["video"] = frame_cols["video"]
+    frames["frame_idx"] = frame_cols["frame_idx"]
+    frames["instance_id_start"] = instance_id_end - frame_cols["n_instances"]
+    frames["instance_id_end"] = instance_id_end
+
+    return frames, instances, points, pred_points
+
+
+def serialize_lazy_frames(
+    lazy_frames: LazyLabeledFrames,
+    videos: Union[List[Video], Dict[Video, int]],
+    skeletons: Union[List, Dict],
+    tracks: Union[List, Dict],
+    frame_id_offset: int = 0,
+    instance_id_offset: int = 0,
+    point_id_offset: int = 0,
+    pred_point_id_offset: int = 0,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Build the tables stored in a `.slp` file from lazily loaded frames.
+
+    The stored columns are remapped and offset without creating any frame objects. See
+    `serialize_labeled_frames` for a description of the arguments.
+
+    Returns:
+        A tuple of `(frames, instances, points, pred_points)` structured arrays.
+    """
+    video_to_idx = _make_index_map(videos)
+    skeleton_to_idx = _make_index_map(skeletons)
+    track_to_idx = _make_index_map(tracks)
+
+    video_map = np.array([video_to_idx[v] for v in lazy_frames.videos], dtype="u4")
+    skeleton_map = np.array(
+        [skeleton_to_idx[s] for s in lazy_frames.skeletons], dtype="u4"
+    )
+
+    # Instances with tracks that were removed from the labels are saved without a
+    # track. The extra element at the end maps the stored -1 (no track) to -1.
+    track_map = np.array(
+        [track_to_idx.get(t, -1) for t in lazy_frames.tracks] + [-1], dtype="i4"
+    )
+
+    frames = lazy_frames.frames.astype(FRAME_DTYPE)
+    frames["frame_id"] = np.arange(len(frames)) + frame_id_offset
+    frames["video"] = video_map[frames["video"]]
+    frames["instance_id_start"] += instance_id_offset
+    frames["instance_id_end"] += instance_id_offset
+
+    instances = lazy_frames.instances.astype(INSTANCE_DTYPE)
+    frame_ids, instance_ids = lazy_frames.instance_rows()
+    instances["instance_id"] = np.arange(len(instances)) + instance_id_offset
+    instances["frame_id"][instance_ids] = frame_ids + frame_id_offset
+    instances["skeleton"] = skeleton_map[instances["skeleton"]]
+    instances["track"] = track_map[instances["track"]]
+    instances["from_predicted"][instances["from_predicted"] != -1] += instance_id_offset
+    point_offsets = np.where(
+        instances["instance_type"] == 1, pred_point_id_offset, point_id_offset
+    ).astype("u8")
+    instances["point_id_start"] += point_offsets
+    instances["point_id_end"] += point_offsets
+
+    points = lazy_frames.points.astype(Point.dtype)
+    pred_points = lazy_frames.pred_points.astype(PredictedPoint.dtype)
+
+    return frames, instances, points, pred_points
+
+
+@attr.s(auto_attribs=True)
+class LabelsV1StreamWriter:
+    """Incrementally write labeled frames to a `.slp` file.
+
+    This is used to flush predictions to disk while they are being generated rather
+    than accumulating all of the labeled frames in memory before saving. The file is
+    opened for each write so that it stays readable if the process is interrupted.
+
+    The ids of the written instances are kept (without keeping the instances alive) so
+    that `from_predicted` links to instances of earlier writes are saved.
+
+    Usage:
+
+    > with LabelsV1StreamWriter("predictions.slp", labels=header_labels) as writer:
+    >     for batch_of_frames in ...:
+    >         writer.write_frames(batch_of_frames)
+
+    Attributes:
+        filename: Path to the `.slp` file.
+        labels: `Labels` with the metadata (videos, skeletons, tracks, provenance) to
+            save. Any labeled frames it contains are written when the file is created.
+            The videos, skeletons and tracks of frames which are written later are
+            added to these lists, but the frames themselves are not kept.
+        append: If `True` and the file already exists, frames are appended to it and
+            the metadata stored in the file is used (with the provenance updated from
+            `labels`). Videos and skeletons of new frames are matched to the stored
+            ones by filename and by structure respectively.
+        n_frames_written: Number of labeled frames in the file.
+    """
+
+    filename: Text
+    labels: Labels = attr.ib(factory=Labels)
+    append: bool = False
+    n_frames_written: int = attr.ib(default=0, init=False)
+
+    def __attrs_post_init__(self):
+        self._metadata_changed = False
+        self._instance_ids = weakref.WeakKeyDictionary()
+        if self.append and os.path.exists(self.filename):
+            with format.filehandle.FileHandle(self.filename) as file:
+                stored_labels = LabelsV1Adaptor.read_headers(file)
+                self.n_frames_written = len(file.file["frames"])
+            stored_labels.provenance.update(self.labels.provenance)
+            self.labels = stored_labels
+        else:
+            LabelsV1Adaptor.write(self.filename, self.labels)
+            self.n_frames_written = len(self.labels)
+            if not getattr(self.labels.labeled_frames, "columns_valid", False):
+                instances = (inst for lf in self.labels for inst in lf.instances)
+                self._instance_ids.update((inst, i) for i, inst in enumerate(instances))
+
+        self._video_to_idx = _make_index_map(self.labels.videos)
+        self._skeleton_to_idx = _make_index_map(self.labels.skeletons)
+        self._track_to_idx = _make_index_map(self.labels.tracks)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _find_video(self, video: Video) -> int:
+        """Return the index of the video, adding it to the metadata if needed."""
+        if video not in self._video_to_idx:
+            for i, stored_video in enumerate(self.labels.videos):
+                if stored_video.filename == video.filename:
+                    self._video_to_idx[video] = i
+                    break
             else:
-                f.create_dataset(
-                    "points", data=points, maxshape=(None,), dtype=Point.dtype
-                )
-                f.create_dataset(
-                    "pred_points",
-                    data=pred_points,
-                    maxshape=(None,),
-                    dtype=PredictedPoint.dtype,
-                )
-                f.create_dataset(
-                    "instances", data=instances, maxshape=(None,), dtype=instance_dtype
-                )
-                f.create_dataset(
-                    "frames", data=frames, maxshape=(None,), dtype=frame_dtype
-                )
+                self._video_to_idx[video] = len(self.labels.videos)
+                self.labels.videos.append(video)
+                self._metadata_changed = True
+        return self._video_to_idx[video]
+
+    def _find_skeleton(self, skeleton) -> int:
+        """Return the index of the skeleton, adding it to the metadata if needed."""
+        if skeleton not in self._skeleton_to_idx:
+            for i, stored_skeleton in enumerate(self.labels.skeletons):
+                if stored_skeleton.matches(skeleton):
+                    self._skeleton_to_idx[skeleton] = i
+                    break
+            else:
+                self._skeleton_to_idx[skeleton] = len(self.labels.skeletons)
+                self.labels.skeletons.append(skeleton)
+                self._metadata_changed = True
+        return self._skeleton_to_idx[skeleton]
+
+    def _find_track(self, track) -> int:
+        """Return the index of the track, adding it to the metadata if needed."""
+        if track not in self._track_to_idx:
+            self._track_to_idx[track] = len(self.labels.tracks)
+            self.labels.tracks.append(track)
+            self._metadata_changed = True
+        return self._track_to_idx[track]
+
+    def write_frames(self, labeled_frames: List[LabeledFrame]):
+        """Append labeled frames to the file.
+
+        Args:
+            labeled_frames: List of `LabeledFrame`s to write.
+        """
+        if len(labeled_frames) == 0:
+            return
+
+        for lf in labeled_frames:
+            self._find_video(lf.video)
+            for instance in lf.instances:
+                self._find_skeleton(instance.skeleton)
+                if instance.track is not None:
+                    self._find_track(instance.track)
+
+        with h5py.File(self.filename, "a") as f:
+            tables = serialize_labeled_frames(
+                labeled_frames,
+                videos=self._video_to_idx,
+                skeletons=self._skeleton_to_idx,
+                tracks=self._track_to_idx,
+                instance_ids=self._instance_ids,
+                **get_table_offsets(f),
+            )
+            append_tables(f, *tables)
+
+            if self._metadata_changed:
+                self._write_metadata(f)
+
+        self.n_frames_written += len(labeled_frames)
+
+    def get_written_frame_inds(self) -> Dict[Video, np.ndarray]:
+        """Return the indices of the frames in the file for each video.
+
+        Returns:
+            A dictionary mapping each video in the metadata to an array with the frame
+            indices of its labeled frames which have been written to the file.
+        """
+        with h5py.File(self.filename, "r") as f:
+            frames = f["frames"][:]
+        return {
+            video: frames["frame_idx"][frames["video"] == i]
+            for i, video in enumerate(self.labels.videos)
+        }
+
+    def _write_metadata(self, f: h5py.File):
+        """Replace the metadata stored in the file with the current metadata."""
+        d = self.labels.to_dict(skip_labels=True)
+        d["videos"] = Video.cattr().unstructure(get_source_videos(self.labels.videos))
+        write_json_lists(f, d)
+
+        meta_group = f.require_group("metadata")
+        meta_group.attrs["format_id"] = LabelsV1Adaptor.FORMAT_ID
+        meta_group.attrs["json"] = np.string_(json_dumps(d))
+        self._metadata_changed = False
+
+    def close(self):
+        """Write the final metadata (e.g., updated provenance) to the file."""
+        with h5py.File(self.filename, "a") as f:
+            self._write_metadata(f)
@@ -100,22 +100,19 @@ class SleapAnalysisAdaptor(Adaptor):
 
         frames = []
         for frame_idx in range(frame_count):
-            instances = []
-            for track_idx in range(track_count):
-                points = tracks_matrix[frame_idx, ..., track_idx]
-                if not np.all(np.isnan(points)):
-                    point_scores = np.ones(len(points))
-                    # make everything a PredictedInstance since the usual use
-                    # case is to export predictions for analysis
-                    instances.append(
-                        PredictedInstance.from_arrays(
-                            points=points,
-                            point_confidences=point_scores,
-                            skeleton=skeleton,
-                            track=tracks[track_idx],
-                            instance_score=1,
-                        )
-                    )
+            # shape: tracks * nodes * 2
+            points = tracks_matrix[frame_idx].transpose((2, 0, 1))
+            track_inds = np.flatnonzero(~np.all(np.isnan(points), axis=(1, 2)))
+
+            # make everything a PredictedInstance since the usual use
+            # case is to export predictions for analysis
+            instances = PredictedInstance.from_arrays_batch(
+                points=points[track_inds],
+                point_confidences=np.ones((len(track_inds), node_count)),
+                instance_scores=np.ones(len(track_inds)),
+                skeleton=skeleton,
+                tracks=[tracks[track_idx] for track_idx in track_inds],
+            )
             if instances:
                 frames.append(
                     LabeledFrame(video=video, frame_idx=frame_idx, instances=instances)
@@ -0,0 +1,419 @@
+"""
+Process-wide cache of decoded video frames.
+
+The same frames tend to be decoded many times: when the GUI revisits frames, when the
+tracker rereads images for optical flow, when the training pipeline reads the labeled
+frames every epoch, and when frames are rendered. `Video.get_frame` looks frames up in
+the shared `FrameCache` first, so each frame is only decoded once while it stays in the
+cache.
+
+Entries are keyed by the video backend object and the frame index (and the scale, for
+downscaled variants), so videos that share a backend share cache entries. The cache
+has a memory budget in bytes and evicts the least recently used frames first. It is
+safe to use from multiple threads.
+
+Frames can also be stored persistently in a `DiskFrameCache`, which keeps decoded frames
+in HDF5 files so that they can be reused by later processes, e.g., by repeated training
+runs on the same videos.
+
+The process-wide cache is disabled by default, since many consumers (e.g., inference
+with `sleap-track`) read each frame only once and wouldn't get any hits. The GUI enables
+it with the size set in its preferences. Enable it with `set_frame_cache_size`.
+
+Usage:
+
+> from sleap.io.framecache import get_frame_cache, set_frame_cache_size
+> set_frame_cache_size(2 * 1024 ** 3)  # 2 GB
+> get_frame_cache().stats
+"""
+
+import atexit
+import hashlib
+import logging
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional, Text, Tuple
+
+import h5py
+import numpy as np
+
+from sleap.util import json_dumps
+
+
+logger = logging.getLogger(__name__)
+
+
+# Default memory budget of a frame cache in bytes. The process-wide cache starts out
+# disabled.
+DEFAULT_FRAME_CACHE_SIZE = 256 * 1024 ** 2
+
+
+class FrameCache:
+    """Thread-safe LRU cache of frame images with a memory budget.
+
+    Cached arrays are stored read-only so that callers can't modify the cached images
+    in place. Copy a frame before modifying it. Frames are stored without copying them,
+    so the cache takes ownership of the arrays that are put in it.
+
+    Attributes:
+        max_bytes: Memory budget in bytes. Frames that don't fit are not cached, and the
+            least recently used frames are evicted to make room for new ones. If 0, the
+            cache is disabled.
+        store_scaled: If `True`, downscaled variants of frames are cached alongside the
+            full resolution frames.
+        hits: Number of lookups that found a cached frame.
+        misses: Number of lookups that did not find a cached frame.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_FRAME_CACHE_SIZE, store_scaled=True):
+        self.max_bytes = max_bytes
+        self.store_scaled = store_scaled
+        self.hits = 0
+        self.misses = 0
+        self._frames = OrderedDict()
+        self._n_bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(backend: object, frame_idx: int, scale: float = 1.0) -> Tuple:
+        """Return the cache key for a frame of a video backend.
+
+        Backends are referenced weakly so that the cache does not keep videos open.
+        """
+        return (weakref.ref(backend), int(frame_idx), float(scale))
+
+    @property
+    def enabled(self) -> bool:
+        """Return `True` if the cache has a memory budget."""
+        return self.max_bytes > 0
+
+    @property
+    def n_bytes(self) -> int:
+        """Return the total size of the cached frames in bytes."""
+        return self._n_bytes
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Return a dictionary with the counters and the size of the cache."""
+        with self._lock:
+            return dict(
+                hits=self.hits,
+                misses=self.misses,
+                n_frames=len(self._frames),
+                n_bytes=self._n_bytes,
+                max_bytes=self.max_bytes,
+            )
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    def get(self, key: Hashable) -> Optional[np.ndarray]:
+        """Return the cached frame for a key, or `None` if it is not cached."""
+        with self._lock:
+            frame = self._frames.get(key)
+            if frame is None:
+                self.misses += 1
+                return None
+            self._frames.move_to_end(key)
+            self.hits += 1
+            return frame
+
+    def put(
+        self, key: Hashable, frame: np.ndarray, share_base: bool = False
+    ) -> np.ndarray:
+        """Add a frame to the cache, evicting the least recently used frames.
+
+        The frame is stored as-is and made read-only, so it must not be modified by the
+        caller afterwards. This is meant for freshly decoded frames that nothing else
+        refers to.
+
+        Args:
+            key: The key from `make_key`.
+            frame: The frame image.
+            share_base: If `False`, frames that are views into a larger array (e.g., a
+                single channel of a decoded color image) are copied so that the cache
+                doesn't keep the rest of the array alive. Set this to `True` when all
+                of the frames in the larger array are cached, e.g., the rows of a batch.
+
+        Returns:
+            The frame as it is stored in the cache (read-only), or the input frame if
+            it was not cached.
+        """
+        frame = np.asarray(frame)
+        if frame.nbytes > self.max_bytes:
+            return frame
+
+        base = frame.base
+        is_view = isinstance(base, np.ndarray) and base.nbytes > frame.nbytes
+        if is_view and not share_base:
+            frame = frame.copy()
+        frame.flags.writeable = False
+
+        with self._lock:
+            old_frame = self._frames.pop(key, None)
+            if old_frame is not None:
+                self._n_bytes -= old_frame.nbytes
+
+            while self._frames and self._n_bytes + frame.nbytes > self.max_bytes:
+                _, evicted = self._frames.popitem(last=False)
+                self._n_bytes -= evicted.nbytes
+
+            self._frames[key] = frame
+            self._n_bytes += frame.nbytes
+
+        return frame
+
+    def clear(self, backend: Optional[object] = None):
+        """Remove cached frames.
+
+        Args:
+            backend: If not `None`, only remove the frames of this video backend.
+        """
+        with self._lock:
+            if backend is None:
+                self._frames.clear()
+                self._n_bytes = 0
+                return
+
+            ref = weakref.ref(backend)
+            for key in [key for key in self._frames if key[0] == ref]:
+                self._n_bytes -= self._frames.pop(key).nbytes
+
+    def reset_stats(self):
+        """Reset the hit and miss counters."""
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def resize(self, max_bytes: int):
+        """Change the memory budget, evicting frames that no longer fit.
+
+        Args:
+            max_bytes: Memory budget in bytes. Use 0 to disable caching.
+        """
+        with self._lock:
+            self.max_bytes = max_bytes
+            while self._frames and self._n_bytes > max(max_bytes, 0):
+                _, evicted = self._frames.popitem(last=False)
+                self._n_bytes -= evicted.nbytes
+
+
+_frame_cache = FrameCache(max_bytes=0)
+
+
+def get_frame_cache() -> FrameCache:
+    """Return the process-wide frame cache."""
+    return _frame_cache
+
+
+def set_frame_cache_size(max_bytes: int):
+    """Set the memory budget of the process-wide frame cache.
+
+    Args:
+        max_bytes: Memory budget in bytes. Use 0 to disable caching.
+    """
+    get_frame_cache().resize(max_bytes)
+
+
+class _DiskFrameCacheFile:
+    """An open cache file with the frames of a single video.
+
+    Frames are stored as rows of the chunked, resizable `frames` dataset in the order
+    they were written, and the `frame_inds` dataset holds the video frame index of each
+    row (-1 for rows that were allocated but not written yet). Rows are read without
+    locking, since a row is only added to the index after it has been written.
+    """
+
+    # Number of rows to allocate at a time when the datasets are full.
+    _GROW_SIZE = 64
+
+    def __init__(self, filename: Text, flush_every: int):
+        self.flush_every = flush_every
+        self.file = h5py.File(filename, "a")
+        self.lock = threading.Lock()
+        self.rows = {}
+        self.n_rows = 0
+        self._n_unflushed = 0
+        if "frame_inds" in self.file:
+            frame_inds = self.file["frame_inds"][:]
+            rows = np.flatnonzero(frame_inds >= 0)
+            self.rows = dict(zip(frame_inds[rows].tolist(), rows.tolist()))
+            self.n_rows = int(rows[-1]) + 1 if len(rows) > 0 else 0
+
+    def read(self, idx: int) -> Optional[np.ndarray]:
+        """Return a frame from the file or `None` if it has not been written."""
+        row = self.rows.get(idx, None)
+        if row is None:
+            return None
+        return self.file["frames"][row]
+
+    def write(self, idx: int, frame: np.ndarray):
+        """Add a frame to the file if it is not already stored."""
+        with self.lock:
+            if idx in self.rows:
+                return
+
+            if "frames" not in self.file:
+                self.file.create_dataset(
+                    "frames",
+                    shape=(0,) + frame.shape,
+                    maxshape=(None,) + frame.shape,
+                    chunks=(1,) + frame.shape,
+                    dtype=frame.dtype,
+                )
+                self.file.create_dataset(
+                    "frame_inds",
+                    shape=(0,),
+                    maxshape=(None,),
+                    chunks=(self._GROW_SIZE,),
+                    dtype="int64",
+                    fillvalue=-1,
+                )
+            frames, frame_inds = self.file["frames"], self.file["frame_inds"]
+            if frames.shape[1:] != frame.shape or frames.dtype != frame.dtype:
+                return
+
+            row = self.n_rows
+            if row >= len(frames):
+                frames.resize(row + self._GROW_SIZE, axis=0)
+                frame_inds.resize(row + self._GROW_SIZE, axis=0)
+            frames[row] = frame
+            frame_inds[row] = idx
+            self.rows[idx] = row
+            self.n_rows += 1
+
+            self._n_unflushed += 1
+            if self._n_unflushed >= self.flush_every:
+                self.file.flush()
+                self._n_unflushed = 0
+
+    def close(self):
+        """Close the file."""
+        with self.lock:
+            self.file.close()
+
+
+class DiskFrameCache:
+    """Persistent cache of decoded video frames stored in HDF5 files.
+
+    The frames of each video are stored in their own file in the cache directory, as
+    rows of a single chunked dataset with an index of the frames that were written.
+    Files are named after a hash of the video file path, its size and modification time
+    and the settings of the video backend, so frames are decoded again if the video
+    changes. Videos that are not stored in files, like numpy videos, are not cached.
+
+    The cache is safe to use from multiple threads. If a cache file can't be opened,
+    e.g., because another process is writing to it, frames of that video are read from
+    the video instead. Open files are shared by all caches in the process and stay open
+    until `close` is called (or the process exits), so call it when done with the cache
+    to let other processes use the files.
+
+    Attributes:
+        path: Path to the cache directory. This is created if it doesn't exist.
+        flush_every: Number of frames to write to a file before flushing it to disk.
+    """
+
+    # Open files are shared by all instances since HDF5 files can only be opened for
+    # writing once per process.
+    _files = {}
+    _lock = threading.Lock()
+
+    def __init__(self, path: Text, flush_every: int = 256):
+        self.path = path
+        self.flush_every = flush_every
+        self._keys = weakref.WeakKeyDictionary()
+
+    @staticmethod
+    def get_video_key(video: "sleap.Video") -> Optional[Text]:
+        """Return the hash that identifies the frames of a video.
+
+        Args:
+            video: A `sleap.Video`.
+
+        Returns:
+            A hex string or `None` if the video is not stored in a file.
+        """
+        backend = video.backend
+        filename = getattr(backend, "filename", None)
+        if not isinstance(filename, str) or not os.path.isfile(filename):
+            return None
+
+        stat = os.stat(filename)
+        identity = dict(
+            backend=type(backend).__name__,
+            filename=os.path.abspath(filename),
+            size=stat.st_size,
+            mtime=stat.st_mtime,
+            dataset=getattr(backend, "dataset", None),
+            input_format=getattr(backend, "input_format", None),
+            grayscale=getattr(backend, "grayscale", None),
+            bgr=getattr(backend, "bgr", None),
+        )
+        return hashlib.sha1(json_dumps(identity).encode("utf-8")).hexdigest()
+
+    def _get_file(self, video: "sleap.Video") -> Optional[_DiskFrameCacheFile]:
+        """Return the open cache file of a video, or `None` if it is not cached."""
+        backend = video.backend
+        if backend not in self._keys:
+            self._keys[backend] = self.get_video_key(video)
+        key = self._keys[backend]
+        if key is None:
+            return None
+
+        filename = os.path.abspath(os.path.join(self.path, f"{key}.h5"))
+        cache_file = self._files.get(filename, False)
+        if cache_file is False:
+            with self._lock:
+                if filename not in self._files:
+                    try:
+                        os.makedirs(self.path, exist_ok=True)
+                        self._files[filename] = _DiskFrameCacheFile(
+                            filename, flush_every=self.flush_every
+                        )
+                    except OSError as e:
+                        logger.warning(
+                            f"Could not open frame cache file {filename}: {e}"
+                        )
+                        self._files[filename] = None
+                cache_file = self._files[filename]
+        return cache_file
+
+    def get_frame(self, video: "sleap.Video", idx: int) -> np.ndarray:
+        """Return a frame from the cache, reading it from the video if needed.
+
+        Args:
+            video: A `sleap.Video`.
+            idx: The index of the video frame.
+
+        Returns:
+            The video frame with shape (height, width, channels).
+        """
+        cache_file = self._get_file(video)
+        if cache_file is None:
+            return video.get_frame(idx)
+
+        idx = int(idx)
+        frame = cache_file.read(idx)
+        if frame is None:
+            frame = video.get_frame(idx)
+            cache_file.write(idx, np.asarray(frame))
+        return frame
+
+    def close(self):
+        """Close the open cache files in the cache directory."""
+        self._close_files(os.path.abspath(self.path))
+
+    @classmethod
+    def _close_files(cls, path: Optional[Text] = None):
+        """Close the open cache files in a directory, or all of them if `None`."""
+        with cls._lock:
+            for filename in list(cls._files):
+                if path is None or os.path.dirname(filename) == path:
+                    cache_file = cls._files.pop(filename)
+                    if cache_file is not None:
+                        cache_file.close()
+
+
+atexit.register(DiskFrameCache._close_files)
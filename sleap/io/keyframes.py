@@ -0,0 +1,314 @@
+"""
+Keyframe index for planning random access into media videos.
+
+Seeking in a compressed video means jumping to the keyframe before the target frame and
+decoding forward from there. OpenCV does this internally on every seek, which is slow
+and, with some codecs, lands on the wrong frame. With the keyframe positions known, the
+reader can instead decide for each request whether to keep decoding forward from the
+current position or to seek to the nearest keyframe and decode forward from there.
+
+The index is built once per video with `ffprobe` (which only reads the packet headers)
+and is cached in a sidecar file next to the video, or in `~/.sleap/keyframes/` if the
+video directory is not writable. If `ffprobe` is not available, an index without
+keyframes is used, which falls back to seeking directly to the target frame unless it
+is only a few frames ahead.
+
+Probing reads every packet of the video, which takes a while for long videos, so
+`request_keyframe_index` builds indices in a background thread, once per video in each
+process, and readers use an index without keyframes until it is ready.
+
+Usage:
+
+> index = load_keyframe_index("video.mp4", n_frames=video.frames)
+> seek_to, n_skip = index.plan(pos=current_frame, target=frame_idx)
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+import threading
+from concurrent.futures import Future
+from typing import Dict, Optional, Text, Tuple
+
+import attr
+import numpy as np
+
+from sleap.util import json_dumps, json_loads
+
+
+logger = logging.getLogger(__name__)
+
+
+# Maximum time in seconds that probing the keyframes of a video may take.
+DEFAULT_PROBE_TIMEOUT = 120.0
+
+
+@attr.s(auto_attribs=True, eq=False)
+class KeyframeIndex:
+    """Positions of the keyframes in a video and the resulting decoding costs.
+
+    Costs are measured in number of decoded frames.
+
+    Attributes:
+        n_frames: Number of frames in the video.
+        keyframes: Sorted array with the indices of the keyframes, or `None` if they
+            are not known.
+        seek_cost: The fixed cost of a seek, in frames. Decoding forward is preferred
+            over seeking when the target is at most this many frames further ahead
+            than the seek would be.
+    """
+
+    n_frames: int
+    keyframes: Optional[np.ndarray] = attr.ib(
+        default=None,
+        converter=attr.converters.optional(lambda x: np.asarray(x, dtype="int64")),
+    )
+    seek_cost: int = 8
+
+    @property
+    def has_keyframes(self) -> bool:
+        """Return `True` if the keyframe positions are known."""
+        return self.keyframes is not None and len(self.keyframes) > 0
+
+    def keyframe_before(self, idx: int) -> int:
+        """Return the index of the last keyframe at or before a frame.
+
+        If the keyframes are not known, this is assumed to be the frame itself.
+        """
+        if not self.has_keyframes:
+            return idx
+        i = np.searchsorted(self.keyframes, idx, side="right") - 1
+        if i < 0:
+            return 0
+        return int(self.keyframes[i])
+
+    def plan(self, pos: int, target: int) -> Tuple[Optional[int], int]:
+        """Plan the cheapest way to decode a frame.
+
+        Args:
+            pos: The index of the frame that the next decoded frame will be.
+            target: The index of the frame to decode.
+
+        Returns:
+            A tuple of `(seek_to, n_skip)`. `seek_to` is the frame to seek to first, or
+            `None` if decoding should continue from the current position. `n_skip` is
+            the number of frames to decode and discard before the target frame.
+        """
+        keyframe = self.keyframe_before(target)
+        seek_skip = target - keyframe
+        if pos <= target and target - pos <= seek_skip + self.seek_cost:
+            return None, target - pos
+        return keyframe, seek_skip
+
+    def decode_cost(self, frame_inds: np.ndarray, pos: int = 0) -> int:
+        """Return the number of frames decoded to read frames in the given order.
+
+        Args:
+            frame_inds: Indices of the frames to read, in order.
+            pos: The position of the reader before the first frame is read.
+
+        Returns:
+            The number of decoded frames, counting each seek as `seek_cost` frames.
+        """
+        cost = 0
+        for idx in frame_inds:
+            idx = int(idx)
+            seek_to, n_skip = self.plan(pos, idx)
+            if seek_to is not None:
+                cost += self.seek_cost
+            cost += n_skip + 1
+            pos = idx + 1
+        return cost
+
+
+def probe_keyframes(
+    filename: Text, timeout: Optional[float] = DEFAULT_PROBE_TIMEOUT
+) -> Optional[np.ndarray]:
+    """Find the keyframes of a video with `ffprobe`.
+
+    Only the packet headers of the video stream are read, so this is much faster than
+    decoding the video.
+
+    Args:
+        filename: Path to the video.
+        timeout: Maximum time in seconds to wait for `ffprobe`, or `None` to wait until
+            it is done.
+
+    Returns:
+        A sorted array with the frame indices of the keyframes, or `None` if `ffprobe`
+        is not available, failed to read the video or timed out.
+    """
+    ffprobe = shutil.which("ffprobe")
+    if ffprobe is None:
+        return None
+
+    try:
+        result = subprocess.run(
+            [
+                ffprobe,
+                "-v",
+                "error",
+                "-select_streams",
+                "v:0",
+                "-show_entries",
+                "packet=pts,flags",
+                "-of",
+                "csv=p=0",
+                filename,
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+            check=True,
+            timeout=timeout,
+        )
+    except (OSError, subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+        logger.warning(f"Could not probe keyframes of {filename}: {e}")
+        return None
+
+    pts, is_key = [], []
+    for line in result.stdout.splitlines():
+        fields = line.strip().split(",")
+        if len(fields) < 2:
+            continue
+        pts.append(fields[0])
+        is_key.append("K" in fields[-1])
+    is_key = np.array(is_key, dtype=bool)
+
+    # Packets are listed in decoding order, which differs from the display order of the
+    # frames when there are B-frames, so frames are numbered by their timestamps.
+    if len(pts) > 0 and all(p.lstrip("-").isdigit() for p in pts):
+        frame_inds = np.empty(len(pts), dtype="int64")
+        frame_inds[np.argsort(np.array(pts, dtype="int64"), kind="stable")] = np.arange(
+            len(pts)
+        )
+    else:
+        frame_inds = np.arange(len(pts))
+
+    return np.sort(frame_inds[is_key])
+
+
+def get_sidecar_path(filename: Text) -> Text:
+    """Return the path of the keyframe index sidecar file next to a video."""
+    return filename + ".keyframes.json"
+
+
+def get_cache_path(filename: Text) -> Text:
+    """Return the path of the keyframe index in the user cache directory."""
+    key = hashlib.sha1(os.path.abspath(filename).encode("utf-8")).hexdigest()
+    return os.path.expanduser(os.path.join("~", ".sleap", "keyframes", f"{key}.json"))
+
+
+def load_keyframe_index(
+    filename: Text,
+    n_frames: int,
+    build: bool = True,
+    timeout: Optional[float] = DEFAULT_PROBE_TIMEOUT,
+) -> KeyframeIndex:
+    """Load the keyframe index of a video, building and caching it if needed.
+
+    Cached indices are only used if the size and modification time of the video match.
+
+    Args:
+        filename: Path to the video.
+        n_frames: Number of frames in the video.
+        build: If `True` and there is no cached index, probe the video for its
+            keyframes and save the index.
+        timeout: Maximum time in seconds to spend probing the video.
+
+    Returns:
+        The `KeyframeIndex` of the video. If no index was cached and one could not be
+        built, the returned index will not have any keyframes.
+    """
+    stat = os.stat(filename)
+    video_key = dict(size=stat.st_size, mtime=stat.st_mtime)
+
+    for path in (get_sidecar_path(filename), get_cache_path(filename)):
+        if os.path.exists(path):
+            try:
+                with open(path, "r") as f:
+                    data = json_loads(f.read())
+            except (OSError, ValueError):
+                continue
+            if data.get("video") == video_key:
+                return KeyframeIndex(n_frames=n_frames, keyframes=data["keyframes"])
+
+    keyframes = probe_keyframes(filename, timeout=timeout) if build else None
+    index = KeyframeIndex(n_frames=n_frames, keyframes=keyframes)
+
+    if keyframes is not None:
+        data = dict(video=video_key, keyframes=keyframes.tolist())
+        for path in (get_sidecar_path(filename), get_cache_path(filename)):
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+                json_dumps(data, path)
+                break
+            except OSError:
+                continue
+
+    return index
+
+
+# Keyframe indices that were requested in this process, keyed by the path, size and
+# modification time of the video.
+_requests: Dict[Tuple, Future] = {}
+_requests_lock = threading.Lock()
+
+
+def _build_keyframe_index(
+    future: Future, filename: Text, n_frames: int, timeout: Optional[float]
+):
+    """Build a keyframe index and set it as the result of a request."""
+    try:
+        index = load_keyframe_index(filename, n_frames=n_frames, timeout=timeout)
+    except Exception as e:
+        logger.warning(f"Could not build the keyframe index of {filename}: {e}")
+        index = KeyframeIndex(n_frames=n_frames)
+    future.set_result(index)
+
+
+def request_keyframe_index(
+    filename: Text,
+    n_frames: int,
+    wait: bool = False,
+    timeout: Optional[float] = DEFAULT_PROBE_TIMEOUT,
+) -> Optional[KeyframeIndex]:
+    """Return the keyframe index of a video, building it in the background if needed.
+
+    A cached index is loaded right away. Otherwise, the video is probed in a background
+    thread. Each video is only loaded or probed once per process, so all readers of the
+    same video share its index.
+
+    Args:
+        filename: Path to the video.
+        n_frames: Number of frames in the video.
+        wait: If `True`, wait for the index to be built instead of returning `None`.
+        timeout: Maximum time in seconds to spend probing the video.
+
+    Returns:
+        The `KeyframeIndex` of the video, or `None` if it is still being built and
+        `wait` is `False`.
+    """
+    stat = os.stat(filename)
+    key = (os.path.abspath(filename), stat.st_size, stat.st_mtime)
+    with _requests_lock:
+        future = _requests.get(key, None)
+        if future is None:
+            future = Future()
+            _requests[key] = future
+            index = load_keyframe_index(filename, n_frames=n_frames, build=False)
+            if index.keyframes is not None:
+                future.set_result(index)
+            else:
+                threading.Thread(
+                    target=_build_keyframe_index,
+                    args=(future, filename, n_frames, timeout),
+                    name="keyframe-index",
+                    daemon=True,
+                ).start()
+
+    if wait or future.done():
+        return future.result()
+    return None
@@ -0,0 +1,358 @@
+"""
+Lazily materialized labeled frames backed by columnar arrays.
+
+Opening a large predictions file is dominated by creating a `LabeledFrame`,
+`Instance` or `PredictedInstance` object for every row of the tables stored in the
+`.slp` file. `LazyLabeledFrames` keeps the `frames`, `instances`, `points` and
+`pred_points` tables as NumPy structured arrays and only builds the Python objects for
+a frame when it is indexed or iterated over.
+
+It is used in place of the list in `Labels.labeled_frames` when loading with:
+
+> labels = sleap.load_file("predictions.slp", lazy=True)
+> tracks = labels.numpy()  # Computed directly from the columns.
+> lf = labels[0]  # Only this frame is materialized.
+
+Whole-dataset operations that can be expressed on the columns (e.g., `Labels.numpy`)
+never create any frame objects. Any operation that modifies the sequence of frames
+will materialize all of the frames and the container will behave like a regular list
+from then on.
+"""
+
+from collections.abc import MutableSequence
+from typing import Dict, List, Optional, Tuple
+
+import attr
+import numpy as np
+
+from sleap.instance import (
+    Instance,
+    PredictedInstance,
+    LabeledFrame,
+    PointArray,
+    PredictedPointArray,
+    Track,
+)
+from sleap.io.video import Video
+from sleap.skeleton import Skeleton
+
+
+@attr.s(auto_attribs=True, eq=False, repr=False)
+class LazyLabeledFrames(MutableSequence):
+    """Sequence of labeled frames that are created from columnar data on access.
+
+    Attributes:
+        frames: Structured array with the `frames` table of a `.slp` file.
+        instances: Structured array with the `instances` table of a `.slp` file.
+        points: Structured array with the `points` table (`Point.dtype`).
+        pred_points: Structured array with the `pred_points` table
+            (`PredictedPoint.dtype`).
+        videos: List of `Video`s referenced by the `video` column of `frames`.
+        skeletons: List of `Skeleton`s referenced by the `skeleton` column of
+            `instances`.
+        tracks: List of `Track`s referenced by the `track` column of `instances`. A
+            track index of -1 denotes an instance without a track.
+    """
+
+    frames: np.ndarray
+    instances: np.ndarray
+    points: np.ndarray
+    pred_points: np.ndarray
+    videos: List[Video]
+    skeletons: List[Skeleton]
+    tracks: List[Track]
+    _frames_cache: Dict[int, LabeledFrame] = attr.ib(default=attr.Factory(dict))
+    _instances_cache: Dict[int, Instance] = attr.ib(default=attr.Factory(dict))
+    _materialized: Optional[List[LabeledFrame]] = None
+
+    def __attrs_post_init__(self):
+        # Keep our own copy of the lists so that indices in the tables remain valid
+        # even if the lists on the `Labels` are changed.
+        self.videos = list(self.videos)
+        self.skeletons = list(self.skeletons)
+        self.tracks = list(self.tracks)
+
+        # Views into the points tables; instances will reference slices of these
+        # rather than copying their points.
+        self._points_array = PointArray(buf=self.points, shape=len(self.points))
+        self._pred_points_array = PredictedPointArray(
+            buf=self.pred_points, shape=len(self.pred_points)
+        )
+
+    def __repr__(self) -> str:
+        """Return a readable representation of the frames."""
+        return (
+            "LazyLabeledFrames("
+            f"frames={len(self)}, "
+            f"materialized={self.n_materialized}"
+            ")"
+        )
+
+    @property
+    def is_materialized(self) -> bool:
+        """Return `True` if the frames are now backed by a list of objects."""
+        return self._materialized is not None
+
+    @property
+    def n_materialized(self) -> int:
+        """Return the number of frames that have been created so far."""
+        if self._materialized is not None:
+            return len(self._materialized)
+        return len(self._frames_cache)
+
+    @property
+    def columns_valid(self) -> bool:
+        """Return `True` if the columns fully describe the frames.
+
+        This is the case until any frame object has been created, since frames and
+        instances can be modified in ways that are not reflected in the columns once
+        they exist.
+        """
+        return self._materialized is None and len(self._frames_cache) == 0
+
+    def materialize(self) -> List[LabeledFrame]:
+        """Create all of the labeled frames and switch to list-backed storage.
+
+        Returns:
+            The list of all `LabeledFrame`s.
+        """
+        if self._materialized is None:
+            self._materialized = [self._get_frame(i) for i in range(len(self.frames))]
+            self._frames_cache = dict()
+            self._instances_cache = dict()
+        return self._materialized
+
+    def _get_instance(self, instance_id: int) -> Instance:
+        """Return the instance for a row in the instances table, creating it."""
+        instance = self._instances_cache.get(instance_id, None)
+        if instance is not None:
+            return instance
+
+        row = self.instances[instance_id]
+        track = None if row["track"] < 0 else self.tracks[row["track"]]
+        skeleton = self.skeletons[row["skeleton"]]
+        start, end = int(row["point_id_start"]), int(row["point_id_end"])
+
+        if row["instance_type"] == 0:  # Instance
+            instance = Instance(
+                skeleton=skeleton, track=track, points=self._points_array[start:end]
+            )
+        else:  # PredictedInstance
+            instance = PredictedInstance(
+                skeleton=skeleton,
+                track=track,
+                points=self._pred_points_array[start:end],
+                score=row["score"],
+            )
+        self._instances_cache[instance_id] = instance
+
+        if row["from_predicted"] != -1:
+            instance.from_predicted = self._get_instance(int(row["from_predicted"]))
+
+        return instance
+
+    def _get_frame(self, frame_id: int) -> LabeledFrame:
+        """Return the labeled frame for a row in the frames table, creating it."""
+        lf = self._frames_cache.get(frame_id, None)
+        if lf is not None:
+            return lf
+
+        row = self.frames[frame_id]
+        start, end = int(row["instance_id_start"]), int(row["instance_id_end"])
+        lf = LabeledFrame(
+            video=self.videos[row["video"]],
+            frame_idx=row["frame_idx"],
+            instances=[self._get_instance(i) for i in range(start, end)],
+        )
+        self._frames_cache[frame_id] = lf
+        return lf
+
+    def __len__(self) -> int:
+        """Return the number of labeled frames."""
+        if self._materialized is not None:
+            return len(self._materialized)
+        return len(self.frames)
+
+    def __getitem__(self, key):
+        """Return labeled frame(s) by linear index, creating them as needed."""
+        if self._materialized is not None:
+            return self._materialized[key]
+
+        if isinstance(key, slice):
+            return [self._get_frame(i) for i in range(*key.indices(len(self)))]
+
+        key = int(key)
+        if key < 0:
+            key += len(self)
+        if key < 0 or key >= len(self):
+            raise IndexError("Labeled frame index out of range.")
+        return self._get_frame(key)
+
+    def __iter__(self):
+        """Iterate over labeled frames, creating them as needed."""
+        if self._materialized is not None:
+            return iter(self._materialized)
+        return (self._get_frame(i) for i in range(len(self.frames)))
+
+    def __contains__(self, value) -> bool:
+        """Return `True` if the labeled frame is in the sequence."""
+        if self._materialized is not None:
+            return value in self._materialized
+
+        # Frames that have not been created yet cannot be compared against.
+        return any(lf is value for lf in self._frames_cache.values())
+
+    def index(self, value, *args) -> int:
+        """Return the linear index of a labeled frame."""
+        if self._materialized is not None:
+            return self._materialized.index(value, *args)
+
+        for frame_id, lf in self._frames_cache.items():
+            if lf is value:
+                return frame_id
+        raise ValueError(f"{value} is not in labeled frames.")
+
+    def __setitem__(self, key, value):
+        """Set labeled frame(s) at the index, materializing all frames."""
+        self.materialize().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        """Delete labeled frame(s) at the index, materializing all frames."""
+        self.materialize().__delitem__(key)
+
+    def insert(self, index: int, value: LabeledFrame):
+        """Insert labeled frame at the index, materializing all frames."""
+        self.materialize().insert(index, value)
+
+    def instance_rows(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the frame and instance table rows of every stored instance.
+
+        Returns:
+            A tuple of `(frame_ids, instance_ids)` integer arrays of the same length,
+            where `frame_ids[i]` is the row in `frames` containing the instance in row
+            `instance_ids[i]` of `instances`.
+        """
+        starts = self.frames["instance_id_start"].astype("int64")
+        counts = self.frames["instance_id_end"].astype("int64") - starts
+        frame_ids = np.repeat(np.arange(len(self.frames)), counts)
+        offsets = np.repeat(np.cumsum(counts) - counts, counts)
+        instance_ids = np.repeat(starts, counts) + np.arange(len(frame_ids)) - offsets
+        return frame_ids, instance_ids
+
+    def frame_inds(self, video: Optional[Video] = None) -> np.ndarray:
+        """Return the frame indices of the labeled frames from the columns.
+
+        Args:
+            video: Video whose frames should be included. If `None`, the frames of all
+                videos are included.
+
+        Returns:
+            An `int64` array with the frame index of each labeled frame in the order
+            they are stored.
+
+        Raises:
+            RuntimeError: If any frames have been created, in which case the columns
+                may no longer reflect the frames (see `columns_valid`).
+        """
+        if not self.columns_valid:
+            raise RuntimeError("Columns are stale once any frames have been created.")
+
+        frame_inds = self.frames["frame_idx"].astype("int64")
+        if video is not None:
+            frame_inds = frame_inds[self.frames["video"] == self.videos.index(video)]
+        return frame_inds
+
+    def instance_arrays(
+        self, video: Optional[Video], tracks: List[Track], n_nodes: int
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Gather the frame, track and points of every instance from the columns.
+
+        Args:
+            video: Video whose instances should be included. If `None`, the instances
+                of all videos are included.
+            tracks: Tracks defining the track indices of the output.
+            n_nodes: Number of nodes in the skeleton.
+
+        Returns:
+            A tuple of `(frame_inds, track_inds, points)` with shapes `(n_instances,)`,
+            `(n_instances,)` and `(n_instances, n_nodes, 2)`. `frame_inds` are the
+            frame indices in the video and `track_inds` are indices into `tracks`,
+            or -1 for instances without a track or with a track not in `tracks`.
+            Points of missing nodes are `NaN`.
+
+        Raises:
+            RuntimeError: If any frames have been created, in which case the columns
+                may no longer reflect the frames (see `columns_valid`).
+        """
+        if not self.columns_valid:
+            raise RuntimeError("Columns are stale once any frames have been created.")
+
+        frame_ids, instance_ids = self.instance_rows()
+        if video is not None:
+            keep = self.frames["video"][frame_ids] == self.videos.index(video)
+            frame_ids, instance_ids = frame_ids[keep], instance_ids[keep]
+
+        # Map the stored track indices to indices in the output track list. The extra
+        # element at the end catches instances without a track (index -1).
+        track_map = {track: i for i, track in enumerate(tracks)}
+        track_map = np.array(
+            [track_map.get(track, -1) for track in self.tracks] + [-1], dtype="int64"
+        )
+        track_inds = track_map[self.instances["track"][instance_ids]]
+
+        # Gather point coordinates for each instance from the relevant points table.
+        rows = self.instances[instance_ids]
+        point_ids = rows["point_id_start"].astype("int64")[:, None] + np.arange(n_nodes)
+        is_predicted = rows["instance_type"] == 1
+
+        points = np.full((len(rows), n_nodes, 2), np.nan, dtype="float32")
+        for mask, table in (
+            (~is_predicted, self.points),
+            (is_predicted, self.pred_points),
+        ):
+            if not mask.any():
+                continue
+            pts = table[point_ids[mask]]
+            pts_xy = np.stack([pts["x"], pts["y"]], axis=-1)
+            pts_xy[~pts["visible"]] = np.nan
+            points[mask] = pts_xy
+
+        frame_inds = self.frames["frame_idx"][frame_ids].astype("int64")
+        return frame_inds, track_inds, points
+
+    def numpy(
+        self,
+        video: Video,
+        tracks: List[Track],
+        n_nodes: int,
+        all_frames: bool = True,
+    ) -> np.ndarray:
+        """Construct a tracks array directly from the columns.
+
+        Args:
+            video: Video whose frames should be included.
+            tracks: Tracks defining the order of the track axis of the output.
+            n_nodes: Number of nodes in the skeleton.
+            all_frames: Same as in `Labels.numpy`.
+
+        Returns:
+            An array of tracks of shape `(n_frames, n_tracks, n_nodes, 2)` with the same
+            contents as `Labels.numpy` would produce from the frame objects.
+
+        Raises:
+            RuntimeError: If any frames have been created, in which case the columns
+                may no longer reflect the frames (see `columns_valid`).
+        """
+        video_frame_inds = self.frame_inds(video)
+        if all_frames:
+            first_frame, last_frame = video_frame_inds.min(), video_frame_inds.max()
+        else:
+            first_frame, last_frame = 0, video.shape[0] - 1
+
+        n_frames = last_frame - first_frame + 1
+        out = np.full((n_frames, len(tracks), n_nodes, 2), np.nan, dtype="float32")
+
+        frame_inds, track_inds, points = self.instance_arrays(video, tracks, n_nodes)
+        keep = track_inds >= 0
+        out[frame_inds[keep] - first_frame, track_inds[keep]] = points[keep]
+        return out
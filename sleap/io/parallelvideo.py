@@ -0,0 +1,271 @@
+"""
+Parallel decoding of media videos in worker processes.
+
+`MediaVideo` reads frames through a single `cv2.VideoCapture` which is shared behind a
+lock, so decoding a video only ever uses one core. `ParallelVideoDecoder` splits the
+requested frames into contiguous segments which are decoded sequentially by a pool of
+worker processes, each with its own capture. Decoded frames are passed back through
+shared memory and yielded in the order they were requested.
+
+Usage:
+
+> decoder = ParallelVideoDecoder(video, n_workers=4)
+> for frame_idx, frame in decoder.iter_frames():
+>     ...
+"""
+
+import ctypes
+import logging
+import multiprocessing
+import queue
+import traceback
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+import attr
+import cv2
+import numpy as np
+
+from sleap.io.keyframes import KeyframeIndex
+from sleap.io.video import MediaVideo, Video
+
+
+logger = logging.getLogger(__name__)
+
+
+def split_segments(frame_inds: Sequence[int], segment_size: int) -> List[np.ndarray]:
+    """Split frame indices into segments that can be decoded sequentially.
+
+    A new segment is started when a segment reaches `segment_size` frames or when the
+    frame indices go backwards, since that always requires seeking.
+
+    Args:
+        frame_inds: The frame indices to read, in the order they should be returned.
+        segment_size: Maximum number of frames in each segment.
+
+    Returns:
+        A list of integer arrays with the frame indices of each segment. Concatenating
+        these gives the original frame indices.
+    """
+    frame_inds = np.asarray(frame_inds, dtype="int64").reshape(-1)
+    if len(frame_inds) == 0:
+        return []
+
+    # Break wherever the indices go backwards...
+    breaks = np.flatnonzero(np.diff(frame_inds) <= 0) + 1
+
+    # ...and then split each run into segments of at most segment_size frames.
+    segments = []
+    for run in np.split(frame_inds, breaks):
+        segments.extend(np.split(run, np.arange(segment_size, len(run), segment_size)))
+    return segments
+
+
+def _decode_segments(
+    filename: str,
+    segments: List[np.ndarray],
+    grayscale: bool,
+    bgr: bool,
+    frame_shape: Tuple[int, int, int],
+    buffer: ctypes.Array,
+    free_slots: multiprocessing.Queue,
+    filled_slots: multiprocessing.Queue,
+    keyframe_index: KeyframeIndex,
+):
+    """Decode segments of a video into a shared memory ring buffer.
+
+    This is the target of each worker process. For every frame, a free slot in the
+    buffer is taken from `free_slots`, the frame is copied into it and a tuple of
+    `(frame_idx, slot, error)` is put in `filled_slots`, where `error` is `None` or a
+    string describing why the frame could not be decoded.
+    """
+    frames = np.frombuffer(buffer, dtype="uint8").reshape((-1,) + frame_shape)
+    reader = cv2.VideoCapture(filename)
+
+    # Index of the frame that the next call to read() will return.
+    pos = 0
+    try:
+        for segment in segments:
+            for idx in segment:
+                idx = int(idx)
+                if idx != pos:
+                    seek_to, n_skip = keyframe_index.plan(pos, idx)
+                    if seek_to is not None:
+                        reader.set(cv2.CAP_PROP_POS_FRAMES, seek_to)
+                    for _ in range(n_skip):
+                        reader.grab()
+                success, frame = reader.read()
+                pos = idx + 1
+
+                slot = free_slots.get()
+                if not success or frame is None:
+                    filled_slots.put((idx, slot, f"Unable to load frame {idx}."))
+                    continue
+
+                if grayscale:
+                    frame = frame[..., :1]
+                if bgr:
+                    frame = frame[..., ::-1]
+                frames[slot] = frame
+                filled_slots.put((idx, slot, None))
+
+    except Exception:
+        filled_slots.put((None, None, traceback.format_exc()))
+
+    finally:
+        reader.release()
+
+
+@attr.s(auto_attribs=True)
+class ParallelVideoDecoder:
+    """Decode frames of a media video in parallel worker processes.
+
+    The frames to read are split into segments of `segment_size` contiguous frames
+    which are dealt out to the workers in turn. Each worker decodes its segments
+    sequentially, only seeking at the start of a segment or over large gaps, and writes
+    the frames to its own ring buffer in shared memory. The frames are collected from
+    the workers in the order of the segments, so while one worker's segment is being
+    consumed, the others decode ahead into their buffers.
+
+    Workers are started with the "spawn" start method by default. This is typically
+    used from threads of a `tf.data` pipeline while the TensorFlow and OpenCV thread
+    pools are running, and forking a multithreaded process can deadlock in the child.
+    Spawned workers take longer to start since they import SLEAP again, and scripts
+    that use the decoder need an `if __name__ == "__main__":` guard.
+
+    Attributes:
+        video: The `Video` to read. This must have a `MediaVideo` backend.
+        n_workers: Number of worker processes. Defaults to the number of CPUs.
+        segment_size: Maximum number of frames in each segment.
+        buffer_size: Number of frames that each worker can decode ahead of the frames
+            that have been consumed. This should be at least `segment_size` so that all
+            workers can decode a full segment at the same time.
+        use_keyframe_index: If `True`, seeks are planned with the keyframe index of the
+            video (see `sleap.io.keyframes`), which is built if needed before the
+            workers are started and passed to them. Otherwise, gaps of up to 8 frames
+            between requested frames are decoded through and larger gaps are seeked
+            over.
+        start_method: The `multiprocessing` start method used to create the workers.
+            This should be "spawn" or "forkserver" when the process runs other threads.
+    """
+
+    video: Video
+    n_workers: int = attr.ib(factory=multiprocessing.cpu_count)
+    segment_size: int = 64
+    buffer_size: int = 64
+    use_keyframe_index: bool = True
+    start_method: str = "spawn"
+
+    def __attrs_post_init__(self):
+        if not isinstance(self.video.backend, MediaVideo):
+            raise ValueError(
+                "Parallel decoding is only supported for videos with a MediaVideo "
+                f"backend, not {type(self.video.backend).__name__}."
+            )
+
+    @property
+    def frame_shape(self) -> Tuple[int, int, int]:
+        """Shape of the decoded frames as `(height, width, channels)`."""
+        return (self.video.height, self.video.width, self.video.channels)
+
+    def iter_frames(
+        self, frame_inds: Optional[Sequence[int]] = None
+    ) -> Iterator[Tuple[int, np.ndarray]]:
+        """Decode frames in parallel and yield them in order.
+
+        Args:
+            frame_inds: Indices of the frames to read. If `None`, all frames of the
+                video are read.
+
+        Yields:
+            Tuples of `(frame_idx, frame)` in the same order as `frame_inds`, where
+            `frame` is an array of shape `(height, width, channels)` identical to
+            `video.get_frame(frame_idx)`.
+
+        Raises:
+            KeyError: If a frame could not be decoded.
+            RuntimeError: If a worker process failed.
+        """
+        if frame_inds is None:
+            frame_inds = np.arange(len(self.video))
+        segments = split_segments(frame_inds, self.segment_size)
+        if len(segments) == 0:
+            return
+
+        backend = self.video.backend
+        frame_shape = self.frame_shape
+        frame_size = int(np.prod(frame_shape))
+        n_workers = max(1, min(self.n_workers, len(segments)))
+        if self.use_keyframe_index:
+            # The index is loaded (or built) once here and passed to the workers.
+            keyframe_index = backend.build_keyframe_index()
+        else:
+            keyframe_index = KeyframeIndex(n_frames=len(self.video))
+
+        context = multiprocessing.get_context(self.start_method)
+        workers = []
+        try:
+            for worker_ind in range(n_workers):
+                buffer = context.RawArray(ctypes.c_uint8, self.buffer_size * frame_size)
+                free_slots = context.Queue()
+                for slot in range(self.buffer_size):
+                    free_slots.put(slot)
+                filled_slots = context.Queue()
+
+                process = context.Process(
+                    target=_decode_segments,
+                    args=(
+                        backend.filename,
+                        segments[worker_ind::n_workers],
+                        backend.grayscale,
+                        backend.bgr,
+                        frame_shape,
+                        buffer,
+                        free_slots,
+                        filled_slots,
+                        keyframe_index,
+                    ),
+                    daemon=True,
+                )
+                process.start()
+
+                frames = np.frombuffer(buffer, dtype="uint8").reshape(
+                    (-1,) + frame_shape
+                )
+                workers.append((process, frames, free_slots, filled_slots))
+
+            for segment_ind, segment in enumerate(segments):
+                process, frames, free_slots, filled_slots = workers[
+                    segment_ind % n_workers
+                ]
+                for _ in range(len(segment)):
+                    frame_idx, slot, error = self._get_filled_slot(
+                        process, filled_slots
+                    )
+                    if frame_idx is None:
+                        raise RuntimeError(f"Video decoding worker failed:\n{error}")
+                    if error is not None:
+                        raise KeyError(f"{error} from {self.video}.")
+
+                    # Copy the frame out so the worker can reuse the slot.
+                    frame = frames[slot].copy()
+                    free_slots.put(slot)
+                    yield frame_idx, frame
+
+        finally:
+            for process, _, free_slots, filled_slots in workers:
+                process.terminate()
+                process.join()
+                free_slots.close()
+                filled_slots.close()
+
+    @staticmethod
+    def _get_filled_slot(
+        process: multiprocessing.Process, filled_slots: multiprocessing.Queue
+    ) -> Tuple[Optional[int], Optional[int], Optional[str]]:
+        """Wait for the next decoded frame from a worker, checking it is alive."""
+        while True:
+            try:
+                return filled_slots.get(timeout=1.0)
+            except queue.Empty:
+                if not process.is_alive():
+                    return None, None, f"Exited with code {process.exitcode}."
@@ -12,13 +12,64 @@ import cattr
 import logging
 import multiprocessing
 
-from typing import Iterable, List, Optional, Tuple, Union, Text
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, List, Optional, Tuple, Union, Text
 
 from sleap.util import json_loads, json_dumps
+from sleap.io.framecache import get_frame_cache
+from sleap.io.keyframes import (
+    DEFAULT_PROBE_TIMEOUT,
+    KeyframeIndex,
+    request_keyframe_index,
+)
 
 logger = logging.getLogger(__name__)
 
 
+def _read_frames(
+    get_frame: Callable[[int], np.ndarray], idxs: Iterable[int]
+) -> np.ndarray:
+    """Read frames one at a time into a preallocated array.
+
+    Each frame is read once, in ascending order of index, which is the cheapest order
+    for backends that read sequentially.
+
+    Args:
+        get_frame: Function that returns the frame with a given index.
+        idxs: An iterable object that contains the indices of frames.
+
+    Returns:
+        The frames with shape (len(idxs), height, width, channels) in the order of
+        `idxs`.
+    """
+    idxs = np.asarray(list(idxs), dtype="int64").reshape(-1)
+    if len(idxs) == 0:
+        raise ValueError("No frame indices were given.")
+
+    unique_idxs, inverse = np.unique(idxs, return_inverse=True)
+    out = None
+    for i, idx in enumerate(unique_idxs):
+        frame = get_frame(int(idx))
+        if out is None:
+            out = np.empty((len(unique_idxs),) + frame.shape, dtype=frame.dtype)
+        out[i] = frame
+
+    if len(unique_idxs) == len(idxs) and np.all(unique_idxs == idxs):
+        return out
+    return out[inverse]
+
+
+def _scale_frame(frame: np.ndarray, scale: float) -> np.ndarray:
+    """Resize a frame of shape (height, width, channels) by a scale factor."""
+    if scale == 1.0:
+        return frame
+    scaled = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    if scaled.ndim == 2:
+        # OpenCV drops the channel axis of single channel images.
+        scaled = scaled[..., None]
+    return scaled
+
+
 @attr.s(auto_attribs=True, eq=False, order=False)
 class DummyVideo:
     """
@@ -333,6 +384,77 @@ class HDF5Video:
 
         return frame
 
+    def get_frames(self, idxs: Iterable[int]) -> np.ndarray:
+        """
+        Get a collection of frames from the underlying HDF5 video data.
+
+        The frames are read from the dataset in a single hyperslab selection of the
+        sorted frame indices.
+
+        Args:
+            idxs: An iterable object that contains the indices of frames.
+
+        Returns:
+            The requested video frames with shape (len(idxs), height, width, channels)
+            in the order of `idxs`.
+        """
+        # Ensure that video is loaded since we'll need data from loading
+        self._load()
+
+        idxs = np.asarray(list(idxs), dtype="int64").reshape(-1)
+        if len(idxs) == 0:
+            raise ValueError("No frame indices were given.")
+
+        # If we only saved some frames from a video, map to idx in dataset.
+        if self.__original_to_current_frame_idx:
+            if not all(idx in self.__original_to_current_frame_idx for idx in idxs):
+                # Some frames have to be read from the source video.
+                return _read_frames(self.get_frame, idxs)
+            idxs = np.array(
+                [self.__original_to_current_frame_idx[idx] for idx in idxs],
+                dtype="int64",
+            )
+
+        # Wrap negative indices and check bounds, as for single frame indexing.
+        n_frames = self.__dataset_h5.shape[0]
+        idxs = np.where(idxs < 0, idxs + n_frames, idxs)
+        if np.any((idxs < 0) | (idxs >= n_frames)):
+            raise ValueError(f"Frame index out of range for {n_frames} frames.")
+
+        unique_idxs, inverse = np.unique(idxs, return_inverse=True)
+        frames = self.__dataset_h5[unique_idxs]
+
+        if self.__dataset_h5.attrs.get("format", ""):
+            decoded = None
+            for i, encoded_frame in enumerate(frames):
+                frame = cv2.imdecode(encoded_frame, cv2.IMREAD_UNCHANGED)
+
+                # Add dimension for single channel (dropped by opencv).
+                if frame.ndim == 2:
+                    frame = frame[..., np.newaxis]
+
+                if decoded is None:
+                    decoded = np.empty((len(frames),) + frame.shape, dtype=frame.dtype)
+                decoded[i] = frame
+            frames = decoded
+
+        if self.input_format == "channels_first":
+            frames = np.transpose(frames, (0, 3, 2, 1))
+
+        if self.convert_range:
+            # Frames are converted individually, as in get_frame.
+            convert = frames.reshape(len(frames), -1).max(axis=1) <= 1.0
+            if np.all(convert):
+                frames = (frames * 255).astype(int)
+            elif np.any(convert):
+                converted = (frames[convert] * 255).astype(int)
+                frames = frames.astype(np.result_type(frames.dtype, converted.dtype))
+                frames[convert] = converted
+
+        if len(unique_idxs) == len(idxs) and np.all(unique_idxs == idxs):
+            return frames
+        return frames[inverse]
+
 
 @attr.s(auto_attribs=True, eq=False, order=False)
 class MediaVideo:
@@ -360,6 +482,7 @@ class MediaVideo:
     _detect_grayscale = False
     _reader_ = None
     _test_frame_ = None
+    _keyframe_index_ = None
 
     @property
     def __lock(self):
@@ -461,17 +584,67 @@ class MediaVideo:
         """See :class:`Video`."""
         return self.test_frame.dtype
 
+    @property
+    def keyframe_index(self) -> KeyframeIndex:
+        """Keyframe index used to plan seeks.
+
+        This is loaded from the sidecar file next to the video. If there is none, the
+        index is built in the background the first time it is needed and an index
+        without keyframes is used until it is ready, so reads never wait for the video
+        to be probed. See `sleap.io.keyframes`.
+        """
+        if self._keyframe_index_ is None:
+            index = request_keyframe_index(self.filename, n_frames=self.frames)
+            if index is None:
+                return KeyframeIndex(n_frames=self.frames)
+            self._keyframe_index_ = index
+        return self._keyframe_index_
+
+    def build_keyframe_index(
+        self, timeout: Optional[float] = DEFAULT_PROBE_TIMEOUT
+    ) -> KeyframeIndex:
+        """Load or build the keyframe index, waiting until it is ready.
+
+        Args:
+            timeout: Maximum time in seconds to spend probing the video.
+
+        Returns:
+            The keyframe index of the video.
+        """
+        if self._keyframe_index_ is None:
+            self._keyframe_index_ = request_keyframe_index(
+                self.filename, n_frames=self.frames, wait=True, timeout=timeout
+            )
+        return self._keyframe_index_
+
     def reset(self):
         """Reloads the video."""
         self._reader_ = None
+        self._keyframe_index_ = None
+        get_frame_cache().clear(self)
+
+    def _seek(self, idx: int):
+        """Position the reader so that the next frame read is `idx`.
+
+        The reader continues decoding forward if the frame is close ahead of the current
+        position, and otherwise seeks to the keyframe before it and decodes forward from
+        there. This must be called while holding the lock.
+        """
+        pos = int(self.__reader.get(cv2.CAP_PROP_POS_FRAMES))
+        if pos == idx:
+            return
+
+        seek_to, n_skip = self.keyframe_index.plan(pos, idx)
+        if seek_to is not None:
+            self.__reader.set(cv2.CAP_PROP_POS_FRAMES, seek_to)
+        for _ in range(n_skip):
+            self.__reader.grab()
 
     def get_frame(self, idx: int, grayscale: bool = None) -> np.ndarray:
         """See :class:`Video`."""
 
         with self.__lock:
-            if self.__reader.get(cv2.CAP_PROP_POS_FRAMES) != idx:
-                self.__reader.set(cv2.CAP_PROP_POS_FRAMES, idx)
-
+            self._seek(idx)
             success, frame = self.__reader.read()
 
         if not success or frame is None:
@@ -488,6 +661,24 @@ class MediaVideo:
 
         return frame
 
+    def get_frames(self, idxs: Iterable[int], grayscale: bool = None) -> np.ndarray:
+        """Return a collection of frames, decoding them in the cheapest order.
+
+        Frames are decoded in ascending order, once each, so that contiguous runs of
+        frames are decoded sequentially and the reader can continue decoding forward
+        between nearby frames instead of seeking.
+
+        Args:
+            idxs: An iterable object that contains the indices of frames.
+            grayscale: Whether to return grayscale frames. Defaults to the `grayscale`
+                attribute of the video.
+
+        Returns:
+            The requested video frames with shape (len(idxs), height, width, channels)
+            in the order of `idxs`.
+        """
+        return _read_frames(lambda idx: self.get_frame(idx, grayscale=grayscale), idxs)
+
 
 @attr.s(auto_attribs=True, eq=False, order=False)
 class NumpyVideo:
@@ -579,6 +770,10 @@ class NumpyVideo:
         """See :class:`Video`."""
         return self.__data[idx]
 
+    def get_frames(self, idxs: Iterable[int]) -> np.ndarray:
+        """See :class:`Video`."""
+        return self.__data[np.asarray(list(idxs), dtype="int64").reshape(-1)]
+
     @property
     def is_missing(self) -> bool:
         """Return True if the video comes from a file and is missing."""
@@ -741,6 +936,23 @@ class ImgStoreVideo:
 
         return img
 
+    def get_frames(self, idxs: Iterable[int]) -> np.ndarray:
+        """
+        Get a collection of frames from the underlying ImgStore video data.
+
+        Frames are read once each in ascending order so that frames in the same chunk
+        of the store are read sequentially.
+
+        Args:
+            idxs: An iterable object that contains the frame numbers to get. See
+                `get_frame` for how these are interpreted.
+
+        Returns:
+            The requested video frames with shape (len(idxs), height, width, channels)
+            in the order of `idxs`.
+        """
+        return _read_frames(self.get_frame, idxs)
+
     @property
     def imgstore(self):
         """
@@ -914,6 +1126,34 @@ class SingleImageVideo:
 
         return self.__data[idx]
 
+    def get_frames(self, idxs: Iterable[int]) -> np.ndarray:
+        """
+        Get a collection of frames, decoding the image files in parallel.
+
+        Args:
+            idxs: An iterable object that contains the indices of frames.
+
+        Returns:
+            The requested video frames with shape (len(idxs), height, width, channels)
+            in the order of `idxs`.
+        """
+        idxs = [int(idx) for idx in idxs]
+        if len(idxs) == 0:
+            raise ValueError("No frame indices were given.")
+
+        # OpenCV releases the GIL while decoding, so threads decode in parallel.
+        to_load = sorted(set(idx for idx in idxs if idx not in self.__data))
+        if len(to_load) > 1:
+            with ThreadPoolExecutor(max_workers=min(len(to_load), 8)) as executor:
+                for idx, img in zip(to_load, executor.map(self._load_idx, to_load)):
+                    self.__data[idx] = img
+
+        test_frame = self.get_frame(idxs[0])
+        out = np.empty((len(idxs),) + test_frame.shape, dtype=test_frame.dtype)
+        for i, idx in enumerate(idxs):
+            out[i] = self.get_frame(idx)
+        return out
+
 
 @attr.s(auto_attribs=True, eq=False, order=False)
 class Video:
@@ -952,6 +1192,9 @@ class Video:
             * :code:`get_frame(frame_index: int) -> np.ndarray`:
               Get a single frame from the underlying video data with
               output shape=(height, width, channels).
+            * :code:`get_frames(frame_indices: Iterable[int]) -> np.ndarray`:
+              Optional batched read of multiple frames with output
+              shape=(len(frame_indices), height, width, channels).
 
     """
 
@@ -1004,21 +1247,57 @@ class Video:
         else:
             return not os.path.exists(self.backend.filename)
 
-    def get_frame(self, idx: int) -> np.ndarray:
+    @property
+    def is_cached(self) -> bool:
+        """Return True if frames of this video are stored in the shared frame cache.
+
+        Only backends that decode or read frames from disk are cached. See
+        `sleap.io.framecache`.
+        """
+        return get_frame_cache().enabled and isinstance(
+            self.backend, (HDF5Video, MediaVideo, ImgStoreVideo)
+        )
+
+    def get_frame(self, idx: int, scale: float = 1.0) -> np.ndarray:
         """
         Return a single frame of video from the underlying video data.
 
+        Frames are looked up in the shared frame cache first, if the video is cached.
+
         Args:
             idx: The index of the video frame
+            scale: Factor by which to resize the frame.
 
         Returns:
             The video frame with shape (height, width, channels)
         """
-        return self.backend.get_frame(idx)
+        if not self.is_cached:
+            return _scale_frame(self.backend.get_frame(idx), scale)
+
+        cache = get_frame_cache()
+        if scale != 1.0 and cache.store_scaled:
+            key = cache.make_key(self.backend, idx, scale)
+            frame = cache.get(key)
+            if frame is None:
+                frame = cache.put(key, _scale_frame(self.get_frame(idx), scale))
+        else:
+            key = cache.make_key(self.backend, idx)
+            frame = cache.get(key)
+            if frame is None:
+                frame = cache.put(key, self.backend.get_frame(idx))
+            frame = _scale_frame(frame, scale)
+
+        # Cached frames are read-only, so return a copy that the caller can modify.
+        if not frame.flags.writeable:
+            frame = frame.copy()
+        return frame
 
     def get_frames(self, idxs: Union[int, Iterable[int]]) -> np.ndarray:
         """Return a collection of video frames from the underlying video data.
 
+        This uses the batched read of the backend if it has one. If the video is cached,
+        only the frames that are not in the shared frame cache are read.
+
         Args:
             idxs: An iterable object that contains the indices of frames.
 
@@ -1027,7 +1306,28 @@ class Video:
         """
         if np.isscalar(idxs):
             idxs = [idxs]
-        return np.stack([self.get_frame(idx) for idx in idxs], axis=0)
+        if not self.is_cached:
+            return self._read_backend_frames(idxs)
+
+        idxs = list(idxs)
+        cache = get_frame_cache()
+        keys = [cache.make_key(self.backend, idx) for idx in idxs]
+        frames = [cache.get(key) for key in keys]
+
+        missing = [i for i, frame in enumerate(frames) if frame is None]
+        if missing:
+            missing_frames = self._read_backend_frames([idxs[i] for i in missing])
+            # Every row of the batch is cached, so the rows don't need to be copied.
+            for i, frame in zip(missing, missing_frames):
+                frames[i] = cache.put(keys[i], frame, share_base=True)
+
+        return np.stack(frames, axis=0)
+
+    def _read_backend_frames(self, idxs: Iterable[int]) -> np.ndarray:
+        """Read frames from the backend, using its batched read if it has one."""
+        if hasattr(self.backend, "get_frames"):
+            return self.backend.get_frames(idxs)
+        return np.stack([self.backend.get_frame(idx) for idx in idxs], axis=0)
 
     def get_frames_safely(self, idxs: Iterable[int]) -> Tuple[List[int], np.ndarray]:
         """Return list of frame indices and frames which were successfully loaded.
@@ -1039,6 +1339,13 @@ class Video:
             * frames has shape (len(frame indices), height, width, channels).
             If zero frames were loaded successfully, then frames is None.
         """
+        # Try to read all of the frames at once first.
+        idxs = list(idxs)
+        try:
+            return idxs, self.get_frames(idxs)
+        except Exception:
+            pass
+
         frames = []
         idxs_found = []
 
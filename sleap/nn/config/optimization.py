@@ -178,6 +178,11 @@ class OptimizationConfig:
             performance of data generation at the cost of memory as all the images will
             be loaded into memory. This is especially beneficial for datasets with few
             examples or when the raw data is on (slow) network storage.
+        frame_cache_dir: If not None, the images of the labeled frames are stored in
+            this folder after they are decoded. Later training runs on the same videos
+            read them from there instead of decoding them again, which speeds up
+            repeated runs and hyperparameter sweeps. Images are stored uncompressed, so
+            this can take up a considerable amount of disk space.
         augmentation_config: Configuration options related to data augmentation.
         online_shuffling: If True, data will be shuffled online by maintaining a buffer
             of examples that are sampled from at each step. This allows for
@@ -233,6 +238,7 @@ class OptimizationConfig:
     """
 
     preload_data: bool = True
+    frame_cache_dir: Optional[Text] = None
     augmentation_config: AugmentationConfig = attr.ib(factory=AugmentationConfig)
     online_shuffling: bool = True
     shuffle_buffer_size: int = 128
@@ -1,10 +1,44 @@
 """Data providers for pipeline I/O."""
 
+import collections
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import tensorflow as tf
 import attr
-from typing import Text, Optional, List, Sequence, Union, Tuple
+from typing import Dict, Text, Optional, List, Sequence, Union, Tuple
 import sleap
+from sleap.io.framecache import DiskFrameCache
+from sleap.io.parallelvideo import ParallelVideoDecoder
+from sleap.nn.profiling import profile_stage
+
+
+def _make_thread_video(video: sleap.Video) -> sleap.Video:
+    """Return a copy of a media video that opens its own reader.
+
+    `MediaVideo` reads frames through a single capture behind a lock, so a copy is
+    needed to decode frames of the same video in several threads at once. The copy
+    shares the keyframe index of the video if it has been loaded. Videos with other
+    backends are returned as they are.
+
+    Args:
+        video: The `sleap.Video` to copy.
+
+    Returns:
+        A new `sleap.Video` if `video` has a `MediaVideo` backend, otherwise `video`.
+    """
+    backend = video.backend
+    if not isinstance(backend, sleap.io.video.MediaVideo):
+        return video
+
+    # Reading the test frame detects whether the video is grayscale, so the copy does
+    # not need to.
+    test_frame = backend.test_frame
+    thread_backend = attr.evolve(backend)
+    thread_backend._test_frame_ = test_frame
+    thread_backend._keyframe_index_ = backend._keyframe_index_
+    return sleap.Video(backend=thread_backend)
 
 
 @attr.s(auto_attribs=True)
@@ -25,11 +59,22 @@ class LabelsReader:
             or filtered.
         user_instances_only: If `True`, load only user labeled instances. If `False`,
             all instances will be loaded.
+        decode_workers: Number of threads that read the images ahead of the pipeline.
+            Each thread decodes media videos with its own reader. If 0, images are read
+            one at a time when the examples are consumed.
+        prefetch_size: Maximum number of examples that are read ahead when using
+            `decode_workers`.
+        frame_cache_dir: If not `None`, decoded images are stored in a
+            `sleap.io.framecache.DiskFrameCache` in this directory and read from there
+            in later runs instead of being decoded again.
     """
 
     labels: sleap.Labels
     example_indices: Optional[Union[Sequence[int], np.ndarray]] = None
     user_instances_only: bool = False
+    decode_workers: int = 4
+    prefetch_size: int = 32
+    frame_cache_dir: Optional[Text] = None
 
     @classmethod
     def from_user_instances(cls, labels: sleap.Labels) -> "LabelsReader":
@@ -170,70 +215,75 @@ class LabelsReader:
         first_image = tf.convert_to_tensor(self.labels[0].image)
         image_dtype = first_image.dtype
         image_num_channels = first_image.shape[-1]
+        if self.is_from_multi_size_videos:
+            image_shape = tf.TensorShape([None, None, image_num_channels])
+        else:
+            image_shape = first_image.shape
 
-        def py_fetch_lf(ind):
-            """Local function that will not be autographed."""
-            lf = self.labels[int(ind.numpy())]
-
-            video_ind = np.array(self.videos.index(lf.video)).astype("int32")
-            frame_ind = np.array(lf.frame_idx).astype("int64")
-
-            raw_image = lf.image
-            raw_image_size = np.array(raw_image.shape).astype("int32")
-
-            if self.user_instances_only:
-                insts = lf.user_instances
+        if ds_index is not None:
+            example_inds = np.array(list(ds_index.as_numpy_iterator()))
+        else:
+            if self.example_indices is None:
+                # Create default indexing dataset.
+                example_inds = np.arange(len(self))
             else:
-                insts = lf.instances
-            insts = [inst for inst in insts if len(inst) > 0]
-            n_instances = len(insts)
-            n_nodes = len(insts[0].skeleton) if n_instances > 0 else 0
-
-            instances = np.full((n_instances, n_nodes, 2), np.nan, dtype="float32")
-            for i, instance in enumerate(insts):
-                instances[i] = instance.numpy()
-
-            skeleton_inds = np.array(
-                [self.labels.skeletons.index(inst.skeleton) for inst in insts]
-            ).astype("int32")
-            return (
-                raw_image,
-                raw_image_size,
-                instances,
-                video_ind,
-                frame_ind,
-                skeleton_inds,
+                # Create indexing dataset from provided indices.
+                example_inds = np.array(list(self.example_indices))
+            ds_index = tf.data.Dataset.from_tensor_slices(example_inds)
+
+        # Precompute the data of each example so that only the images are read in the
+        # pipeline.
+        example_data = self._make_example_data(example_inds)
+
+        def get_example_data(ind: int) -> Tuple[np.ndarray, ...]:
+            """Return the data of an example, computing it if needed."""
+            if ind not in example_data:
+                example_data.update(self._make_example_data([ind]))
+            return example_data[ind]
+
+        # Frames are only read concurrently from backends that are thread-safe. Media
+        # videos are read by each thread with its own reader (see `read_examples`).
+        video_locks = {
+            video: threading.Lock()
+            for video in self.videos
+            if not isinstance(
+                video.backend,
+                (
+                    sleap.io.video.HDF5Video,
+                    sleap.io.video.MediaVideo,
+                    sleap.io.video.NumpyVideo,
+                ),
             )
+        }
 
-        def fetch_lf(ind):
-            """Local function that fetches a sample given the index."""
-            ind = tf.cast(ind, tf.int64)
-            (
-                image,
-                raw_image_size,
-                instances,
-                video_ind,
-                frame_ind,
-                skeleton_inds,
-            ) = tf.py_function(
-                py_fetch_lf,
-                [ind],
-                [image_dtype, tf.int32, tf.float32, tf.int32, tf.int64, tf.int32],
-            )
-
-            # Ensure shape with constant or variable height/width, based on whether or
-            # not the videos have mixed sizes.
-            if self.is_from_multi_size_videos:
-                image = tf.ensure_shape(image, (None, None, image_num_channels))
-            else:
-                image = tf.ensure_shape(image, first_image.shape)
-
+        if self.frame_cache_dir is not None:
+            get_frame = DiskFrameCache(self.frame_cache_dir).get_frame
+        else:
+            get_frame = sleap.Video.get_frame
+
+        def read_image(
+            ind: int, videos: Optional[List[sleap.Video]] = None
+        ) -> np.ndarray:
+            """Read the image of an example, optionally from copies of the videos."""
+            video_ind, frame_ind = get_example_data(ind)[:2]
+            lock = video_locks.get(self.videos[video_ind], None)
+            video = self.videos[video_ind] if videos is None else videos[video_ind]
+            if lock is not None:
+                with lock:
+                    return get_frame(video, frame_ind)
+            return get_frame(video, frame_ind)
+
+        def make_example(
+            ind, image, video_ind, frame_ind, instances, skeleton_inds
+        ) -> Dict[Text, tf.Tensor]:
+            """Local function that packs the data of a labeled frame into an example."""
+            image = tf.ensure_shape(image, image_shape)
             instances = tf.ensure_shape(instances, tf.TensorShape([None, None, 2]))
             skeleton_inds = tf.ensure_shape(skeleton_inds, tf.TensorShape([None]))
 
             return {
                 "image": image,
-                "raw_image_size": raw_image_size,
+                "raw_image_size": tf.shape(image, out_type=tf.int32),
                 "example_ind": ind,
                 "video_ind": video_ind,
                 "frame_ind": frame_ind,
@@ -242,24 +292,113 @@ class LabelsReader:
                 "skeleton_inds": skeleton_inds,
             }
 
-        if self.example_indices is None:
-            # Create default indexing dataset.
-            ds_index = tf.data.Dataset.range(len(self))
-        else:
-            # Create indexing dataset from provided indices.
-            if isinstance(self.example_indices, range):
-                ds_index = tf.data.Dataset.from_tensor_slices(
-                    list(self.example_indices)
-                )
-            else:
-                ds_index = tf.data.Dataset.from_tensor_slices(self.example_indices)
+        output_types = (tf.int64, image_dtype, tf.int32, tf.int64, tf.float32, tf.int32)
+
+        if self.decode_workers > 0:
+
+            # Each thread reads media videos with its own capture so that they are
+            # decoded concurrently instead of one at a time behind the video's lock.
+            thread_data = threading.local()
+
+            def read_image_in_thread(ind: int) -> np.ndarray:
+                """Read the image of an example with the thread's copies of the videos."""
+                if not hasattr(thread_data, "videos"):
+                    thread_data.videos = [
+                        _make_thread_video(video) for video in self.videos
+                    ]
+                with profile_stage("provider_fetch"):
+                    return read_image(ind, thread_data.videos)
+
+            def read_examples():
+                """Generator over the examples with images read in a thread pool."""
+                with ThreadPoolExecutor(max_workers=self.decode_workers) as pool:
+                    pending = collections.deque()
+                    for ind in example_inds.tolist():
+                        pending.append((ind, pool.submit(read_image_in_thread, ind)))
+                        if len(pending) > self.prefetch_size:
+                            ind, image = pending.popleft()
+                            yield (ind, image.result()) + get_example_data(ind)
+                    while pending:
+                        ind, image = pending.popleft()
+                        yield (ind, image.result()) + get_example_data(ind)
+
+            ds_reader = tf.data.Dataset.from_generator(
+                read_examples,
+                output_types=output_types,
+                output_shapes=(
+                    (),
+                    image_shape,
+                    (),
+                    (),
+                    (None, None, 2),
+                    (None,),
+                ),
+            )
+            return ds_reader.map(make_example)
+
+        def py_fetch_lf(ind):
+            """Local function that will not be autographed."""
+            ind = int(ind.numpy())
+            with profile_stage("provider_fetch"):
+                return (read_image(ind),) + get_example_data(ind)
+
+        def fetch_lf(ind):
+            """Local function that fetches a sample given the index."""
+            ind = tf.cast(ind, tf.int64)
+            data = tf.py_function(py_fetch_lf, [ind], output_types[1:])
+            return make_example(ind, *data)
 
         # Create reader dataset.
-        # Note: We don't parallelize here for thread safety.
+        # Note: We don't parallelize here for thread safety. Use `decode_workers` to
+        # read the images concurrently.
         ds_reader = ds_index.map(fetch_lf)
 
         return ds_reader
 
+    def _make_example_data(
+        self, example_inds: Sequence[int]
+    ) -> Dict[int, Tuple[np.ndarray, ...]]:
+        """Gather the data of labeled frames other than the images.
+
+        Args:
+            example_inds: Indices of the labeled frames in `labels`.
+
+        Returns:
+            A dictionary mapping each example index to a tuple of `(video_ind,
+            frame_ind, instances, skeleton_inds)`. See `make_dataset` for details.
+        """
+        video_inds = {video: i for i, video in enumerate(self.videos)}
+        skeleton_inds = {
+            skeleton: i for i, skeleton in enumerate(self.labels.skeletons)
+        }
+
+        example_data = {}
+        for ind in example_inds:
+            ind = int(ind)
+            lf = self.labels[ind]
+
+            if self.user_instances_only:
+                insts = lf.user_instances
+            else:
+                insts = lf.instances
+            insts = [inst for inst in insts if len(inst) > 0]
+            n_instances = len(insts)
+            n_nodes = len(insts[0].skeleton) if n_instances > 0 else 0
+
+            instances = np.full((n_instances, n_nodes, 2), np.nan, dtype="float32")
+            for i, instance in enumerate(insts):
+                instances[i] = instance.numpy()
+
+            example_data[ind] = (
+                np.array(video_inds[lf.video], dtype="int32"),
+                np.array(lf.frame_idx, dtype="int64"),
+                instances,
+                np.array(
+                    [skeleton_inds[inst.skeleton] for inst in insts], dtype="int32"
+                ),
+            )
+        return example_data
+
 
 @attr.s(auto_attribs=True)
 class VideoReader:
@@ -275,10 +414,18 @@ class VideoReader:
             If not provided, the entire video will be read.
         video_ind: Scalar index of video to keep with each example. Helpful when running
             inference across videos.
+        decode_workers: If greater than 1 and the video has a `MediaVideo` backend,
+            frames are decoded in this many worker processes with a
+            `sleap.io.parallelvideo.ParallelVideoDecoder`. Otherwise, frames are read
+            in batches of `frames_per_read` in the pipeline.
+        frames_per_read: Number of frames to read at a time with `Video.get_frames`
+            when not using parallel decoding.
     """
 
     video: sleap.Video
     example_indices: Optional[Union[Sequence[int], np.ndarray]] = None
+    decode_workers: int = 0
+    frames_per_read: int = 16
 
     @classmethod
     def from_filepath(
@@ -350,29 +497,71 @@ class VideoReader:
         )
         image_dtype = test_image.dtype
 
-        def py_fetch_frame(ind):
+        def py_fetch_frames(inds):
             """Local function that will not be autographed."""
-            frame_ind = int(ind.numpy())
-            raw_image = self.video.get_frame(frame_ind)
-            raw_image_size = np.array(raw_image.shape).astype("int32")
-            return raw_image, raw_image_size, np.array(frame_ind).astype("int64")
+            frame_inds = inds.numpy().astype("int64")
+            with profile_stage("provider_fetch"):
+                raw_images = self.video.get_frames(frame_inds)
+            raw_image_sizes = np.tile(
+                np.array(raw_images.shape[1:], dtype="int32"), (len(frame_inds), 1)
+            )
+            return raw_images, raw_image_sizes, frame_inds
 
-        def fetch_frame(ind):
-            """Local function that fetches a sample given the index."""
-            ind = tf.cast(ind, tf.int64)
-            image, raw_image_size, frame_ind = tf.py_function(
-                py_fetch_frame, [ind], [image_dtype, tf.int32, tf.int64]
+        def fetch_frames(inds):
+            """Local function that fetches a batch of samples given the indices."""
+            inds = tf.cast(inds, tf.int64)
+            images, raw_image_sizes, frame_inds = tf.py_function(
+                py_fetch_frames, [inds], [image_dtype, tf.int32, tf.int64]
             )
-            image = tf.ensure_shape(image, test_image.shape)
+            images = tf.ensure_shape(images, [None] + test_image.shape.as_list())
+            raw_image_sizes = tf.ensure_shape(raw_image_sizes, [None, 3])
+            frame_inds = tf.ensure_shape(frame_inds, [None])
 
             return {
-                "image": image,
-                "raw_image_size": raw_image_size,
-                "video_ind": 0,
-                "frame_ind": frame_ind,
-                "scale": tf.ones([2], dtype=tf.float32),
+                "image": images,
+                "raw_image_size": raw_image_sizes,
+                "video_ind": tf.zeros_like(frame_inds, dtype=tf.int32),
+                "frame_ind": frame_inds,
+                "scale": tf.ones([tf.shape(frame_inds)[0], 2], dtype=tf.float32),
             }
 
+        if self.decode_workers > 1 and isinstance(
+            self.video.backend, sleap.io.video.MediaVideo
+        ):
+            decoder = ParallelVideoDecoder(self.video, n_workers=self.decode_workers)
+            example_indices = self.example_indices
+            if isinstance(example_indices, range):
+                example_indices = list(example_indices)
+
+            def decoded_frames():
+                """Generator over the frames decoded by the worker processes."""
+                frames = decoder.iter_frames(example_indices)
+                while True:
+                    with profile_stage("provider_fetch"):
+                        frame = next(frames, None)
+                    if frame is None:
+                        return
+                    frame_ind, raw_image = frame
+                    yield raw_image, frame_ind
+
+            ds_decoded = tf.data.Dataset.from_generator(
+                decoded_frames,
+                output_types=(image_dtype, tf.int64),
+                output_shapes=(test_image.shape, ()),
+            )
+
+            def make_example(image, frame_ind):
+                """Local function that packs a decoded frame into an example."""
+                return {
+                    "image": image,
+                    "raw_image_size": tf.shape(image, out_type=tf.int32),
+                    "video_ind": 0,
+                    "frame_ind": frame_ind,
+                    "scale": tf.ones([2], dtype=tf.float32),
+                }
+
+            return ds_decoded.map(make_example)
+
         if self.example_indices is None:
             # Create default indexing dataset.
             ds_index = tf.data.Dataset.range(len(self))
@@ -385,8 +574,9 @@ class VideoReader:
             else:
                 ds_index = tf.data.Dataset.from_tensor_slices(self.example_indices)
 
-        # Create reader dataset.
+        # Create reader dataset. Frames are read in batches with the batched read of
+        # the video backend and then split back into single examples.
         # Note: We don't parallelize here for thread safety.
-        ds_reader = ds_index.map(fetch_frame)
+        ds_reader = ds_index.batch(self.frames_per_read).map(fetch_frames).unbatch()
 
         return ds_reader
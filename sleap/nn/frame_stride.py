@@ -0,0 +1,363 @@
+"""
+Frame-stride inference for high frame rate videos.
+
+Consecutive frames of high frame rate recordings are nearly identical, so predicting
+every frame spends most of the model compute on redundant work. With a frame stride of
+`k`, only every `k`-th frame (and the last frame) is predicted and tracked, and the
+frames in between are filled afterwards from the predicted frames around them:
+
+- `"linear"`: Linear interpolation of each node of each track between the predicted
+  frames before and after the filled frame.
+- `"spline"`: Cubic spline interpolation of each node of each track through all of the
+  predicted frames of the track.
+- `"flow"`: Optical flow displacement of the instances of the nearest predicted frame
+  with `FlowCandidateMaker.flow_shift_instances`.
+
+Interpolation needs tracks to know which instances belong together, so it only fills
+tracked instances and only across gaps where the track was predicted on both sides.
+Optical flow doesn't need tracks, but needs to read the frames that are filled.
+
+Filled instances get an instance score of `FILLED_INSTANCE_SCORE` so that they can be
+told apart from predicted instances. Their point scores are taken from the predicted
+instances that they were filled from.
+
+Usage:
+
+> labels = predictor.predict(VideoReader(video, example_indices=strided_inds))
+> labels = sleap.Labels(fill_strided_frames(labels.labeled_frames, frame_inds))
+
+From the command line: `sleap-track ... --frame_stride 4 --stride_fill linear`
+"""
+
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Text, Tuple
+
+import numpy as np
+from scipy.interpolate import CubicSpline
+
+from sleap.instance import LabeledFrame, PredictedInstance, Track
+from sleap.io.video import Video
+from sleap.nn.tracking import FlowCandidateMaker
+
+
+# Instance score of the instances that were filled in between predicted frames.
+FILLED_INSTANCE_SCORE = -1.0
+
+# Methods for filling the frames in between predicted frames.
+FILL_METHODS = ("linear", "spline", "flow")
+
+
+def make_strided_frame_inds(frame_inds: Sequence[int], frame_stride: int) -> np.ndarray:
+    """Select the frames to predict with a frame stride.
+
+    Args:
+        frame_inds: Indices of all of the frames that should have predictions.
+        frame_stride: Predict every `frame_stride`-th frame of `frame_inds`.
+
+    Returns:
+        Every `frame_stride`-th frame index of the sorted `frame_inds`, starting with
+        the first one. The last frame index is always included so that the frames at
+        the end can be interpolated rather than extrapolated.
+    """
+    if frame_stride < 1:
+        raise ValueError(f"Frame stride must be at least 1 (got {frame_stride}).")
+    frame_inds = np.unique(np.asarray(frame_inds, dtype="int64"))
+    strided_inds = frame_inds[::frame_stride]
+    if len(frame_inds) > 0 and strided_inds[-1] != frame_inds[-1]:
+        strided_inds = np.append(strided_inds, frame_inds[-1])
+    return strided_inds
+
+
+def _get_track_arrays(
+    labeled_frames: List[LabeledFrame],
+) -> Dict[Track, Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """Collect the points of each track across predicted frames.
+
+    Args:
+        labeled_frames: Predicted frames of a single video sorted by frame index.
+
+    Returns:
+        A dictionary mapping each track to a tuple of `(frame_inds, points, scores)`
+        with shapes `(n_frames,)`, `(n_frames, n_nodes, 2)` and `(n_frames, n_nodes)`.
+        If a track has more than one instance in a frame, the first one is used.
+    """
+    track_data = defaultdict(lambda: ([], [], []))
+    for lf in labeled_frames:
+        for instance in lf.instances:
+            if instance.track is None:
+                continue
+            frame_inds, points, scores = track_data[instance.track]
+            if frame_inds and frame_inds[-1] == lf.frame_idx:
+                continue
+            frame_inds.append(lf.frame_idx)
+            points.append(instance.numpy())
+            scores.append(instance.scores)
+
+    return {
+        track: (
+            np.array(frame_inds, dtype="int64"),
+            np.stack(points).astype("float64"),
+            np.stack(scores).astype("float32"),
+        )
+        for track, (frame_inds, points, scores) in track_data.items()
+    }
+
+
+def interpolate_instances(
+    labeled_frames: List[LabeledFrame],
+    frame_inds: Sequence[int],
+    method: Text = "linear",
+    filled_score: float = FILLED_INSTANCE_SCORE,
+) -> List[LabeledFrame]:
+    """Fill frames in between predicted frames by interpolating tracks.
+
+    A track is filled in a frame if it was predicted in both of the nearest predicted
+    frames before and after it. Nodes that are missing in either of these are missing
+    in the filled instance.
+
+    Args:
+        labeled_frames: Tracked predicted frames of a single video.
+        frame_inds: Indices of the frames to fill. Frames that were predicted are
+            ignored.
+        method: `"linear"` or `"spline"`.
+        filled_score: Instance score of the filled instances.
+
+    Returns:
+        A list of new labeled frames with the filled instances of each frame in
+        `frame_inds` that is in between predicted frames, sorted by frame index. Frames
+        where no tracks could be filled have no instances.
+    """
+    if method not in ("linear", "spline"):
+        raise ValueError(f"Unknown interpolation method: {method}")
+    if len(labeled_frames) == 0:
+        return []
+
+    video = labeled_frames[0].video
+    labeled_frames = sorted(labeled_frames, key=lambda lf: lf.frame_idx)
+    predicted_inds = np.array([lf.frame_idx for lf in labeled_frames], dtype="int64")
+    frame_inds = np.unique(np.asarray(frame_inds, dtype="int64"))
+    frame_inds = frame_inds[~np.isin(frame_inds, predicted_inds)]
+    frame_inds = frame_inds[
+        (frame_inds > predicted_inds[0]) & (frame_inds < predicted_inds[-1])
+    ]
+
+    # Index of the predicted frame after each filled frame.
+    next_inds = np.searchsorted(predicted_inds, frame_inds)
+    prev_frames = predicted_inds[next_inds - 1]
+    next_frames = predicted_inds[next_inds]
+    weights = (frame_inds - prev_frames) / (next_frames - prev_frames)
+
+    skeleton = next(
+        (instance.skeleton for lf in labeled_frames for instance in lf.instances), None
+    )
+    filled_instances = [[] for _ in frame_inds]
+    for track, (track_inds, points, scores) in _get_track_arrays(
+        labeled_frames
+    ).items():
+        # Only fill the frames where the track is in both neighboring predicted frames.
+        prev_pos = np.searchsorted(track_inds, prev_frames)
+        prev_pos = np.minimum(prev_pos, len(track_inds) - 1)
+        next_pos = np.minimum(prev_pos + 1, len(track_inds) - 1)
+        fill = (track_inds[prev_pos] == prev_frames) & (
+            track_inds[next_pos] == next_frames
+        )
+        if not fill.any():
+            continue
+        w = weights[fill][:, None]
+        prev_pos, next_pos = prev_pos[fill], next_pos[fill]
+        filled_scores = (1 - w) * scores[prev_pos] + w * scores[next_pos]
+        w = w[..., None]
+        filled_points = (1 - w) * points[prev_pos] + w * points[next_pos]
+
+        if method == "spline":
+            # The linear interpolation is kept for nodes with too few samples and as
+            # the NaN mask, so nodes missing in a neighboring frame stay missing.
+            for node_ind in range(points.shape[1]):
+                valid = ~np.isnan(points[:, node_ind]).any(axis=-1)
+                if valid.sum() < 3:
+                    continue
+                spline = CubicSpline(track_inds[valid], points[valid, node_ind])
+                node_points = spline(frame_inds[fill])
+                missing = np.isnan(filled_points[:, node_ind]).any(axis=-1)
+                node_points[missing] = np.nan
+                filled_points[:, node_ind] = node_points
+
+        for i, pts, pt_scores in zip(
+            np.flatnonzero(fill), filled_points.astype("float32"), filled_scores
+        ):
+            filled_instances[i].append(
+                PredictedInstance.from_arrays(
+                    points=pts,
+                    point_confidences=pt_scores,
+                    instance_score=filled_score,
+                    skeleton=skeleton,
+                    track=track,
+                )
+            )
+
+    return [
+        LabeledFrame(video=video, frame_idx=int(frame_ind), instances=instances)
+        for frame_ind, instances in zip(frame_inds, filled_instances)
+    ]
+
+
+def flow_fill_instances(
+    labeled_frames: List[LabeledFrame],
+    frame_inds: Sequence[int],
+    video: Optional[Video] = None,
+    filled_score: float = FILLED_INSTANCE_SCORE,
+    scale: float = 1.0,
+    window_size: int = 21,
+    max_levels: int = 3,
+    min_shifted_points: int = 0,
+) -> List[LabeledFrame]:
+    """Fill frames in between predicted frames by shifting instances with optical flow.
+
+    The instances of the nearest predicted frame (the previous one in case of a tie)
+    are shifted to each filled frame with `FlowCandidateMaker.flow_shift_instances`.
+    Tracks are kept, so untracked instances are filled as well.
+
+    Args:
+        labeled_frames: Predicted frames of a single video.
+        frame_inds: Indices of the frames to fill. Frames that were predicted are
+            ignored.
+        video: The video to read frames from. If `None`, the video of the labeled
+            frames is used.
+        filled_score: Instance score of the filled instances.
+        scale: Factor to scale the images by when computing optical flow.
+        window_size: Optical flow window size to consider at each pyramid scale level.
+        max_levels: Number of pyramid scale levels to consider.
+        min_shifted_points: Minimum number of points that must be found by optical
+            flow in a filled frame to keep a shifted instance.
+
+    Returns:
+        A list of new labeled frames with the filled instances of each frame in
+        `frame_inds` that was not predicted, sorted by frame index.
+    """
+    if len(labeled_frames) == 0:
+        return []
+    if video is None:
+        video = labeled_frames[0].video
+
+    labeled_frames = sorted(labeled_frames, key=lambda lf: lf.frame_idx)
+    predicted_inds = np.array([lf.frame_idx for lf in labeled_frames], dtype="int64")
+    frame_inds = np.unique(np.asarray(frame_inds, dtype="int64"))
+    frame_inds = frame_inds[~np.isin(frame_inds, predicted_inds)]
+
+    # Nearest predicted frame of each filled frame, preferring the previous one.
+    next_inds = np.searchsorted(predicted_inds, frame_inds)
+    prev_inds = np.clip(next_inds - 1, 0, None)
+    next_inds = np.minimum(next_inds, len(predicted_inds) - 1)
+    use_next = np.abs(predicted_inds[next_inds] - frame_inds) < np.abs(
+        frame_inds - predicted_inds[prev_inds]
+    )
+    ref_inds = np.where(use_next, next_inds, prev_inds)
+
+    filled_frames = []
+    ref_ind, ref_img = None, None
+    for frame_ind, lf_ind in zip(frame_inds, ref_inds):
+        ref_frame = labeled_frames[lf_ind]
+        ref_instances = ref_frame.instances
+        instances = []
+        if len(ref_instances) > 0:
+            # Filled frames are visited in order, so each reference image is only
+            # read and prepared once for all of the frames that are filled from it.
+            if ref_ind != lf_ind:
+                ref_img = FlowCandidateMaker.prepare_image(
+                    video.get_frame(ref_frame.frame_idx), scale=scale
+                )
+                ref_ind = lf_ind
+            new_img = FlowCandidateMaker.prepare_image(
+                video.get_frame(int(frame_ind)), scale=scale
+            )
+
+            # Keep all shifted instances so they line up with the reference instances.
+            shifted_instances = FlowCandidateMaker.flow_shift_instances(
+                ref_instances,
+                ref_img,
+                new_img,
+                min_shifted_points=-1,
+                scale=scale,
+                window_size=window_size,
+                max_levels=max_levels,
+                preprocessed=True,
+            )
+            for ref_instance, shifted in zip(ref_instances, shifted_instances):
+                points = np.asarray(shifted.points_array, dtype="float32")
+                if (~np.isnan(points).any(axis=-1)).sum() <= min_shifted_points:
+                    continue
+                instances.append(
+                    PredictedInstance.from_arrays(
+                        points=points,
+                        point_confidences=ref_instance.scores,
+                        instance_score=filled_score,
+                        skeleton=ref_instance.skeleton,
+                        track=shifted.track,
+                    )
+                )
+
+        filled_frames.append(
+            LabeledFrame(video=video, frame_idx=int(frame_ind), instances=instances)
+        )
+
+    return filled_frames
+
+
+def fill_strided_frames(
+    labeled_frames: List[LabeledFrame],
+    frame_inds: Sequence[int],
+    method: Text = "linear",
+    filled_score: float = FILLED_INSTANCE_SCORE,
+    **flow_kwargs,
+) -> List[LabeledFrame]:
+    """Fill the frames that were skipped by frame-stride inference.
+
+    Args:
+        labeled_frames: Predicted frames. These can be from more than one video.
+        frame_inds: Indices of all of the frames that should have predictions in each
+            video, including the predicted ones.
+        method: One of `FILL_METHODS`. `"linear"` and `"spline"` require tracked
+            instances.
+        filled_score: Instance score of the filled instances.
+        **flow_kwargs: Additional arguments to `flow_fill_instances` when `method` is
+            `"flow"`.
+
+    Returns:
+        The predicted and filled frames of each video, sorted by frame index. Every
+        frame in `frame_inds` of each video has a labeled frame, which can be empty.
+    """
+    if method not in FILL_METHODS:
+        raise ValueError(
+            f"Unknown fill method: {method} (must be one of {', '.join(FILL_METHODS)})"
+        )
+
+    frames_by_video = defaultdict(list)
+    for lf in labeled_frames:
+        frames_by_video[lf.video].append(lf)
+
+    all_frames = []
+    for video, video_frames in frames_by_video.items():
+        if method == "flow":
+            filled_frames = flow_fill_instances(
+                video_frames, frame_inds, filled_score=filled_score, **flow_kwargs
+            )
+        else:
+            filled_frames = interpolate_instances(
+                video_frames, frame_inds, method=method, filled_score=filled_score
+            )
+
+        # Frames at the ends that can't be interpolated are added without instances.
+        done = {lf.frame_idx for lf in video_frames + filled_frames}
+        empty_frames = [
+            LabeledFrame(video=video, frame_idx=int(frame_ind))
+            for frame_ind in np.unique(frame_inds)
+            if frame_ind not in done
+        ]
+        all_frames.extend(
+            sorted(
+                video_frames + filled_frames + empty_frames,
+                key=lambda lf: lf.frame_idx,
+            )
+        )
+
+    return all_frames
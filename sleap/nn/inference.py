@@ -33,6 +33,8 @@ import atexit
 import rich.progress
 from collections import deque
 import json
+import queue
+import threading
 from time import time
 from datetime import datetime
 from pathlib import Path
@@ -44,10 +46,24 @@ import tensorflow as tf
 import numpy as np
 
 import sleap
+from sleap.info.write_tracking_h5 import AnalysisH5StreamWriter
+from sleap.io.format.hdf5 import LabelsV1Adaptor, LabelsV1StreamWriter
 from sleap.nn.config import TrainingJobConfig
 from sleap.nn.model import Model
 from sleap.nn.tracking import Tracker
+from sleap.nn.frame_stride import (
+    FILL_METHODS,
+    fill_strided_frames,
+    make_strided_frame_inds,
+)
+from sleap.nn.motion_gating import MotionGate
 from sleap.nn.paf_grouping import PAFScorer
+from sleap.nn.profiling import (
+    get_profiler,
+    graph_stage_end,
+    graph_stage_start,
+    profile_stage,
+)
 from sleap.nn.data.pipelines import (
     Provider,
     Pipeline,
@@ -88,9 +104,245 @@ class RateColumn(rich.progress.ProgressColumn):
         return rich.progress.Text(f"{speed:.1f} FPS", style="progress.data.speed")
 
 
+class PredictionSink(ABC):
+    """Base interface class for destinations that predictions are streamed to.
+
+    Predictors write the labeled frames of each batch to the sink as soon as they are
+    created, so the results of long videos never need to be held in memory at once.
+    Sinks can be used as context managers to close them when inference is done.
+    """
+
+    @abstractmethod
+    def write_frames(self, labeled_frames: List[sleap.LabeledFrame]):
+        """Receive the labeled frames predicted for a batch."""
+        pass
+
+    def flush(self):
+        """Write out any frames that are buffered."""
+        pass
+
+    def close(self):
+        """Flush the remaining frames and finalize the output."""
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+@attr.s(auto_attribs=True)
+class LabelsSink(PredictionSink):
+    """Prediction sink that incrementally writes to a `.slp` file.
+
+    Frames are buffered and appended to the file every `flush_every` batches, so the
+    file contains all but the most recent predictions if inference is interrupted.
+
+    Attributes:
+        filename: Path to the `.slp` file to write. Other extensions of the HDF5
+            labels format (`.h5` or `.hdf5`) are also accepted.
+        flush_every: Number of batches of frames to buffer before writing them.
+        resume: If `True` and the file already exists, new frames are appended to it.
+            Use `get_predicted_frame_inds()` to find the frames that can be skipped.
+            Otherwise, any existing file is overwritten.
+        remove_empty_frames: If `True`, frames without any predicted instances are not
+            written.
+        provenance: Provenance metadata to save with the labels. This can be updated
+            until the sink is closed.
+    """
+
+    filename: Text
+    flush_every: int = 1
+    resume: bool = False
+    remove_empty_frames: bool = False
+    provenance: Dict = attr.ib(factory=dict)
+    writer: LabelsV1StreamWriter = attr.ib(init=False)
+    _buffer: List[sleap.LabeledFrame] = attr.ib(factory=list, init=False)
+    _n_buffered_batches: int = attr.ib(default=0, init=False)
+
+    @writer.default
+    def _init_writer(self):
+        if not LabelsV1Adaptor().does_match_ext(self.filename):
+            raise ValueError(
+                "Predictions can only be streamed to .slp files (or .h5/.hdf5), not: "
+                f"{self.filename}"
+            )
+        return LabelsV1StreamWriter(
+            self.filename, labels=sleap.Labels(), append=self.resume
+        )
+
+    @property
+    def n_frames_written(self) -> int:
+        """Number of labeled frames in the file."""
+        return self.writer.n_frames_written
+
+    def get_predicted_frame_inds(self) -> Dict[Text, np.ndarray]:
+        """Return the frames that are already in the file.
+
+        Returns:
+            A dictionary mapping video filenames to the indices of the frames with
+            predictions in the file.
+        """
+        return {
+            video.filename: frame_inds
+            for video, frame_inds in self.writer.get_written_frame_inds().items()
+        }
+
+    def write_frames(self, labeled_frames: List[sleap.LabeledFrame]):
+        """Buffer the frames of a batch, writing them out every `flush_every` calls."""
+        if self.remove_empty_frames:
+            labeled_frames = [lf for lf in labeled_frames if len(lf.instances) > 0]
+        self._buffer.extend(labeled_frames)
+        self._n_buffered_batches += 1
+        if self._n_buffered_batches >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """Append the buffered frames to the file."""
+        self.writer.write_frames(self._buffer)
+        self._buffer = []
+        self._n_buffered_batches = 0
+
+    def close(self):
+        """Write the remaining frames and the final metadata to the file."""
+        self.flush()
+        self.writer.labels.provenance.update(self.provenance)
+        self.writer.close()
+
+
+@attr.s(auto_attribs=True)
+class AnalysisSink(PredictionSink):
+    """Prediction sink that incrementally writes to an analysis HDF5 file.
+
+    The track occupancy and point location matrices are written in blocks of frames to
+    chunked, resizable datasets, so they never need to be held in memory at once.
+
+    Attributes:
+        filename: Path to the analysis HDF5 file to write.
+        dtype: Data type of the point coordinates, `"float64"` or `"float32"`.
+        block_size: Number of frames to buffer before writing them.
+        compression: HDF5 compression filter of the matrices, or `None` to disable
+            compression.
+        compression_opts: Options of the compression filter.
+    """
+
+    filename: Text
+    dtype: Text = "float64"
+    block_size: int = 1024
+    compression: Optional[Text] = "gzip"
+    compression_opts: Optional[int] = 4
+    writer: AnalysisH5StreamWriter = attr.ib(init=False)
+
+    @writer.default
+    def _init_writer(self):
+        return AnalysisH5StreamWriter(
+            self.filename,
+            dtype=self.dtype,
+            block_size=self.block_size,
+            compression=self.compression,
+            compression_opts=self.compression_opts,
+        )
+
+    def write_frames(self, labeled_frames: List[sleap.LabeledFrame]):
+        """Buffer the frames of a batch, writing them out every `block_size` frames."""
+        self.writer.write_frames(labeled_frames)
+
+    def flush(self):
+        """Write the buffered frames to the file."""
+        self.writer.flush()
+
+    def close(self):
+        """Write the remaining frames and finalize the file."""
+        self.writer.close()
+
+
+@attr.s(auto_attribs=True)
+class MultiSink(PredictionSink):
+    """Prediction sink that passes the frames on to several other sinks.
+
+    Attributes:
+        sinks: The sinks to write to, in order.
+    """
+
+    sinks: List[PredictionSink]
+
+    def write_frames(self, labeled_frames: List[sleap.LabeledFrame]):
+        """Write the frames of a batch to each sink."""
+        for sink in self.sinks:
+            sink.write_frames(labeled_frames)
+
+    def flush(self):
+        """Flush each sink."""
+        for sink in self.sinks:
+            sink.flush()
+
+    def close(self):
+        """Close each sink."""
+        for sink in self.sinks:
+            sink.close()
+
+
+# Names of the stages of the inference loop that are timed.
+INFERENCE_STAGES = ("inference", "postprocessing", "tracking", "writing")
+
+# Marks the end of the batches passed between pipelined inference stages.
+_END_OF_BATCHES = object()
+
+
+def _put_unless_stopped(
+    batches: queue.Queue, item: object, stop: threading.Event
+) -> bool:
+    """Put an item in a bounded queue, giving up if the pipeline is stopped.
+
+    Returns:
+        `True` if the item was put in the queue, `False` if the pipeline was stopped.
+    """
+    while not stop.is_set():
+        try:
+            batches.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _get_unless_stopped(batches: queue.Queue, stop: threading.Event) -> object:
+    """Get an item from a queue, or `_END_OF_BATCHES` if the pipeline is stopped."""
+    while not stop.is_set():
+        try:
+            return batches.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return _END_OF_BATCHES
+
+
 @attr.s(auto_attribs=True)
 class Predictor(ABC):
-    """Base interface class for predictors."""
+    """Base interface class for predictors.
+
+    Attributes:
+        verbosity: Mode of inference progress reporting. One of `"none"`, `"rich"` or
+            `"json"`.
+        report_rate: Number of progress reports per second.
+        model_paths: Paths to the trained models used by the predictor.
+        pipelined: If `True`, the model forward pass, the creation of the predicted
+            instances and the tracking run concurrently in separate threads that are
+            connected by bounded queues, so the model doesn't wait for the
+            post-processing of the previous batch. Results are identical to the
+            sequential mode.
+        max_queued_batches: Maximum number of batches waiting between two stages when
+            `pipelined` is `True`. Larger values smooth out variable stage times at the
+            cost of memory.
+        stage_times: Total time in seconds spent in each stage of the last inference
+            run (see `INFERENCE_STAGES`). This is included in the JSON progress
+            reports. In pipelined mode, stages overlap, so the times can add up to more
+            than the elapsed time.
+        motion_gate: If not `None`, a `MotionGate` that is used to skip frames without
+            motion. Skipped frames are not passed to the model and get copies of the
+            predicted instances of the last processed frame of their video, after
+            tracking. The skipped frames are listed in `MotionGate.skipped_frames`.
+    """
 
     verbosity: str = attr.ib(
         validator=attr.validators.in_(["none", "rich", "json"]),
@@ -99,6 +351,10 @@ class Predictor(ABC):
     )
     report_rate: float = attr.ib(default=2.0, kw_only=True)
     model_paths: List[str] = attr.ib(factory=list, kw_only=True)
+    pipelined: bool = attr.ib(default=False, kw_only=True)
+    max_queued_batches: int = attr.ib(default=2, kw_only=True)
+    stage_times: Dict[Text, float] = attr.ib(factory=dict, init=False, kw_only=True)
+    motion_gate: Optional[MotionGate] = attr.ib(default=None, kw_only=True)
 
     @property
     def report_period(self) -> float:
@@ -113,6 +369,7 @@ class Predictor(ABC):
         integral_refinement: bool = True,
         integral_patch_size: int = 5,
         batch_size: int = 4,
+        instance_batch_size: Optional[int] = None,
     ) -> "Predictor":
         """Create the appropriate `Predictor` subclass from a list of model paths.
 
@@ -128,6 +385,9 @@ class Predictor(ABC):
             batch_size: The default batch size to use when loading data for inference.
                 Higher values increase inference speed at the cost of higher memory
                 usage.
+            instance_batch_size: Number of instance crops per micro-batch of the
+                centered instance model of top-down models. If `None`, all crops of a
+                batch are predicted at once. No effect for other model types.
 
         Returns:
             A subclass of `Predictor`.
@@ -168,6 +428,7 @@ class Predictor(ABC):
                 peak_threshold=peak_threshold,
                 integral_refinement=integral_refinement,
                 integral_patch_size=integral_patch_size,
+                instance_batch_size=instance_batch_size,
             )
 
         elif "multi_instance" in model_types:
@@ -223,6 +484,46 @@ class Predictor(ABC):
     def _initialize_inference_model(self):
         pass
 
+    def _reset_stage_times(self):
+        """Reset the stage timers for a new inference run."""
+        # All stages are added up front so the dictionary never changes size while it
+        # is read by other threads.
+        self.stage_times = {stage: 0.0 for stage in INFERENCE_STAGES}
+
+    def _add_stage_time(self, stage: Text, elapsed: float):
+        """Add time spent in an inference stage."""
+        self.stage_times[stage] = self.stage_times.get(stage, 0.0) + elapsed
+
+    def _apply_motion_gate(
+        self, ex: Dict[str, Union[tf.Tensor, tf.RaggedTensor]]
+    ) -> Dict[str, Union[tf.Tensor, tf.RaggedTensor, np.ndarray]]:
+        """Remove the frames of a batch that are skipped by the motion gate.
+
+        Args:
+            ex: A batch of examples from the data pipeline.
+
+        Returns:
+            The batch with only the frames that should be passed to the model. The
+            indices of all frames of the original batch are added in the keys
+            `"batch_video_ind"` and `"batch_frame_ind"`, and whether each of them was
+            kept in the key `"motion_active"`.
+        """
+        video_inds = np.asarray(ex["video_ind"]).flatten()
+        frame_inds = np.asarray(ex["frame_ind"]).flatten()
+        with profile_stage("motion_gating"):
+            active = self.motion_gate.update(
+                np.asarray(ex["image"]), video_inds, frame_inds
+            )
+
+        if not active.all():
+            active_inds = np.flatnonzero(active)
+            ex = {key: tf.gather(val, active_inds) for key, val in ex.items()}
+
+        ex["batch_video_ind"] = video_inds
+        ex["batch_frame_ind"] = frame_inds
+        ex["motion_active"] = active
+        return ex
+
     def _predict_generator(
         self, data_provider: Provider
     ) -> Iterator[Dict[str, np.ndarray]]:
@@ -247,13 +548,24 @@ class Predictor(ABC):
 
         # Update the data provider source.
         self.pipeline.providers = [data_provider]
+        self._reset_stage_times()
+        if self.motion_gate is not None:
+            self.motion_gate.reset()
+        self._last_predicted_frames = {}
 
         def process_batch(ex):
-            # Run inference on current batch.
-            preds = self.inference_model.predict_on_batch(ex)
+            t0 = time()
+
+            # Skip frames without motion.
+            if self.motion_gate is not None:
+                ex = self._apply_motion_gate(ex)
 
-            # Add model outputs to the input data example.
-            ex.update(preds)
+            # Run inference on current batch unless all of its frames were skipped.
+            if len(ex["frame_ind"]) > 0:
+                preds = self.inference_model.predict_on_batch(ex)
+
+                # Add model outputs to the input data example.
+                ex.update(preds)
 
             # Convert to numpy arrays if not already.
             if isinstance(ex["video_ind"], tf.Tensor):
@@ -261,6 +573,14 @@ class Predictor(ABC):
             if isinstance(ex["frame_ind"], tf.Tensor):
                 ex["frame_ind"] = ex["frame_ind"].numpy().flatten()
 
+            if self.pipelined:
+                # Convert everything in this thread so that the later stages don't
+                # have to wait for the device.
+                for key, val in ex.items():
+                    if isinstance(val, tf.Tensor):
+                        ex[key] = val.numpy()
+
+            self._add_stage_time("inference", time() - t0)
             return ex
 
         # Loop over data batches with optional progress reporting.
@@ -280,7 +600,9 @@ class Predictor(ABC):
                 last_report = time()
                 for ex in self.pipeline.make_dataset():
                     ex = process_batch(ex)
-                    progress.update(task, advance=len(ex["frame_ind"]))
+                    progress.update(
+                        task, advance=len(ex.get("batch_frame_ind", ex["frame_ind"]))
+                    )
 
                     # Handle refreshing manually to support notebooks.
                     elapsed_since_last_report = time() - last_report
@@ -305,7 +627,7 @@ class Predictor(ABC):
                 # Track timing and progress.
                 elapsed_batch = time() - t0_batch
                 t0_batch = time()
-                n_batch = len(ex["frame_ind"])
+                n_batch = len(ex.get("batch_frame_ind", ex["frame_ind"]))
                 n_processed += n_batch
                 elapsed_all = time() - t0_all
 
@@ -326,6 +648,7 @@ class Predictor(ABC):
                                 "elapsed": elapsed_all,
                                 "rate": rate,
                                 "eta": eta,
+                                "stage_times": dict(self.stage_times),
                             }
                         ),
                         flush=True,
@@ -338,9 +661,286 @@ class Predictor(ABC):
             for ex in self.pipeline.make_dataset():
                 yield process_batch(ex)
 
+    def _make_labeled_frames_from_batch(
+        self, ex: Dict[str, np.ndarray], data_provider: Provider
+    ) -> List[sleap.LabeledFrame]:
+        """Create labeled frames from a batch of inference results.
+
+        This is implemented by the subclasses which produce instances. The instances
+        are not assigned to tracks yet.
+
+        Args:
+            ex: A dictionary with the inference results of a batch, as yielded by the
+                `_predict_generator()` method.
+            data_provider: The `sleap.pipelines.Provider` that the predictions are being
+                created from.
+
+        Returns:
+            A list of `sleap.LabeledFrame`s with the predicted instances of the batch.
+        """
+        raise NotImplementedError(
+            f"{type(self).__name__} does not create labeled frames."
+        )
+
+    def _make_batch_labeled_frames(
+        self, ex: Dict[str, np.ndarray], data_provider: Provider
+    ) -> List[sleap.LabeledFrame]:
+        """Create the labeled frames of a batch and time the post-processing stage.
+
+        Args:
+            ex: A dictionary with the inference results of a batch.
+            data_provider: The `sleap.pipelines.Provider` that the predictions are being
+                created from.
+
+        Returns:
+            The labeled frames from `_make_labeled_frames_from_batch()`, or an empty
+            list if all frames of the batch were skipped by the motion gate.
+        """
+        t0 = time()
+        if len(ex["frame_ind"]) > 0:
+            predicted_frames = self._make_labeled_frames_from_batch(ex, data_provider)
+        else:
+            predicted_frames = []
+        self._add_stage_time("postprocessing", time() - t0)
+        return predicted_frames
+
+    def _carry_forward_skipped_frames(
+        self,
+        labeled_frames: List[sleap.LabeledFrame],
+        ex: Dict[str, np.ndarray],
+        data_provider: Provider,
+    ) -> List[sleap.LabeledFrame]:
+        """Add the frames of a batch that were skipped by the motion gate.
+
+        Skipped frames get copies of the instances of the last processed frame of the
+        same video, including their tracks. This must be called after tracking and in
+        the order of the batches.
+
+        Args:
+            labeled_frames: The labeled frames of the processed frames of the batch.
+            ex: The dictionary with the inference results of the batch.
+            data_provider: The `sleap.pipelines.Provider` that the predictions are being
+                created from.
+
+        Returns:
+            The labeled frames of all frames of the original batch in order.
+        """
+        if "motion_active" not in ex:
+            return labeled_frames
+
+        processed_frames = iter(labeled_frames)
+        all_frames = []
+        for video_ind, frame_ind, active in zip(
+            ex["batch_video_ind"], ex["batch_frame_ind"], ex["motion_active"]
+        ):
+            if active:
+                labeled_frame = next(processed_frames)
+                self._last_predicted_frames[video_ind] = labeled_frame
+            else:
+                last_frame = self._last_predicted_frames.get(video_ind, None)
+                instances = []
+                if last_frame is not None:
+                    for instance in last_frame.instances:
+                        carried_instance = sleap.PredictedInstance.from_arrays(
+                            points=instance.numpy(),
+                            point_confidences=instance.scores,
+                            instance_score=instance.score,
+                            skeleton=instance.skeleton,
+                            track=instance.track,
+                        )
+                        carried_instance.tracking_score = instance.tracking_score
+                        instances.append(carried_instance)
+                labeled_frame = sleap.LabeledFrame(
+                    video=data_provider.videos[video_ind],
+                    frame_idx=frame_ind,
+                    instances=instances,
+                )
+            all_frames.append(labeled_frame)
+        return all_frames
+
+    def _track_labeled_frames(
+        self, labeled_frames: List[sleap.LabeledFrame], ex: Dict[str, np.ndarray]
+    ):
+        """Assign the instances of a batch to tracks if the predictor has a tracker.
+
+        Args:
+            labeled_frames: The labeled frames of the batch from
+                `_make_labeled_frames_from_batch()`. Their instances are replaced by the
+                tracked instances.
+            ex: The dictionary with the inference results of the batch. This must
+                contain the `"image"` and `"frame_ind"` of each frame.
+        """
+        tracker = getattr(self, "tracker", None)
+        if not tracker:
+            return
+
+        t0 = time()
+        for labeled_frame, image, frame_ind in zip(
+            labeled_frames, ex["image"], ex["frame_ind"]
+        ):
+            # Set tracks for predicted instances in this frame.
+            with profile_stage("tracking"):
+                labeled_frame.instances = tracker.track(
+                    untracked_instances=labeled_frame.instances, img=image, t=frame_ind
+                )
+        self._add_stage_time("tracking", time() - t0)
+
+    def _iter_labeled_frames_from_generator(
+        self, generator: Iterator[Dict[str, np.ndarray]], data_provider: Provider
+    ) -> Iterator[List[sleap.LabeledFrame]]:
+        """Create labeled frames for each batch of inference results.
+
+        This converts the arrays of each batch into SLEAP-specific data structures and
+        runs them through the tracker if there is one. If `pipelined` is `True`, this is
+        done by `_iter_labeled_frames_pipelined()`.
+
+        Args:
+            generator: A generator that returns dictionaries with inference results.
+                This can be created using the `_predict_generator()` method.
+            data_provider: The `sleap.pipelines.Provider` that the predictions are being
+                created from.
+
+        Yields:
+            A list of `sleap.LabeledFrame`s for each batch of results.
+        """
+        if self.pipelined:
+            yield from self._iter_labeled_frames_pipelined(generator, data_provider)
+            return
+
+        for ex in generator:
+            predicted_frames = self._make_batch_labeled_frames(ex, data_provider)
+            self._track_labeled_frames(predicted_frames, ex)
+            yield self._carry_forward_skipped_frames(
+                predicted_frames, ex, data_provider
+            )
+
+    def _iter_labeled_frames_pipelined(
+        self, generator: Iterator[Dict[str, np.ndarray]], data_provider: Provider
+    ) -> Iterator[List[sleap.LabeledFrame]]:
+        """Create labeled frames for each batch of inference results in a pipeline.
+
+        The batches go through three stages which run concurrently:
+
+            1. The model forward pass, in a worker thread that consumes `generator`.
+
+            2. The creation of the predicted instances and labeled frames, in a second
+            worker thread.
+
+            3. The tracking, in the calling thread. Whatever the caller does with the
+            yielded frames (e.g., writing them to a file) is also part of this stage.
+
+        Stages are connected by queues of at most `max_queued_batches` batches, so the
+        model can run ahead of the post-processing by a few batches. Tracking stays in
+        the calling thread since it has to see the frames in order.
+
+        Args:
+            generator: A generator that returns dictionaries with inference results.
+                This can be created using the `_predict_generator()` method.
+            data_provider: The `sleap.pipelines.Provider` that the predictions are being
+                created from.
+
+        Yields:
+            A list of `sleap.LabeledFrame`s for each batch of results, in order.
+
+        Raises:
+            Any exception raised in one of the worker threads is raised again here.
+        """
+        stop = threading.Event()
+        predicted_batches = queue.Queue(maxsize=self.max_queued_batches)
+        labeled_batches = queue.Queue(maxsize=self.max_queued_batches)
+
+        def predict_batches():
+            try:
+                for ex in generator:
+                    if not _put_unless_stopped(predicted_batches, ex, stop):
+                        break
+                else:
+                    _put_unless_stopped(predicted_batches, _END_OF_BATCHES, stop)
+            except BaseException as e:
+                _put_unless_stopped(predicted_batches, e, stop)
+            finally:
+                # Close the generator in this thread since it is running here.
+                if hasattr(generator, "close"):
+                    generator.close()
+
+        def make_labeled_frames():
+            try:
+                while True:
+                    ex = _get_unless_stopped(predicted_batches, stop)
+                    if ex is _END_OF_BATCHES or isinstance(ex, BaseException):
+                        _put_unless_stopped(labeled_batches, ex, stop)
+                        break
+                    predicted_frames = self._make_batch_labeled_frames(
+                        ex, data_provider
+                    )
+                    if not _put_unless_stopped(
+                        labeled_batches, (ex, predicted_frames), stop
+                    ):
+                        break
+            except BaseException as e:
+                _put_unless_stopped(labeled_batches, e, stop)
+
+        workers = [
+            threading.Thread(target=predict_batches, daemon=True),
+            threading.Thread(target=make_labeled_frames, daemon=True),
+        ]
+        for worker in workers:
+            worker.start()
+
+        try:
+            while True:
+                batch = labeled_batches.get()
+                if batch is _END_OF_BATCHES:
+                    break
+                if isinstance(batch, BaseException):
+                    raise batch
+                ex, predicted_frames = batch
+                self._track_labeled_frames(predicted_frames, ex)
+                yield self._carry_forward_skipped_frames(
+                    predicted_frames, ex, data_provider
+                )
+
+        finally:
+            stop.set()
+            for worker in workers:
+                worker.join()
+
+    def _make_labeled_frames_from_generator(
+        self, generator: Iterator[Dict[str, np.ndarray]], data_provider: Provider
+    ) -> List[sleap.LabeledFrame]:
+        """Create labeled frames from a generator that yields inference results.
+
+        This collects the frames of all batches and then runs the final pass of the
+        tracker if one is specified.
+
+        Args:
+            generator: A generator that returns dictionaries with inference results.
+                This can be created using the `_predict_generator()` method.
+            data_provider: The `sleap.pipelines.Provider` that the predictions are being
+                created from.
+
+        Returns:
+            A list of `sleap.LabeledFrame`s with `sleap.PredictedInstance`s created from
+            arrays returned from the inference result generator.
+        """
+        predicted_frames = []
+        for batch_frames in self._iter_labeled_frames_from_generator(
+            generator, data_provider
+        ):
+            predicted_frames.extend(batch_frames)
+
+        tracker = getattr(self, "tracker", None)
+        if tracker:
+            tracker.final_pass(predicted_frames)
+
+        return predicted_frames
+
     def predict(
-        self, data: Union[Provider, sleap.Labels, sleap.Video], make_labels: bool = True
-    ) -> Union[List[Dict[str, np.ndarray]], sleap.Labels]:
+        self,
+        data: Union[Provider, sleap.Labels, sleap.Video],
+        make_labels: bool = True,
+        sink: Optional["PredictionSink"] = None,
+    ) -> Union[List[Dict[str, np.ndarray]], sleap.Labels, None]:
         """Run inference on a data source.
 
         Args:
@@ -349,11 +949,16 @@ class Predictor(ABC):
             make_labels: If `True` (the default), returns a `sleap.Labels` instance with
                 `sleap.PredictedInstance`s. If `False`, just return a list of
                 dictionaries containing the raw arrays returned by the inference model.
+            sink: If not `None`, a `PredictionSink` that the labeled frames of each
+                batch are written to as soon as they are created, instead of collecting
+                all of them in memory. The sink is not closed after inference. The
+                final pass of the tracker (e.g., track cleaning) is not run in this
+                case since it requires all of the frames.
 
         Returns:
             A `sleap.Labels` with `sleap.PredictedInstance`s if `make_labels` is `True`,
             otherwise a list of dictionaries containing batches of numpy arrays with the
-            raw results.
+            raw results. If a `sink` is specified, `None` is returned.
         """
         # Create provider if necessary.
         if isinstance(data, np.ndarray):
@@ -366,7 +971,26 @@ class Predictor(ABC):
         # Initialize inference loop generator.
         generator = self._predict_generator(data)
 
-        if make_labels:
+        if sink is not None:
+            tracker = getattr(self, "tracker", None)
+            if tracker is not None and tracker.has_final_pass:
+                logger.warning(
+                    "The final tracking pass is not run when streaming predictions."
+                )
+
+            # Write SLEAP data structures to the sink while consuming results.
+            for batch_frames in self._iter_labeled_frames_from_generator(
+                generator, data
+            ):
+                t0 = time()
+                with profile_stage("serialization"):
+                    sink.write_frames(batch_frames)
+                self._add_stage_time("writing", time() - t0)
+            with profile_stage("serialization"):
+                sink.flush()
+            return None
+
+        elif make_labels:
             # Create SLEAP data structures while consuming results.
             return sleap.Labels(
                 self._make_labeled_frames_from_generator(generator, data)
@@ -713,6 +1337,8 @@ class InferenceLayer(tf.keras.layers.Layer):
             always be a `tf.float32`, which will be adjusted to the range `[0, 1]` if it
             was previously an integer.
         """
+        start, imgs = graph_stage_start(imgs)
+
         if self.ensure_grayscale:
             imgs = sleap.nn.data.normalization.ensure_grayscale(imgs)
         else:
@@ -726,7 +1352,20 @@ class InferenceLayer(tf.keras.layers.Layer):
         if self.pad_to_stride > 1:
             imgs = sleap.nn.data.resizing.pad_to_stride(imgs, self.pad_to_stride)
 
-        return imgs
+        return graph_stage_end("preprocess", start, imgs)
+
+    def call_keras_model(self, imgs: tf.Tensor) -> Union[tf.Tensor, List[tf.Tensor]]:
+        """Call the Keras model on a batch of preprocessed images.
+
+        Args:
+            imgs: A batch of images as returned by `preprocess`.
+
+        Returns:
+            The output of the Keras model.
+        """
+        start, imgs = graph_stage_start(imgs)
+        preds = self.keras_model(imgs)
+        return graph_stage_end("forward_pass", start, preds)
 
     def call(self, data: tf.Tensor) -> tf.Tensor:
         """Call the model with preprocessed data.
@@ -737,7 +1376,7 @@ class InferenceLayer(tf.keras.layers.Layer):
         Returns:
             Output of the model after being called with preprocessing.
         """
-        return self.keras_model(self.preprocess(data))
+        return self.call_keras_model(self.preprocess(data))
 
 
 class InferenceModel(tf.keras.Model):
@@ -976,7 +1615,7 @@ class SingleInstanceInferenceLayer(InferenceLayer):
         else:
             imgs = data
         imgs = self.preprocess(imgs)
-        preds = self.keras_model(imgs)
+        preds = self.call_keras_model(imgs)
         offsets = None
         if isinstance(preds, list):
             cms = preds[self.confmaps_ind]
@@ -1145,53 +1784,46 @@ class SingleInstancePredictor(Predictor):
         obj._initialize_inference_model()
         return obj
 
-    def _make_labeled_frames_from_generator(
-        self, generator: Iterator[Dict[str, np.ndarray]], data_provider: Provider
+    def _make_labeled_frames_from_batch(
+        self, ex: Dict[str, np.ndarray], data_provider: Provider
     ) -> List[sleap.LabeledFrame]:
-        """Create labeled frames from a generator that yields inference results.
+        """Create labeled frames from a batch of inference results.
 
         This method converts pure arrays into SLEAP-specific data structures.
 
         Args:
-            generator: A generator that returns dictionaries with inference results.
-                This should return dictionaries with keys `"video_ind"`, `"frame_ind"`,
-                `"peaks"`, and `"peak_vals"`. This can be created using the
-                `_predict_generator()` method.
+            ex: A dictionary with the inference results of a batch with keys
+                `"video_ind"`, `"frame_ind"`, `"peaks"`, and `"peak_vals"`. This is
+                yielded by the `_predict_generator()` method.
             data_provider: The `sleap.pipelines.Provider` that the predictions are being
                 created from. This is used to retrieve the `sleap.Video` instance
                 associated with each inference result.
 
         Returns:
             A list of `sleap.LabeledFrame`s with `sleap.PredictedInstance`s created from
-            arrays returned from the inference result generator.
+            the arrays of the batch.
         """
         skeleton = self.confmap_config.data.labels.skeletons[0]
-
-        # Loop over batches.
         predicted_frames = []
-        for ex in generator:
 
-            # Loop over frames.
-            for video_ind, frame_ind, points, confidences in zip(
-                ex["video_ind"], ex["frame_ind"], ex["peaks"], ex["peak_vals"]
-            ):
-                # Loop over instances.
-                predicted_instances = [
-                    sleap.instance.PredictedInstance.from_arrays(
-                        points=points,
-                        point_confidences=confidences,
-                        instance_score=np.nansum(confidences),
-                        skeleton=skeleton,
-                    )
-                ]
+        # Loop over frames.
+        for video_ind, frame_ind, points, confidences in zip(
+            ex["video_ind"], ex["frame_ind"], ex["peaks"], ex["peak_vals"]
+        ):
+            predicted_instances = sleap.instance.PredictedInstance.from_arrays_batch(
+                points=points[None],
+                point_confidences=confidences[None],
+                instance_scores=[np.nansum(confidences)],
+                skeleton=skeleton,
+            )
 
-                predicted_frames.append(
-                    sleap.LabeledFrame(
-                        video=data_provider.videos[video_ind],
-                        frame_idx=frame_ind,
-                        instances=predicted_instances,
-                    )
+            predicted_frames.append(
+                sleap.LabeledFrame(
+                    video=data_provider.videos[video_ind],
+                    frame_idx=frame_ind,
+                    instances=predicted_instances,
                 )
+            )
 
         return predicted_frames
 
@@ -1330,7 +1962,7 @@ class CentroidCrop(InferenceLayer):
         imgs = self.preprocess(imgs)
 
         # Predict confidence maps.
-        out = self.keras_model(imgs)
+        out = self.call_keras_model(imgs)
         offsets = None
         if isinstance(out, list):
             cms = out[self.confmaps_ind]
@@ -1465,6 +2097,13 @@ class FindInstancePeaks(InferenceLayer):
             automatically by searching for the first tensor that contains
             `"OffsetRefinementHead"` in its name. If the head is not present, the method
             specified in the `refinement` attribute will be used.
+        instance_batch_size: If not `None`, the crops of all samples in the batch are
+            passed to the model in micro-batches of exactly this many crops, with the
+            last micro-batch padded with empty crops. This keeps the input shape of the
+            model fixed regardless of the number of detected instances, which makes
+            the throughput stable on videos with varying numbers of animals and bounds
+            the memory used by the model. If `None` (the default), all crops are passed
+            to the model at once.
     """
 
     def __init__(
@@ -1478,11 +2117,17 @@ class FindInstancePeaks(InferenceLayer):
         return_confmaps: bool = False,
         confmaps_ind: Optional[int] = None,
         offsets_ind: Optional[int] = None,
+        instance_batch_size: Optional[int] = None,
         **kwargs,
     ):
         super().__init__(
             keras_model=keras_model, input_scale=input_scale, pad_to_stride=1, **kwargs
         )
+        if instance_batch_size is not None and instance_batch_size < 1:
+            raise ValueError(
+                f"Instance batch size must be at least 1 (got {instance_batch_size})."
+            )
+        self.instance_batch_size = instance_batch_size
         self.peak_threshold = peak_threshold
         self.refinement = refinement
         self.integral_patch_size = integral_patch_size
@@ -1511,6 +2156,52 @@ class FindInstancePeaks(InferenceLayer):
             )
         self.output_stride = output_stride
 
+    def predict_micro_batches(
+        self, crops: tf.Tensor
+    ) -> Union[tf.Tensor, List[tf.Tensor]]:
+        """Preprocess crops and call the model on fixed-size micro-batches of them.
+
+        Args:
+            crops: Instance-centered images as a `tf.Tensor` of shape
+                `(n_crops, height, width, channels)`.
+
+        Returns:
+            The output of the model for each crop, concatenated over the micro-batches.
+            The padding crops of the last micro-batch are removed.
+        """
+        batch_size = self.instance_batch_size
+        n_crops = tf.shape(crops)[0]
+
+        # Pad the crops to whole micro-batches. At least one micro-batch is run so that
+        # the output shapes are defined when there are no crops.
+        n_batches = tf.maximum((n_crops + batch_size - 1) // batch_size, 1)
+        n_padding = n_batches * batch_size - n_crops
+        crops = tf.pad(crops, [[0, n_padding], [0, 0], [0, 0], [0, 0]])
+        micro_batches = tf.reshape(
+            crops, tf.concat([[n_batches, batch_size], tf.shape(crops)[1:]], axis=0)
+        )
+        micro_batches.set_shape(
+            tf.TensorShape([None, batch_size]).concatenate(crops.shape[1:])
+        )
+
+        def predict_micro_batch(micro_batch):
+            return self.call_keras_model(self.preprocess(micro_batch))
+
+        output_dtypes = [output.dtype for output in self.keras_model.outputs]
+        if len(output_dtypes) == 1:
+            output_dtypes = output_dtypes[0]
+        out = tf.map_fn(
+            predict_micro_batch, micro_batches, fn_output_signature=output_dtypes
+        )
+
+        def merge_micro_batches(x):
+            # (n_batches, batch_size, ...) -> (n_crops, ...)
+            merged = tf.reshape(x, tf.concat([[-1], tf.shape(x)[2:]], axis=0))
+            merged.set_shape(tf.TensorShape([None]).concatenate(x.shape[2:]))
+            return merged[:n_crops]
+
+        return tf.nest.map_structure(merge_micro_batches, out)
+
     def call(
         self, inputs: Union[Dict[str, tf.Tensor], tf.Tensor]
     ) -> Dict[str, tf.Tensor]:
@@ -1579,11 +2270,15 @@ class FindInstancePeaks(InferenceLayer):
                 samples = tf.shape(crops)[0]
                 crop_sample_inds = tf.range(samples, dtype=tf.int32)
 
-        # Preprocess inputs (scaling, padding, colorspace, int to float).
-        crops = self.preprocess(crops)
+        if self.instance_batch_size is None:
+            # Preprocess inputs (scaling, padding, colorspace, int to float).
+            crops = self.preprocess(crops)
 
-        # Network forward pass.
-        out = self.keras_model(crops)
+            # Network forward pass.
+            out = self.call_keras_model(crops)
+        else:
+            # Preprocess and run the network on fixed-size micro-batches of crops.
+            out = self.predict_micro_batches(crops)
 
         # Sort outputs.
         offsets = None
@@ -1753,6 +2448,9 @@ class TopDownPredictor(Predictor):
             head.
         integral_patch_size: Size of patches to crop around each rough peak for integral
             refinement as an integer scalar.
+        instance_batch_size: If not `None`, the instance crops of each batch are passed
+            to the centered instance model in micro-batches of this many crops. See
+            `FindInstancePeaks.instance_batch_size`.
     """
 
     centroid_config: Optional[TrainingJobConfig] = attr.ib(default=None)
@@ -1766,6 +2464,7 @@ class TopDownPredictor(Predictor):
     peak_threshold: float = 0.2
     integral_refinement: bool = True
     integral_patch_size: int = 5
+    instance_batch_size: Optional[int] = None
 
     def _initialize_inference_model(self):
         """Initialize the inference model from the trained models and configuration."""
@@ -1805,6 +2504,7 @@ class TopDownPredictor(Predictor):
                 refinement="integral" if self.integral_refinement else "local",
                 integral_patch_size=self.integral_patch_size,
                 return_confmaps=False,
+                instance_batch_size=self.instance_batch_size,
             )
 
         self.inference_model = TopDownInferenceModel(
@@ -1820,6 +2520,7 @@ class TopDownPredictor(Predictor):
         peak_threshold: float = 0.2,
         integral_refinement: bool = True,
         integral_patch_size: int = 5,
+        instance_batch_size: Optional[int] = None,
     ) -> "TopDownPredictor":
         """Create predictor from saved models.
 
@@ -1841,6 +2542,9 @@ class TopDownPredictor(Predictor):
                 offset regression head.
             integral_patch_size: Size of patches to crop around each rough peak for
                 integral refinement as an integer scalar.
+            instance_batch_size: Number of instance crops per micro-batch of the
+                centered instance model. If `None`, all crops of a batch are predicted
+                at once.
 
         Returns:
             An instance of `TopDownPredictor` with the loaded models.
@@ -1886,6 +2590,7 @@ class TopDownPredictor(Predictor):
             peak_threshold=peak_threshold,
             integral_refinement=integral_refinement,
             integral_patch_size=integral_patch_size,
+            instance_batch_size=instance_batch_size,
         )
         obj._initialize_inference_model()
         return obj
@@ -1926,89 +2631,70 @@ class TopDownPredictor(Predictor):
 
         return pipeline
 
-    def _make_labeled_frames_from_generator(
-        self, generator: Iterator[Dict[str, np.ndarray]], data_provider: Provider
+    def _make_labeled_frames_from_batch(
+        self, ex: Dict[str, np.ndarray], data_provider: Provider
     ) -> List[sleap.LabeledFrame]:
-        """Create labeled frames from a generator that yields inference results.
+        """Create labeled frames from a batch of inference results.
 
-        This method converts pure arrays into SLEAP-specific data structures and runs
-        them through the tracker if it is specified.
+        This method converts pure arrays into SLEAP-specific data structures. Tracking
+        is done separately (see `Predictor._track_labeled_frames()`).
 
         Args:
-            generator: A generator that returns dictionaries with inference results.
-                This should return dictionaries with keys `"image"`, `"video_ind"`,
-                `"frame_ind"`, `"instance_peaks"`, `"instance_peak_vals"`, and
-                `"centroid_vals"`. This can be created using the `_predict_generator()`
-                method.
+            ex: A dictionary with the inference results of a batch with keys
+                `"video_ind"`, `"frame_ind"`, `"instance_peaks"`,
+                `"instance_peak_vals"`, and `"centroid_vals"`. This is yielded by the
+                `_predict_generator()` method.
             data_provider: The `sleap.pipelines.Provider` that the predictions are being
                 created from. This is used to retrieve the `sleap.Video` instance
                 associated with each inference result.
 
         Returns:
             A list of `sleap.LabeledFrame`s with `sleap.PredictedInstance`s created from
-            arrays returned from the inference result generator.
+            the arrays of the batch.
         """
         if self.confmap_config is not None:
             skeleton = self.confmap_config.data.labels.skeletons[0]
         else:
             skeleton = self.centroid_config.data.labels.skeletons[0]
 
-        # Loop over batches.
         predicted_frames = []
-        for ex in generator:
 
-            if "n_valid" in ex:
-                ex["instance_peaks"] = [
-                    x[:n] for x, n in zip(ex["instance_peaks"], ex["n_valid"])
-                ]
-                ex["instance_peak_vals"] = [
-                    x[:n] for x, n in zip(ex["instance_peak_vals"], ex["n_valid"])
-                ]
-                ex["centroids"] = [
-                    x[:n] for x, n in zip(ex["centroids"], ex["n_valid"])
-                ]
-                ex["centroid_vals"] = [
-                    x[:n] for x, n in zip(ex["centroid_vals"], ex["n_valid"])
-                ]
-
-            # Loop over frames.
-            for image, video_ind, frame_ind, points, confidences, scores in zip(
-                ex["image"],
-                ex["video_ind"],
-                ex["frame_ind"],
-                ex["instance_peaks"],
-                ex["instance_peak_vals"],
-                ex["centroid_vals"],
-            ):
-
-                # Loop over instances.
-                predicted_instances = []
-                for pts, confs, score in zip(points, confidences, scores):
-                    predicted_instances.append(
-                        sleap.instance.PredictedInstance.from_arrays(
-                            points=pts,
-                            point_confidences=confs,
-                            instance_score=score,
-                            skeleton=skeleton,
-                        )
-                    )
-
-                if self.tracker:
-                    # Set tracks for predicted instances in this frame.
-                    predicted_instances = self.tracker.track(
-                        untracked_instances=predicted_instances, img=image, t=frame_ind
-                    )
+        if "n_valid" in ex:
+            ex["instance_peaks"] = [
+                x[:n] for x, n in zip(ex["instance_peaks"], ex["n_valid"])
+            ]
+            ex["instance_peak_vals"] = [
+                x[:n] for x, n in zip(ex["instance_peak_vals"], ex["n_valid"])
+            ]
+            ex["centroids"] = [x[:n] for x, n in zip(ex["centroids"], ex["n_valid"])]
+            ex["centroid_vals"] = [
+                x[:n] for x, n in zip(ex["centroid_vals"], ex["n_valid"])
+            ]
+
+        # Loop over frames.
+        for video_ind, frame_ind, points, confidences, scores in zip(
+            ex["video_ind"],
+            ex["frame_ind"],
+            ex["instance_peaks"],
+            ex["instance_peak_vals"],
+            ex["centroid_vals"],
+        ):
+
+            # Create all instances in the frame at once.
+            predicted_instances = sleap.instance.PredictedInstance.from_arrays_batch(
+                points=points,
+                point_confidences=confidences,
+                instance_scores=scores,
+                skeleton=skeleton,
+            )
 
-                predicted_frames.append(
-                    sleap.LabeledFrame(
-                        video=data_provider.videos[video_ind],
-                        frame_idx=frame_ind,
-                        instances=predicted_instances,
-                    )
+            predicted_frames.append(
+                sleap.LabeledFrame(
+                    video=data_provider.videos[video_ind],
+                    frame_idx=frame_ind,
+                    instances=predicted_instances,
                 )
-
-        if self.tracker:
-            self.tracker.final_pass(predicted_frames)
+            )
 
         return predicted_frames
 
@@ -2145,7 +2831,7 @@ class BottomUpInferenceLayer(InferenceLayer):
         imgs = self.preprocess(imgs)
 
         # Model forward pass.
-        preds = self.keras_model(imgs)
+        preds = self.call_keras_model(imgs)
         if self.offsets_ind is None:
             cms = preds[self.confmaps_ind]
             pafs = preds[self.pafs_ind]
@@ -2236,11 +2922,18 @@ class BottomUpInferenceLayer(InferenceLayer):
         """
         cms, pafs, offsets = self.forward_pass(data)
         peaks, peak_vals, peak_channel_inds = self.find_peaks(cms, offsets)
+        start, (pafs, peaks, peak_vals, peak_channel_inds) = graph_stage_start(
+            (pafs, peaks, peak_vals, peak_channel_inds)
+        )
         (
             predicted_instances,
             predicted_peak_scores,
             predicted_instance_scores,
-        ) = self.paf_scorer.predict(pafs, peaks, peak_vals, peak_channel_inds)
+        ) = graph_stage_end(
+            "paf_scoring",
+            start,
+            self.paf_scorer.predict(pafs, peaks, peak_vals, peak_channel_inds),
+        )
 
         # Adjust for input scaling.
         if self.input_scale != 1.0:
@@ -2429,19 +3122,18 @@ class BottomUpPredictor(Predictor):
         obj._initialize_inference_model()
         return obj
 
-    def _make_labeled_frames_from_generator(
-        self, generator: Iterator[Dict[str, np.ndarray]], data_provider: Provider
+    def _make_labeled_frames_from_batch(
+        self, ex: Dict[str, np.ndarray], data_provider: Provider
     ) -> List[sleap.LabeledFrame]:
-        """Create labeled frames from a generator that yields inference results.
+        """Create labeled frames from a batch of inference results.
 
-        This method converts pure arrays into SLEAP-specific data structures and runs
-        them through the tracker if it is specified.
+        This method converts pure arrays into SLEAP-specific data structures. Tracking
+        is done separately (see `Predictor._track_labeled_frames()`).
 
         Args:
-            generator: A generator that returns dictionaries with inference results.
-                This should return dictionaries with keys `"image"`, `"video_ind"`,
-                `"frame_ind"`, `"instance_peaks"`, `"instance_peak_vals"`, and
-                `"instance_scores"`. This can be created using the
+            ex: A dictionary with the inference results of a batch with keys
+                `"video_ind"`, `"frame_ind"`, `"instance_peaks"`,
+                `"instance_peak_vals"`, and `"instance_scores"`. This is yielded by the
                 `_predict_generator()` method.
             data_provider: The `sleap.pipelines.Provider` that the predictions are being
                 created from. This is used to retrieve the `sleap.Video` instance
@@ -2449,64 +3141,47 @@ class BottomUpPredictor(Predictor):
 
         Returns:
             A list of `sleap.LabeledFrame`s with `sleap.PredictedInstance`s created from
-            arrays returned from the inference result generator.
+            the arrays of the batch.
         """
         skeleton = self.bottomup_config.data.labels.skeletons[0]
-
-        # Loop over batches.
         predicted_frames = []
-        for ex in generator:
-
-            if "n_valid" in ex:
-                # Crop possibly variable length results.
-                ex["instance_peaks"] = [
-                    x[:n] for x, n in zip(ex["instance_peaks"], ex["n_valid"])
-                ]
-                ex["instance_peak_vals"] = [
-                    x[:n] for x, n in zip(ex["instance_peak_vals"], ex["n_valid"])
-                ]
-                ex["instance_scores"] = [
-                    x[:n] for x, n in zip(ex["instance_scores"], ex["n_valid"])
-                ]
-
-            # Loop over frames.
-            for image, video_ind, frame_ind, points, confidences, scores in zip(
-                ex["image"],
-                ex["video_ind"],
-                ex["frame_ind"],
-                ex["instance_peaks"],
-                ex["instance_peak_vals"],
-                ex["instance_scores"],
-            ):
-
-                # Loop over instances.
-                predicted_instances = []
-                for pts, confs, score in zip(points, confidences, scores):
-                    predicted_instances.append(
-                        sleap.instance.PredictedInstance.from_arrays(
-                            points=pts,
-                            point_confidences=confs,
-                            instance_score=score,
-                            skeleton=skeleton,
-                        )
-                    )
 
-                if self.tracker:
-                    # Set tracks for predicted instances in this frame.
-                    predicted_instances = self.tracker.track(
-                        untracked_instances=predicted_instances, img=image, t=frame_ind
-                    )
+        if "n_valid" in ex:
+            # Crop possibly variable length results.
+            ex["instance_peaks"] = [
+                x[:n] for x, n in zip(ex["instance_peaks"], ex["n_valid"])
+            ]
+            ex["instance_peak_vals"] = [
+                x[:n] for x, n in zip(ex["instance_peak_vals"], ex["n_valid"])
+            ]
+            ex["instance_scores"] = [
+                x[:n] for x, n in zip(ex["instance_scores"], ex["n_valid"])
+            ]
+
+        # Loop over frames.
+        for video_ind, frame_ind, points, confidences, scores in zip(
+            ex["video_ind"],
+            ex["frame_ind"],
+            ex["instance_peaks"],
+            ex["instance_peak_vals"],
+            ex["instance_scores"],
+        ):
+
+            # Create all instances in the frame at once.
+            predicted_instances = sleap.instance.PredictedInstance.from_arrays_batch(
+                points=points,
+                point_confidences=confidences,
+                instance_scores=scores,
+                skeleton=skeleton,
+            )
 
-                predicted_frames.append(
-                    sleap.LabeledFrame(
-                        video=data_provider.videos[video_ind],
-                        frame_idx=frame_ind,
-                        instances=predicted_instances,
-                    )
+            predicted_frames.append(
+                sleap.LabeledFrame(
+                    video=data_provider.videos[video_ind],
+                    frame_idx=frame_ind,
+                    instances=predicted_instances,
                 )
-
-        if self.tracker:
-            self.tracker.final_pass(predicted_frames)
+            )
 
         return predicted_frames
 
@@ -2521,6 +3196,8 @@ def load_model(
     tracker_max_instances: Optional[int] = None,
     disable_gpu_preallocation: bool = True,
     progress_reporting: str = "rich",
+    pipelined: bool = False,
+    instance_batch_size: Optional[int] = None,
 ) -> Predictor:
     """Load a trained SLEAP model.
 
@@ -2553,6 +3230,13 @@ def load_model(
             for programmatic progress monitoring. If `"none"`, nothing is displayed
             during inference -- this is recommended when running on clusters or headless
             machines where the output is captured to a log file.
+        pipelined: If `True`, the model forward pass, the creation of the predicted
+            instances and the tracking run concurrently instead of one after another.
+            See `Predictor.pipelined`.
+        instance_batch_size: If not `None`, the centered instance model of top-down
+            models is run on fixed-size micro-batches of this many instance crops. This
+            makes the throughput more stable on videos where the number of animals
+            varies. No effect for other model types.
 
     Returns:
         An instance of a `Predictor` based on which model type was detected.
@@ -2599,8 +3283,10 @@ def load_model(
         peak_threshold=peak_threshold,
         integral_refinement=refinement == "integral",
         batch_size=batch_size,
+        instance_batch_size=instance_batch_size,
     )
     predictor.verbosity = progress_reporting
+    predictor.pipelined = pipelined
     if tracker is not None:
         predictor.tracker = Tracker.make_tracker_by_name(
             tracker=tracker,
@@ -2693,6 +3379,52 @@ def _make_cli_parser() -> argparse.ArgumentParser:
             "saving to output."
         ),
     )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        default=False,
+        help=(
+            "Continue an interrupted run by appending to the output file and skipping "
+            "the frames that it already contains. Requires a .slp output and cannot be "
+            "combined with tracking."
+        ),
+    )
+    parser.add_argument(
+        "--flush_every",
+        type=int,
+        default=16,
+        help=(
+            "Number of batches of predictions to hold in memory before they are "
+            "written to the output file."
+        ),
+    )
+    parser.add_argument(
+        "--analysis_output",
+        type=str,
+        default=None,
+        help=(
+            "Path to an analysis HDF5 file (track occupancy and point locations as "
+            "matrices) to write the predictions to, in addition to the output file. "
+            "The matrices are written in blocks of frames while predicting, so they "
+            "are never held in memory at once."
+        ),
+    )
+    parser.add_argument(
+        "--analysis.dtype",
+        type=str,
+        choices=["float64", "float32"],
+        default="float64",
+        help="Data type of the point locations in the analysis HDF5 file.",
+    )
+    parser.add_argument(
+        "--analysis.block_size",
+        type=int,
+        default=1024,
+        help=(
+            "Number of frames to buffer before writing them to the analysis HDF5 file. "
+            "This is also the chunk size of the datasets along the frame axis."
+        ),
+    )
     parser.add_argument(
         "--verbosity",
         type=str,
@@ -2705,6 +3437,94 @@ def _make_cli_parser() -> argparse.ArgumentParser:
             "console."
         ),
     )
+    parser.add_argument(
+        "--pipelined",
+        action="store_true",
+        default=False,
+        help=(
+            "Run the model, the creation of the predicted instances and the tracking "
+            "concurrently in separate threads, so the model doesn't wait for the "
+            "post-processing of each batch. The time spent in each stage is included "
+            "in the JSON progress reports."
+        ),
+    )
+    parser.add_argument(
+        "--motion_gating",
+        action="store_true",
+        default=False,
+        help=(
+            "Skip frames without motion instead of running the model on them. Frames "
+            "are compared to the last processed frame after downsampling, and skipped "
+            "frames get copies of its predictions. The skipped frames and the fraction "
+            "of model compute saved are saved in the provenance of the output file."
+        ),
+    )
+    parser.add_argument(
+        "--motion_gating.pixel_threshold",
+        type=float,
+        default=10.0,
+        help=(
+            "Minimum intensity difference (0-255) of a downsampled pixel for it to "
+            "count as changed when motion gating."
+        ),
+    )
+    parser.add_argument(
+        "--motion_gating.min_changed_fraction",
+        type=float,
+        default=0.001,
+        help=(
+            "Minimum fraction of changed downsampled pixels for a frame to be "
+            "processed when motion gating."
+        ),
+    )
+    parser.add_argument(
+        "--motion_gating.downsample",
+        type=int,
+        default=4,
+        help="Factor to downsample frames by before comparing them for motion gating.",
+    )
+    parser.add_argument(
+        "--motion_gating.max_skipped",
+        type=int,
+        default=30,
+        help=(
+            "Maximum number of consecutive frames to skip when motion gating. The "
+            "next frame is processed regardless of motion. Use 0 for no limit."
+        ),
+    )
+    parser.add_argument(
+        "--frame_stride",
+        type=int,
+        default=1,
+        help=(
+            "Only predict every k-th frame (and the last frame) of the video and fill "
+            "the frames in between afterwards with the method set by --stride_fill. "
+            "Tracking is done on the predicted frames only. This speeds up inference "
+            "on high frame rate videos. Filled instances have a score of -1."
+        ),
+    )
+    parser.add_argument(
+        "--stride_fill",
+        type=str,
+        choices=FILL_METHODS,
+        default="linear",
+        help=(
+            "Method to fill the frames in between predicted frames with when using "
+            "--frame_stride. 'linear' and 'spline' interpolate each track and "
+            "require tracking. 'flow' shifts the instances of the nearest predicted "
+            "frame with optical flow."
+        ),
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        default=None,
+        help=(
+            "Path to a JSON file to save the time spent in each stage of inference "
+            "(video decoding, preprocessing, model forward pass, PAF grouping, "
+            "tracking and saving) to. A summary table is also printed at exit."
+        ),
+    )
     parser.add_argument(
         "--video.dataset", type=str, default=None, help="The dataset for HDF5 videos."
     )
@@ -2714,6 +3534,16 @@ def _make_cli_parser() -> argparse.ArgumentParser:
         default="channels_last",
         help="The input_format for HDF5 videos.",
     )
+    parser.add_argument(
+        "--video.decode_workers",
+        type=int,
+        default=0,
+        help=(
+            "Number of processes to decode media videos (e.g., mp4) with in parallel. "
+            "This speeds up inference when decoding is the bottleneck, e.g., when "
+            "running on CPU. If 0 or 1, frames are decoded in the main process."
+        ),
+    )
     device_group = parser.add_mutually_exclusive_group(required=False)
     device_group.add_argument(
         "--cpu",
@@ -2749,6 +3579,18 @@ def _make_cli_parser() -> argparse.ArgumentParser:
             "inference speeds, but require more memory."
         ),
     )
+    parser.add_argument(
+        "--instance_batch_size",
+        type=int,
+        default=None,
+        help=(
+            "Number of instance crops to run the centered instance model of top-down "
+            "models on at a time. The crops of each batch of frames are split into "
+            "micro-batches of exactly this size (the last one is padded), so the "
+            "model input has the same shape regardless of the number of animals. "
+            "If not specified, all crops of a batch are predicted at once."
+        ),
+    )
 
     # Deprecated legacy args. These will still be parsed for backward compatibility but
     # are hidden from the CLI help.
@@ -2840,10 +3682,51 @@ def _make_provider_from_cli(args: argparse.Namespace) -> Tuple[Provider, str]:
         provider = VideoReader.from_filepath(
             filename=data_path, example_indices=args.frames, **video_kwargs
         )
+        provider.decode_workers = vars(args).get("video.decode_workers", 0)
 
     return provider, data_path
 
 
+def _skip_predicted_frames(
+    provider: Provider, predicted_frame_inds: Dict[Text, np.ndarray]
+) -> Provider:
+    """Restrict a data provider to the frames that have not been predicted yet.
+
+    Args:
+        provider: A `LabelsReader` or `VideoReader`. This will be modified in place.
+        predicted_frame_inds: Dictionary mapping video filenames to the indices of the
+            frames that were already predicted, e.g., from
+            `LabelsSink.get_predicted_frame_inds()`.
+
+    Returns:
+        The provider with its `example_indices` updated to exclude predicted frames.
+    """
+    if isinstance(provider, LabelsReader):
+        example_inds = provider.example_indices
+        if example_inds is None:
+            example_inds = np.arange(len(provider.labels))
+        done = {
+            filename: set(frame_inds.tolist())
+            for filename, frame_inds in predicted_frame_inds.items()
+        }
+        keep = []
+        for i in example_inds:
+            lf = provider.labels[i]
+            if lf.frame_idx not in done.get(lf.video.filename, set()):
+                keep.append(i)
+        provider.example_indices = np.array(keep, dtype="int64")
+
+    elif isinstance(provider, VideoReader):
+        example_inds = provider.example_indices
+        if example_inds is None:
+            example_inds = np.arange(len(provider.video))
+        example_inds = np.asarray(example_inds, dtype="int64")
+        done = predicted_frame_inds.get(provider.video.filename, [])
+        provider.example_indices = example_inds[~np.isin(example_inds, done)]
+
+    return provider
+
+
 def _make_predictor_from_cli(args: argparse.Namespace) -> Predictor:
     """Make predictor from parsed CLI args.
 
@@ -2882,8 +3765,18 @@ def _make_predictor_from_cli(args: argparse.Namespace) -> Predictor:
         peak_threshold=peak_threshold,
         integral_refinement=True,
         batch_size=batch_size,
+        instance_batch_size=args.instance_batch_size,
     )
     predictor.verbosity = args.verbosity
+    predictor.pipelined = args.pipelined
+    if args.motion_gating:
+        max_skipped = getattr(args, "motion_gating.max_skipped")
+        predictor.motion_gate = MotionGate(
+            pixel_threshold=getattr(args, "motion_gating.pixel_threshold"),
+            min_changed_fraction=getattr(args, "motion_gating.min_changed_fraction"),
+            downsample=getattr(args, "motion_gating.downsample"),
+            max_skipped=max_skipped if max_skipped > 0 else None,
+        )
     return predictor
 
 
@@ -2943,6 +3836,12 @@ def main():
     sleap.nn.system.summary()
     print()
 
+    # Profiling has to be enabled before the inference model is created so that the
+    # timing ops are added to its graph.
+    if args.profile is not None:
+        get_profiler().reset()
+        get_profiler().enable()
+
     # Setup data loader.
     provider, data_path = _make_provider_from_cli(args)
 
@@ -2953,38 +3852,157 @@ def main():
     tracker = _make_tracker_from_cli(args)
     predictor.tracker = tracker
 
+    output_path = args.output
+    if output_path is None:
+        output_path = data_path + ".predictions.slp"
+
+    provenance = dict(
+        sleap_version=sleap.__version__,
+        platform=platform.platform(),
+        data_path=data_path,
+        model_paths=predictor.model_paths,
+        output_path=output_path,
+        predictor=type(predictor).__name__,
+    )
+    n_total = len(provider)
+
+    frame_stride = args.frame_stride
+    if frame_stride > 1:
+        if not isinstance(provider, VideoReader):
+            raise ValueError("Frame stride can only be used when predicting on videos.")
+        if args.stride_fill != "flow" and tracker is None:
+            raise ValueError(
+                f"Filling frames with '{args.stride_fill}' interpolation requires "
+                "tracking. Specify a tracker or use --stride_fill flow."
+            )
+        if args.resume:
+            raise ValueError("Inference cannot be resumed when using a frame stride.")
+        target_frame_inds = provider.example_indices
+        if target_frame_inds is None:
+            target_frame_inds = np.arange(len(provider.video))
+        provider.example_indices = make_strided_frame_inds(
+            target_frame_inds, frame_stride
+        )
+        print(f"Predicting {len(provider)}/{n_total} frames with a frame stride.")
+
+    # The final tracking pass and filling the frames skipped by a frame stride need
+    # all of the frames, so they can't be streamed to the output file in these cases.
+    # Only the HDF5 labels format can be appended to, so other outputs are saved with
+    # the labels at the end.
+    stream = (
+        (tracker is None or not tracker.has_final_pass)
+        and frame_stride == 1
+        and LabelsV1Adaptor().does_match_ext(output_path)
+    )
+    if args.resume and tracker is not None:
+        # The tracker can't be seeded with the tracks that are already in the output
+        # file, so resuming would start new tracks that duplicate the stored ones.
+        raise ValueError(
+            "Inference cannot be resumed when tracking since the tracks that are "
+            "already in the output file can't be continued."
+        )
+    if args.resume and not stream:
+        raise ValueError(
+            "Inference can only be resumed when the output is a .slp file."
+        )
+
+    analysis_sink = None
+    if args.analysis_output is not None:
+        if args.resume:
+            raise ValueError(
+                "Inference cannot be resumed when writing an analysis HDF5 file."
+            )
+        analysis_sink = AnalysisSink(
+            args.analysis_output,
+            dtype=getattr(args, "analysis.dtype"),
+            block_size=getattr(args, "analysis.block_size"),
+        )
+
     # Run inference!
-    labels_pr = predictor.predict(provider)
+    if stream:
+        sink = LabelsSink(
+            output_path,
+            flush_every=args.flush_every,
+            resume=args.resume,
+            remove_empty_frames=args.no_empty_frames,
+            provenance=provenance,
+        )
+        if args.resume and sink.n_frames_written > 0:
+            provider = _skip_predicted_frames(provider, sink.get_predicted_frame_inds())
+            print(f"Resuming with {len(provider)} frames left to predict.")
+
+        if len(provider) > 0:
+            if analysis_sink is None:
+                predictor.predict(provider, sink=sink)
+            else:
+                predictor.predict(provider, sink=MultiSink([sink, analysis_sink]))
+        sink.flush()
+        n_predicted = sink.n_frames_written
 
-    if args.no_empty_frames:
-        # Clear empty frames if specified.
-        labels_pr.remove_empty_frames()
+    else:
+        labels_pr = predictor.predict(provider)
+
+        if frame_stride > 1:
+            n_strided = len(labels_pr)
+            labels_pr = sleap.Labels(
+                fill_strided_frames(
+                    labels_pr.labeled_frames,
+                    target_frame_inds,
+                    method=args.stride_fill,
+                )
+            )
+            provenance["frame_stride"] = dict(
+                frame_stride=frame_stride,
+                fill_method=args.stride_fill,
+                n_strided_frames=n_strided,
+            )
+
+        if args.no_empty_frames:
+            # Clear empty frames if specified.
+            labels_pr.remove_empty_frames()
+        n_predicted = len(labels_pr)
 
     finish_timestamp = str(datetime.now())
     total_elapsed = time() - t0
     print("Finished inference at:", finish_timestamp)
     print(f"Total runtime: {total_elapsed} secs")
-    print(f"Predicted frames: {len(labels_pr)}/{len(provider)}")
-
-    output_path = args.output
-    if output_path is None:
-        output_path = data_path + ".predictions.slp"
+    print(f"Predicted frames: {n_predicted}/{n_total}")
+    if predictor.motion_gate is not None:
+        motion_gating = predictor.motion_gate.summary()
+        print(
+            f"Motion gating skipped {motion_gating['n_skipped']}/"
+            f"{motion_gating['n_frames']} frames "
+            f"({motion_gating['skipped_fraction']:.1%} of model compute saved)."
+        )
+        provenance["motion_gating"] = motion_gating
 
     # Add provenance metadata to predictions.
-    labels_pr.provenance["sleap_version"] = sleap.__version__
-    labels_pr.provenance["platform"] = platform.platform()
-    labels_pr.provenance["data_path"] = data_path
-    labels_pr.provenance["model_paths"] = predictor.model_paths
-    labels_pr.provenance["output_path"] = output_path
-    labels_pr.provenance["predictor"] = type(predictor).__name__
-    labels_pr.provenance["total_elapsed"] = total_elapsed
-    labels_pr.provenance["start_timestamp"] = start_timestamp
-    labels_pr.provenance["finish_timestamp"] = finish_timestamp
+    provenance["total_elapsed"] = total_elapsed
+    provenance["start_timestamp"] = start_timestamp
+    provenance["finish_timestamp"] = finish_timestamp
 
     # Save results.
-    labels_pr.save(output_path)
+    with profile_stage("serialization"):
+        if stream:
+            sink.close()
+        else:
+            labels_pr.provenance.update(provenance)
+            labels_pr.save(output_path)
     print("Saved output:", output_path)
 
+    if analysis_sink is not None:
+        with profile_stage("serialization"):
+            if not stream:
+                analysis_sink.write_frames(labels_pr.labeled_frames)
+            analysis_sink.close()
+        print("Saved analysis output:", args.analysis_output)
+
+    if args.profile is not None:
+        get_profiler().save(args.profile)
+        print("Profile:")
+        print(get_profiler().summary_table())
+        print("Saved profile:", args.profile)
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,157 @@
+"""
+Motion gating for skipping static frames during inference.
+
+Many videos are recorded in arenas where nothing changes for long stretches of time.
+A `MotionGate` compares each frame to the last frame that was passed to the model,
+after converting both to grayscale and downsampling them by block averaging. Frames
+where only a small fraction of the downsampled pixels changed are skipped and their
+predictions are carried forward from the last processed frame of the same video.
+
+Comparing against the last processed frame rather than the previous frame means that
+slow changes still add up and eventually trigger inference. Frames are also processed
+periodically regardless of motion, so that predictions are refreshed.
+
+Usage:
+
+> predictor.motion_gate = MotionGate(pixel_threshold=10, min_changed_fraction=0.001)
+> labels = predictor.predict(video)
+> predictor.motion_gate.summary()
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+import attr
+import numpy as np
+
+
+@attr.s(auto_attribs=True)
+class MotionGate:
+    """Decide which frames need inference by differencing downsampled frames.
+
+    Attributes:
+        pixel_threshold: Minimum absolute difference in intensity (in the range of the
+            images, e.g., 0-255) of a downsampled grayscale pixel for it to count as
+            changed.
+        min_changed_fraction: Minimum fraction of changed downsampled pixels for a
+            frame to be processed.
+        downsample: Factor to downsample frames by before differencing. Larger values
+            are faster and less sensitive to noise, but miss smaller changes.
+        max_skipped: Maximum number of consecutive frames of a video that can be
+            skipped. The next frame is processed regardless of motion. If `None`,
+            there is no limit.
+        n_frames: Number of frames that were checked since the last reset.
+        n_skipped: Number of frames that were skipped since the last reset.
+        skipped_frames: The `(video_ind, frame_ind)` of each skipped frame since the
+            last reset.
+    """
+
+    pixel_threshold: float = 10.0
+    min_changed_fraction: float = 0.001
+    downsample: int = 4
+    max_skipped: Optional[int] = 30
+    n_frames: int = attr.ib(default=0, init=False)
+    n_skipped: int = attr.ib(default=0, init=False)
+    skipped_frames: List[Tuple[int, int]] = attr.ib(factory=list, init=False)
+    _references: Dict[int, np.ndarray] = attr.ib(factory=dict, init=False)
+    _n_consecutive_skipped: Dict[int, int] = attr.ib(factory=dict, init=False)
+
+    def reset(self):
+        """Forget the reference frames and reset the counters."""
+        self.n_frames = 0
+        self.n_skipped = 0
+        self.skipped_frames = []
+        self._references = {}
+        self._n_consecutive_skipped = {}
+
+    def downsample_images(self, images: np.ndarray) -> np.ndarray:
+        """Convert images to grayscale and downsample them by block averaging.
+
+        Args:
+            images: Images of shape `(n_images, height, width, channels)`.
+
+        Returns:
+            A `float32` array of shape
+            `(n_images, height // downsample, width // downsample)`.
+        """
+        n, height, width, channels = images.shape
+        block_height = min(max(int(self.downsample), 1), height)
+        block_width = min(max(int(self.downsample), 1), width)
+        height, width = height // block_height, width // block_width
+        blocks = images[:, : height * block_height, : width * block_width].reshape(
+            (n, height, block_height, width, block_width, channels)
+        )
+        return blocks.mean(axis=(2, 4, 5), dtype="float32")
+
+    def update(
+        self, images: np.ndarray, video_inds: np.ndarray, frame_inds: np.ndarray
+    ) -> np.ndarray:
+        """Check a batch of frames for motion.
+
+        Frames must be passed in the order that they will be predicted in. The frames
+        that are returned as active become the new reference frames of their video.
+
+        Args:
+            images: Frames of shape `(n_frames, height, width, channels)`.
+            video_inds: Index of the video of each frame, of shape `(n_frames,)`.
+            frame_inds: Index of each frame within its video, of shape `(n_frames,)`.
+
+        Returns:
+            A boolean array of shape `(n_frames,)` that is `True` for the frames that
+            should be processed and `False` for the frames that can be skipped.
+        """
+        small_images = self.downsample_images(np.asarray(images))
+        active = np.ones(len(small_images), dtype=bool)
+        for i, (small_image, video_ind) in enumerate(zip(small_images, video_inds)):
+            video_ind = int(video_ind)
+            reference = self._references.get(video_ind, None)
+            n_consecutive = self._n_consecutive_skipped.get(video_ind, 0)
+            if (
+                reference is not None
+                and reference.shape == small_image.shape
+                and (self.max_skipped is None or n_consecutive < self.max_skipped)
+            ):
+                changed = np.abs(small_image - reference) > self.pixel_threshold
+                active[i] = changed.mean() >= self.min_changed_fraction
+
+            if active[i]:
+                self._references[video_ind] = small_image
+                self._n_consecutive_skipped[video_ind] = 0
+            else:
+                self._n_consecutive_skipped[video_ind] = n_consecutive + 1
+                self.skipped_frames.append((video_ind, int(frame_inds[i])))
+
+        self.n_frames += len(active)
+        self.n_skipped += int((~active).sum())
+        return active
+
+    @property
+    def skipped_fraction(self) -> float:
+        """Return the fraction of checked frames that were skipped."""
+        return self.n_skipped / self.n_frames if self.n_frames > 0 else 0.0
+
+    def summary(self) -> dict:
+        """Return a JSON serializable summary of the skipped frames.
+
+        Returns:
+            A dictionary with the settings of the gate, the number of checked and
+            skipped frames, the fraction of model compute that was saved and the
+            skipped frames as `[video_ind, start_frame_ind, end_frame_ind]` runs of
+            consecutive frames (inclusive).
+        """
+        runs = []
+        for video_ind, frame_ind in self.skipped_frames:
+            if runs and runs[-1][0] == video_ind and runs[-1][2] == frame_ind - 1:
+                runs[-1][2] = frame_ind
+            else:
+                runs.append([video_ind, frame_ind, frame_ind])
+
+        return dict(
+            pixel_threshold=self.pixel_threshold,
+            min_changed_fraction=self.min_changed_fraction,
+            downsample=self.downsample,
+            max_skipped=self.max_skipped,
+            n_frames=self.n_frames,
+            n_skipped=self.n_skipped,
+            skipped_fraction=self.skipped_fraction,
+            skipped_frames=runs,
+        )
@@ -24,9 +24,12 @@ References:
 """
 
 import attr
-from typing import Dict, List, Union, Tuple, Text
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Hashable, List, Optional, Union, Tuple, Text
 import tensorflow as tf
 import numpy as np
+from scipy.optimize import linear_sum_assignment
 from sleap.nn.utils import tf_linear_sum_assignment
 from sleap.nn.config import MultiInstanceConfig
 
@@ -609,6 +612,7 @@ def match_candidates_batch(
     edge_peak_inds: tf.RaggedTensor,
     line_scores: tf.RaggedTensor,
     n_edges: int,
+    n_workers: Optional[int] = None,
 ) -> Tuple[tf.RaggedTensor, tf.RaggedTensor, tf.RaggedTensor, tf.RaggedTensor]:
     """Match candidate connections for a batch based on PAF scores.
 
@@ -625,6 +629,8 @@ def match_candidates_batch(
             `tf.RaggedTensor` of shape `(n_samples, (n_candidates))` and dtype
             `tf.float32`. Can be generated using `score_paf_lines_batch()`.
         n_edges: A scalar `int` denoting the number of edges in the skeleton.
+        n_workers: Number of threads to match the samples with. If `None`, one thread
+            per sample is used up to the number of CPUs. See `match_candidates_flat()`.
 
     Returns:
         The connection peaks for each edge matched based on score as 4-tuple of:
@@ -649,61 +655,51 @@ def match_candidates_batch(
 
     Notes:
         The matching is performed using the Munkres algorithm implemented in
-        `scipy.optimize.linear_sum_assignment()` which is wrapped in
-        `tf_linear_sum_assignment()` for execution within a graph.
+        `scipy.optimize.linear_sum_assignment()`. The problems of all samples and edges
+        are solved together by `match_candidates_flat()` within a single
+        `tf.numpy_function`.
 
-    See also: match_candidates_sample, score_paf_lines_batch, group_instances_batch
+    See also: match_candidates_flat, score_paf_lines_batch, group_instances_batch
     """
     n_samples = edge_inds.nrows()
 
-    match_sample_inds = tf.TensorArray(
-        tf.int32, size=n_samples, infer_shape=False, element_shape=[None]
-    )
-    match_edge_inds = tf.TensorArray(
-        tf.int32, size=n_samples, infer_shape=False, element_shape=[None]
-    )
-    match_src_peak_inds = tf.TensorArray(
-        tf.int32, size=n_samples, infer_shape=False, element_shape=[None]
-    )
-    match_dst_peak_inds = tf.TensorArray(
-        tf.int32, size=n_samples, infer_shape=False, element_shape=[None]
-    )
-    match_line_scores = tf.TensorArray(
-        tf.float32, size=n_samples, infer_shape=False, element_shape=[None]
-    )
-
-    for sample in range(n_samples):
-        edge_inds_sample = edge_inds[sample]
-        edge_peak_inds_sample = edge_peak_inds[sample]
-        line_scores_sample = line_scores[sample]
-
-        (
-            match_edge_inds_sample,
-            match_src_peak_inds_sample,
-            match_dst_peak_inds_sample,
-            match_line_scores_sample,
-        ) = match_candidates_sample(
-            edge_inds_sample, edge_peak_inds_sample, line_scores_sample, n_edges
-        )
-
-        # Save
-        match_sample_inds = match_sample_inds.write(
-            sample, tf.repeat([sample], [tf.shape(match_edge_inds_sample)[0]])
-        )
-        match_edge_inds = match_edge_inds.write(sample, match_edge_inds_sample)
-        match_src_peak_inds = match_src_peak_inds.write(
-            sample, match_src_peak_inds_sample
-        )
-        match_dst_peak_inds = match_dst_peak_inds.write(
-            sample, match_dst_peak_inds_sample
+    def _match_candidates_flat(
+        sample_inds, edge_inds, edge_peak_inds, line_scores, n_samples
+    ):
+        """Helper to avoid passing `n_workers` to `tf.numpy_function`."""
+        return match_candidates_flat(
+            sample_inds,
+            edge_inds,
+            edge_peak_inds,
+            line_scores,
+            int(n_samples),
+            n_edges,
+            n_workers=n_workers,
         )
-        match_line_scores = match_line_scores.write(sample, match_line_scores_sample)
 
-    match_sample_inds = match_sample_inds.concat()
-    match_edge_inds = match_edge_inds.concat()
-    match_src_peak_inds = match_src_peak_inds.concat()
-    match_dst_peak_inds = match_dst_peak_inds.concat()
-    match_line_scores = match_line_scores.concat()
+    # Match all the samples in a single call.
+    (
+        match_sample_inds,
+        match_edge_inds,
+        match_src_peak_inds,
+        match_dst_peak_inds,
+        match_line_scores,
+    ) = tf.numpy_function(
+        _match_candidates_flat,
+        inp=[
+            edge_inds.value_rowids(),
+            edge_inds.flat_values,
+            edge_peak_inds.flat_values,
+            line_scores.flat_values,
+            n_samples,
+        ],
+        Tout=[tf.int64, tf.int32, tf.int32, tf.int32, tf.float32],
+    )
+    match_sample_inds.set_shape([None])
+    match_edge_inds.set_shape([None])
+    match_src_peak_inds.set_shape([None])
+    match_dst_peak_inds.set_shape([None])
+    match_line_scores.set_shape([None])
 
     match_edge_inds = tf.RaggedTensor.from_value_rowids(
         match_edge_inds, match_sample_inds, nrows=n_samples
@@ -726,6 +722,330 @@ def match_candidates_batch(
     )
 
 
+def match_candidates_flat(
+    sample_inds: np.ndarray,
+    edge_inds: np.ndarray,
+    edge_peak_inds: np.ndarray,
+    line_scores: np.ndarray,
+    n_samples: int,
+    n_edges: int,
+    n_workers: Optional[int] = None,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Match candidate connections for a whole batch at once from flat arrays.
+
+    This solves the same bipartite matching problems as `match_candidates_sample()` for
+    every sample and edge of the batch, but without building them one at a time in the
+    graph. The line scores of all the problems are scattered into a single padded score
+    tensor of shape `(n_problems, max_n_src, max_n_dst)`, the assignment problems are
+    solved and the matched scores are gathered back from the padded tensor.
+
+    Args:
+        sample_inds: Index of the sample that each candidate connection belongs to as
+            an array of shape `(n_candidates,)`.
+        edge_inds: Index of the edge that each candidate connection belongs to as an
+            array of shape `(n_candidates,)`.
+        edge_peak_inds: Indices of the source and destination peaks of each candidate
+            connection as an array of shape `(n_candidates, 2)`.
+        line_scores: Scores of each candidate connection as an array of shape
+            `(n_candidates,)`.
+        n_samples: The number of samples in the batch.
+        n_edges: The number of edges in the skeleton.
+        n_workers: Number of threads to solve the problems of different samples with.
+            `linear_sum_assignment` releases the GIL, so samples can be matched in
+            parallel. If `None`, one thread per sample is used up to the number of
+            CPUs. If 1, all problems are solved in the calling thread.
+
+    Returns:
+        The matched connections of all samples as a 5-tuple of flat arrays of shape
+        `(n_connections,)`, ordered by sample and then by edge:
+
+        `match_sample_inds`: Index of the sample of each connection (`int64`).
+
+        `match_edge_inds`: Index of the skeleton edge of each connection (`int32`).
+
+        `match_src_peak_inds`: Indices of the source peaks of each connection
+        (`int32`). Important: These indices correspond to the edge-grouped peaks, not
+        the set of all peaks in the sample.
+
+        `match_dst_peak_inds`: Indices of the destination peaks of each connection
+        (`int32`). Important: These indices correspond to the edge-grouped peaks, not
+        the set of all peaks in the sample.
+
+        `match_line_scores`: PAF line scores of the matched connections (`float32`).
+
+    Notes:
+        The candidates of each sample and edge are expected to form the full grid of
+        source and destination peaks in source-major order, as generated by
+        `get_connection_candidates()`.
+
+    See also: match_candidates_batch, match_candidates_sample
+    """
+    sample_inds = np.asarray(sample_inds, dtype="int64").reshape(-1)
+    edge_inds = np.asarray(edge_inds, dtype="int64").reshape(-1)
+    edge_peak_inds = np.asarray(edge_peak_inds).reshape(-1, 2)
+    line_scores = np.asarray(line_scores, dtype="float32").reshape(-1)
+
+    if len(line_scores) == 0:
+        return (
+            np.zeros((0,), dtype="int64"),
+            np.zeros((0,), dtype="int32"),
+            np.zeros((0,), dtype="int32"),
+            np.zeros((0,), dtype="int32"),
+            np.zeros((0,), dtype="float32"),
+        )
+
+    # Group the candidates into one problem per sample and edge.
+    problem_keys = sample_inds * n_edges + edge_inds
+    order = np.argsort(problem_keys, kind="stable")
+    problem_keys = problem_keys[order]
+    src_peak_inds = edge_peak_inds[order, 0]
+    line_scores = line_scores[order]
+    problem_keys, problem_starts, problem_sizes = np.unique(
+        problem_keys, return_index=True, return_counts=True
+    )
+    n_problems = len(problem_keys)
+    candidate_problems = np.repeat(np.arange(n_problems), problem_sizes)
+
+    # Candidates form a source-major grid, so the number of destination peaks is the
+    # number of candidates that share the first source peak.
+    is_first_src = src_peak_inds == src_peak_inds[problem_starts][candidate_problems]
+    n_dst = np.bincount(candidate_problems, weights=is_first_src, minlength=n_problems)
+    n_dst = n_dst.astype("int64")
+    n_src = problem_sizes // n_dst
+
+    # Scatter the scores into a padded tensor of score matrices.
+    grid_inds = np.arange(len(line_scores)) - problem_starts[candidate_problems]
+    rows = grid_inds // n_dst[candidate_problems]
+    cols = grid_inds % n_dst[candidate_problems]
+    scores = np.full((n_problems, n_src.max(), n_dst.max()), np.nan, dtype="float32")
+    scores[candidate_problems, rows, cols] = line_scores
+
+    def _solve(problems: np.ndarray) -> List[Tuple[np.ndarray, np.ndarray]]:
+        matches = []
+        for problem in problems:
+            # Replace NaNs with inf since linear_sum_assignment doesn't accept NaNs and
+            # flip the sign to maximize the scores.
+            cost_matrix = -scores[problem, : n_src[problem], : n_dst[problem]]
+            cost_matrix[np.isnan(cost_matrix)] = np.inf
+            matches.append(linear_sum_assignment(cost_matrix))
+        return matches
+
+    # Solve the problems of each sample in parallel.
+    problem_samples = problem_keys // n_edges
+    sample_problems = np.split(
+        np.arange(n_problems), np.flatnonzero(np.diff(problem_samples)) + 1
+    )
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    n_workers = min(n_workers, len(sample_problems))
+    if n_workers > 1:
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            sample_matches = list(executor.map(_solve, sample_problems))
+    else:
+        sample_matches = [_solve(problems) for problems in sample_problems]
+    matches = [match for matches in sample_matches for match in matches]
+
+    # Gather the matched scores from the padded tensor.
+    n_matches = np.array([len(match_rows) for match_rows, _ in matches])
+    match_problems = np.repeat(np.arange(n_problems), n_matches)
+    match_src_peak_inds = np.concatenate([match_rows for match_rows, _ in matches])
+    match_dst_peak_inds = np.concatenate([match_cols for _, match_cols in matches])
+    match_line_scores = scores[match_problems, match_src_peak_inds, match_dst_peak_inds]
+
+    return (
+        problem_samples[match_problems],
+        (problem_keys % n_edges)[match_problems].astype("int32"),
+        match_src_peak_inds.astype("int32"),
+        match_dst_peak_inds.astype("int32"),
+        match_line_scores,
+    )
+
+
+class InstanceAssembler:
+    """Incrementally groups peaks into instances for `assign_connections_to_instances`.
+
+    Instances are kept in a union-find forest over peak slots, so merging two instances
+    takes near-constant time instead of a scan over all assigned peaks. Each assigned
+    peak holds a slot in the tree of its instance. When a peak is reassigned to another
+    instance, it gets a new slot and its old slot is left behind as an empty slot. The
+    nodes in each instance are counted incrementally so that instances can be checked
+    for shared nodes without scanning their peaks.
+
+    New instances are numbered one higher than the highest instance ID in use, which
+    is how instances were numbered when assignments were kept in a flat dictionary.
+
+    Peaks can be identified by any hashable key, e.g., a `PeakID` or the index of the
+    peak in a flat array of peaks, as long as the node type of the peak is provided
+    along with it.
+    """
+
+    def __init__(self):
+        # Parent of each slot in the union-find forest.
+        self._parents: List[int] = []
+
+        # Slot of each assigned peak, in the order that peaks were first assigned.
+        self._peak_slots: Dict[Hashable, int] = dict()
+
+        # Instance ID of each root slot and root slot of each instance ID.
+        self._root_instances: Dict[int, int] = dict()
+        self._instance_roots: Dict[int, int] = dict()
+
+        # Number of peaks of each node type and total number of peaks per root slot.
+        self._root_node_counts: Dict[int, Dict[int, int]] = dict()
+        self._root_peak_counts: Dict[int, int] = dict()
+
+        self._max_instance = -1
+
+    def _find(self, slot: int) -> int:
+        """Return the root slot of a slot, compressing the path to it."""
+        root = slot
+        while self._parents[root] != root:
+            root = self._parents[root]
+        while self._parents[slot] != root:
+            self._parents[slot], slot = root, self._parents[slot]
+        return root
+
+    def _remove_instance(self, instance: int):
+        """Forget an instance that has no peaks left."""
+        root = self._instance_roots.pop(instance)
+        del self._root_instances[root]
+        del self._root_node_counts[root]
+        del self._root_peak_counts[root]
+        while (
+            self._max_instance >= 0 and self._max_instance not in self._instance_roots
+        ):
+            self._max_instance -= 1
+
+    def get_instance(self, peak_id: Hashable) -> Union[int, None]:
+        """Return the instance ID of a peak, or `None` if it is not assigned."""
+        slot = self._peak_slots.get(peak_id, None)
+        if slot is None:
+            return None
+        return self._root_instances[self._find(slot)]
+
+    def has_instance(self, instance: int) -> bool:
+        """Return `True` if the instance has any peaks assigned."""
+        return instance in self._instance_roots
+
+    def new_instance(self) -> int:
+        """Create an empty instance and return its ID."""
+        instance = self._max_instance + 1
+        root = len(self._parents)
+        self._parents.append(root)
+        self._root_instances[root] = instance
+        self._instance_roots[instance] = root
+        self._root_node_counts[root] = dict()
+        self._root_peak_counts[root] = 0
+        self._max_instance = instance
+        return instance
+
+    def assign(self, peak_id: Hashable, node_ind: int, instance: int):
+        """Assign a peak to an instance, removing it from its current instance."""
+        current_instance = self.get_instance(peak_id)
+        if current_instance == instance:
+            return
+
+        if current_instance is not None:
+            root = self._instance_roots[current_instance]
+            node_counts = self._root_node_counts[root]
+            node_counts[node_ind] -= 1
+            if node_counts[node_ind] == 0:
+                del node_counts[node_ind]
+            self._root_peak_counts[root] -= 1
+            if self._root_peak_counts[root] == 0:
+                self._remove_instance(current_instance)
+
+        root = self._instance_roots[instance]
+        slot = len(self._parents)
+        self._parents.append(root)
+        self._peak_slots[peak_id] = slot
+        node_counts = self._root_node_counts[root]
+        node_counts[node_ind] = node_counts.get(node_ind, 0) + 1
+        self._root_peak_counts[root] += 1
+
+    def share_nodes(self, instance_a: int, instance_b: int) -> bool:
+        """Return `True` if two instances have peaks of the same node type."""
+        nodes_a = self._root_node_counts[self._instance_roots[instance_a]]
+        nodes_b = self._root_node_counts[self._instance_roots[instance_b]]
+        if len(nodes_a) > len(nodes_b):
+            nodes_a, nodes_b = nodes_b, nodes_a
+        return any(node_ind in nodes_b for node_ind in nodes_a)
+
+    def merge(self, instance: int, other_instance: int):
+        """Move all the peaks of `other_instance` to `instance`."""
+        root = self._instance_roots[instance]
+        other_root = self._instance_roots[other_instance]
+        node_counts = self._root_node_counts[root]
+        other_node_counts = self._root_node_counts[other_root]
+        peak_count = self._root_peak_counts[root]
+        other_peak_count = self._root_peak_counts[other_root]
+        self._remove_instance(other_instance)
+        self._remove_instance(instance)
+
+        # Attach the smaller tree to the larger one and add up the node counts.
+        if peak_count < other_peak_count:
+            root, other_root = other_root, root
+            node_counts, other_node_counts = other_node_counts, node_counts
+        self._parents[other_root] = root
+        for node_ind, count in other_node_counts.items():
+            node_counts[node_ind] = node_counts.get(node_ind, 0) + count
+
+        # The merged tree keeps the instance ID.
+        self._root_instances[root] = instance
+        self._instance_roots[instance] = root
+        self._root_node_counts[root] = node_counts
+        self._root_peak_counts[root] = peak_count + other_peak_count
+        self._max_instance = max(self._max_instance, instance)
+
+    def add_connection(
+        self,
+        src_peak_id: Hashable,
+        src_node_ind: int,
+        dst_peak_id: Hashable,
+        dst_node_ind: int,
+    ):
+        """Add a matched connection between two peaks to the instances."""
+        # Get instance assignments for the connection peaks.
+        src_instance = self.get_instance(src_peak_id)
+        dst_instance = self.get_instance(dst_peak_id)
+
+        if src_instance is None and dst_instance is None:
+            # Case 1: Neither peak is assigned to an instance yet. We'll create a new
+            # instance to hold both.
+            new_instance = self.new_instance()
+            self.assign(src_peak_id, src_node_ind, new_instance)
+            self.assign(dst_peak_id, dst_node_ind, new_instance)
+
+        elif src_instance is not None and dst_instance is None:
+            # Case 2: The source peak is assigned already, but not the destination
+            # peak. We'll assign the destination peak to the same instance as the
+            # source.
+            self.assign(dst_peak_id, dst_node_ind, src_instance)
+
+        elif src_instance is not None and dst_instance != src_instance:
+            # Case 3: Both peaks have been assigned. We'll update the destination peak
+            # to be a part of the source peak instance.
+            self.assign(dst_peak_id, dst_node_ind, src_instance)
+
+            # We'll also check if they form disconnected subgraphs, in which case we'll
+            # merge them by assigning all peaks belonging to the destination peak's
+            # instance to the source peak's instance.
+            if self.has_instance(dst_instance) and not self.share_nodes(
+                src_instance, dst_instance
+            ):
+                self.merge(src_instance, dst_instance)
+
+    def get_assignments(self) -> Dict[Hashable, int]:
+        """Return a dict mapping each assigned peak to its instance ID.
+
+        Peaks are ordered by when they were first assigned.
+        """
+        return {
+            peak_id: self._root_instances[self._find(slot)]
+            for peak_id, slot in self._peak_slots.items()
+        }
+
+
 def assign_connections_to_instances(
     connections: Dict[EdgeType, List[EdgeConnection]],
     min_instance_peaks: Union[int, float] = 0,
@@ -760,8 +1080,7 @@ def assign_connections_to_instances(
 
         This function expects connections from a single sample/frame!
     """
-    # Grouping table that maps PeakID(node_ind, peak_ind) to an instance_id.
-    instance_assignments = dict()
+    assembler = InstanceAssembler()
 
     # Loop through edge types.
     for edge_type, edge_connections in connections.items():
@@ -770,49 +1089,15 @@ def assign_connections_to_instances(
         for connection in edge_connections:
 
             # Notation: specific peaks are identified by (node_ind, peak_ind).
-            src_id = PeakID(edge_type.src_node_ind, connection.src_peak_ind)
-            dst_id = PeakID(edge_type.dst_node_ind, connection.dst_peak_ind)
-
-            # Get instance assignments for the connection peaks.
-            src_instance = instance_assignments.get(src_id, None)
-            dst_instance = instance_assignments.get(dst_id, None)
-
-            if src_instance is None and dst_instance is None:
-                # Case 1: Neither peak is assigned to an instance yet. We'll create a
-                # new instance to hold both.
-                new_instance = max(instance_assignments.values(), default=-1) + 1
-                instance_assignments[src_id] = new_instance
-                instance_assignments[dst_id] = new_instance
-
-            elif src_instance is not None and dst_instance is None:
-                # Case 2: The source peak is assigned already, but not the destination
-                # peak. We'll assign the destination peak to the same instance as the
-                # source.
-                instance_assignments[dst_id] = src_instance
-
-            elif src_instance is not None and dst_instance is not None:
-                # Case 3: Both peaks have been assigned. We'll update the destination
-                # peak to be a part of the source peak instance.
-                instance_assignments[dst_id] = src_instance
-
-                # We'll also check if they form disconnected subgraphs, in which case
-                # we'll merge them by assigning all peaks belonging to the destination
-                # peak's instance to the source peak's instance.
-                src_instance_nodes = set(
-                    peak_id.node_ind
-                    for peak_id, instance in instance_assignments.items()
-                    if instance == src_instance
-                )
-                dst_instance_nodes = set(
-                    peak_id.node_ind
-                    for peak_id, instance in instance_assignments.items()
-                    if instance == dst_instance
-                )
+            assembler.add_connection(
+                PeakID(edge_type.src_node_ind, connection.src_peak_ind),
+                edge_type.src_node_ind,
+                PeakID(edge_type.dst_node_ind, connection.dst_peak_ind),
+                edge_type.dst_node_ind,
+            )
 
-                if len(src_instance_nodes.intersection(dst_instance_nodes)) == 0:
-                    for peak_id in instance_assignments:
-                        if instance_assignments[peak_id] == dst_instance:
-                            instance_assignments[peak_id] = src_instance
+    # Grouping table that maps PeakID(node_ind, peak_ind) to an instance_id.
+    instance_assignments = assembler.get_assignments()
 
     if min_instance_peaks > 0:
         if isinstance(min_instance_peaks, float):
@@ -977,8 +1262,7 @@ def group_instances_sample(
         shape `(n_instances,)` and dtype `float32`.
 
     Notes:
-        This function is meant to be run as a `tf.py_function` within a graph (see
-        `group_instances_batch()`).
+        This is a convenience wrapper for `group_instances_flat()` for a single sample.
     """
     if isinstance(peaks_sample, tf.Tensor):
         # Convert all the data to numpy arrays.
@@ -990,49 +1274,208 @@ def group_instances_sample(
         match_dst_peak_inds_sample = match_dst_peak_inds_sample.numpy()
         match_line_scores_sample = match_line_scores_sample.numpy()
 
-    # Group peaks by channel.
-    peaks = []
-    peak_scores = []
-    for i in range(n_nodes):
-        in_channel = peak_channel_inds_sample == i
-        peaks.append(peaks_sample[in_channel])
-        peak_scores.append(peak_scores_sample[in_channel])
-
-    # Group connection data by edge.
-    src_peak_inds = []
-    dst_peak_inds = []
-    line_scores = []
-    for i in range(n_edges):
-        in_edge = match_edge_inds_sample == i
-        src_peak_inds.append(match_src_peak_inds_sample[in_edge])
-        dst_peak_inds.append(match_dst_peak_inds_sample[in_edge])
-        line_scores.append(match_line_scores_sample[in_edge])
-
-    # Form connections structure.
-    connections = dict()
-    for edge_ind, (src_peak_ind, dst_peak_ind, line_score) in enumerate(
-        zip(src_peak_inds, dst_peak_inds, line_scores)
+    (
+        _,
+        predicted_instances,
+        predicted_peak_scores,
+        predicted_instance_scores,
+    ) = group_instances_flat(
+        np.zeros(len(peak_channel_inds_sample), dtype="int64"),
+        peaks_sample,
+        peak_scores_sample,
+        peak_channel_inds_sample,
+        np.zeros(len(match_edge_inds_sample), dtype="int64"),
+        match_edge_inds_sample,
+        match_src_peak_inds_sample,
+        match_dst_peak_inds_sample,
+        match_line_scores_sample,
+        [(edge_type.src_node_ind, edge_type.dst_node_ind) for edge_type in edge_types],
+        n_samples=1,
+        n_nodes=n_nodes,
+        min_instance_peaks=min_instance_peaks,
+    )
+
+    return predicted_instances, predicted_peak_scores, predicted_instance_scores
+
+
+def group_instances_flat(
+    peak_sample_inds: np.ndarray,
+    peaks: np.ndarray,
+    peak_scores: np.ndarray,
+    peak_channel_inds: np.ndarray,
+    match_sample_inds: np.ndarray,
+    match_edge_inds: np.ndarray,
+    match_src_peak_inds: np.ndarray,
+    match_dst_peak_inds: np.ndarray,
+    match_line_scores: np.ndarray,
+    edge_inds: np.ndarray,
+    n_samples: int,
+    n_nodes: int,
+    min_instance_peaks: Union[int, float] = 0,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Group matched connections into full instances for a whole batch at once.
+
+    This is equivalent to calling `group_instances_sample()` on each sample, but works
+    on the flat arrays of the whole batch. Peaks are identified by their index in the
+    flat `peaks` array instead of by `PeakID`s, so all samples can be assembled in a
+    single pass and the instances are gathered with vectorized indexing.
+
+    Args:
+        peak_sample_inds: Index of the sample of each peak as an array of shape
+            `(n_peaks,)`.
+        peaks: The coordinates of the peaks as an array of shape `(n_peaks, 2)`.
+        peak_scores: The scores of the peaks as an array of shape `(n_peaks,)`.
+        peak_channel_inds: The channel (node) of each peak as an array of shape
+            `(n_peaks,)`.
+        match_sample_inds: Index of the sample of each connection as an array of shape
+            `(n_connections,)`.
+        match_edge_inds: Index of the skeleton edge of each connection as an array of
+            shape `(n_connections,)`.
+        match_src_peak_inds: Indices of the source peaks of each connection within the
+            edge-grouped peaks as an array of shape `(n_connections,)`.
+        match_dst_peak_inds: Indices of the destination peaks of each connection within
+            the edge-grouped peaks as an array of shape `(n_connections,)`.
+        match_line_scores: PAF line scores of the connections as an array of shape
+            `(n_connections,)`.
+        edge_inds: The source and destination node indices of each skeleton edge as an
+            array of shape `(n_edges, 2)`.
+        n_samples: The number of samples in the batch.
+        n_nodes: The total number of nodes in the skeleton.
+        min_instance_peaks: If this is greater than 0, grouped instances with fewer
+            assigned peaks than this threshold will be excluded. If a `float` in the
+            range `(0., 1.]` is provided, this is interpreted as a fraction of the total
+            number of nodes in the skeleton. If an `int` is provided, this is the
+            absolute minimum number of peaks.
+
+    Returns:
+        A tuple of flat arrays with the grouped instances of all samples, ordered by
+        sample:
+
+        `instance_sample_inds`: Index of the sample of each instance as an array of
+        shape `(n_instances,)` and dtype `int64`.
+
+        `predicted_instances`: The grouped coordinates for each instance as an array of
+        shape `(n_instances, n_nodes, 2)` and dtype `float32`. Missing peaks are
+        represented by `np.NaN`s.
+
+        `predicted_peak_scores`: The confidence map values for each peak as an array of
+        `(n_instances, n_nodes)` and dtype `float32`.
+
+        `predicted_instance_scores`: The grouping score for each instance as an array of
+        shape `(n_instances,)` and dtype `float32`.
+
+    See also: group_instances_batch, match_candidates_flat
+    """
+    peak_sample_inds = np.asarray(peak_sample_inds, dtype="int64").reshape(-1)
+    peaks = np.asarray(peaks, dtype="float32").reshape(-1, 2)
+    peak_scores = np.asarray(peak_scores, dtype="float32").reshape(-1)
+    peak_channel_inds = np.asarray(peak_channel_inds, dtype="int64").reshape(-1)
+    match_sample_inds = np.asarray(match_sample_inds, dtype="int64").reshape(-1)
+    match_edge_inds = np.asarray(match_edge_inds, dtype="int64").reshape(-1)
+    edge_inds = np.asarray(edge_inds, dtype="int64").reshape(-1, 2)
+    n_edges = len(edge_inds)
+
+    # Connections are assembled in order of sample and edge.
+    order = np.argsort(match_sample_inds * n_edges + match_edge_inds, kind="stable")
+    match_sample_inds = match_sample_inds[order]
+    match_edge_inds = match_edge_inds[order]
+    match_src_peak_inds = np.asarray(match_src_peak_inds, dtype="int64")[order]
+    match_dst_peak_inds = np.asarray(match_dst_peak_inds, dtype="int64")[order]
+    match_line_scores = np.asarray(match_line_scores, dtype="float32")[order]
+
+    # Convert the edge-grouped peak indices to indices into the flat peaks.
+    peak_groups = peak_sample_inds * n_nodes + peak_channel_inds
+    grouped_peak_inds = np.argsort(peak_groups, kind="stable")
+    group_starts = np.searchsorted(
+        peak_groups[grouped_peak_inds], np.arange(n_samples * n_nodes)
+    )
+    src_node_inds = edge_inds[match_edge_inds, 0]
+    dst_node_inds = edge_inds[match_edge_inds, 1]
+    src_peak_inds = grouped_peak_inds[
+        group_starts[match_sample_inds * n_nodes + src_node_inds] + match_src_peak_inds
+    ]
+    dst_peak_inds = grouped_peak_inds[
+        group_starts[match_sample_inds * n_nodes + dst_node_inds] + match_dst_peak_inds
+    ]
+
+    # Peaks of different samples are never connected, so all samples can share one
+    # assembler. Instance IDs increase with the sample index.
+    assembler = InstanceAssembler()
+    for src_peak_ind, src_node_ind, dst_peak_ind, dst_node_ind in zip(
+        src_peak_inds.tolist(),
+        src_node_inds.tolist(),
+        dst_peak_inds.tolist(),
+        dst_node_inds.tolist(),
     ):
-        connections[edge_types[edge_ind]] = [
-            EdgeConnection(src, dst, score)
-            for src, dst, score in zip(src_peak_ind, dst_peak_ind, line_score)
-        ]
+        assembler.add_connection(src_peak_ind, src_node_ind, dst_peak_ind, dst_node_ind)
+    instance_assignments = assembler.get_assignments()
+    assigned_peak_inds = np.fromiter(
+        instance_assignments.keys(), dtype="int64", count=len(instance_assignments)
+    )
+    assigned_instances = np.fromiter(
+        instance_assignments.values(), dtype="int64", count=len(instance_assignments)
+    )
 
-    # Bipartite graph partitioning to group connections into instances.
-    instance_assignments = assign_connections_to_instances(
-        connections,
-        min_instance_peaks=min_instance_peaks,
-        n_nodes=n_nodes,
+    # Filter out small instances.
+    if min_instance_peaks > 0:
+        if isinstance(min_instance_peaks, float):
+            min_instance_peaks = int(min_instance_peaks * n_nodes)
+        _, instance_inds, instance_peak_counts = np.unique(
+            assigned_instances, return_inverse=True, return_counts=True
+        )
+        is_kept = instance_peak_counts[instance_inds] >= min_instance_peaks
+        assigned_peak_inds = assigned_peak_inds[is_kept]
+        assigned_instances = assigned_instances[is_kept]
+
+    # Ensure instance IDs are contiguous.
+    instance_ids, instance_inds = np.unique(assigned_instances, return_inverse=True)
+    n_instances = len(instance_ids)
+    peak_instance_inds = np.full(len(peaks), -1, dtype="int64")
+    peak_instance_inds[assigned_peak_inds] = instance_inds
+
+    instance_sample_inds = np.zeros((n_instances,), dtype="int64")
+    instance_sample_inds[instance_inds] = peak_sample_inds[assigned_peak_inds]
+
+    # Compute instance scores as the sum of all edge scores.
+    src_instance_inds = peak_instance_inds[src_peak_inds]
+    is_assigned = src_instance_inds >= 0
+    predicted_instance_scores = np.full((n_instances,), 0.0, dtype="float32")
+    np.add.at(
+        predicted_instance_scores,
+        src_instance_inds[is_assigned],
+        match_line_scores[is_assigned],
     )
 
-    # Gather the data by instance.
-    (
+    # Sanity check: both peaks in the edge should have been assigned to the same
+    # instance.
+    assert np.all(
+        peak_instance_inds[dst_peak_inds[is_assigned]] == src_instance_inds[is_assigned]
+    )
+
+    # Fill out instances and peak scores. If an instance has more than one peak of the
+    # same node, the last assigned peak is used.
+    assigned_node_inds = peak_channel_inds[assigned_peak_inds]
+    _, last_inds = np.unique(
+        (instance_inds * n_nodes + assigned_node_inds)[::-1], return_index=True
+    )
+    last_inds = len(assigned_peak_inds) - 1 - last_inds
+    instance_inds = instance_inds[last_inds]
+    assigned_node_inds = assigned_node_inds[last_inds]
+    assigned_peak_inds = assigned_peak_inds[last_inds]
+
+    predicted_instances = np.full((n_instances, n_nodes, 2), np.nan, dtype="float32")
+    predicted_peak_scores = np.full((n_instances, n_nodes), np.nan, dtype="float32")
+    predicted_instances[instance_inds, assigned_node_inds] = peaks[assigned_peak_inds]
+    predicted_peak_scores[instance_inds, assigned_node_inds] = peak_scores[
+        assigned_peak_inds
+    ]
+
+    return (
+        instance_sample_inds,
         predicted_instances,
         predicted_peak_scores,
         predicted_instance_scores,
-    ) = make_predicted_instances(peaks, peak_scores, connections, instance_assignments)
-
-    return predicted_instances, predicted_peak_scores, predicted_instance_scores
+    )
 
 
 def group_instances_batch(
@@ -1101,99 +1544,74 @@ def group_instances_batch(
         instance as an array of shape `(n_samples, (n_instances))` and dtype
         `tf.float32`.
 
-    See also: match_candidates_batch, group_instances_sample
+    Notes:
+        All samples are grouped by `group_instances_flat()` within a single
+        `tf.numpy_function`.
+
+    See also: match_candidates_batch, group_instances_flat
     """
 
-    def _group_instances_sample(
-        peaks_sample,
-        peak_scores_sample,
-        peak_channel_inds_sample,
-        match_edge_inds_sample,
-        match_src_peak_inds_sample,
-        match_dst_peak_inds_sample,
-        match_line_scores_sample,
-        n_nodes,
-        n_edges,
-        min_instance_peaks,
+    edge_inds = [
+        (edge_type.src_node_ind, edge_type.dst_node_ind) for edge_type in edge_types
+    ]
+
+    def _group_instances_flat(
+        peak_sample_inds,
+        peaks,
+        peak_scores,
+        peak_channel_inds,
+        match_sample_inds,
+        match_edge_inds,
+        match_src_peak_inds,
+        match_dst_peak_inds,
+        match_line_scores,
+        n_samples,
     ):
-        """Helper to avoid passing `EdgeType`s to `tf.py_function`."""
-        return group_instances_sample(
-            peaks_sample,
-            peak_scores_sample,
-            peak_channel_inds_sample,
-            match_edge_inds_sample,
-            match_src_peak_inds_sample,
-            match_dst_peak_inds_sample,
-            match_line_scores_sample,
+        """Helper to avoid passing `EdgeType`s to `tf.numpy_function`."""
+        return group_instances_flat(
+            peak_sample_inds,
+            peaks,
+            peak_scores,
+            peak_channel_inds,
+            match_sample_inds,
+            match_edge_inds,
+            match_src_peak_inds,
+            match_dst_peak_inds,
+            match_line_scores,
+            edge_inds,
+            int(n_samples),
             n_nodes,
-            n_edges,
-            edge_types,
             min_instance_peaks,
         )
 
     n_samples = peaks.nrows()
 
-    sample_inds = tf.TensorArray(
-        tf.int32, size=n_samples, infer_shape=False, element_shape=[None]
-    )
-    predicted_instances = tf.TensorArray(
-        size=n_samples,
-        dtype=tf.float32,
-        infer_shape=False,
-        element_shape=[None, n_nodes, 2],
-    )
-    predicted_peak_scores = tf.TensorArray(
-        size=n_samples,
-        dtype=tf.float32,
-        infer_shape=False,
-        element_shape=[None, n_nodes],
-    )
-    predicted_instance_scores = tf.TensorArray(
-        size=n_samples, dtype=tf.float32, infer_shape=False, element_shape=[None]
+    # Group all the samples in a single call.
+    (
+        sample_inds,
+        predicted_instances,
+        predicted_peak_scores,
+        predicted_instance_scores,
+    ) = tf.numpy_function(
+        _group_instances_flat,
+        inp=[
+            peaks.value_rowids(),
+            peaks.flat_values,
+            peak_vals.flat_values,
+            peak_channel_inds.flat_values,
+            match_edge_inds.value_rowids(),
+            match_edge_inds.flat_values,
+            match_src_peak_inds.flat_values,
+            match_dst_peak_inds.flat_values,
+            match_line_scores.flat_values,
+            n_samples,
+        ],
+        Tout=[tf.int64, tf.float32, tf.float32, tf.float32],
     )
-
-    for sample in range(n_samples):
-
-        # Call sample-wise function in Eager mode.
-        (
-            predicted_instances_sample,
-            predicted_peak_scores_sample,
-            predicted_instance_scores_sample,
-        ) = tf.py_function(
-            _group_instances_sample,
-            inp=[
-                peaks[sample],
-                peak_vals[sample],
-                peak_channel_inds[sample],
-                match_edge_inds[sample],
-                match_src_peak_inds[sample],
-                match_dst_peak_inds[sample],
-                match_line_scores[sample],
-                n_nodes,
-                n_edges,
-                # edge_types, # not serializable!
-                min_instance_peaks,
-            ],
-            Tout=[tf.float32, tf.float32, tf.float32],
-        )
-
-        sample_inds = sample_inds.write(
-            sample, tf.repeat([sample], [tf.shape(predicted_instances_sample)[0]])
-        )
-        predicted_instances = predicted_instances.write(
-            sample, predicted_instances_sample
-        )
-        predicted_peak_scores = predicted_peak_scores.write(
-            sample, predicted_peak_scores_sample
-        )
-        predicted_instance_scores = predicted_instance_scores.write(
-            sample, predicted_instance_scores_sample
-        )
-
-    sample_inds = sample_inds.concat()
-    predicted_instances = predicted_instances.concat()
-    predicted_peak_scores = predicted_peak_scores.concat()
-    predicted_instance_scores = predicted_instance_scores.concat()
+    sample_inds.set_shape([None])
+    predicted_instances.set_shape([None, n_nodes, 2])
+    predicted_peak_scores.set_shape([None, n_nodes])
+    predicted_instance_scores.set_shape([None])
 
     predicted_instances = tf.RaggedTensor.from_value_rowids(
         predicted_instances, sample_inds, nrows=n_samples
@@ -0,0 +1,300 @@
+"""
+Opt-in timing of the stages of the inference pipeline.
+
+The stages of inference are timed when profiling is enabled:
+
+- `"provider_fetch"`: Reading frames from the data provider (video decoding).
+- `"motion_gating"`: Checking frames for motion with a `MotionGate`, if enabled.
+- `"preprocess"`: `InferenceLayer.preprocess` (colorspace, scaling and padding).
+- `"forward_pass"`: The forward pass of the Keras model.
+- `"paf_scoring"`: `PAFScorer.predict` (PAF line scoring, matching and grouping).
+- `"tracking"`: `Tracker.track` for each frame.
+- `"serialization"`: Writing the predictions to the output file.
+
+The profiler records the number of calls, the total, minimum and maximum wall time
+and a histogram of the times of each stage. It is safe to use from multiple threads.
+
+Stages that run within the TensorFlow graph of the inference model are timed with
+`graph_stage_start` and `graph_stage_end`, which add timestamp ops to the graph. These
+are only added when profiling is enabled while the model is traced, so profiling must be
+enabled before running inference for the first time.
+
+Usage:
+
+> from sleap.nn.profiling import get_profiler
+> profiler = get_profiler()
+> profiler.enable()
+> predictor.predict(video)
+> print(profiler.summary_table())
+> profiler.save("profile.json")
+
+From the command line: `sleap-track ... --profile profile.json`
+"""
+
+import contextlib
+import json
+import threading
+from time import perf_counter
+from typing import Any, Dict, Optional, Text, Tuple
+
+import numpy as np
+import tensorflow as tf
+
+
+# Stages of the inference pipeline in the order they are listed in summaries.
+PROFILE_STAGES = (
+    "provider_fetch",
+    "motion_gating",
+    "preprocess",
+    "forward_pass",
+    "paf_scoring",
+    "tracking",
+    "serialization",
+)
+
+# Bin edges of the time histograms in seconds, with 4 bins per decade from 1 us to
+# 1000 s. Times outside of this range are counted in the first or last bin.
+HISTOGRAM_EDGES = np.logspace(-6, 3, 37)
+
+
+class StageStats:
+    """Timing statistics of a single stage.
+
+    Attributes:
+        count: Number of times the stage was recorded.
+        total: Total time spent in the stage in seconds.
+        min: Shortest recorded time in seconds.
+        max: Longest recorded time in seconds.
+        histogram: Number of recorded times in each bin of `HISTOGRAM_EDGES`.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+        self.histogram = np.zeros(len(HISTOGRAM_EDGES) - 1, dtype="int64")
+
+    def add(self, elapsed: float):
+        """Add a recorded time in seconds."""
+        self.count += 1
+        self.total += elapsed
+        self.min = min(self.min, elapsed)
+        self.max = max(self.max, elapsed)
+        bin_ind = np.searchsorted(HISTOGRAM_EDGES, elapsed, side="right") - 1
+        self.histogram[np.clip(bin_ind, 0, len(self.histogram) - 1)] += 1
+
+    @property
+    def mean(self) -> float:
+        """Return the mean time in seconds."""
+        return self.total / self.count if self.count > 0 else 0.0
+
+    def percentile(self, q: float) -> float:
+        """Estimate a percentile of the recorded times from the histogram.
+
+        Args:
+            q: Percentile in the range [0, 100].
+
+        Returns:
+            The geometric center of the histogram bin that contains the percentile,
+            clipped to the range of the recorded times, in seconds.
+        """
+        if self.count == 0:
+            return 0.0
+        bin_ind = np.searchsorted(np.cumsum(self.histogram), q / 100 * self.count)
+        bin_ind = min(bin_ind, len(self.histogram) - 1)
+        center = np.sqrt(HISTOGRAM_EDGES[bin_ind] * HISTOGRAM_EDGES[bin_ind + 1])
+        return float(np.clip(center, self.min, self.max))
+
+    def to_dict(self) -> Dict[Text, Any]:
+        """Return the statistics as a JSON serializable dictionary."""
+        return dict(
+            count=self.count,
+            total=self.total,
+            mean=self.mean,
+            min=self.min if self.count > 0 else 0.0,
+            max=self.max,
+            p50=self.percentile(50),
+            p95=self.percentile(95),
+            histogram=self.histogram.tolist(),
+        )
+
+
+class StageProfiler:
+    """Thread-safe recorder of the time spent in named stages.
+
+    Attributes:
+        enabled: If `False`, nothing is recorded. Profiling is disabled by default.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def enable(self):
+        """Start recording stage times."""
+        self.enabled = True
+
+    def disable(self):
+        """Stop recording stage times."""
+        self.enabled = False
+
+    def reset(self):
+        """Remove all recorded times."""
+        with self._lock:
+            self._stats = {}
+
+    def record(self, stage: Text, elapsed: float):
+        """Record the time spent in a stage.
+
+        Args:
+            stage: Name of the stage.
+            elapsed: Wall time in seconds.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            if stage not in self._stats:
+                self._stats[stage] = StageStats()
+            self._stats[stage].add(float(elapsed))
+
+    @contextlib.contextmanager
+    def stage(self, stage: Text):
+        """Context manager that records the time spent in its block.
+
+        Args:
+            stage: Name of the stage.
+        """
+        if not self.enabled:
+            yield
+            return
+        t0 = perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, perf_counter() - t0)
+
+    @property
+    def stages(self) -> Tuple[Text, ...]:
+        """Return the names of the recorded stages in a stable order.
+
+        The stages in `PROFILE_STAGES` are listed first, followed by any other stages
+        in alphabetical order, so that summaries of different runs line up.
+        """
+        with self._lock:
+            names = set(self._stats)
+        known = [stage for stage in PROFILE_STAGES if stage in names]
+        return tuple(known + sorted(names - set(known)))
+
+    def get_stats(self, stage: Text) -> Optional[StageStats]:
+        """Return the statistics of a stage or `None` if it was never recorded."""
+        with self._lock:
+            return self._stats.get(stage, None)
+
+    def to_dict(self) -> Dict[Text, Any]:
+        """Return the recorded statistics as a JSON serializable dictionary."""
+        with self._lock:
+            stats = {stage: self._stats[stage].to_dict() for stage in self._stats}
+        return dict(
+            histogram_edges=HISTOGRAM_EDGES.tolist(),
+            stages={stage: stats[stage] for stage in self.stages if stage in stats},
+        )
+
+    def save(self, filename: Text):
+        """Save the recorded statistics to a JSON file.
+
+        Args:
+            filename: Path to the output file.
+        """
+        with open(filename, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def summary_table(self) -> Text:
+        """Return a plain text table with the statistics of each stage.
+
+        Times are in milliseconds except for the total time, which is in seconds.
+        """
+        header = (
+            f"{'stage':<16} {'count':>8} {'total (s)':>10} {'mean (ms)':>10} "
+            f"{'p50 (ms)':>10} {'p95 (ms)':>10} {'max (ms)':>10}"
+        )
+        lines = [header, "-" * len(header)]
+        for stage in self.stages:
+            stats = self.get_stats(stage)
+            lines.append(
+                f"{stage:<16} {stats.count:>8d} {stats.total:>10.3f} "
+                f"{stats.mean * 1000:>10.3f} {stats.percentile(50) * 1000:>10.3f} "
+                f"{stats.percentile(95) * 1000:>10.3f} {stats.max * 1000:>10.3f}"
+            )
+        return "\n".join(lines)
+
+
+_profiler = StageProfiler()
+
+
+def get_profiler() -> StageProfiler:
+    """Return the process-wide stage profiler."""
+    return _profiler
+
+
+def profile_stage(stage: Text):
+    """Return a context manager that records the time spent in its block.
+
+    This does nothing if the process-wide profiler is disabled.
+
+    Args:
+        stage: Name of the stage.
+    """
+    return _profiler.stage(stage)
+
+
+def graph_stage_start(inputs: Any) -> Tuple[Optional[tf.Tensor], Any]:
+    """Mark the start of a stage in a TensorFlow graph.
+
+    Args:
+        inputs: A tensor or nested structure of tensors that are the inputs of the
+            stage.
+
+    Returns:
+        A tuple of `(start, inputs)`. `start` is a timestamp tensor that is taken after
+        the inputs are computed, or `None` if profiling is disabled. `inputs` are the
+        inputs that the stage should use, which are computed only after the timestamp.
+    """
+    if not _profiler.enabled:
+        return None, inputs
+
+    with tf.control_dependencies(tf.nest.flatten(inputs, expand_composites=True)):
+        start = tf.timestamp()
+    with tf.control_dependencies([start]):
+        inputs = tf.nest.map_structure(tf.identity, inputs, expand_composites=True)
+    return start, inputs
+
+
+def graph_stage_end(stage: Text, start: Optional[tf.Tensor], outputs: Any) -> Any:
+    """Mark the end of a stage in a TensorFlow graph and record its time.
+
+    Args:
+        stage: Name of the stage.
+        start: The timestamp returned by `graph_stage_start`. If `None`, nothing is
+            recorded.
+        outputs: A tensor or nested structure of tensors that are the outputs of the
+            stage.
+
+    Returns:
+        The outputs of the stage, which are computed only after the time is recorded.
+    """
+    if start is None:
+        return outputs
+
+    with tf.control_dependencies(tf.nest.flatten(outputs, expand_composites=True)):
+        end = tf.timestamp()
+
+    def record(start, end):
+        _profiler.record(stage, end - start)
+        return np.int32(0)
+
+    done = tf.numpy_function(record, [start, end], tf.int32)
+    with tf.control_dependencies([done]):
+        outputs = tf.nest.map_structure(tf.identity, outputs, expand_composites=True)
+    return outputs
@@ -14,7 +14,7 @@ Main types of functions:
 """
 import operator
 from collections import defaultdict
-from typing import List, Tuple, Optional, TypeVar, Callable
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar
 
 import attr
 import numpy as np
@@ -26,6 +26,72 @@ from sleap.nn import utils
 InstanceType = TypeVar("InstanceType", Instance, PredictedInstance)
 
 
+@attr.s(auto_attribs=True)
+class InstanceFeatureCache:
+    """Per-tracker cache of the instance features used for matching.
+
+    Features are computed the first time they are needed and kept until the instance
+    is evicted. Trackers evict instances when their frame leaves the matching window,
+    so the cache only holds features of the instances that can still be matched
+    against.
+
+    Only `Instance`s are cached. Other instance-like candidates, such as flow shifted
+    instances, are created for a single frame and their features are not stored.
+    """
+
+    _points: Dict[InstanceType, np.ndarray] = attr.ib(factory=dict)
+    _centroids: Dict[InstanceType, np.ndarray] = attr.ib(factory=dict)
+    _bounding_boxes: Dict[InstanceType, np.ndarray] = attr.ib(factory=dict)
+
+    def __len__(self) -> int:
+        """Return the number of instances with cached features."""
+        return len(self._points)
+
+    def points(self, instance: InstanceType) -> np.ndarray:
+        """Return the `(n_nodes, 2)` points array of an instance."""
+        if not isinstance(instance, Instance):
+            return instance.points_array
+        if instance not in self._points:
+            self._points[instance] = instance.points_array
+        return self._points[instance]
+
+    def stack_points(self, instances: List[InstanceType]) -> np.ndarray:
+        """Return the `(n_instances, n_nodes, 2)` points of a list of instances."""
+        return np.stack([self.points(instance) for instance in instances])
+
+    def centroid(self, instance: InstanceType) -> np.ndarray:
+        """Return the centroid of an instance (median of its visible points)."""
+        if not isinstance(instance, Instance):
+            return instance.centroid
+        if instance not in self._centroids:
+            self._centroids[instance] = np.nanmedian(self.points(instance), axis=0)
+        return self._centroids[instance]
+
+    def bounding_box(self, instance: InstanceType) -> np.ndarray:
+        """Return the bounding box of an instance in `[y1, x1, y2, x2]` format."""
+        if not isinstance(instance, Instance):
+            return instance.bounding_box
+        if instance not in self._bounding_boxes:
+            points = self.points(instance)
+            self._bounding_boxes[instance] = np.concatenate(
+                [np.nanmin(points, axis=0)[::-1], np.nanmax(points, axis=0)[::-1]]
+            )
+        return self._bounding_boxes[instance]
+
+    def evict(self, instances: List[InstanceType]):
+        """Remove the features of instances from the cache."""
+        for instance in instances:
+            self._points.pop(instance, None)
+            self._centroids.pop(instance, None)
+            self._bounding_boxes.pop(instance, None)
+
+    def clear(self):
+        """Remove all cached features."""
+        self._points.clear()
+        self._centroids.clear()
+        self._bounding_boxes.clear()
+
+
 def instance_similarity(
     ref_instance: InstanceType, query_instance: InstanceType
 ) -> float:
@@ -41,74 +107,217 @@ def instance_similarity(
 
 
 def centroid_distance(
-    ref_instance: InstanceType, query_instance: InstanceType, cache: dict = dict()
+    ref_instance: InstanceType,
+    query_instance: InstanceType,
+    cache: Optional[InstanceFeatureCache] = None,
 ) -> float:
     """Returns the negative distance between the centroids of two instances.
 
-    Uses `cache` dictionary (created with function so it persists between calls)
-    since without cache this method is significantly slower than others.
+    If a `cache` is provided, the centroids are read from it.
     """
-
-    if ref_instance not in cache:
-        cache[ref_instance] = ref_instance.centroid
-
-    if query_instance not in cache:
-        cache[query_instance] = query_instance.centroid
-
-    a = cache[ref_instance]
-    b = cache[query_instance]
+    if cache is None:
+        a, b = ref_instance.centroid, query_instance.centroid
+    else:
+        a, b = cache.centroid(ref_instance), cache.centroid(query_instance)
 
     return -np.linalg.norm(a - b)
 
 
 def instance_iou(
-    ref_instance: InstanceType, query_instance: InstanceType, cache: dict = dict()
+    ref_instance: InstanceType,
+    query_instance: InstanceType,
+    cache: Optional[InstanceFeatureCache] = None,
 ) -> float:
-    """Computes IOU between bounding boxes of instances."""
+    """Computes IOU between bounding boxes of instances.
+
+    If a `cache` is provided, the bounding boxes are read from it.
+    """
+    if cache is None:
+        a, b = ref_instance.bounding_box, query_instance.bounding_box
+    else:
+        a, b = cache.bounding_box(ref_instance), cache.bounding_box(query_instance)
 
-    if ref_instance not in cache:
-        cache[ref_instance] = ref_instance.bounding_box
+    return utils.compute_iou(a, b)
 
-    if query_instance not in cache:
-        cache[query_instance] = query_instance.bounding_box
 
-    a = cache[ref_instance]
-    b = cache[query_instance]
+def instance_similarity_batch(
+    ref_points: np.ndarray, query_points: np.ndarray
+) -> np.ndarray:
+    """Computes similarity between all pairs of instances.
 
-    return utils.compute_iou(a, b)
+    This is a vectorized version of `instance_similarity`.
+
+    Args:
+        ref_points: Points of the reference instances with shape
+            (n_ref, n_nodes, 2).
+        query_points: Points of the query instances with shape
+            (n_query, n_nodes, 2).
+
+    Returns:
+        An array of shape (n_ref, n_query) with the similarity of each pair.
+    """
+    ref_visible = ~(np.isnan(ref_points).any(axis=2))
+    dists = np.sum((query_points[None] - ref_points[:, None]) ** 2, axis=3)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        similarity = np.nansum(np.exp(-dists), axis=2) / np.sum(
+            ref_visible, axis=1, keepdims=True
+        )
+
+    return similarity
+
+
+def centroid_distance_batch(
+    ref_points: np.ndarray, query_points: np.ndarray
+) -> np.ndarray:
+    """Returns the negative distance between the centroids of all pairs of instances.
+
+    This is a vectorized version of `centroid_distance`. See
+    `instance_similarity_batch` for the arguments.
+    """
+    ref_centroids = np.nanmedian(ref_points, axis=1)
+    query_centroids = np.nanmedian(query_points, axis=1)
+
+    return -np.linalg.norm(ref_centroids[:, None] - query_centroids[None], axis=2)
+
+
+def instance_iou_batch(ref_points: np.ndarray, query_points: np.ndarray) -> np.ndarray:
+    """Computes IOU between bounding boxes of all pairs of instances.
+
+    This is a vectorized version of `instance_iou`. See `instance_similarity_batch`
+    for the arguments.
+    """
+
+    def bounding_boxes(points):
+        return np.concatenate(
+            [np.nanmin(points, axis=1)[:, ::-1], np.nanmax(points, axis=1)[:, ::-1]],
+            axis=1,
+        )
+
+    return utils.compute_iou_matrix(
+        bounding_boxes(ref_points), bounding_boxes(query_points)
+    )
+
+
+# Vectorized versions of the pairwise similarity functions.
+batch_similarity_functions = {
+    instance_similarity: instance_similarity_batch,
+    centroid_distance: centroid_distance_batch,
+    instance_iou: instance_iou_batch,
+}
+
+
+def max_similarity_by_track(
+    similarities: np.ndarray, track_inds: np.ndarray, n_tracks: int
+) -> np.ndarray:
+    """Reduces similarities with candidate instances to the best one of each track.
+
+    Args:
+        similarities: Array of shape (n_instances, n_candidates) with similarities
+            between instances and candidate instances.
+        track_inds: Array of shape (n_candidates,) with the index of the track of each
+            candidate. Every track must have at least one candidate.
+        n_tracks: Number of tracks.
+
+    Returns:
+        An array of shape (n_instances, n_tracks) with the highest similarity among the
+        candidates of each track. This is NaN if any of the similarities is NaN.
+    """
+    order = np.argsort(track_inds, kind="stable")
+    starts = np.searchsorted(track_inds[order], np.arange(n_tracks))
+    return np.maximum.reduceat(similarities[:, order], starts, axis=1)
 
 
 def hungarian_matching(cost_matrix: np.ndarray) -> List[Tuple[int, int]]:
-    """Wrapper for Hungarian matching algorithm in scipy."""
+    """Wrapper for Hungarian matching algorithm in scipy.
 
-    row_ind, col_ind = linear_sum_assignment(cost_matrix)
-    return list(zip(row_ind, col_ind))
+    Pairs with infinite (or NaN) cost are never matched.
+    """
+    feasible = cost_matrix < np.inf
+    if feasible.all():
+        row_ind, col_ind = linear_sum_assignment(cost_matrix)
+        return list(zip(row_ind, col_ind))
+
+    if not feasible.any():
+        return []
+
+    # Replace infeasible costs with a cost that is higher than any difference between
+    # the total costs of two matchings, so that as many feasible pairs as possible are
+    # matched and the optimal matching among those is found.
+    feasible_costs = cost_matrix[feasible]
+    infeasible_cost = feasible_costs.max() + (
+        feasible_costs.max() - feasible_costs.min() + 1
+    ) * (min(cost_matrix.shape) + 1)
+    row_ind, col_ind = linear_sum_assignment(
+        np.where(feasible, cost_matrix, infeasible_cost)
+    )
+    return [(i, j) for i, j in zip(row_ind, col_ind) if feasible[i, j]]
 
 
 def greedy_matching(cost_matrix: np.ndarray) -> List[Tuple[int, int]]:
     """
     Performs greedy bipartite matching.
-    """
 
-    # Sort edges by ascending cost.
-    rows, cols = np.unravel_index(np.argsort(cost_matrix, axis=None), cost_matrix.shape)
-    unassigned_edges = list(zip(rows, cols))
+    Edges are assigned in order of ascending cost, skipping edges with an instance or
+    track that is already assigned. Edges with infinite (or NaN) cost are never
+    assigned. This takes O(E log E) time for E edges.
+    """
+    # Sort edges by ascending cost and drop the infeasible ones.
+    edge_inds = np.argsort(cost_matrix, axis=None)
+    edge_inds = edge_inds[cost_matrix.flat[edge_inds] < np.inf]
+    rows, cols = np.unravel_index(edge_inds, cost_matrix.shape)
 
     # Greedily assign edges.
+    row_assigned = np.zeros(cost_matrix.shape[0], dtype=bool)
+    col_assigned = np.zeros(cost_matrix.shape[-1], dtype=bool)
+    max_assignments = min(cost_matrix.shape)
     assignments = []
-    while len(unassigned_edges) > 0:
-        # Assign the lowest cost edge.
-        row_ind, col_ind = unassigned_edges.pop(0)
+    for row_ind, col_ind in zip(rows, cols):
+        if row_assigned[row_ind] or col_assigned[col_ind]:
+            continue
+
+        # Assign the lowest cost edge that doesn't contain an assigned node.
         assignments.append((row_ind, col_ind))
+        row_assigned[row_ind] = True
+        col_assigned[col_ind] = True
 
-        # Remove all other edges that contain either node (in reverse order).
-        for i in range(len(unassigned_edges) - 1, -1, -1):
-            if unassigned_edges[i][0] == row_ind or unassigned_edges[i][1] == col_ind:
-                del unassigned_edges[i]
+        if len(assignments) == max_assignments:
+            break
 
     return assignments
 
 
+def centroid_gate(
+    instances: List[InstanceType],
+    candidate_instances: List[InstanceType],
+    max_distance: float,
+    feature_cache: Optional[InstanceFeatureCache] = None,
+) -> np.ndarray:
+    """Finds the pairs of instances with centroids within a distance of each other.
+
+    This is used to make the cost matrix sparse: similarities are only computed for
+    the pairs within the gate.
+
+    Args:
+        instances: List of `n` instances.
+        candidate_instances: List of `m` candidate instances.
+        max_distance: Maximum distance between the centroids of a pair.
+        feature_cache: Optional cache to read the centroids from.
+
+    Returns:
+        A boolean array of shape `(n, m)` which is `True` for the pairs within the
+        gate. Pairs with undefined centroids are not within the gate.
+    """
+    if feature_cache is None:
+        feature_cache = InstanceFeatureCache()
+
+    centroids = np.stack([feature_cache.centroid(inst) for inst in instances])
+    candidate_centroids = np.stack(
+        [feature_cache.centroid(inst) for inst in candidate_instances]
+    )
+    dists = np.linalg.norm(centroids[:, None] - candidate_centroids[None], axis=2)
+    return dists <= max_distance
+
+
 def nms_instances(
     instances, iou_threshold, target_count=None
 ) -> Tuple[List[PredictedInstance], List[PredictedInstance]]:
@@ -385,7 +594,8 @@ class FrameMatches:
     Attributes:
         matches: the list of `Match` objects.
         cost_matrix: the cost matrix, shape is
-            (number of untracked instances, number of candidate tracks).
+            (number of untracked instances, number of candidate tracks). Pairs
+            which can't be matched have infinite cost.
         unmatched_instances: the instances for which we are finding matches.
 
     """
@@ -410,7 +620,26 @@ class FrameMatches:
         candidate_instances: List[InstanceType],
         similarity_function: Callable,
         matching_function: Callable,
+        feature_cache: Optional[InstanceFeatureCache] = None,
+        max_centroid_distance: Optional[float] = None,
     ):
+        """Matches untracked instances to the tracks of candidate instances.
+
+        Args:
+            untracked_instances: The instances to match.
+            candidate_instances: Instances with tracks to match against.
+            similarity_function: Pairwise instance similarity function.
+            matching_function: Function that takes a cost matrix and returns the
+                matched `(instance, track)` index pairs.
+            feature_cache: Optional cache of instance features.
+            max_centroid_distance: If set, only pairs of instances with centroids
+                within this distance are scored. Other pairs can't be matched.
+
+        Returns:
+            The `FrameMatches`.
+        """
+        if feature_cache is None:
+            feature_cache = InstanceFeatureCache()
 
         cost = np.ndarray((0,))
         candidate_tracks = []
@@ -425,30 +654,39 @@ class FrameMatches:
             # Compute similarity matrix between untracked instances and best
             # candidate for each track.
             candidate_tracks = list(candidate_instances_by_track.keys())
-            matching_similarities = np.full(
-                (len(untracked_instances), len(candidate_tracks)), np.nan
-            )
-
-            for i, untracked_instance in enumerate(untracked_instances):
 
-                for j, candidate_track in enumerate(candidate_tracks):
-                    # Compute similarity between untracked instance and all track
-                    # candidates.
-                    track_instances = candidate_instances_by_track[candidate_track]
-                    track_matching_similarities = [
-                        similarity_function(
-                            untracked_instance,
-                            candidate_instance,
-                        )
-                        for candidate_instance in track_instances
-                    ]
-
-                    # Keep the best scoring instance for this track.
-                    best_ind = np.argmax(track_matching_similarities)
+            # Only score the pairs of instances that are close enough to match.
+            gate = None
+            if max_centroid_distance is not None and untracked_instances:
+                gate = centroid_gate(
+                    untracked_instances,
+                    [
+                        instance
+                        for track_instances in candidate_instances_by_track.values()
+                        for instance in track_instances
+                    ],
+                    max_centroid_distance,
+                    feature_cache,
+                )
 
-                    # Use the best similarity score for matching.
-                    best_similarity = track_matching_similarities[best_ind]
-                    matching_similarities[i, j] = best_similarity
+            batch_similarity_function = batch_similarity_functions.get(
+                similarity_function
+            )
+            if batch_similarity_function is not None:
+                matching_similarities = cls._batch_track_similarities(
+                    untracked_instances,
+                    candidate_instances_by_track,
+                    batch_similarity_function,
+                    feature_cache,
+                    gate,
+                )
+            else:
+                matching_similarities = cls._track_similarities(
+                    untracked_instances,
+                    candidate_instances_by_track,
+                    similarity_function,
+                    gate,
+                )
 
             # Perform matching between untracked instances and candidates.
             cost = -matching_similarities
@@ -458,6 +696,90 @@ class FrameMatches:
             cost, untracked_instances, candidate_tracks, matching_function
         )
 
+    @staticmethod
+    def _track_similarities(
+        untracked_instances: List[InstanceType],
+        candidate_instances_by_track: Dict[Track, List[InstanceType]],
+        similarity_function: Callable,
+        gate: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """Computes the best similarity to each track one pair at a time.
+
+        Pairs outside of the `gate` are not scored and get a similarity of `-inf`.
+        """
+        matching_similarities = np.full(
+            (len(untracked_instances), len(candidate_instances_by_track)), np.nan
+        )
+
+        for i, untracked_instance in enumerate(untracked_instances):
+
+            k = 0
+            for j, track_instances in enumerate(candidate_instances_by_track.values()):
+                # Compute similarity between untracked instance and all track
+                # candidates.
+                track_matching_similarities = [
+                    similarity_function(
+                        untracked_instance,
+                        candidate_instance,
+                    )
+                    if gate is None or gate[i, k + n]
+                    else -np.inf
+                    for n, candidate_instance in enumerate(track_instances)
+                ]
+                k += len(track_instances)
+
+                # Keep the best scoring instance for this track.
+                best_ind = np.argmax(track_matching_similarities)
+
+                # Use the best similarity score for matching.
+                best_similarity = track_matching_similarities[best_ind]
+                matching_similarities[i, j] = best_similarity
+
+        return matching_similarities
+
+    @staticmethod
+    def _batch_track_similarities(
+        untracked_instances: List[InstanceType],
+        candidate_instances_by_track: Dict[Track, List[InstanceType]],
+        batch_similarity_function: Callable,
+        feature_cache: InstanceFeatureCache,
+        gate: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """Computes the best similarity to each track for all pairs at once.
+
+        If a `gate` is given, only the instances and candidates with a pair inside the
+        gate are scored, and pairs outside of the gate get a similarity of `-inf`.
+        """
+        n_tracks = len(candidate_instances_by_track)
+        if len(untracked_instances) == 0:
+            return np.full((0, n_tracks), np.nan)
+
+        candidate_instances = []
+        candidate_track_inds = []
+        for j, track_instances in enumerate(candidate_instances_by_track.values()):
+            candidate_instances.extend(track_instances)
+            candidate_track_inds.extend([j] * len(track_instances))
+
+        if gate is None:
+            similarities = batch_similarity_function(
+                feature_cache.stack_points(untracked_instances),
+                feature_cache.stack_points(candidate_instances),
+            )
+        else:
+            similarities = np.full(gate.shape, -np.inf)
+            rows = np.flatnonzero(gate.any(axis=1))
+            cols = np.flatnonzero(gate.any(axis=0))
+            if len(rows) > 0:
+                similarities[np.ix_(rows, cols)] = batch_similarity_function(
+                    feature_cache.stack_points([untracked_instances[i] for i in rows]),
+                    feature_cache.stack_points([candidate_instances[j] for j in cols]),
+                )
+                similarities[~gate] = -np.inf
+
+        return max_similarity_by_track(
+            similarities, np.array(candidate_track_inds), n_tracks
+        )
+
     @classmethod
     def from_cost_matrix(
         cls,
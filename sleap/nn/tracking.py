@@ -3,11 +3,12 @@
 from collections import deque, defaultdict
 import abc
 import attr
+import cattr
 import numpy as np
 import cv2
 from typing import Callable, Deque, Dict, Iterable, List, Optional, Tuple
 
-from sleap import Track, LabeledFrame, Skeleton
+from sleap import Instance, PredictedInstance, Track, LabeledFrame, Skeleton, Video
 
 from sleap.nn.tracker.components import (
     instance_similarity,
@@ -19,6 +20,7 @@ from sleap.nn.tracker.components import (
     cull_frame_instances,
     connect_single_track_breaks,
     InstanceType,
+    InstanceFeatureCache,
     FrameMatches,
     Match,
 )
@@ -106,12 +108,40 @@ class FlowCandidateMaker:
     def uses_image(self):
         return True
 
+    def preprocess_image(self, img: np.ndarray) -> np.ndarray:
+        """Converts a frame to the scaled grayscale image used for optical flow.
+
+        Trackers preprocess each frame once and keep only the preprocessed image in the
+        matching queue, so it is reused for every frame that it is matched against.
+
+        Args:
+            img: Frame image as a numpy array or tensor.
+
+        Returns:
+            The uint8 grayscale image scaled by `img_scale`.
+        """
+        return self.prepare_image(img, scale=self.img_scale)
+
     def get_candidates(
         self,
         track_matching_queue: Deque[MatchedFrameInstances],
         t: int,
         img: np.ndarray,
     ) -> List[ShiftedInstance]:
+        """Returns the instances in the queue flow shifted to the current frame.
+
+        Args:
+            track_matching_queue: Queue of the previously tracked frames.
+            t: Current timestep.
+            img: Current frame image.
+
+        Returns:
+            A list of the shifted instances.
+
+        Notes:
+            The current frame image and the images in the queue must have been
+            preprocessed with `preprocess_image`, as `Tracker.track` does.
+        """
         candidate_instances = []
         for matched_item in track_matching_queue:
             ref_t, ref_img, ref_instances = (
@@ -130,6 +160,7 @@ class FlowCandidateMaker:
                     scale=self.img_scale,
                     window_size=self.of_window_size,
                     max_levels=self.of_max_levels,
+                    preprocessed=True,
                 )
 
                 # Add to candidate pool.
@@ -140,6 +171,38 @@ class FlowCandidateMaker:
                     self.shifted_instances[(ref_t, t)] = shifted_instances
         return candidate_instances
 
+    @staticmethod
+    def prepare_image(img: np.ndarray, scale: float = 1.0) -> np.ndarray:
+        """Converts an image to the scaled uint8 grayscale image used for optical flow.
+
+        Args:
+            img: Image as a numpy array or tensor.
+            scale: Factor to scale the image by.
+
+        Returns:
+            The converted image as a numpy array.
+        """
+        # Convert to uint8 for cv2.calcOpticalFlowPyrLK
+        img = ensure_int(img)
+
+        # Convert tensors to ndarays
+        if hasattr(img, "numpy"):
+            img = img.numpy()
+
+        # Ensure images are rank 2 in case there is a singleton channel dimension.
+        if img.ndim > 3:
+            img = np.squeeze(img)
+
+        # Convert RGB to grayscale.
+        if img.ndim > 2 and img.shape[-1] == 3:
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+        # Input image scaling.
+        if scale != 1:
+            img = cv2.resize(img, None, None, scale, scale)
+
+        return img
+
     @staticmethod
     def flow_shift_instances(
         ref_instances: List[InstanceType],
@@ -149,6 +212,7 @@ class FlowCandidateMaker:
         scale: float = 1.0,
         window_size: int = 21,
         max_levels: int = 3,
+        preprocessed: bool = False,
     ) -> List[ShiftedInstance]:
         """Generates instances in a new frame by applying optical flow displacements.
 
@@ -165,6 +229,8 @@ class FlowCandidateMaker:
                 level.
             max_levels: Number of pyramid scale levels to consider. This is different
                 from the scale parameter, which determines the initial image scaling.
+            preprocessed: If True, the images have already been converted with
+                `FlowCandidateMaker.prepare_image` using the same `scale`.
 
         Returns:
             A list of ShiftedInstances with the optical flow displacements applied to
@@ -175,31 +241,9 @@ class FlowCandidateMaker:
             This function relies on the Lucas-Kanade method for optical flow estimation.
         """
 
-        # Convert to uint8 for cv2.calcOpticalFlowPyrLK
-        ref_img = ensure_int(ref_img)
-        new_img = ensure_int(new_img)
-
-        # Convert tensors to ndarays
-        if hasattr(ref_img, "numpy"):
-            ref_img = ref_img.numpy()
-
-        if hasattr(new_img, "numpy"):
-            new_img = new_img.numpy()
-
-        # Ensure images are rank 2 in case there is a singleton channel dimension.
-        if ref_img.ndim > 3:
-            ref_img = np.squeeze(ref_img)
-            new_img = np.squeeze(new_img)
-
-        # Convert RGB to grayscale.
-        if ref_img.ndim > 2 and ref_img.shape[-1] == 3:
-            ref_img = cv2.cvtColor(ref_img, cv2.COLOR_BGR2GRAY)
-            new_img = cv2.cvtColor(new_img, cv2.COLOR_BGR2GRAY)
-
-        # Input image scaling.
-        if scale != 1:
-            ref_img = cv2.resize(ref_img, None, None, scale, scale)
-            new_img = cv2.resize(new_img, None, None, scale, scale)
+        if not preprocessed:
+            ref_img = FlowCandidateMaker.prepare_image(ref_img, scale=scale)
+            new_img = FlowCandidateMaker.prepare_image(new_img, scale=scale)
 
         # Gather reference points.
         ref_pts = [inst.points_array for inst in ref_instances]
@@ -309,6 +353,11 @@ class BaseTracker(abc.ABC):
     def final_pass(self, frames: List[LabeledFrame]):
         pass
 
+    @property
+    def has_final_pass(self) -> bool:
+        """Whether `final_pass` modifies the frames after tracking."""
+        return False
+
     @abc.abstractmethod
     def get_name(self):
         pass
@@ -326,7 +375,9 @@ class Tracker(BaseTracker):
         track_window: How many frames back to look for candidate instances to
             match instances in the current frame against.
         similarity_function: A function that returns a numeric pairwise
-            instance similarity value.
+            instance similarity value. The built-in similarity functions are
+            computed for all pairs of instances at once with their vectorized
+            versions (see `batch_similarity_functions`).
         matching_function: A function that takes a matrix of pairwise similarities
             and determines the matches to use.
         candidate_maker: A class instance with a `get_candidates` method
@@ -336,6 +387,13 @@ class Tracker(BaseTracker):
             after the other tracking has run for all frames.
         min_new_track_points: We won't spawn a new track for an instance with
             fewer than this many points.
+        max_centroid_distance: If set, instances are only matched to candidates with
+            centroids within this distance (in pixels). Other pairs are not scored.
+        feature_cache: Cache of the point arrays, centroids and bounding boxes of
+            the instances being matched. Features of instances are evicted when
+            their frame leaves the matching queue.
+        last_tracked_sources: The untracked instances that the instances returned by
+            the last call to `track` were copied from, in the same order.
     """
 
     track_window: int = 5
@@ -349,6 +407,7 @@ class Tracker(BaseTracker):
     post_connect_single_breaks: bool = False
 
     min_new_track_points: int = 0
+    max_centroid_distance: Optional[float] = None
 
     track_matching_queue: Deque[MatchedFrameInstances] = attr.ib()
 
@@ -360,6 +419,9 @@ class Tracker(BaseTracker):
     )  # keyed by t
 
     last_matches: Optional[FrameMatches] = None
+    last_tracked_sources: List[InstanceType] = attr.ib(factory=list)
+
+    feature_cache: InstanceFeatureCache = attr.ib(factory=InstanceFeatureCache)
 
     @property
     def is_valid(self):
@@ -372,6 +434,12 @@ class Tracker(BaseTracker):
 
     def reset_candidates(self):
         self.track_matching_queue = deque(maxlen=self.track_window)
+        self.feature_cache.clear()
+
+    @property
+    def feature_cache_size(self) -> int:
+        """Returns the number of instances with cached features."""
+        return len(self.feature_cache)
 
     @property
     def unique_tracks_in_queue(self) -> List[Track]:
@@ -388,6 +456,14 @@ class Tracker(BaseTracker):
     def uses_image(self):
         return getattr(self.candidate_maker, "uses_image", False)
 
+    @property
+    def has_final_pass(self) -> bool:
+        """Whether `final_pass` modifies the frames after tracking."""
+        return bool(
+            self.cleaner
+            or (self.target_instance_count and self.post_connect_single_breaks)
+        )
+
     def track(
         self,
         untracked_instances: List[InstanceType],
@@ -406,6 +482,7 @@ class Tracker(BaseTracker):
         """
 
         if self.candidate_maker is None:
+            self.last_tracked_sources = list(untracked_instances)
             return untracked_instances
 
         # Infer timestep if not provided.
@@ -420,9 +497,12 @@ class Tracker(BaseTracker):
 
         # Initialize containers for tracked instances at the current timestep.
         tracked_instances = []
+        tracked_sources = []
 
-        # Make cache so similarity function doesn't have to recompute everything.
-        # similarity_cache = dict()
+        # Preprocess the image once for all the frames it will be matched against. Only
+        # the preprocessed image is kept in the matching queue.
+        if img is not None and hasattr(self.candidate_maker, "preprocess_image"):
+            img = self.candidate_maker.preprocess_image(img)
 
         # Process untracked instances.
         if untracked_instances:
@@ -443,8 +523,14 @@ class Tracker(BaseTracker):
                 candidate_instances=candidate_instances,
                 similarity_function=self.similarity_function,
                 matching_function=self.matching_function,
+                feature_cache=self.feature_cache,
+                max_centroid_distance=self.max_centroid_distance,
             )
 
+            # The tracked instances are copies, so the features of the untracked
+            # instances won't be needed again.
+            self.feature_cache.evict(untracked_instances)
+
             # Store the most recent match data (for outside inspection).
             self.last_matches = frame_matches
 
@@ -452,11 +538,25 @@ class Tracker(BaseTracker):
             tracked_instances.extend(
                 self.update_matched_instance_tracks(frame_matches.matches)
             )
-
-            # Spawn a new track for each remaining untracked instance.
+            tracked_sources.extend(match.instance for match in frame_matches.matches)
+
+            # Spawn a new track for each remaining untracked instance that is large
+            # enough to spawn a track with.
+            spawnable_instances = [
+                inst
+                for inst in frame_matches.unmatched_instances
+                if inst.n_visible_points >= self.min_new_track_points
+            ]
             tracked_instances.extend(
-                self.spawn_for_untracked_instances(frame_matches.unmatched_instances, t)
+                self.spawn_for_untracked_instances(spawnable_instances, t)
             )
+            tracked_sources.extend(spawnable_instances)
+
+        self.last_tracked_sources = tracked_sources
+
+        # Drop the features of the frame that is about to leave the matching buffer.
+        if len(self.track_matching_queue) == self.track_matching_queue.maxlen:
+            self.feature_cache.evict(self.track_matching_queue[0].instances_t)
 
         # Add the tracked instances to the matching buffer.
         self.track_matching_queue.append(
@@ -531,6 +631,7 @@ class Tracker(BaseTracker):
         track_window: int = 5,
         min_new_track_points: int = 0,
         min_match_points: int = 0,
+        max_centroid_distance: float = 0,
         # Optical flow options
         img_scale: float = 1.0,
         of_window_size: int = 21,
@@ -594,6 +695,7 @@ class Tracker(BaseTracker):
         tracker_obj = cls(
             track_window=track_window,
             min_new_track_points=min_new_track_points,
+            max_centroid_distance=max_centroid_distance or None,
             similarity_function=similarity_function,
             matching_function=matching_function,
             candidate_maker=candidate_maker,
@@ -696,6 +798,14 @@ class Tracker(BaseTracker):
         option["help"] = "Minimum points for match candidates"
         options.append(option)
 
+        option = dict(name="max_centroid_distance", default=0)
+        option["type"] = float
+        option["help"] = (
+            "If non-zero, only match instances to candidates with centroids within "
+            "this many pixels"
+        )
+        options.append(option)
+
         option = dict(name="img_scale", default=1.0)
         option["type"] = float
         option["help"] = "For optical-flow: Image scale"
@@ -1041,6 +1151,10 @@ class KalmanTracker(BaseTracker):
     def final_pass(self, frames: List[LabeledFrame]):
         self.init_tracker.final_pass(frames)
 
+    @property
+    def has_final_pass(self) -> bool:
+        return self.init_tracker is not None and self.init_tracker.has_final_pass
+
 
 @attr.s(auto_attribs=True)
 class TrackCleaner:
@@ -1111,6 +1225,208 @@ def run_tracker(frames: List[LabeledFrame], tracker: BaseTracker) -> List[Labele
     return new_lfs
 
 
+def _track_chunk(
+    tracker_args: dict, chunk: dict
+) -> List[List[Tuple[int, int, Optional[float]]]]:
+    """Track a chunk of frames. This is the target of `run_tracker_chunked` workers.
+
+    Args:
+        tracker_args: Keyword arguments for `Tracker.make_tracker_by_name`.
+        chunk: Dictionary with the serialized frames of the chunk, as made by
+            `run_tracker_chunked`.
+
+    Returns:
+        A list with the tracking results of each frame in the chunk. The results of a
+        frame are tuples of `(instance_ind, track_ind, tracking_score)` for each tracked
+        instance in the order returned by the tracker, where `instance_ind` indexes the
+        instances of the input frame and `track_ind` indexes the tracks spawned by the
+        chunk's tracker. `tracking_score` is `None` for user instances.
+    """
+    tracker = Tracker.make_tracker_by_name(**tracker_args)
+    skeletons = [Skeleton.from_json(skeleton) for skeleton in chunk["skeletons"]]
+    videos = [cattr.structure(video, Video) for video in chunk["videos"]]
+
+    results = []
+    for t, video_ind, frame_idx, instances_data in chunk["frames"]:
+        instances = []
+        for skeleton_ind, points, score, tracking_score in instances_data:
+            skeleton = skeletons[skeleton_ind]
+            if score is None:
+                instances.append(Instance(skeleton=skeleton, points=points))
+            else:
+                instances.append(
+                    PredictedInstance(
+                        skeleton=skeleton,
+                        points=points,
+                        score=score,
+                        tracking_score=tracking_score,
+                    )
+                )
+
+        # Tracked instances are copies, so they are mapped back to the inputs through
+        # the untracked instances that the tracker reports as their sources.
+        instance_inds = {inst: i for i, inst in enumerate(instances)}
+
+        img = videos[video_ind][frame_idx] if tracker.uses_image else None
+        tracked_instances = tracker.track(untracked_instances=instances, img=img, t=t)
+
+        track_inds = {track: i for i, track in enumerate(tracker.spawned_tracks)}
+        results.append(
+            [
+                (
+                    instance_inds[source],
+                    track_inds[inst.track],
+                    getattr(inst, "tracking_score", None),
+                )
+                for inst, source in zip(tracked_instances, tracker.last_tracked_sources)
+            ]
+        )
+
+    return results
+
+
+def run_tracker_chunked(
+    frames: List[LabeledFrame],
+    tracker_args: dict,
+    chunk_size: int = 5000,
+    overlap: int = 50,
+    n_workers: Optional[int] = None,
+) -> List[LabeledFrame]:
+    """Run a tracker on a set of labeled frames in parallel chunks.
+
+    The frames are split into consecutive chunks of `chunk_size` frames which are
+    tracked in separate processes. Each chunk's tracker starts `overlap` frames before
+    the chunk so that its matching queue is warmed up when the chunk starts. The tracks
+    of each chunk are then stitched to the tracks of the previous chunk by Hungarian
+    matching on the number of instances in the overlapping frames that were assigned to
+    each pair of tracks. Tracks that can't be stitched are given new identities.
+
+    When `overlap` is at least the tracker's `track_window` and the tracks in the
+    overlapping frames are unambiguous, the result is the same as tracking all frames
+    sequentially with `run_tracker`.
+
+    Only regular `Tracker`s can be run in chunks. Other trackers (e.g., with a Kalman
+    filter, which is initialized on the first frames) are run sequentially.
+
+    Args:
+        frames: A list of labeled frames with instances, in tracking order.
+        tracker_args: Keyword arguments for `Tracker.make_tracker_by_name` which are
+            used to create the tracker of each chunk.
+        chunk_size: Number of frames in each chunk.
+        overlap: Number of frames before each chunk that are also tracked by the chunk
+            and used for stitching.
+        n_workers: Number of worker processes. Defaults to the number of CPUs.
+
+    Returns:
+        The tracked frames, as returned by `run_tracker`. The tracker's `final_pass` is
+        not applied.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    tracker = Tracker.make_tracker_by_name(**tracker_args)
+    if not isinstance(tracker, Tracker) or len(frames) <= chunk_size:
+        return run_tracker(frames, tracker)
+    if not tracker.is_valid:
+        return frames
+
+    # Serialize the frames so they can be sent to the workers.
+    skeletons, videos = [], []
+    frames_data = []
+    for t, lf in enumerate(frames):
+        if lf.video not in videos:
+            videos.append(lf.video)
+        instances_data = []
+        for inst in lf.instances:
+            inst.track = None
+            if inst.skeleton not in skeletons:
+                skeletons.append(inst.skeleton)
+            instances_data.append(
+                (
+                    skeletons.index(inst.skeleton),
+                    inst.get_points_array(copy=False, full=True),
+                    getattr(inst, "score", None),
+                    getattr(inst, "tracking_score", None),
+                )
+            )
+        frames_data.append((t, videos.index(lf.video), lf.frame_idx, instances_data))
+
+    chunk_starts = list(range(0, len(frames), chunk_size))
+    chunk_bounds = [
+        (max(0, start - overlap), start, min(start + chunk_size, len(frames)))
+        for start in chunk_starts
+    ]
+    skeletons_json = [skeleton.to_json() for skeleton in skeletons]
+    videos_data = [cattr.unstructure(video) for video in videos]
+
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = [
+            executor.submit(
+                _track_chunk,
+                tracker_args,
+                dict(
+                    skeletons=skeletons_json,
+                    videos=videos_data,
+                    frames=frames_data[warmup_start:end],
+                ),
+            )
+            for warmup_start, _, end in chunk_bounds
+        ]
+        chunk_results = [future.result() for future in futures]
+
+    # Stitch the chunks together.
+    tracks = []
+    frame_tracks = []  # Track of each instance of each frame, keyed by instance ind.
+    new_lfs = []
+    for (warmup_start, start, end), results in zip(chunk_bounds, chunk_results):
+
+        # Count the instances assigned to each pair of tracks in the overlap.
+        overlap_counts = defaultdict(int)
+        for t, frame_results in zip(range(warmup_start, start), results):
+            for instance_ind, track_ind, _ in frame_results:
+                track = frame_tracks[t].get(instance_ind, None)
+                if track is not None:
+                    overlap_counts[(track_ind, track)] += 1
+
+        # Match the tracks of the chunk to the stitched tracks.
+        track_map = dict()
+        if overlap_counts:
+            chunk_track_inds = sorted({key[0] for key in overlap_counts})
+            prev_tracks = list({key[1]: None for key in overlap_counts})
+            counts = np.zeros((len(chunk_track_inds), len(prev_tracks)))
+            for (track_ind, track), count in overlap_counts.items():
+                counts[
+                    chunk_track_inds.index(track_ind), prev_tracks.index(track)
+                ] = count
+            for i, j in hungarian_matching(-counts):
+                if counts[i, j] > 0:
+                    track_map[chunk_track_inds[i]] = prev_tracks[j]
+
+        stitched_results = results[start - warmup_start :]
+        for t, frame_results in zip(range(start, end), stitched_results):
+            lf = frames[t]
+            instances, instance_tracks = [], dict()
+            for instance_ind, track_ind, tracking_score in frame_results:
+                if track_ind not in track_map:
+                    track = Track(spawned_on=t, name=f"track_{len(tracks)}")
+                    track_map[track_ind] = track
+                    tracks.append(track)
+                instance_tracks[instance_ind] = track_map[track_ind]
+
+                changes = dict(track=track_map[track_ind])
+                if tracking_score is not None:
+                    changes["tracking_score"] = tracking_score
+                instances.append(attr.evolve(lf.instances[instance_ind], **changes))
+
+            frame_tracks.append(instance_tracks)
+            new_lfs.append(
+                LabeledFrame(
+                    frame_idx=lf.frame_idx, video=lf.video, instances=instances
+                )
+            )
+
+    return new_lfs
+
+
 def retrack():
     import argparse
     import operator
@@ -1129,6 +1445,30 @@ def retrack():
         default=None,
         help="The output filename to use for the predicted data.",
     )
+    parser.add_argument(
+        "--chunk_size",
+        type=int,
+        default=0,
+        help=(
+            "If greater than 0, track chunks of this many frames in parallel "
+            "processes and stitch their tracks together."
+        ),
+    )
+    parser.add_argument(
+        "--chunk_overlap",
+        type=int,
+        default=50,
+        help=(
+            "Number of frames before each chunk that are used to stitch it to the "
+            "previous chunk. This should be at least the track window."
+        ),
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of processes to track chunks with. Defaults to the CPU count.",
+    )
 
     Tracker.add_cli_parser_args(parser)
 
@@ -1148,7 +1488,16 @@ def retrack():
     print(f"Done loading predictions in {time.time() - t0} seconds.")
 
     print("Starting tracker...")
-    frames = run_tracker(frames=frames, tracker=tracker)
+    if args.chunk_size > 0:
+        frames = run_tracker_chunked(
+            frames=frames,
+            tracker_args=tracker_args,
+            chunk_size=args.chunk_size,
+            overlap=args.chunk_overlap,
+            n_workers=args.workers,
+        )
+    else:
+        frames = run_tracker(frames=frames, tracker=tracker)
     tracker.final_pass(frames)
 
     new_labels = Labels(labeled_frames=frames)
@@ -20,6 +20,7 @@ import copy
 
 import sleap
 from sleap.util import get_package_file
+from sleap.io.framecache import DiskFrameCache
 
 # Config
 from sleap.nn.config import (
@@ -627,6 +628,14 @@ class Trainer(ABC):
             update_config=True,
         )
         config.data.labels.skeletons = data_readers.training_labels.skeletons
+        if config.optimization.frame_cache_dir is not None:
+            for labels_reader in (
+                data_readers.training_labels_reader,
+                data_readers.validation_labels_reader,
+                data_readers.test_labels_reader,
+            ):
+                if labels_reader is not None:
+                    labels_reader.frame_cache_dir = config.optimization.frame_cache_dir
 
         # Create model.
         model = Model.from_config(
@@ -906,6 +915,10 @@ class Trainer(ABC):
             if self.config.outputs.zip_outputs:
                 self.package()
 
+        # Close the frame cache files so that other processes can use them.
+        if self.config.optimization.frame_cache_dir is not None:
+            DiskFrameCache(self.config.optimization.frame_cache_dir).close()
+
     def evaluate(self):
         """Compute evaluation metrics on data splits and save them."""
         logger.info("Saving evaluation metrics to model folder...")
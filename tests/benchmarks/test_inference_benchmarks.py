@@ -0,0 +1,86 @@
+import json
+
+import numpy as np
+import pytest
+
+from sleap.benchmarks.inference import (
+    MODEL_TYPES,
+    PeakMemoryMonitor,
+    make_random_predictor,
+    make_synthetic_skeleton,
+    make_synthetic_video,
+    run_benchmarks,
+    save_results,
+)
+from sleap.nn.inference import (
+    BottomUpPredictor,
+    SingleInstancePredictor,
+    TopDownPredictor,
+)
+from sleap.nn.profiling import get_profiler
+
+
+@pytest.mark.parametrize("backend", ["numpy", "hdf5"])
+def test_make_synthetic_video(tmpdir, backend):
+    video = make_synthetic_video(
+        n_frames=4,
+        height=32,
+        width=48,
+        channels=3,
+        backend=backend,
+        filename=str(tmpdir.join("video.h5")),
+    )
+    assert video.shape == (4, 32, 48, 3)
+    frame = video.get_frame(0)
+    assert frame.dtype == np.uint8
+    assert frame.max() > 128
+
+    with pytest.raises(ValueError):
+        make_synthetic_video(backend="mp4")
+
+
+def test_make_random_predictor():
+    skeleton = make_synthetic_skeleton(3)
+    assert len(skeleton.edges) == 2
+
+    predictor_types = [SingleInstancePredictor, TopDownPredictor, BottomUpPredictor]
+    for model_type, predictor_type in zip(MODEL_TYPES, predictor_types):
+        predictor = make_random_predictor(
+            model_type, skeleton, input_shape=(64, 64, 1), filters=4
+        )
+        assert isinstance(predictor, predictor_type)
+        assert predictor.inference_model is not None
+
+    with pytest.raises(ValueError):
+        make_random_predictor("leap", skeleton, input_shape=(64, 64, 1))
+
+
+def test_peak_memory_monitor():
+    with PeakMemoryMonitor(interval=0.001) as memory:
+        data = np.ones(2 ** 24, dtype="uint8")
+    del data
+    assert memory.peak >= memory.baseline > 0
+
+
+def test_run_benchmarks(tmpdir):
+    results = run_benchmarks(
+        n_frames=8, height=64, width=64, n_nodes=3, batch_size=4, filters=4
+    )
+    assert [(result["model_type"], result["backend"]) for result in results] == [
+        (model_type, backend)
+        for backend in ["numpy", "hdf5"]
+        for model_type in MODEL_TYPES
+    ]
+    for result in results:
+        assert result["n_frames"] == 8
+        assert result["fps"] > 0
+        assert result["stage_times"]["inference"] > 0
+        assert result["stages"]["forward_pass"]["count"] > 0
+    assert not get_profiler().enabled
+
+    filename = str(tmpdir.join("results.json"))
+    save_results(results, filename, config=dict(n_frames=8))
+    with open(filename) as f:
+        data = json.load(f)
+    assert data["config"]["n_frames"] == 8
+    assert len(data["results"]) == len(results)
@@ -3,7 +3,9 @@ import os
 import h5py
 import numpy as np
 
+from sleap.io.dataset import load_file
 from sleap.info.write_tracking_h5 import (
+    AnalysisH5StreamWriter,
     get_tracks_as_np_strings,
     get_occupancy_and_points_matrices,
     remove_empty_tracks_from_matrices,
@@ -65,6 +67,29 @@ def test_output_matrices(centered_pair_predictions):
     assert points.shape == (1100, 24, 2, 26)
 
 
+def test_output_matrices_lazy():
+    filename = "tests/data/hdf5_format_v1/centered_pair_predictions.h5"
+    labels = load_file(filename)
+    lazy_labels = load_file(filename, lazy=True)
+
+    occupancy, points = get_occupancy_and_points_matrices(labels, all_frames=True)
+    lazy_occupancy, lazy_points = get_occupancy_and_points_matrices(
+        lazy_labels, all_frames=True
+    )
+    np.testing.assert_array_equal(occupancy, lazy_occupancy)
+    np.testing.assert_array_equal(points, lazy_points)
+    assert lazy_labels.labeled_frames.n_materialized == 0
+
+    # Compare against the points of the instance objects.
+    for lf in labels:
+        for inst in lf:
+            track_i = labels.tracks.index(inst.track) if inst.track else 0
+            assert occupancy[track_i, lf.frame_idx] == 1
+            np.testing.assert_array_equal(
+                points[lf.frame_idx, ..., track_i], inst.numpy()
+            )
+
+
 def test_hdf5_saving(tmpdir):
     path = os.path.join(tmpdir, "occupany.h5")
 
@@ -87,3 +112,78 @@ def test_hdf5_tranposed_saving(tmpdir):
 
     with h5py.File(path, "r") as f:
         assert f["x"].shape == np.transpose(x).shape
+
+
+def test_hdf5_slab_saving(tmpdir):
+    path = os.path.join(tmpdir, "slabs.h5")
+
+    x = np.random.rand(100, 3, 2, 4)
+    data_dict = dict(x=x, empty=np.zeros((0, 4)), names=[np.string_("a")])
+
+    write_occupancy_file(path, data_dict, transpose=True, slab_size=7)
+
+    with h5py.File(path, "r") as f:
+        np.testing.assert_array_equal(f["x"][:], np.transpose(x))
+        assert f["x"].compression == "gzip"
+        assert f["empty"].shape == (4, 0)
+        assert len(f["names"]) == 1
+
+    write_occupancy_file(path, data_dict, transpose=False, compression=None)
+
+    with h5py.File(path, "r") as f:
+        np.testing.assert_array_equal(f["x"][:], x)
+        assert f["x"].compression is None
+
+
+def test_analysis_stream_writer(tmpdir, centered_pair_predictions):
+    labels = centered_pair_predictions
+    occupancy, points = get_occupancy_and_points_matrices(labels, all_frames=True)
+
+    path = os.path.join(tmpdir, "stream.h5")
+    with AnalysisH5StreamWriter(path, block_size=64) as writer:
+        # Frames can be written in any order.
+        writer.write_frames(labels.labeled_frames[500:])
+        writer.write_frames(labels.labeled_frames[:500])
+
+    # Tracks are ordered by their first appearance in the written frames.
+    track_inds = [labels.tracks.index(track) for track in writer.tracks]
+
+    with h5py.File(path, "r") as f:
+        assert f["tracks"].chunks is not None
+        assert [name.decode() for name in f["track_names"][:]] == [
+            track.name for track in writer.tracks
+        ]
+        assert len(f["node_names"]) == len(labels.skeleton.nodes)
+        np.testing.assert_array_equal(f["track_occupancy"][:].T, occupancy[track_inds])
+        np.testing.assert_array_equal(f["tracks"][:].T, points[..., track_inds])
+
+    with AnalysisH5StreamWriter(path, dtype="float32", compression=None) as writer:
+        writer.write_frames(labels.labeled_frames)
+    track_inds = [labels.tracks.index(track) for track in writer.tracks]
+
+    with h5py.File(path, "r") as f:
+        assert f["tracks"].dtype == np.float32
+        assert f["tracks"].compression is None
+        np.testing.assert_allclose(
+            f["tracks"][:].T, points[..., track_inds].astype("float32")
+        )
+
+
+def test_analysis_stream_writer_sparse_frames(tmpdir, centered_pair_predictions):
+    labels = centered_pair_predictions
+    lf0, lf1 = labels.labeled_frames[:2]
+    lf1.frame_idx = 10000
+
+    # Frames far apart in the same block are written one chunk of frames at a time.
+    path = os.path.join(tmpdir, "sparse.h5")
+    with AnalysisH5StreamWriter(path, block_size=4) as writer:
+        writer.write_frames([lf1, lf0])
+
+    with h5py.File(path, "r") as f:
+        occupancy = f["track_occupancy"][:].T
+        tracks = f["tracks"][:].T
+    assert occupancy.shape[1] == 10001
+    assert occupancy[:, lf0.frame_idx].sum() == len(lf0.instances)
+    assert occupancy[:, 10000].sum() == len(lf1.instances)
+    assert occupancy.sum() == len(lf0.instances) + len(lf1.instances)
+    assert np.isnan(tracks[lf0.frame_idx + 1 : 10000]).all()
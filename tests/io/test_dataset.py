@@ -957,6 +957,116 @@ def test_hdf5_empty_save(tmpdir):
     Labels.save_hdf5(filename=filename, labels=labels)
 
 
+def test_hdf5_lazy_load():
+    filename = "tests/data/hdf5_format_v1/centered_pair_predictions.h5"
+    labels = load_file(filename)
+    lazy_labels = load_file(filename, lazy=True)
+
+    assert len(lazy_labels) == len(labels)
+    assert lazy_labels.labeled_frames.n_materialized == 0
+
+    # Whole-dataset operations work on the columns.
+    np.testing.assert_array_equal(lazy_labels.numpy(), labels.numpy())
+    assert lazy_labels.labeled_frames.n_materialized == 0
+
+    # Frames are only created when accessed and keep their identity.
+    lf = lazy_labels[10]
+    assert lazy_labels.labeled_frames.n_materialized == 1
+    assert lazy_labels[10] is lf
+    assert lf in lazy_labels
+    assert lf.frame_idx == labels[10].frame_idx
+    assert len(lf) == len(labels[10])
+    for inst, lazy_inst in zip(labels[10], lf):
+        assert type(inst) == type(lazy_inst)
+        assert lazy_inst.frame is lf
+        assert lazy_inst.track is lazy_labels.tracks[labels.tracks.index(inst.track)]
+        np.testing.assert_array_equal(inst.numpy(), lazy_inst.numpy())
+
+    # Finding frames builds the cache from the frames.
+    video = lazy_labels.video
+    assert lazy_labels.find(video, lf.frame_idx)[0] is lf
+    assert len(lazy_labels.find(video)) == len(labels.find(labels.video))
+
+    # Modifying the frames materializes them.
+    lazy_labels.remove(lf)
+    assert lazy_labels.labeled_frames.is_materialized
+    assert len(lazy_labels) == len(labels) - 1
+    assert lazy_labels.find(video, lf.frame_idx) == []
+
+
+def test_get_instance_arrays():
+    filename = "tests/data/hdf5_format_v1/centered_pair_predictions.h5"
+    labels = load_file(filename)
+    lazy_labels = load_file(filename, lazy=True)
+
+    frame_inds, track_inds, points = labels.get_instance_arrays()
+    n_instances = sum(len(lf) for lf in labels)
+    assert frame_inds.shape == (n_instances,)
+    assert track_inds.shape == (n_instances,)
+    assert points.shape == (n_instances, len(labels.skeleton.nodes), 2)
+
+    i = 0
+    for lf in labels:
+        for inst in lf:
+            assert frame_inds[i] == lf.frame_idx
+            if inst.track is None:
+                assert track_inds[i] == -1
+            else:
+                assert track_inds[i] == labels.tracks.index(inst.track)
+            np.testing.assert_array_equal(points[i], inst.numpy())
+            i += 1
+
+    # Lazily loaded labels give the same arrays without creating any frames.
+    for x, lazy_x in zip(
+        (frame_inds, track_inds, points), lazy_labels.get_instance_arrays()
+    ):
+        np.testing.assert_array_equal(x, lazy_x)
+    np.testing.assert_array_equal(
+        lazy_labels.get_labeled_frame_inds(), labels.get_labeled_frame_inds()
+    )
+    assert lazy_labels.labeled_frames.n_materialized == 0
+
+    # Instances without a track have a track index of -1.
+    labels[0].instances[0].track = None
+    assert labels.get_instance_arrays()[1][0] == -1
+
+    # Instances of other videos are excluded.
+    other_video = Video.from_filename("foo.mp4")
+    labels.append(LabeledFrame(video=other_video, frame_idx=0))
+    assert len(labels.get_labeled_frame_inds()) == len(labels)
+    assert len(labels.get_labeled_frame_inds(video=other_video)) == 1
+    assert len(labels.get_instance_arrays(video=other_video)[0]) == 0
+
+
+def test_lazy_numpy_after_edit():
+    filename = "tests/data/hdf5_format_v1/centered_pair_predictions.h5"
+    labels = load_file(filename)
+    lazy_labels = load_file(filename, lazy=True)
+
+    # Edit one frame of both labels. The stored columns no longer reflect the frames,
+    # so the exports must come from the frame objects.
+    for lbls in (labels, lazy_labels):
+        lf = lbls[0]
+        lf.instances[0].track, lf.instances[1].track = (
+            lf.instances[1].track,
+            lf.instances[0].track,
+        )
+        lbls.remove_instance(lbls[1], lbls[1].instances[0])
+    assert not lazy_labels.labeled_frames.columns_valid
+    assert not lazy_labels.labeled_frames.is_materialized
+
+    np.testing.assert_array_equal(lazy_labels.numpy(), labels.numpy())
+    for x, lazy_x in zip(
+        labels.get_instance_arrays(), lazy_labels.get_instance_arrays()
+    ):
+        np.testing.assert_array_equal(x, lazy_x)
+
+    with pytest.raises(RuntimeError):
+        lazy_labels.labeled_frames.instance_arrays(
+            None, lazy_labels.tracks, len(lazy_labels.skeleton.nodes)
+        )
+
+
 def test_makedirs(tmpdir):
     labels = Labels()
     filename = os.path.join(tmpdir, "new/dirs/test.h5")
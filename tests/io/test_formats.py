@@ -1,4 +1,5 @@
 from sleap.io.format import read, dispatch, adaptor, text, genericjson, hdf5, filehandle
+from sleap.instance import Instance, LabeledFrame
 import pytest
 import os
 import numpy as np
@@ -111,6 +112,80 @@ def test_hdf5_v1_filehandle():
     )
 
 
+def test_hdf5_v1_lazy_write(tmpdir):
+    from sleap.io.dataset import load_file
+
+    filename = "tests/data/hdf5_format_v1/centered_pair_predictions.h5"
+    labels = load_file(filename)
+    lazy_labels = load_file(filename, lazy=True)
+
+    # Lazily loaded frames are written straight from the columns.
+    filename = os.path.join(tmpdir, "test.slp")
+    hdf5.LabelsV1Adaptor.write(filename, lazy_labels)
+    assert lazy_labels.labeled_frames.n_materialized == 0
+
+    saved_labels = load_file(filename)
+    assert len(saved_labels) == len(labels)
+    assert_array_equal(saved_labels.numpy(), labels.numpy())
+    for lf, saved_lf in zip(labels, saved_labels):
+        assert lf.frame_idx == saved_lf.frame_idx
+        assert [inst.score for inst in lf] == [inst.score for inst in saved_lf]
+
+
+def test_hdf5_v1_stream_writer(tmpdir, min_labels):
+    filename = "tests/data/hdf5_format_v1/centered_pair_predictions.h5"
+    labels = hdf5.LabelsV1Adaptor.read(filehandle.FileHandle(filename))
+
+    header_labels = hdf5.LabelsV1Adaptor.read_headers(filehandle.FileHandle(filename))
+    header_labels.tracks = []
+
+    filename = os.path.join(tmpdir, "test.slp")
+    with hdf5.LabelsV1StreamWriter(filename, labels=header_labels) as writer:
+        for start in range(0, 600, 200):
+            writer.write_frames(labels.labeled_frames[start : start + 200])
+            assert writer.n_frames_written == start + 200
+
+    # Tracks are added to the metadata as they are written.
+    saved_labels = hdf5.LabelsV1Adaptor.read(filehandle.FileHandle(filename))
+    assert len(saved_labels) == 600
+    assert 0 < len(saved_labels.tracks) < len(labels.tracks)
+
+    # Continue writing to the same file.
+    with hdf5.LabelsV1StreamWriter(filename, append=True) as writer:
+        assert writer.n_frames_written == 600
+        writer.write_frames(labels.labeled_frames[600:])
+
+    saved_labels = hdf5.LabelsV1Adaptor.read(filehandle.FileHandle(filename))
+    assert len(saved_labels) == len(labels)
+    assert len(saved_labels.videos) == 1
+    assert len(saved_labels.tracks) == len(labels.tracks)
+    assert_array_equal(saved_labels.numpy(), labels.numpy())
+
+    # User instances with links to predicted instances are written.
+    user_inst = min_labels[0][0]
+    user_inst.from_predicted = labels[0][0]
+    labels[0].instances.append(user_inst)
+    with hdf5.LabelsV1StreamWriter(filename, append=True) as writer:
+        writer.write_frames([labels[0]])
+    saved_labels = hdf5.LabelsV1Adaptor.read(filehandle.FileHandle(filename))
+    saved_inst = saved_labels[-1].instances[-1]
+    assert saved_inst.from_predicted is saved_labels[-1].instances[0]
+    assert len(saved_labels.skeletons) == 2
+
+    # Links to predicted instances that were written by an earlier call are kept.
+    user_inst = Instance(skeleton=labels.skeletons[0], from_predicted=labels[1][0])
+    user_lf = LabeledFrame(
+        video=labels.videos[0], frame_idx=labels[2].frame_idx, instances=[user_inst]
+    )
+    filename = os.path.join(tmpdir, "test_links.slp")
+    with hdf5.LabelsV1StreamWriter(filename, labels=header_labels) as writer:
+        writer.write_frames([labels[1]])
+        writer.write_frames([user_lf])
+    saved_labels = hdf5.LabelsV1Adaptor.read(filehandle.FileHandle(filename))
+    saved_inst = saved_labels[1].instances[0]
+    assert saved_inst.from_predicted is saved_labels[0].instances[0]
+
+
 def test_analysis_hdf5(tmpdir, centered_pair_predictions):
     from sleap.info.write_tracking_h5 import main as write_analysis
 
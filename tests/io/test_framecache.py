@@ -0,0 +1,199 @@
+import threading
+
+import h5py
+import numpy as np
+import pytest
+
+from sleap.io.framecache import (
+    DEFAULT_FRAME_CACHE_SIZE,
+    DiskFrameCache,
+    FrameCache,
+    get_frame_cache,
+    set_frame_cache_size,
+)
+from sleap.io.video import Video
+
+
+class Backend:
+    pass
+
+
+@pytest.fixture
+def frame_cache():
+    cache = get_frame_cache()
+    max_bytes = cache.max_bytes
+    cache.resize(DEFAULT_FRAME_CACHE_SIZE)
+    cache.clear()
+    cache.reset_stats()
+    yield cache
+    cache.resize(max_bytes)
+    cache.clear()
+    cache.reset_stats()
+
+
+def test_frame_cache_lru():
+    frame = np.zeros((10, 10, 1), dtype="uint8")
+    cache = FrameCache(max_bytes=3 * frame.nbytes)
+    backend = Backend()
+    keys = [cache.make_key(backend, i) for i in range(4)]
+
+    assert cache.get(keys[0]) is None
+    for key in keys[:3]:
+        cache.put(key, frame)
+    assert len(cache) == 3
+    assert cache.n_bytes == 3 * frame.nbytes
+
+    # Touch the first frame so that the second one is evicted next.
+    assert cache.get(keys[0]) is not None
+    cache.put(keys[3], frame)
+    assert len(cache) == 3
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[3]) is not None
+
+    assert cache.stats["hits"] == 3
+    assert cache.stats["misses"] == 2
+
+    # Frames larger than the budget are not cached.
+    big_frame = np.zeros((100, 100, 1), dtype="uint8")
+    assert cache.put(cache.make_key(backend, 10), big_frame) is big_frame
+    assert len(cache) == 3
+
+    cache.resize(frame.nbytes)
+    assert len(cache) == 1
+    assert cache.n_bytes == frame.nbytes
+
+
+def test_frame_cache_read_only():
+    cache = FrameCache()
+    backend = Backend()
+
+    # Frames are stored without a copy and can't be modified afterwards.
+    frame = np.ones((4, 4, 1), dtype="uint8")
+    key = cache.make_key(backend, 0)
+    cached = cache.put(key, frame)
+    assert cached is frame
+    assert not cached.flags.writeable
+    with pytest.raises(ValueError):
+        frame[:] = 0
+
+    # Views into larger arrays are copied so the rest of the array isn't kept alive,
+    # unless all of the array is cached.
+    color_frame = np.ones((4, 4, 3), dtype="uint8")
+    cached = cache.put(cache.make_key(backend, 1), color_frame[..., :1])
+    assert cached.base is None
+    assert color_frame.flags.writeable
+
+    batch = np.ones((2, 4, 4, 1), dtype="uint8")
+    cached = cache.put(cache.make_key(backend, 2), batch[0], share_base=True)
+    assert cached.base is batch
+    assert cache.n_bytes == 3 * frame.nbytes
+
+
+def test_frame_cache_clear_backend():
+    cache = FrameCache()
+    backend_a, backend_b = Backend(), Backend()
+    frame = np.zeros((4, 4, 1), dtype="uint8")
+    cache.put(cache.make_key(backend_a, 0), frame)
+    cache.put(cache.make_key(backend_b, 0), frame)
+
+    cache.clear(backend_a)
+    assert cache.get(cache.make_key(backend_a, 0)) is None
+    assert cache.get(cache.make_key(backend_b, 0)) is not None
+    assert cache.n_bytes == frame.nbytes
+
+
+def test_frame_cache_threads():
+    frame = np.zeros((8, 8, 1), dtype="uint8")
+    cache = FrameCache(max_bytes=16 * frame.nbytes)
+    backend = Backend()
+
+    def worker():
+        for i in range(200):
+            key = cache.make_key(backend, i % 32)
+            if cache.get(key) is None:
+                cache.put(key, frame)
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(cache) <= 16
+    assert cache.n_bytes == len(cache) * frame.nbytes
+    assert cache.hits + cache.misses == 800
+
+
+def test_video_get_frame_cached(frame_cache, hdf5_vid):
+    frame = hdf5_vid.get_frame(3)
+    assert frame_cache.misses == 1
+    assert len(frame_cache) == 1
+
+    # The second read is served from the cache and can be modified by the caller.
+    cached_frame = hdf5_vid.get_frame(3)
+    assert frame_cache.hits == 1
+    np.testing.assert_array_equal(cached_frame, frame)
+    cached_frame[:] = 0
+    np.testing.assert_array_equal(hdf5_vid.get_frame(3), frame)
+
+    # Batched reads only read the frames that are not cached.
+    frames = hdf5_vid.get_frames([3, 4, 5])
+    np.testing.assert_array_equal(frames[0], frame)
+    np.testing.assert_array_equal(frames[1:], hdf5_vid.backend.get_frames([4, 5]))
+    assert len(frame_cache) == 3
+
+
+def test_video_get_frame_scaled(frame_cache, hdf5_vid):
+    frame = hdf5_vid.get_frame(0, scale=0.5)
+    assert frame.shape == (256, 256, 1)
+    assert len(frame_cache) == 2
+
+    np.testing.assert_array_equal(hdf5_vid.get_frame(0, scale=0.5), frame)
+    assert frame_cache.hits == 1
+
+
+def test_video_get_frame_cache_disabled(frame_cache, small_robot_mp4_vid):
+    set_frame_cache_size(0)
+    assert not small_robot_mp4_vid.is_cached
+
+    small_robot_mp4_vid.get_frame(0)
+    assert len(frame_cache) == 0
+    assert frame_cache.misses == 0
+
+    # Numpy videos are never cached.
+    set_frame_cache_size(2 ** 20)
+    video = Video.from_numpy(np.zeros((2, 4, 4, 1), dtype="uint8"))
+    assert not video.is_cached
+
+
+def test_disk_frame_cache(tmpdir, hdf5_vid):
+    cache = DiskFrameCache(str(tmpdir))
+    frame = cache.get_frame(hdf5_vid, 1)
+    np.testing.assert_array_equal(frame, hdf5_vid.get_frame(1))
+    cache.close()
+
+    key = DiskFrameCache.get_video_key(hdf5_vid)
+    assert tmpdir.join(f"{key}.h5").check()
+
+    # Frames are read from the cache file by a new cache.
+    cache = DiskFrameCache(str(tmpdir))
+    np.testing.assert_array_equal(cache.get_frame(hdf5_vid, 1), frame)
+    assert cache._get_file(hdf5_vid).rows == {1: 0}
+
+    # Frames are appended to a single dataset.
+    np.testing.assert_array_equal(cache.get_frame(hdf5_vid, 0), hdf5_vid.get_frame(0))
+    cache_file = cache._get_file(hdf5_vid)
+    assert cache_file.rows == {1: 0, 0: 1}
+    assert cache_file.file["frames"].shape[1:] == frame.shape
+    cache.close()
+
+    # The file can be opened by other processes once the cache is closed.
+    with h5py.File(str(tmpdir.join(f"{key}.h5")), "r") as f:
+        np.testing.assert_array_equal(f["frame_inds"][:2], [1, 0])
+        np.testing.assert_array_equal(f["frames"][0], frame)
+
+    # Videos that are not stored in files are not cached.
+    video = Video.from_numpy(np.zeros((2, 4, 4, 1), dtype="uint8"))
+    assert DiskFrameCache.get_video_key(video) is None
+    assert cache.get_frame(video, 0).shape == (4, 4, 1)
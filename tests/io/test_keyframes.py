@@ -0,0 +1,159 @@
+import os
+import shutil
+import subprocess
+import threading
+
+import numpy as np
+import pytest
+
+from sleap.io import keyframes as keyframes_module
+from sleap.io.keyframes import (
+    KeyframeIndex,
+    get_sidecar_path,
+    load_keyframe_index,
+    probe_keyframes,
+    request_keyframe_index,
+)
+from sleap.io.video import Video
+from tests.fixtures.videos import TEST_SMALL_ROBOT_MP4_FILE
+
+
+def test_keyframe_index_plan():
+    index = KeyframeIndex(n_frames=100, keyframes=[0, 30, 60, 90], seek_cost=5)
+
+    assert index.keyframe_before(0) == 0
+    assert index.keyframe_before(29) == 0
+    assert index.keyframe_before(30) == 30
+    assert index.keyframe_before(99) == 90
+
+    # Continue decoding forward when the target is close.
+    assert index.plan(pos=10, target=12) == (None, 2)
+
+    # Decoding forward from past the keyframe is never worse than seeking.
+    assert index.plan(pos=31, target=59) == (None, 28)
+
+    # Seek to the keyframe before the target otherwise.
+    assert index.plan(pos=10, target=62) == (60, 2)
+    assert index.plan(pos=50, target=40) == (30, 10)
+
+    # Reading in ascending order decodes the fewest frames.
+    assert index.decode_cost([10, 62, 12]) > index.decode_cost([10, 12, 62])
+
+
+def test_keyframe_index_unknown_keyframes():
+    index = KeyframeIndex(n_frames=100, seek_cost=8)
+    assert not index.has_keyframes
+    assert index.plan(pos=10, target=15) == (None, 5)
+    assert index.plan(pos=10, target=50) == (50, 0)
+    assert index.plan(pos=10, target=5) == (5, 0)
+
+
+@pytest.mark.skipif(shutil.which("ffprobe") is None, reason="requires ffprobe")
+def test_load_keyframe_index(tmpdir):
+    filename = os.path.join(tmpdir, "small_robot.mp4")
+    shutil.copy(TEST_SMALL_ROBOT_MP4_FILE, filename)
+
+    keyframes = probe_keyframes(filename)
+    assert keyframes[0] == 0
+
+    index = load_keyframe_index(filename, n_frames=166)
+    np.testing.assert_array_equal(index.keyframes, keyframes)
+    assert os.path.exists(get_sidecar_path(filename))
+
+    # The index is loaded from the sidecar file without probing.
+    index = load_keyframe_index(filename, n_frames=166, build=False)
+    np.testing.assert_array_equal(index.keyframes, keyframes)
+
+
+def test_probe_keyframes_timeout(monkeypatch):
+    def run(args, **kwargs):
+        raise subprocess.TimeoutExpired(args, kwargs["timeout"])
+
+    monkeypatch.setattr(shutil, "which", lambda name: name)
+    monkeypatch.setattr(subprocess, "run", run)
+    assert probe_keyframes(TEST_SMALL_ROBOT_MP4_FILE, timeout=1.0) is None
+
+
+def test_request_keyframe_index(tmpdir, monkeypatch):
+    filename = os.path.join(tmpdir, "small_robot.mp4")
+    shutil.copy(TEST_SMALL_ROBOT_MP4_FILE, filename)
+
+    probed = threading.Event()
+    release = threading.Event()
+
+    def probe(filename, timeout=None):
+        probed.set()
+        release.wait()
+        return np.array([0, 50])
+
+    monkeypatch.setattr(keyframes_module, "probe_keyframes", probe)
+
+    # The video is probed in the background.
+    assert request_keyframe_index(filename, n_frames=166) is None
+    assert probed.wait(timeout=10)
+    assert request_keyframe_index(filename, n_frames=166) is None
+
+    release.set()
+    index = request_keyframe_index(filename, n_frames=166, wait=True)
+    np.testing.assert_array_equal(index.keyframes, [0, 50])
+
+    # Later requests share the index.
+    assert request_keyframe_index(filename, n_frames=166) is index
+
+
+def test_media_video_random_access(tmpdir):
+    filename = os.path.join(tmpdir, "small_robot.mp4")
+    shutil.copy(TEST_SMALL_ROBOT_MP4_FILE, filename)
+
+    video = Video.from_media(filename)
+    frames = [video.get_frame(idx) for idx in range(20)]
+
+    video = Video.from_media(filename)
+    for idx in [15, 3, 4, 19, 0]:
+        np.testing.assert_array_equal(video.get_frame(idx), frames[idx])
+
+    batch = video.get_frames([19, 2, 2, 11])
+    assert batch.shape == (4, 320, 560, 3)
+    for frame, idx in zip(batch, [19, 2, 2, 11]):
+        np.testing.assert_array_equal(frame, frames[idx])
+
+
+def test_media_video_keyframe_index_in_background(tmpdir, monkeypatch):
+    filename = os.path.join(tmpdir, "small_robot.mp4")
+    shutil.copy(TEST_SMALL_ROBOT_MP4_FILE, filename)
+
+    release = threading.Event()
+
+    def probe(filename, timeout=None):
+        release.wait()
+        return np.array([0])
+
+    monkeypatch.setattr(keyframes_module, "probe_keyframes", probe)
+
+    # Random access reads don't wait for the video to be probed.
+    video = Video.from_media(filename)
+    frame = video.get_frame(10)
+    assert frame.shape == (320, 560, 3)
+    assert not video.backend.keyframe_index.has_keyframes
+    assert video.backend._keyframe_index_ is None
+
+    release.set()
+    index = video.backend.build_keyframe_index()
+    np.testing.assert_array_equal(index.keyframes, [0])
+    assert video.backend.keyframe_index is index
+
+
+def test_media_video_reset_keyframe_index(tmpdir):
+    filename = os.path.join(tmpdir, "video.mp4")
+    shutil.copy(TEST_SMALL_ROBOT_MP4_FILE, filename)
+
+    video = Video.from_media(filename)
+    index = video.backend.build_keyframe_index()
+    assert index.n_frames == 166
+
+    # Replacing the file (e.g., with the GUI's replace video command) must not reuse
+    # the keyframes of the previous file.
+    shutil.copy("tests/data/videos/centered_pair_small.mp4", filename)
+    video.backend.reset()
+    assert video.backend._keyframe_index_ is None
+    assert video.backend.build_keyframe_index() is not index
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+from sleap.io.parallelvideo import ParallelVideoDecoder, split_segments
+
+
+def test_split_segments():
+    segments = split_segments([0, 1, 2, 3, 4, 10, 11, 2, 3], segment_size=3)
+    assert [s.tolist() for s in segments] == [[0, 1, 2], [3, 4, 10], [11], [2, 3]]
+    assert split_segments([], segment_size=3) == []
+
+
+def test_parallel_video_decoder(small_robot_mp4_vid):
+    decoder = ParallelVideoDecoder(
+        small_robot_mp4_vid, n_workers=3, segment_size=4, buffer_size=4
+    )
+    frame_inds = [0, 1, 2, 3, 4, 5, 7, 9, 30, 31, 3, 100, 101]
+    frames = list(decoder.iter_frames(frame_inds))
+
+    assert decoder.start_method == "spawn"
+    assert [frame_idx for frame_idx, _ in frames] == frame_inds
+    for frame_idx, frame in frames:
+        np.testing.assert_array_equal(frame, small_robot_mp4_vid.get_frame(frame_idx))
+
+
+def test_parallel_video_decoder_bad_frame(small_robot_mp4_vid):
+    decoder = ParallelVideoDecoder(small_robot_mp4_vid, n_workers=2)
+    with pytest.raises(KeyError):
+        list(decoder.iter_frames([0, 1000]))
+
+
+def test_parallel_video_decoder_backend(hdf5_vid):
+    with pytest.raises(ValueError):
+        ParallelVideoDecoder(hdf5_vid)
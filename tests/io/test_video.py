@@ -61,6 +61,27 @@ def test_hdf5_get_item(hdf5_vid):
     assert np.alltrue(hdf5_vid[1:10:3] == hdf5_vid.get_frames([1, 4, 7]))
 
 
+def test_get_frames_batched(hdf5_vid, small_robot_mp4_vid):
+    idxs = [7, 2, 2, 0, 9]
+
+    def assert_matches_get_frame(vid):
+        frames = vid.get_frames(idxs)
+        assert frames.shape == (len(idxs), vid.height, vid.width, vid.channels)
+        for frame, idx in zip(frames, idxs):
+            np.testing.assert_array_equal(frame, vid.get_frame(idx))
+
+    assert_matches_get_frame(hdf5_vid)
+    assert_matches_get_frame(small_robot_mp4_vid)
+    assert_matches_get_frame(Video.from_numpy(small_robot_mp4_vid[:10]))
+
+    filenames = [f"tests/data/videos/robot{i}.jpg" for i in range(3)]
+    images_vid = Video.from_image_filenames(filenames)
+    frames = images_vid.get_frames([2, 0, 2])
+    assert frames.shape == (3, 320, 560, 3)
+    np.testing.assert_array_equal(frames[0], images_vid.get_frame(2))
+    np.testing.assert_array_equal(frames[1], images_vid.get_frame(0))
+
+
 def test_hd5f_file_not_found():
     with pytest.raises(FileNotFoundError):
         Video.from_hdf5("non-existent-filename.h5", "dataset_name").height
@@ -261,6 +282,11 @@ def test_hdf5_inline_video(small_robot_mp4_vid, tmpdir, format):
     # Try loading a frame from the source video that's not in the inline video
     assert hdf5_vid.get_frame(3).shape == (320, 560, 3)
 
+    # Batched reads decode the same frames, also when mixed with source frames.
+    frames = hdf5_vid.get_frames([5, 0, 3])
+    for frame, i in zip(frames, [5, 0, 3]):
+        np.testing.assert_array_equal(frame, hdf5_vid.get_frame(i))
+
     # Check the image data is exactly the same when lossless is used.
     if format in ("", "png"):
         assert np.allclose(
@@ -6,6 +6,7 @@ use_cpu_only()  # hide GPUs for test
 from tests.fixtures.videos import TEST_H5_FILE, TEST_SMALL_ROBOT_MP4_FILE
 import sleap
 from sleap.nn.data import providers
+from sleap.nn.profiling import get_profiler
 
 
 def test_labels_reader(min_labels):
@@ -72,6 +73,76 @@ def test_labels_reader_subset(min_labels):
     assert examples[1]["example_ind"] == 1
 
 
+def test_labels_reader_decode_workers(min_labels):
+    labels = sleap.Labels([min_labels[0], min_labels[0], min_labels[0]])
+
+    serial_examples = list(
+        iter(
+            providers.LabelsReader(
+                labels, example_indices=[2, 0, 1], decode_workers=0
+            ).make_dataset()
+        )
+    )
+    examples = list(
+        iter(
+            providers.LabelsReader(
+                labels, example_indices=[2, 0, 1], decode_workers=2, prefetch_size=1
+            ).make_dataset()
+        )
+    )
+
+    assert len(examples) == 3
+    for example, serial_example in zip(examples, serial_examples):
+        assert example.keys() == serial_example.keys()
+        for key in example:
+            assert example[key].dtype == serial_example[key].dtype
+            np.testing.assert_array_equal(example[key], serial_example[key])
+    assert [int(example["example_ind"]) for example in examples] == [2, 0, 1]
+
+
+def test_labels_reader_mp4_decode_workers(min_labels_robot):
+    def read_examples(decode_workers):
+        labels_reader = providers.LabelsReader(
+            min_labels_robot,
+            example_indices=[1, 0, 1, 0, 1],
+            decode_workers=decode_workers,
+            prefetch_size=2,
+        )
+        return list(iter(labels_reader.make_dataset()))
+
+    serial_examples = read_examples(0)
+    get_profiler().reset()
+    get_profiler().enable()
+    try:
+        examples = read_examples(2)
+    finally:
+        get_profiler().disable()
+
+    # The reads in the threads are profiled.
+    assert get_profiler().get_stats("provider_fetch").count == 5
+    get_profiler().reset()
+    for example, serial_example in zip(examples, serial_examples):
+        assert int(example["frame_ind"]) == int(serial_example["frame_ind"])
+        np.testing.assert_array_equal(example["image"], serial_example["image"])
+
+    video = min_labels_robot.videos[0]
+    thread_video = providers._make_thread_video(video)
+    assert thread_video.backend is not video.backend
+    assert thread_video.backend.grayscale == video.backend.grayscale
+    np.testing.assert_array_equal(thread_video.get_frame(79), video.get_frame(79))
+
+
+def test_labels_reader_frame_cache_dir(min_labels, tmpdir):
+    labels_reader = providers.LabelsReader(min_labels, frame_cache_dir=str(tmpdir))
+    example = next(iter(labels_reader.make_dataset()))
+    assert len(tmpdir.listdir()) == 1
+
+    # The second pass reads the image from the cache.
+    cached_example = next(iter(labels_reader.make_dataset()))
+    np.testing.assert_array_equal(cached_example["image"], example["image"])
+    np.testing.assert_array_equal(cached_example["image"], min_labels[0].image)
+
+
 def test_video_reader_mp4():
     video_reader = providers.VideoReader.from_filepath(TEST_SMALL_ROBOT_MP4_FILE)
     ds = video_reader.make_dataset()
@@ -108,6 +179,25 @@ def test_video_reader_mp4_subset():
     assert examples[2]["frame_ind"] == 4
 
 
+def test_video_reader_mp4_decode_workers():
+    video_reader = providers.VideoReader.from_filepath(
+        TEST_SMALL_ROBOT_MP4_FILE, example_indices=[2, 1, 4, 5, 6]
+    )
+    video_reader.decode_workers = 2
+
+    ds = video_reader.make_dataset()
+    examples = list(iter(ds))
+
+    assert [int(ex["frame_ind"]) for ex in examples] == [2, 1, 4, 5, 6]
+    assert examples[0]["frame_ind"].dtype == tf.int64
+    assert examples[0]["raw_image_size"].dtype == tf.int32
+    np.testing.assert_array_equal(examples[0]["raw_image_size"], (320, 560, 3))
+    for ex in examples:
+        np.testing.assert_array_equal(
+            ex["image"], video_reader.video.get_frame(int(ex["frame_ind"]))
+        )
+
+
 def test_video_reader_mp4_grayscale():
     video_reader = providers.VideoReader.from_filepath(
         TEST_SMALL_ROBOT_MP4_FILE, grayscale=True
@@ -124,6 +214,24 @@ def test_video_reader_mp4_grayscale():
     np.testing.assert_array_equal(example["raw_image_size"], (320, 560, 1))
 
 
+def test_video_reader_mp4_decode_workers_after_tf_op():
+    # The TensorFlow thread pools are running once an op has executed, so the decoder
+    # workers must not be forked from this process.
+    assert tf.reduce_sum(tf.ones([8, 8])).numpy() == 64
+
+    video_reader = providers.VideoReader.from_filepath(
+        TEST_SMALL_ROBOT_MP4_FILE, example_indices=[3, 0, 50, 51]
+    )
+    video_reader.decode_workers = 2
+    examples = list(iter(video_reader.make_dataset()))
+
+    assert [int(ex["frame_ind"]) for ex in examples] == [3, 0, 50, 51]
+    for ex in examples:
+        np.testing.assert_array_equal(
+            ex["image"], video_reader.video.get_frame(int(ex["frame_ind"]))
+        )
+
+
 def test_video_reader_hdf5():
     video_reader = providers.VideoReader.from_filepath(
         TEST_H5_FILE, dataset="/box", input_format="channels_first"
@@ -0,0 +1,149 @@
+import numpy as np
+import pytest
+
+import sleap
+from sleap.instance import LabeledFrame, PredictedInstance, Track
+from sleap.nn.frame_stride import (
+    FILLED_INSTANCE_SCORE,
+    fill_strided_frames,
+    flow_fill_instances,
+    interpolate_instances,
+    make_strided_frame_inds,
+)
+
+
+@pytest.fixture
+def skeleton():
+    skeleton = sleap.Skeleton()
+    skeleton.add_node("a")
+    skeleton.add_node("b")
+    return skeleton
+
+
+def make_strided_frames(video, skeleton, frame_inds, tracks):
+    """Make frames with one instance per track that moves along a parabola."""
+    labeled_frames = []
+    for frame_ind in frame_inds:
+        instances = []
+        for i, track in enumerate(tracks):
+            points = np.array(
+                [[frame_ind, frame_ind ** 2], [frame_ind + 10 * i, 5.0]], "float32"
+            )
+            instances.append(
+                PredictedInstance.from_arrays(
+                    points=points,
+                    point_confidences=np.array([0.5, 1.0], "float32"),
+                    instance_score=1.0,
+                    skeleton=skeleton,
+                    track=track,
+                )
+            )
+        labeled_frames.append(
+            LabeledFrame(video=video, frame_idx=int(frame_ind), instances=instances)
+        )
+    return labeled_frames
+
+
+def test_make_strided_frame_inds():
+    np.testing.assert_array_equal(make_strided_frame_inds(range(9), 4), [0, 4, 8])
+    np.testing.assert_array_equal(make_strided_frame_inds(range(10), 4), [0, 4, 8, 9])
+    np.testing.assert_array_equal(make_strided_frame_inds([5, 1, 3], 1), [1, 3, 5])
+    assert len(make_strided_frame_inds([], 4)) == 0
+    with pytest.raises(ValueError):
+        make_strided_frame_inds(range(10), 0)
+
+
+def test_interpolate_instances_linear(skeleton):
+    video = sleap.Video.from_numpy(np.zeros((13, 8, 8, 1), "uint8"))
+    tracks = [Track(name="0"), Track(name="1")]
+    labeled_frames = make_strided_frames(video, skeleton, [0, 4, 8, 12], tracks)
+
+    # Track 1 and node "b" of track 0 are missing in frame 8.
+    labeled_frames[2].instances[0]["b"].visible = False
+    labeled_frames[2].instances = labeled_frames[2].instances[:1]
+
+    filled_frames = interpolate_instances(labeled_frames, range(13), method="linear")
+    assert [lf.frame_idx for lf in filled_frames] == [1, 2, 3, 5, 6, 7, 9, 10, 11]
+
+    lf = filled_frames[1]
+    assert len(lf.instances) == 2
+    assert [inst.track for inst in lf.instances] == tracks
+    assert all(inst.score == FILLED_INSTANCE_SCORE for inst in lf.instances)
+    np.testing.assert_allclose(lf.instances[0].numpy(), [[2, 8], [2, 5]])
+    np.testing.assert_allclose(lf.instances[1].numpy(), [[2, 8], [12, 5]])
+    np.testing.assert_allclose(lf.instances[0].scores, [0.5, 1.0])
+
+    # Track 1 can't be interpolated across frame 8 and node "b" of track 0 is missing.
+    for lf in filled_frames[3:]:
+        assert len(lf.instances) == 1
+        assert np.isnan(lf.instances[0].numpy()[1]).all()
+        assert not np.isnan(lf.instances[0].numpy()[0]).any()
+
+
+def test_interpolate_instances_spline(skeleton):
+    video = sleap.Video.from_numpy(np.zeros((13, 8, 8, 1), "uint8"))
+    tracks = [Track(name="0")]
+    labeled_frames = make_strided_frames(video, skeleton, [0, 4, 8, 12], tracks)
+
+    filled_frames = interpolate_instances(labeled_frames, range(13), method="spline")
+    assert len(filled_frames) == 9
+
+    # The spline recovers the parabola exactly while linear interpolation doesn't.
+    for lf in filled_frames:
+        t = lf.frame_idx
+        np.testing.assert_allclose(
+            lf.instances[0].numpy(), [[t, t ** 2], [t, 5]], atol=1e-3
+        )
+
+    with pytest.raises(ValueError):
+        interpolate_instances(labeled_frames, range(13), method="nearest")
+
+
+def test_flow_fill_instances(skeleton):
+    # A bright square that moves one pixel to the right per frame.
+    imgs = np.zeros((5, 64, 64, 1), "uint8")
+    for t in range(5):
+        imgs[t, 24:40, 20 + t : 36 + t] = 255
+    video = sleap.Video.from_numpy(imgs)
+
+    instance = PredictedInstance.from_arrays(
+        points=np.array([[20, 24], [35, 39]], "float32"),
+        point_confidences=np.array([0.5, 1.0], "float32"),
+        instance_score=1.0,
+        skeleton=skeleton,
+        track=None,
+    )
+    labeled_frames = [LabeledFrame(video=video, frame_idx=0, instances=[instance])]
+
+    filled_frames = flow_fill_instances(labeled_frames, range(3))
+    assert [lf.frame_idx for lf in filled_frames] == [1, 2]
+    for lf in filled_frames:
+        assert len(lf.instances) == 1
+        assert lf.instances[0].score == FILLED_INSTANCE_SCORE
+        assert lf.instances[0].track is None
+        np.testing.assert_allclose(lf.instances[0].scores, [0.5, 1.0])
+        np.testing.assert_allclose(
+            lf.instances[0].numpy(),
+            [[20 + lf.frame_idx, 24], [35 + lf.frame_idx, 39]],
+            atol=0.5,
+        )
+
+
+def test_fill_strided_frames(skeleton):
+    video = sleap.Video.from_numpy(np.zeros((11, 8, 8, 1), "uint8"))
+    tracks = [Track(name="0")]
+    labeled_frames = make_strided_frames(video, skeleton, [2, 6], tracks)
+
+    all_frames = fill_strided_frames(labeled_frames, range(11), method="linear")
+    assert [lf.frame_idx for lf in all_frames] == list(range(11))
+    assert [len(lf.instances) for lf in all_frames] == [0, 0] + [1] * 5 + [0] * 4
+    assert all_frames[2] is labeled_frames[0]
+    assert all_frames[6] is labeled_frames[1]
+    assert all_frames[4].instances[0].score == FILLED_INSTANCE_SCORE
+
+    labels = sleap.Labels(all_frames)
+    assert len(labels) == 11
+    assert labels.tracks == tracks
+
+    with pytest.raises(ValueError):
+        fill_strided_frames(labeled_frames, range(11), method="cubic")
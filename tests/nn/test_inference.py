@@ -1,3 +1,6 @@
+import os
+import sys
+import h5py
 import pytest
 import numpy as np
 import tensorflow as tf
@@ -25,8 +28,19 @@ from sleap.nn.inference import (
     TopDownInferenceModel,
     TopDownPredictor,
     BottomUpPredictor,
+    Predictor,
+    LabelsSink,
+    AnalysisSink,
+    MultiSink,
+    INFERENCE_STAGES,
     load_model,
+    get_keras_model_path,
+    _skip_predicted_frames,
+    main as sleap_track,
 )
+from sleap.nn.data.providers import LabelsReader, VideoReader
+from sleap.nn.motion_gating import MotionGate
+from sleap.nn.profiling import get_profiler
 
 sleap.nn.system.use_cpu_only()
 
@@ -529,6 +543,58 @@ def test_topdown_predictor_centered_instance(
     assert_allclose(points_gt[inds1.numpy()], points_pr[inds2.numpy()], atol=1.5)
 
 
+@pytest.mark.parametrize("instance_batch_size", [1, 3])
+def test_topdown_predictor_instance_batch_size(
+    min_labels,
+    min_centroid_model_path,
+    min_centered_instance_model_path,
+    instance_batch_size,
+):
+    predictor = TopDownPredictor.from_trained_models(
+        centroid_model_path=min_centroid_model_path,
+        confmap_model_path=min_centered_instance_model_path,
+    )
+    labels_pr = predictor.predict(min_labels)
+
+    predictor = TopDownPredictor.from_trained_models(
+        centroid_model_path=min_centroid_model_path,
+        confmap_model_path=min_centered_instance_model_path,
+        instance_batch_size=instance_batch_size,
+    )
+    assert (
+        predictor.inference_model.instance_peaks.instance_batch_size
+        == instance_batch_size
+    )
+    labels_batched = predictor.predict(min_labels)
+
+    assert len(labels_batched[0].instances) == len(labels_pr[0].instances)
+    for inst_batched, inst_pr in zip(labels_batched[0], labels_pr[0]):
+        assert_allclose(inst_batched.numpy(), inst_pr.numpy(), atol=1e-4)
+
+
+def test_find_instance_peaks_micro_batches(min_centered_instance_model_path):
+    keras_model = tf.keras.models.load_model(
+        get_keras_model_path(min_centered_instance_model_path), compile=False
+    )
+    layer = FindInstancePeaks(keras_model=keras_model, instance_batch_size=2)
+    crops = tf.random.uniform(
+        [5] + keras_model.inputs[0].shape[1:].as_list(), maxval=255
+    )
+    crops = tf.cast(crops, tf.uint8)
+
+    out = layer.predict_micro_batches(crops)
+    expected = keras_model(layer.preprocess(crops))
+    for x, y in zip(tf.nest.flatten(out), tf.nest.flatten(expected)):
+        assert_allclose(x, y, atol=1e-5)
+
+    # No crops.
+    out = layer.predict_micro_batches(crops[:0])
+    assert all(x.shape[0] == 0 for x in tf.nest.flatten(out))
+
+    with pytest.raises(ValueError):
+        FindInstancePeaks(keras_model=keras_model, instance_batch_size=0)
+
+
 def test_topdown_predictor_bottomup(min_labels, min_bottomup_model_path):
     predictor = BottomUpPredictor.from_trained_models(
         model_path=min_bottomup_model_path
@@ -547,6 +613,193 @@ def test_topdown_predictor_bottomup(min_labels, min_bottomup_model_path):
     assert_allclose(points_gt[inds1.numpy()], points_pr[inds2.numpy()], atol=1.75)
 
 
+def test_predictor_sink(tmpdir, min_labels, min_bottomup_model_path):
+    predictor = BottomUpPredictor.from_trained_models(
+        model_path=min_bottomup_model_path
+    )
+    labels_pr = predictor.predict(min_labels)
+
+    filename = str(tmpdir.join("predictions.slp"))
+    with LabelsSink(filename, provenance={"test": True}) as sink:
+        assert predictor.predict(min_labels, sink=sink) is None
+        assert sink.n_frames_written == 1
+
+    labels_sink = sleap.load_file(filename)
+    assert len(labels_sink) == 1
+    assert labels_sink.provenance["test"]
+    assert_allclose(labels_sink[0][0].numpy(), labels_pr[0][0].numpy())
+
+    # All frames are already in the file, so none are left to predict.
+    sink = LabelsSink(filename, resume=True)
+    provider = _skip_predicted_frames(
+        LabelsReader(min_labels), sink.get_predicted_frame_inds()
+    )
+    assert len(provider) == 0
+
+
+def test_sleap_track_json_output(tmpdir, monkeypatch, min_bottomup_model_path):
+    output_path = str(tmpdir.join("predictions.json"))
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        [
+            "sleap-track",
+            "tests/data/slp_hdf5/minimal_instance.slp",
+            "-m",
+            min_bottomup_model_path,
+            "-o",
+            output_path,
+        ],
+    )
+    sleap_track()
+
+    # Only .slp outputs are streamed, so no HDF5 file is written to the .json path and
+    # the predictions are saved with `Labels.save` instead.
+    assert not os.path.exists(output_path)
+    labels_pr = sleap.load_file(output_path + ".slp")
+    assert len(labels_pr) == 1
+
+    with pytest.raises(ValueError):
+        LabelsSink(output_path)
+
+
+def test_predictor_analysis_sink(tmpdir, min_labels, min_bottomup_model_path):
+    predictor = BottomUpPredictor.from_trained_models(
+        model_path=min_bottomup_model_path
+    )
+    labels_pr = predictor.predict(min_labels)
+
+    filename = str(tmpdir.join("predictions.slp"))
+    analysis_filename = str(tmpdir.join("predictions.analysis.h5"))
+    labels_sink = LabelsSink(filename)
+    analysis_sink = AnalysisSink(analysis_filename, dtype="float32", block_size=1)
+    with MultiSink([labels_sink, analysis_sink]) as sink:
+        predictor.predict(min_labels, sink=sink)
+    assert labels_sink.n_frames_written == 1
+
+    with h5py.File(analysis_filename, "r") as f:
+        tracks = f["tracks"][:].T
+        assert f["tracks"].dtype == np.float32
+        assert f["track_occupancy"][:].T.shape == (1, 1)
+    assert tracks.shape == (1, 2, 2, 1)
+
+    # Untracked instances are written to the first track.
+    assert any(
+        np.allclose(tracks[0, ..., 0], inst.numpy(), equal_nan=True)
+        for inst in labels_pr[0]
+    )
+
+
+def test_predictor_pipelined(tmpdir, min_labels, min_bottomup_model_path):
+    predictor = BottomUpPredictor.from_trained_models(
+        model_path=min_bottomup_model_path
+    )
+    labels_pr = predictor.predict(min_labels)
+
+    predictor.pipelined = True
+    labels_pipelined = predictor.predict(min_labels)
+    assert len(labels_pipelined) == len(labels_pr)
+    assert_allclose(labels_pipelined[0][0].numpy(), labels_pr[0][0].numpy())
+
+    with LabelsSink(str(tmpdir.join("predictions.slp"))) as sink:
+        predictor.predict(min_labels, sink=sink)
+        assert sink.n_frames_written == 1
+    assert set(predictor.stage_times) == set(INFERENCE_STAGES)
+    assert predictor.stage_times["inference"] > 0
+
+
+def test_predictor_profiling(min_labels, min_bottomup_model_path):
+    profiler = get_profiler()
+    profiler.reset()
+    profiler.enable()
+    try:
+        predictor = BottomUpPredictor.from_trained_models(
+            model_path=min_bottomup_model_path
+        )
+        predictor.predict(min_labels)
+    finally:
+        profiler.disable()
+
+    for stage in ["provider_fetch", "preprocess", "forward_pass", "paf_scoring"]:
+        assert profiler.get_stats(stage).count > 0
+    profiler.reset()
+
+
+@pytest.mark.parametrize("pipelined", [False, True])
+def test_predictor_motion_gate(min_labels, min_bottomup_model_path, pipelined):
+    frame = min_labels.videos[0].get_frame(min_labels[0].frame_idx)
+    frames = np.stack([frame, frame, frame, 255 - frame, 255 - frame, frame])
+    video = sleap.Video.from_numpy(frames)
+
+    predictor = BottomUpPredictor.from_trained_models(
+        model_path=min_bottomup_model_path
+    )
+    predictor.pipelined = pipelined
+    labels_pr = predictor.predict(video)
+
+    predictor.motion_gate = MotionGate()
+    labels_gated = predictor.predict(video)
+    assert predictor.motion_gate.skipped_frames == [(0, 1), (0, 2), (0, 4)]
+
+    assert [lf.frame_idx for lf in labels_gated] == list(range(6))
+    for lf_pr, lf_gated in zip(labels_pr, labels_gated):
+        assert len(lf_gated.instances) == len(lf_pr.instances)
+        for inst_pr, inst_gated in zip(lf_pr, lf_gated):
+            assert_allclose(inst_gated.numpy(), inst_pr.numpy(), atol=1e-3)
+
+
+class ListPredictor(Predictor):
+    """Predictor that creates empty frames from a list of batches."""
+
+    @classmethod
+    def from_trained_models(cls):
+        return cls()
+
+    def _initialize_inference_model(self):
+        pass
+
+    def _make_labeled_frames_from_batch(self, ex, data_provider):
+        if ex["frame_ind"][0] < 0:
+            raise ValueError("Invalid frame.")
+        return [
+            sleap.LabeledFrame(video=data_provider.videos[0], frame_idx=frame_ind)
+            for frame_ind in ex["frame_ind"]
+        ]
+
+
+def test_predictor_pipelined_stages(centered_pair_vid):
+    provider = VideoReader(centered_pair_vid)
+    batches = [{"frame_ind": np.arange(i, i + 4)} for i in range(0, 40, 4)]
+    predictor = ListPredictor(pipelined=True, max_queued_batches=1)
+    predictor._reset_stage_times()
+
+    labeled_batches = predictor._iter_labeled_frames_from_generator(
+        iter(batches), provider
+    )
+    frames = [lf for batch_frames in labeled_batches for lf in batch_frames]
+    assert [lf.frame_idx for lf in frames] == list(range(40))
+
+    # Errors in the worker threads are raised in the calling thread.
+    batches[5]["frame_ind"] = np.array([-1])
+    with pytest.raises(ValueError):
+        list(predictor._iter_labeled_frames_from_generator(iter(batches), provider))
+
+    # The workers are stopped if the consumer stops early.
+    labeled_batches = predictor._iter_labeled_frames_from_generator(
+        iter(batches), provider
+    )
+    next(labeled_batches)
+    labeled_batches.close()
+
+
+def test_skip_predicted_frames(centered_pair_vid):
+    provider = VideoReader(centered_pair_vid, example_indices=[0, 1, 2, 3])
+    provider = _skip_predicted_frames(
+        provider, {centered_pair_vid.filename: np.array([1, 3, 5])}
+    )
+    assert_array_equal(provider.example_indices, [0, 2])
+
+
 def test_load_model(
     min_single_instance_robot_model_path,
     min_centroid_model_path,
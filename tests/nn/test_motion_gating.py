@@ -0,0 +1,49 @@
+import numpy as np
+
+from sleap.nn.motion_gating import MotionGate
+
+
+def test_motion_gate():
+    frames = np.zeros((8, 32, 32, 1), dtype="uint8")
+    frames[4:, 8:16, 8:16] = 255
+    gate = MotionGate(max_skipped=None)
+
+    active = gate.update(frames[:3], np.zeros(3), np.arange(3))
+    np.testing.assert_array_equal(active, [True, False, False])
+
+    # Frames are compared to the last processed frame across batches.
+    active = gate.update(frames[3:], np.zeros(5), np.arange(3, 8))
+    np.testing.assert_array_equal(active, [False, True, False, False, False])
+
+    assert gate.n_frames == 8
+    assert gate.n_skipped == 6
+    assert gate.skipped_fraction == 0.75
+
+    summary = gate.summary()
+    assert summary["skipped_frames"] == [[0, 1, 3], [0, 5, 7]]
+
+    gate.reset()
+    assert gate.n_frames == 0
+    assert gate.update(frames[:1], [0], [0]).all()
+
+
+def test_motion_gate_options():
+    frames = np.zeros((6, 16, 16, 3), dtype="uint8")
+    frames[1:, 0, 0] = 100
+
+    # A single changed pixel is averaged out by downsampling.
+    gate = MotionGate(downsample=4, max_skipped=2)
+    assert gate.downsample_images(frames).shape == (6, 4, 4)
+    active = gate.update(frames, np.zeros(6), np.arange(6))
+    np.testing.assert_array_equal(active, [True, False, False, True, False, False])
+
+    gate = MotionGate(downsample=1)
+    np.testing.assert_array_equal(
+        gate.update(frames, np.zeros(6), np.arange(6)),
+        [True, True, False, False, False, False],
+    )
+
+    # Videos have separate reference frames.
+    gate = MotionGate()
+    active = gate.update(frames[[0, 0, 1]], [0, 1, 0], [0, 0, 1])
+    np.testing.assert_array_equal(active, [True, True, False])
@@ -12,9 +12,18 @@ from sleap.nn.paf_grouping import (
     score_paf_lines_batch,
     match_candidates_sample,
     match_candidates_batch,
+    match_candidates_flat,
     group_instances_sample,
     group_instances_batch,
+    group_instances_flat,
+    assign_connections_to_instances,
+    EdgeConnection,
     EdgeType,
+    PeakID,
+)
+from sleap.benchmarks.paf_grouping import (
+    benchmark_assign_connections,
+    make_synthetic_connections,
 )
 
 sleap.nn.system.use_cpu_only()
@@ -166,6 +175,61 @@ def test_match_candidates_batch():
     assert_array_equal(match_line_scores.flat_values, [1.0])
 
 
+@pytest.mark.parametrize("n_workers", [1, 2])
+def test_match_candidates_flat(n_workers):
+    # Sample 0 has a 2x1 problem for edge 0 and sample 1 has a 2x2 problem for edge 0
+    # and a 1x1 problem for edge 1.
+    sample_inds = np.array([0, 0, 1, 1, 1, 1, 1])
+    edge_inds = np.array([0, 0, 0, 0, 0, 0, 1])
+    edge_peak_inds = np.array(
+        [[0, 1], [2, 1], [0, 1], [0, 3], [2, 1], [2, 3], [1, 4]], dtype="int32"
+    )
+    line_scores = np.array([-0.5, 1.0, 0.1, 0.9, 0.8, 0.2, 0.5], dtype="float32")
+
+    (
+        match_sample_inds,
+        match_edge_inds,
+        match_src_peak_inds,
+        match_dst_peak_inds,
+        match_line_scores,
+    ) = match_candidates_flat(
+        sample_inds,
+        edge_inds,
+        edge_peak_inds,
+        line_scores,
+        n_samples=2,
+        n_edges=2,
+        n_workers=n_workers,
+    )
+
+    assert_array_equal(match_sample_inds, [0, 1, 1, 1])
+    assert_array_equal(match_edge_inds, [0, 0, 0, 1])
+    assert_array_equal(match_src_peak_inds, [1, 0, 1, 0])
+    assert_array_equal(match_dst_peak_inds, [0, 1, 0, 0])
+    assert_allclose(match_line_scores, [1.0, 0.9, 0.8, 0.5])
+
+    # Same matches as matching each sample separately.
+    for sample in range(2):
+        in_sample = sample_inds == sample
+        matches = match_candidates_sample(
+            tf.constant(edge_inds[in_sample], tf.int32),
+            tf.constant(edge_peak_inds[in_sample]),
+            tf.constant(line_scores[in_sample]),
+            2,
+        )
+        is_match = match_sample_inds == sample
+        assert_array_equal(matches[0], match_edge_inds[is_match])
+        assert_array_equal(matches[1], match_src_peak_inds[is_match])
+        assert_array_equal(matches[2], match_dst_peak_inds[is_match])
+        assert_array_equal(matches[3], match_line_scores[is_match])
+
+    # Empty batches.
+    matches = match_candidates_flat(
+        [], [], np.zeros((0, 2)), [], n_samples=2, n_edges=2
+    )
+    assert all(len(x) == 0 for x in matches)
+
+
 def test_group_instances_sample():
     peaks_sample = tf.reshape(tf.range(5 * 2, dtype=tf.float32), [5, 2])
     peak_scores_sample = tf.range(5, dtype=tf.float32)
@@ -212,6 +276,73 @@ def test_group_instances_sample():
     assert_array_equal(predicted_instance_scores, [1.0, 2.0])
 
 
+def test_group_instances_flat():
+    # The same sample as in test_group_instances_sample twice, with the edges of the
+    # second copy in reverse order and peaks from both samples interleaved.
+    peaks = np.reshape(np.arange(5 * 2, dtype="float32"), [5, 2])
+    peaks = np.concatenate([peaks, peaks + 10])
+    peak_scores = np.concatenate([np.arange(5), np.arange(5) + 10]).astype("float32")
+    peak_channel_inds = np.array([0, 1, 2, 0, 1] * 2)
+    peak_sample_inds = np.array([0] * 5 + [1] * 5)
+    order = np.array([0, 5, 1, 6, 2, 7, 3, 8, 4, 9])
+
+    (
+        instance_sample_inds,
+        predicted_instances,
+        predicted_peak_scores,
+        predicted_instance_scores,
+    ) = group_instances_flat(
+        peak_sample_inds[order],
+        peaks[order],
+        peak_scores[order],
+        peak_channel_inds[order],
+        match_sample_inds=[0, 0, 0, 1, 1, 1],
+        match_edge_inds=[0, 1, 0, 1, 0, 0],
+        match_src_peak_inds=[0, 0, 1, 0, 0, 1],
+        match_dst_peak_inds=[0, 0, 1, 0, 0, 1],
+        match_line_scores=[0.0, 1.0, 2.0, 1.0, 0.0, 2.0],
+        edge_inds=[[0, 1], [1, 2]],
+        n_samples=2,
+        n_nodes=3,
+    )
+
+    assert_array_equal(instance_sample_inds, [0, 0, 1, 1])
+    expected_instances = [
+        [[0.0, 1.0], [2.0, 3.0], [4.0, 5.0]],
+        [[6.0, 7.0], [8.0, 9.0], [np.nan, np.nan]],
+    ]
+    assert_array_equal(predicted_instances[:2], expected_instances)
+    assert_array_equal(predicted_instances[2:], np.add(expected_instances, 10))
+    assert_array_equal(
+        predicted_peak_scores,
+        [
+            [0.0, 1.0, 2.0],
+            [3.0, 4.0, np.nan],
+            [10.0, 11.0, 12.0],
+            [13.0, 14.0, np.nan],
+        ],
+    )
+    assert_array_equal(predicted_instance_scores, [1.0, 2.0, 1.0, 2.0])
+
+    # Small instances are filtered out.
+    _, predicted_instances, _, _ = group_instances_flat(
+        peak_sample_inds,
+        peaks,
+        peak_scores,
+        peak_channel_inds,
+        match_sample_inds=[0, 0, 0],
+        match_edge_inds=[0, 1, 0],
+        match_src_peak_inds=[0, 0, 1],
+        match_dst_peak_inds=[0, 0, 1],
+        match_line_scores=[0.0, 1.0, 2.0],
+        edge_inds=[[0, 1], [1, 2]],
+        n_samples=2,
+        n_nodes=3,
+        min_instance_peaks=1.0,
+    )
+    assert_array_equal(predicted_instances, expected_instances[:1])
+
+
 def test_group_instances_batch():
     row_ids = tf.zeros([5], dtype=tf.int32)
     peaks = tf.RaggedTensor.from_value_rowids(
@@ -278,3 +409,66 @@ def test_group_instances_batch():
         predicted_peak_scores.flat_values, [[0.0, 1.0, 2.0], [3.0, 4.0, np.nan]]
     )
     assert_array_equal(predicted_instance_scores.flat_values, [1.0, 2.0])
+
+
+def test_assign_connections_to_instances():
+    connections = {
+        EdgeType(0, 1): [EdgeConnection(0, 0, 1.0), EdgeConnection(1, 1, 1.0)],
+        EdgeType(2, 3): [EdgeConnection(0, 0, 1.0), EdgeConnection(1, 1, 1.0)],
+        # Merges the instances formed by the first two edges.
+        EdgeType(1, 2): [EdgeConnection(0, 1, 1.0), EdgeConnection(1, 0, 1.0)],
+    }
+    instance_assignments = assign_connections_to_instances(connections)
+    assert instance_assignments == {
+        PeakID(0, 0): 0,
+        PeakID(1, 0): 0,
+        PeakID(0, 1): 1,
+        PeakID(1, 1): 1,
+        PeakID(2, 0): 1,
+        PeakID(3, 0): 1,
+        PeakID(2, 1): 0,
+        PeakID(3, 1): 0,
+    }
+
+    # Instances with peaks of the same node are not merged.
+    connections[EdgeType(3, 0)] = [EdgeConnection(1, 1, 1.0)]
+    instance_assignments = assign_connections_to_instances(connections)
+    assert instance_assignments[PeakID(0, 1)] == 0
+    assert instance_assignments[PeakID(1, 1)] == 1
+
+    # Small instances are filtered out.
+    instance_assignments = assign_connections_to_instances(
+        {EdgeType(0, 1): [EdgeConnection(0, 0, 1.0)]}, min_instance_peaks=0.5, n_nodes=6
+    )
+    assert instance_assignments == {}
+
+
+@pytest.mark.parametrize("n_instances", [50, 200])
+def test_assign_connections_to_instances_synthetic(n_instances):
+    def group_nodes(instance_assignments):
+        instances = {}
+        for peak_id, instance in instance_assignments.items():
+            instances.setdefault(instance, []).append(peak_id.node_ind)
+        return list(instances.values())
+
+    # Instances are fully assembled when the edges are in order.
+    connections = make_synthetic_connections(
+        n_instances, n_nodes=10, drop_rate=0, swap_rate=0, shuffle_edges=False
+    )
+    instances = group_nodes(assign_connections_to_instances(connections))
+    assert len(instances) == n_instances
+    assert all(sorted(nodes) == list(range(10)) for nodes in instances)
+
+    # Partial instances are merged without duplicating nodes otherwise.
+    connections = make_synthetic_connections(
+        n_instances, n_nodes=10, drop_rate=0, swap_rate=0
+    )
+    instances = group_nodes(assign_connections_to_instances(connections))
+    assert len(instances) >= n_instances
+    assert all(len(set(nodes)) == len(nodes) for nodes in instances)
+
+
+def test_benchmark_assign_connections():
+    results = benchmark_assign_connections(n_instances=[5, 10], n_nodes=4, repeats=2)
+    assert [result["n_instances"] for result in results] == [5, 10]
+    assert all(result["best"] <= result["mean"] for result in results)
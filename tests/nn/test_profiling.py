@@ -0,0 +1,130 @@
+import json
+import threading
+
+import numpy as np
+import pytest
+import tensorflow as tf
+
+from sleap.nn.profiling import (
+    HISTOGRAM_EDGES,
+    StageProfiler,
+    StageStats,
+    get_profiler,
+    graph_stage_end,
+    graph_stage_start,
+    profile_stage,
+)
+
+
+@pytest.fixture
+def profiler():
+    profiler = get_profiler()
+    profiler.reset()
+    profiler.enable()
+    yield profiler
+    profiler.disable()
+    profiler.reset()
+
+
+def test_stage_stats():
+    stats = StageStats()
+    assert stats.mean == 0
+    assert stats.percentile(50) == 0
+
+    for elapsed in [0.001] * 9 + [0.1]:
+        stats.add(elapsed)
+    assert stats.count == 10
+    assert stats.total == pytest.approx(0.109)
+    assert stats.min == 0.001
+    assert stats.max == 0.1
+    assert stats.histogram.sum() == 10
+    assert len(stats.histogram) == len(HISTOGRAM_EDGES) - 1
+
+    # Percentiles are estimated within the histogram bin of the recorded times.
+    assert 0.001 <= stats.percentile(50) < 0.002
+    assert stats.percentile(100) == pytest.approx(0.1, rel=0.5)
+
+    # Times outside of the histogram range are counted in the outer bins.
+    stats.add(1e-9)
+    stats.add(1e6)
+    assert stats.histogram[0] == 1
+    assert stats.histogram[-1] == 1
+
+
+def test_stage_profiler(tmpdir):
+    profiler = StageProfiler()
+    with profiler.stage("decode"):
+        pass
+    assert profiler.stages == ()
+
+    profiler.enable()
+    profiler.record("decode", 0.5)
+    profiler.record("tracking", 0.25)
+    profiler.record("forward_pass", 0.5)
+    with profiler.stage("forward_pass"):
+        pass
+    assert profiler.stages == ("forward_pass", "tracking", "decode")
+    assert profiler.get_stats("forward_pass").count == 2
+    assert profiler.get_stats("preprocess") is None
+
+    table = profiler.summary_table().splitlines()
+    assert table[0].split()[:2] == ["stage", "count"]
+    assert [line.split()[0] for line in table[2:]] == list(profiler.stages)
+
+    filename = str(tmpdir.join("profile.json"))
+    profiler.save(filename)
+    with open(filename) as f:
+        data = json.load(f)
+    assert list(data["stages"]) == list(profiler.stages)
+    assert data["stages"]["decode"]["total"] == 0.5
+    assert len(data["histogram_edges"]) == len(HISTOGRAM_EDGES)
+
+    profiler.reset()
+    assert profiler.stages == ()
+
+
+def test_stage_profiler_threads():
+    profiler = StageProfiler(enabled=True)
+
+    def worker():
+        for _ in range(100):
+            profiler.record("stage", 0.01)
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert profiler.get_stats("stage").count == 400
+    assert profiler.get_stats("stage").histogram.sum() == 400
+
+
+def test_profile_stage(profiler):
+    with profile_stage("tracking"):
+        pass
+    assert profiler.get_stats("tracking").count == 1
+
+    profiler.disable()
+    with profile_stage("tracking"):
+        pass
+    assert profiler.get_stats("tracking").count == 1
+
+
+def test_graph_stage(profiler):
+    @tf.function
+    def f(x):
+        start, x = graph_stage_start(x)
+        y = graph_stage_end("square", start, tf.square(x))
+        return y + 1
+
+    out = f(tf.ones([2, 3]))
+    np.testing.assert_array_equal(out, 2)
+    out = f(tf.ones([2, 3]))
+    assert profiler.get_stats("square").count == 2
+
+    # Nothing is added to the graph when profiling is disabled.
+    profiler.disable()
+    start, x = graph_stage_start(tf.ones([1]))
+    assert start is None
+    assert graph_stage_end("square", start, x) is x
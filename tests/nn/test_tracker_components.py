@@ -1,16 +1,25 @@
 import pytest
 import numpy as np
 
-from sleap.nn.tracking import Tracker
+from sleap.nn.tracking import Tracker, run_tracker, run_tracker_chunked
 from sleap.nn.tracker.components import (
     nms_instances,
     nms_fast,
     cull_instances,
     FrameMatches,
     greedy_matching,
+    hungarian_matching,
+    centroid_gate,
+    instance_similarity,
+    centroid_distance,
+    instance_iou,
+    batch_similarity_functions,
+    max_similarity_by_track,
+    InstanceFeatureCache,
 )
 
-from sleap.instance import PredictedInstance
+from sleap.instance import LabeledFrame, PredictedInstance, Track
+from sleap.io.video import Video
 from sleap.skeleton import Skeleton
 
 
@@ -166,3 +175,252 @@ def test_frame_match_object():
 
     assert matches[1].track == "track b"
     assert matches[1].instance == "instance b"
+
+
+def make_random_instances(skeleton, n, rng, track=None):
+    points = rng.uniform(0, 10, size=(n, len(skeleton.nodes), 2))
+    points[0, 0] = np.nan
+    return [
+        PredictedInstance.from_arrays(
+            pts, np.ones(len(pts)), 1.0, skeleton=skeleton, track=track
+        )
+        for pts in points
+    ]
+
+
+@pytest.mark.parametrize(
+    "similarity_function", [instance_similarity, centroid_distance, instance_iou]
+)
+def test_batch_similarity_functions(similarity_function):
+    skeleton = Skeleton.from_names_and_edge_inds(["a", "b", "c"])
+    rng = np.random.default_rng(0)
+    refs = make_random_instances(skeleton, 3, rng)
+    queries = make_random_instances(skeleton, 4, rng)
+
+    similarities = batch_similarity_functions[similarity_function](
+        np.stack([inst.points_array for inst in refs]),
+        np.stack([inst.points_array for inst in queries]),
+    )
+    assert similarities.shape == (3, 4)
+    for i, ref in enumerate(refs):
+        for j, query in enumerate(queries):
+            np.testing.assert_allclose(
+                similarities[i, j], similarity_function(ref, query)
+            )
+
+
+def test_max_similarity_by_track():
+    similarities = np.array([[1.0, 3.0, 2.0, 0.5], [np.nan, 1.0, 2.0, 4.0]])
+    track_inds = np.array([1, 0, 1, 2])
+
+    np.testing.assert_array_equal(
+        max_similarity_by_track(similarities, track_inds, 3),
+        [[3.0, 2.0, 0.5], [1.0, np.nan, 4.0]],
+    )
+
+
+def test_frame_matches_batch_similarity():
+    skeleton = Skeleton.from_names_and_edge_inds(["a", "b", "c"])
+    rng = np.random.default_rng(0)
+    untracked = make_random_instances(skeleton, 3, rng)
+    candidates = []
+    for i in range(3):
+        candidates.extend(make_random_instances(skeleton, 2, rng, Track(name=str(i))))
+
+    batch_matches = FrameMatches.from_candidate_instances(
+        untracked, candidates, instance_similarity, greedy_matching
+    )
+    pairwise_matches = FrameMatches.from_candidate_instances(
+        untracked,
+        candidates,
+        lambda ref, query: instance_similarity(ref, query),
+        greedy_matching,
+    )
+    np.testing.assert_allclose(batch_matches.cost_matrix, pairwise_matches.cost_matrix)
+    assert [(m.instance, m.track) for m in batch_matches.matches] == [
+        (m.instance, m.track) for m in pairwise_matches.matches
+    ]
+
+
+def test_instance_feature_cache():
+    skeleton = Skeleton.from_names_and_edge_inds(["a", "b", "c"])
+    rng = np.random.default_rng(0)
+    instances = make_random_instances(skeleton, 3, rng)
+    cache = InstanceFeatureCache()
+
+    for inst in instances:
+        np.testing.assert_array_equal(cache.points(inst), inst.points_array)
+        np.testing.assert_array_equal(cache.centroid(inst), inst.centroid)
+        np.testing.assert_array_equal(cache.bounding_box(inst), inst.bounding_box)
+    assert len(cache) == 3
+    assert cache.stack_points(instances).shape == (3, 3, 2)
+
+    # Features are computed once and then read from the cache.
+    assert cache.centroid(instances[0]) is cache.centroid(instances[0])
+    assert centroid_distance(instances[0], instances[1], cache) == centroid_distance(
+        instances[0], instances[1]
+    )
+    assert instance_iou(instances[0], instances[1], cache) == instance_iou(
+        instances[0], instances[1]
+    )
+
+    cache.evict(instances[:2])
+    assert len(cache) == 1
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_tracker_feature_cache_is_bounded():
+    skeleton = Skeleton.from_names_and_edge_inds(["a", "b", "c"])
+    rng = np.random.default_rng(0)
+    tracker = Tracker.make_tracker_by_name(
+        tracker="simple", similarity="centroid", track_window=3
+    )
+
+    for t in range(20):
+        tracker.track(make_random_instances(skeleton, 4, rng), t=t)
+        assert tracker.feature_cache_size <= 3 * 4
+    assert len(tracker.spawned_tracks) >= 4
+
+    tracker.reset_candidates()
+    assert tracker.feature_cache_size == 0
+
+
+def test_tracker_last_tracked_sources():
+    skeleton = Skeleton.from_names_and_edge_inds(["a", "b", "c"])
+    rng = np.random.default_rng(0)
+    tracker = Tracker.make_tracker_by_name(
+        tracker="simple", similarity="centroid", min_new_track_points=3
+    )
+
+    for t in range(3):
+        instances = make_random_instances(skeleton, 3, rng)
+        tracked_instances = tracker.track(list(instances), t=t)
+        assert len(tracker.last_tracked_sources) == len(tracked_instances)
+        for inst, source in zip(tracked_instances, tracker.last_tracked_sources):
+            assert inst is not source
+            assert source in instances
+            np.testing.assert_array_equal(inst.numpy(), source.numpy())
+
+        # The first instance has a missing point, so it can't spawn the first track.
+        if t == 0:
+            assert tracker.last_tracked_sources == instances[1:]
+
+
+def test_run_tracker_chunked():
+    skeleton = Skeleton.from_names_and_edge_inds(["a", "b", "c"])
+    video = Video.from_numpy(np.zeros((30, 8, 8, 1), dtype="uint8"))
+    offsets = np.array([[0, 0], [1, 0], [0, 1]], dtype="float64")
+
+    def make_frames():
+        frames = []
+        for t in range(30):
+            # Three animals moving along separate lines, listed in a different order
+            # in each frame.
+            points = np.stack([offsets + [t, 10 * i] for i in np.roll([0, 1, 2], t)])
+            instances = PredictedInstance.from_arrays_batch(
+                points, np.ones((3, 3)), np.ones(3), skeleton=skeleton
+            )
+            frames.append(LabeledFrame(video=video, frame_idx=t, instances=instances))
+        return frames
+
+    tracker_args = dict(tracker="simple", similarity="centroid", track_window=3)
+    expected = run_tracker(make_frames(), Tracker.make_tracker_by_name(**tracker_args))
+    chunked = run_tracker_chunked(
+        make_frames(), tracker_args, chunk_size=10, overlap=5, n_workers=2
+    )
+
+    assert len(chunked) == len(expected)
+    for lf, expected_lf in zip(chunked, expected):
+        assert lf.frame_idx == expected_lf.frame_idx
+        assert [(inst.track.name, inst.track.spawned_on) for inst in lf] == [
+            (inst.track.name, inst.track.spawned_on) for inst in expected_lf
+        ]
+        for inst, expected_inst in zip(lf, expected_lf):
+            np.testing.assert_array_equal(inst.numpy(), expected_inst.numpy())
+
+
+def test_flow_tracker_preprocesses_images():
+    skeleton = Skeleton.from_names_and_edge_inds(["a", "b", "c"])
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 256, size=(64, 64, 3), dtype="uint8")
+    tracker = Tracker.make_tracker_by_name(tracker="flow", img_scale=0.5)
+
+    for t in range(3):
+        tracker.track(make_random_instances(skeleton, 2, rng), img=img, t=t)
+
+    # Only the scaled grayscale images are kept in the queue.
+    for matched_item in tracker.track_matching_queue:
+        assert matched_item.img_t.shape == (32, 32)
+        assert matched_item.img_t.dtype == np.uint8
+
+    candidate_maker = tracker.candidate_maker
+    ref_instances = tracker.track_matching_queue[0].instances_t
+    shifted = candidate_maker.flow_shift_instances(ref_instances, img, img, scale=0.5)
+    shifted_preprocessed = candidate_maker.flow_shift_instances(
+        ref_instances,
+        candidate_maker.preprocess_image(img),
+        candidate_maker.preprocess_image(img),
+        scale=0.5,
+        preprocessed=True,
+    )
+    assert len(shifted) == len(shifted_preprocessed)
+    for inst, inst_preprocessed in zip(shifted, shifted_preprocessed):
+        np.testing.assert_array_equal(inst.points_array, inst_preprocessed.points_array)
+
+
+def test_greedy_matching():
+    cost_matrix = np.array([[10, 200, 5], [75, 150, 1], [2, np.inf, np.inf]])
+    assert greedy_matching(cost_matrix) == [(1, 2), (2, 0), (0, 1)]
+
+    # Infeasible pairs are never matched.
+    cost_matrix = np.array([[1, np.inf], [np.inf, np.inf], [np.nan, 3]])
+    assert greedy_matching(cost_matrix) == [(0, 0), (2, 1)]
+
+    # Each row and column is matched at most once.
+    rng = np.random.default_rng(0)
+    cost_matrix = rng.uniform(size=(50, 30))
+    matches = greedy_matching(cost_matrix)
+    assert len(matches) == 30
+    assert len({i for i, _ in matches}) == len({j for _, j in matches}) == 30
+    assert matches[0] == np.unravel_index(cost_matrix.argmin(), cost_matrix.shape)
+
+
+def test_hungarian_matching_infeasible_pairs():
+    cost_matrix = np.array([[1, np.inf], [2, np.inf]])
+    assert hungarian_matching(cost_matrix) == [(0, 0)]
+    assert hungarian_matching(np.full((2, 2), np.inf)) == []
+
+
+def test_frame_matches_centroid_gate():
+    skeleton = Skeleton.from_names_and_edge_inds(["a", "b"])
+    track_a, track_b = Track(name="a"), Track(name="b")
+
+    def make_instance(x, track=None):
+        return PredictedInstance.from_arrays(
+            np.array([[x, 0], [x + 1, 0]]), np.ones(2), 1.0, skeleton, track=track
+        )
+
+    candidates = [make_instance(0, track_a), make_instance(100, track_b)]
+    untracked = [make_instance(2), make_instance(300)]
+
+    np.testing.assert_array_equal(
+        centroid_gate(untracked, candidates, 10), [[True, False], [False, False]]
+    )
+
+    for similarity_function in (
+        instance_similarity,
+        lambda ref, query: instance_similarity(ref, query),
+    ):
+        frame_matches = FrameMatches.from_candidate_instances(
+            untracked,
+            candidates,
+            similarity_function,
+            greedy_matching,
+            max_centroid_distance=10,
+        )
+        assert np.isinf(frame_matches.cost_matrix).sum() == 3
+        assert [(m.instance, m.track) for m in frame_matches.matches] == [
+            (untracked[0], track_a)
+        ]
+        assert frame_matches.unmatched_instances == [untracked[1]]
@@ -12,6 +12,7 @@ from sleap.instance import (
     Point,
     PredictedPoint,
     LabeledFrame,
+    Track,
 )
 from sleap import Labels
 
@@ -282,6 +283,40 @@ def test_instance_from_pointsarray(skeleton):
     assert inst[skeleton.nodes[1]].y == 4
 
 
+def test_predicted_instance_from_arrays_batch(skeleton):
+    points = np.arange(2 * 5 * 2, dtype="float32").reshape(2, 5, 2)
+    points[0, 1, 0] = np.nan
+    confidences = np.full((2, 5), 0.5, dtype="float32")
+    tracks = [Track(name="a"), None]
+
+    insts = PredictedInstance.from_arrays_batch(
+        points, confidences, np.array([1.0, 2.0]), skeleton, tracks=tracks
+    )
+    assert len(insts) == 2
+
+    for i, inst in enumerate(insts):
+        expected = PredictedInstance.from_arrays(
+            points[i], confidences[i], [1.0, 2.0][i], skeleton, track=tracks[i]
+        )
+        assert inst.score == expected.score
+        assert inst.track is expected.track
+        np.testing.assert_array_equal(
+            inst.points_and_scores_array, expected.points_and_scores_array
+        )
+        assert len(inst) == len(expected)
+
+    assert (
+        PredictedInstance.from_arrays_batch(
+            np.zeros((0, 5, 2)), np.zeros((0, 5)), np.zeros(0), skeleton
+        )
+        == []
+    )
+    with pytest.raises(ValueError):
+        PredictedInstance.from_arrays_batch(
+            np.zeros((1, 3, 2)), np.zeros((1, 3)), np.zeros(1), skeleton
+        )
+
+
 def test_frame_merge_predicted_and_user(skeleton, centered_pair_vid):
     user_inst = Instance(
         skeleton=skeleton,